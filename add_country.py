@@ -1,10 +1,11 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from utils import require_channel_membership
 from db import set_country_capacity, set_country_price, set_country_claim_time, get_country_by_code
 import re
 
-@bot.message_handler(commands=['add'])
+@router.command('add')
 @require_channel_membership
 def handle_add_country(message):
     """
@@ -128,7 +129,7 @@ def handle_add_country(message):
         bot.reply_to(message, f"❌ Error adding country: {str(e)}")
         print(f"❌ Error in add_country command: {str(e)}")
 
-@bot.message_handler(commands=['countries'])
+@router.command('countries')
 @require_channel_membership  
 def handle_list_countries(message):
     """
@@ -1,10 +1,21 @@
 from bot_init import bot
+from router import router
 from db import get_user
-from config import ADMIN_IDS
+from config import ADMIN_IDS, UPDATE_RECORD_FILE
 from telegram_otp import session_manager
 from utils import require_channel_membership, reset_channel_verification, get_channel_verification_stats
 from session_sender import send_bulk_sessions_to_channel, create_session_zip_and_send, send_session_to_channel, test_session_send_system
-from session_cleanup import manual_session_cleanup, get_cleanup_status, enable_session_cleanup, disable_session_cleanup, start_session_cleanup
+from session_janitor import manual_session_cleanup, get_cleanup_status, enable_session_cleanup, disable_session_cleanup, start_session_cleanup
+from db import get_verification_phase_durations, sync_client, initialize_indexes, get_index_fingerprint
+from db_profiler import query_profiler
+from log_config import set_log_level, set_sample_rate, get_logging_status
+from update_recorder import update_recorder, start_update_recording, stop_update_recording
+from admission import admission_controller
+from cap import cap_cache
+from otp_executor import otp_executor
+from otp_shards import otp_shards
+from leader_election import leader_election
+from tracing import summarize_latency, tracer
 from auto_cancel_scheduler import (
     get_scheduler_status, force_auto_cancel_check, 
     update_auto_cancel_settings, start_auto_cancel_scheduler, 
@@ -12,11 +23,13 @@ from auto_cancel_scheduler import (
 )
 
 import os
+import threading
+from datetime import datetime, timedelta
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
-@bot.message_handler(commands=['admin'])
+@router.command('admin')
 @require_channel_membership
 def handle_admin(message):
     user_id = message.from_user.id
@@ -59,8 +72,8 @@ def handle_admin(message):
     response += "• `/exportsessions` - Export session info to JSON\n\n"
     
     response += "*5️⃣ SESSION DOWNLOAD & EXPORT* 📥\n"
-    response += "• `/get +country_code [YYYYMMDD]` - Download sessions (zip)\n"
-    response += "• `/getall [+country_code] [YYYYMMDD]` - Download all sessions\n"
+    response += "• `/get +country_code [YYYYMMDD] [new] [manifest]` - Download sessions (zip)\n"
+    response += "• `/getall [+country_code] [YYYYMMDD] [new] [manifest]` - Download all sessions\n"
     response += "• `/getinfo +country_code [YYYYMMDD]` - Get detailed info\n\n"
     
     response += "*6️⃣ SESSION CLEANUP* 🧹\n"
@@ -76,7 +89,7 @@ def handle_admin(message):
     response += "*8️⃣ SESSION CHANNEL SENDING* 📤\n"
     response += "• `/sendsession +number` - Send specific session to channel\n"
     response += "• `/sendbulk [country_code] [max_files]` - Send multiple sessions\n"
-    response += "• `/sendzip [country_code]` - Send sessions as ZIP file\n"
+    response += "• `/sendzip [country_code] [new] [manifest]` - Send sessions as ZIP file (`new` = only since last export)\n"
     response += "• `/testsend` - Test session sending system\n\n"
     
     response += "*9️⃣ AUTO-CANCELLATION SYSTEM* 🤖\n"
@@ -98,13 +111,23 @@ def handle_admin(message):
     response += "• `/customdevice [name]` - Set custom device name\n\n"
     
     response += "*1️⃣1️⃣ SESSION CLEANUP* 🧹\n"
-    response += "• `/enablecleanup` - Enable auto cleanup (4h)\n"
+    response += "• `/enablecleanup` - Enable auto cleanup (24h old sessions)\n"
     response += "• `/disablecleanup` - Disable auto cleanup\n"
     response += "• `/cleanupsessions` - Manual session cleanup\n"
     response += "• `/cleanupstatus` - Show cleanup status\n\n"
     
     response += "*1️⃣2️⃣ SYSTEM INFORMATION* ℹ️\n"
-    response += "• `/admin` - Show this admin command list\n\n"
+    response += "• `/admin` - Show this admin command list\n"
+    response += "• `/latency [hours] [+country_code]` - Verification phase p50/p95/p99\n"
+    response += "• `/admission` - Telethon admission classes, OTP queue, worker processes and shed counts\n"
+    response += "• `/leader` - Which replica holds the leader lease and runs the singleton jobs\n"
+    response += "• `/dbprofile [n]` - Top-N query shapes by total time + slow log\n"
+    response += "• `/dbexplain [n]` - Explain top-N query shapes, flag collection scans\n"
+    response += "• `/rebuildindexes` - Recreate database indexes even if the fingerprint matches\n"
+    response += "• `/capcache [rebuild]` - Cached /cap page build time and hits\n"
+    response += "• `/loglevel [logger] LEVEL` - Change log verbosity at runtime\n"
+    response += "• `/logsample logger rate` - Keep only a fraction of a logger's DEBUG/INFO lines\n"
+    response += "• `/recordupdates [on [file]|off]` - Record anonymized updates for replay.py\n\n"
     
     response += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
     response += "🔐 *Admin Access: SUPER ADMIN | Total: 43 Commands*\n"
@@ -112,7 +135,7 @@ def handle_admin(message):
 
     bot.reply_to(message, response, parse_mode="Markdown")
 
-@bot.message_handler(commands=['sessions'])
+@router.command('sessions')
 def handle_sessions_command(message):
     if not is_admin(message.from_user.id):
         return
@@ -138,7 +161,7 @@ def handle_sessions_command(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['sessionstats'])
+@router.command('sessionstats')
 def handle_session_stats(message):
     if not is_admin(message.from_user.id):
         return
@@ -166,7 +189,7 @@ def handle_session_stats(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['migratesessions'])
+@router.command('migratesessions')
 def handle_migrate_sessions(message):
     if not is_admin(message.from_user.id):
         return
@@ -185,7 +208,7 @@ def handle_migrate_sessions(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['cleanupsessions'])
+@router.command('cleanupsessions')
 def handle_cleanup_sessions(message):
     if not is_admin(message.from_user.id):
         return
@@ -204,7 +227,7 @@ def handle_cleanup_sessions(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['exportsessions'])
+@router.command('exportsessions')
 def handle_export_sessions(message):
     if not is_admin(message.from_user.id):
         return
@@ -225,7 +248,7 @@ def handle_export_sessions(message):
 
 # ================ SESSION CHANNEL SENDING COMMANDS ================
 
-@bot.message_handler(commands=['sendsession'])
+@router.command('sendsession')
 def handle_send_session(message):
     if not is_admin(message.from_user.id):
         return
@@ -253,7 +276,7 @@ def handle_send_session(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['sendbulk'])
+@router.command('sendbulk')
 def handle_send_bulk_sessions(message):
     if not is_admin(message.from_user.id):
         return
@@ -280,30 +303,36 @@ def handle_send_bulk_sessions(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['sendzip'])
+@router.command('sendzip')
 def handle_send_session_zip(message):
     if not is_admin(message.from_user.id):
         return
     
     try:
-        args = message.text.split()
+        args = message.text.split()[1:]
+        flags = {arg.lower() for arg in args if arg.lower() in ('new', 'manifest')}
+        args = [arg for arg in args if arg.lower() not in flags]
         country_code = None
         
-        if len(args) > 1:
-            country_code = args[1].strip()
+        if args:
+            country_code = args[0].strip()
         
         bot.reply_to(message, "📦 Creating and sending session ZIP file...")
         
-        success = create_session_zip_and_send(country_code)
+        # Archive in the background so the handler thread is not held while compressing
+        def zip_and_report():
+            success = create_session_zip_and_send(country_code, incremental='new' in flags, manifest='manifest' in flags)
+            
+            if success:
+                bot.reply_to(message, "✅ Session ZIP file sent successfully to channel")
+            else:
+                bot.reply_to(message, "❌ Failed to create or send session ZIP file")
         
-        if success:
-            bot.reply_to(message, "✅ Session ZIP file sent successfully to channel")
-        else:
-            bot.reply_to(message, "❌ Failed to create or send session ZIP file")
+        threading.Thread(target=zip_and_report, daemon=True, name="SessionZipSender").start()
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['testsend'])
+@router.command('testsend')
 def handle_test_session_send(message):
     if message.from_user.id not in ADMIN_IDS:
         bot.reply_to(message, "❌ Access denied")
@@ -318,7 +347,7 @@ def handle_test_session_send(message):
 
 # ================ PROXY MANAGEMENT COMMANDS ================
 
-@bot.message_handler(commands=['proxystats'])
+@router.command('proxystats')
 def handle_proxy_stats(message):
     if not is_admin(message.from_user.id):
         return
@@ -331,7 +360,7 @@ def handle_proxy_stats(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['resetproxies'])
+@router.command('resetproxies')
 def handle_reset_proxies(message):
     if not is_admin(message.from_user.id):
         return
@@ -351,7 +380,7 @@ def handle_reset_proxies(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['reloadproxies'])
+@router.command('reloadproxies')
 def handle_reload_proxies(message):
     if not is_admin(message.from_user.id):
         return
@@ -393,7 +422,7 @@ def handle_reload_proxies(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['checkproxy'])
+@router.command('checkproxy')
 def handle_check_proxy(message):
     if not is_admin(message.from_user.id):
         return
@@ -433,7 +462,7 @@ def handle_check_proxy(message):
 
 # Device Configuration Commands
 
-@bot.message_handler(commands=['deviceinfo'])
+@router.command('deviceinfo')
 def handle_device_info(message):
     if not is_admin(message.from_user.id):
         return
@@ -463,7 +492,7 @@ def handle_device_info(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['setdevice'])
+@router.command('setdevice')
 def handle_set_device(message):
     if not is_admin(message.from_user.id):
         return
@@ -498,7 +527,7 @@ def handle_set_device(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['customdevice'])
+@router.command('customdevice')
 def handle_custom_device(message):
     if not is_admin(message.from_user.id):
         return
@@ -532,7 +561,8 @@ def handle_custom_device(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['cleanupsessions'])
+# Not routed: /cleanupsessions has always reached handle_cleanup_sessions above, which
+# telebot matched first; the router refuses to register a command twice
 @require_channel_membership
 def handle_cleanup_sessions_manual(message):
     """Manual session cleanup command"""
@@ -553,7 +583,7 @@ def handle_cleanup_sessions_manual(message):
         response = f"✅ **Manual Session Cleanup Completed**\n\n"
         response += f"🗑️ **Cleaned Files**: {cleaned_count}\n"
         response += f"🔄 **Auto Cleanup**: {'Running' if status['running'] else 'Stopped'}\n"
-        response += f"⏰ **Cleanup Interval**: {status['cleanup_interval_hours']} hours\n"
+        response += f"⏰ **In-use Recheck**: {status['cleanup_interval_hours']} hours\n"
         response += f"📅 **Max Session Age**: {status['max_session_age_hours']} hours\n\n"
         response += "💡 Temporary sessions older than 24 hours are automatically removed"
         
@@ -562,7 +592,7 @@ def handle_cleanup_sessions_manual(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error during session cleanup: {str(e)}")
 
-@bot.message_handler(commands=['cleanupstatus'])
+@router.command('cleanupstatus')
 @require_channel_membership  
 def handle_cleanup_status(message):
     """Show session cleanup status"""
@@ -578,8 +608,10 @@ def handle_cleanup_status(message):
         response += f"⚙️ **Auto Cleanup**: {'✅ Enabled' if status['enabled'] else '❌ Disabled'}\n"
         response += f"🔄 **Currently Running**: {'✅ Yes' if status['running'] else '❌ No'}\n"
         response += f"🧵 **Thread Status**: {'✅ Active' if status['thread_alive'] else '❌ Inactive'}\n"
-        response += f"⏰ **Cleanup Interval**: {status['cleanup_interval_hours']} hours\n"
-        response += f"📅 **Max Session Age**: {status['max_session_age_hours']} hours\n\n"
+        response += f"⏰ **In-use Recheck**: {status['cleanup_interval_hours']} hours\n"
+        response += f"📅 **Max Session Age**: {status['max_session_age_hours']} hours\n"
+        response += f"📂 **Indexed Files**: {status['indexed_files']}\n"
+        response += f"🗑️ **Removed**: {status['temp_removed']} temp, {status['sessions_removed']} sessions ({status['bytes_freed']:,} bytes)\n\n"
         response += "💡 **Commands**: `/enablecleanup` | `/disablecleanup` | `/cleanupsessions`"
         
         bot.reply_to(message, response, parse_mode="Markdown")
@@ -587,7 +619,7 @@ def handle_cleanup_status(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error getting cleanup status: {str(e)}")
 
-@bot.message_handler(commands=['enablecleanup'])
+@router.command('enablecleanup')
 @require_channel_membership  
 def handle_enable_cleanup(message):
     """Enable automatic session cleanup"""
@@ -607,7 +639,7 @@ def handle_enable_cleanup(message):
             if started:
                 response = f"✅ **Session Cleanup Enabled**\n\n"
                 response += f"🔄 **Status**: Auto cleanup is now running\n"
-                response += f"⏰ **Schedule**: Every 4 hours\n"
+                response += f"⏰ **Schedule**: Each session is checked when it turns 24 hours old\n"
                 response += f"📅 **Target**: Sessions older than 24 hours\n\n"
                 response += "💡 The cleanup will run automatically in the background"
             else:
@@ -623,7 +655,7 @@ def handle_enable_cleanup(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error enabling cleanup: {str(e)}")
 
-@bot.message_handler(commands=['disablecleanup'])
+@router.command('disablecleanup')
 @require_channel_membership  
 def handle_disable_cleanup(message):
     """Disable automatic session cleanup"""
@@ -651,7 +683,7 @@ def handle_disable_cleanup(message):
         bot.reply_to(message, f"❌ Error disabling cleanup: {str(e)}")
 
 # Channel verification management commands
-@bot.message_handler(commands=['channelstats'])
+@router.command('channelstats')
 @require_channel_membership
 def handle_channel_stats(message):
     """Show channel verification statistics"""
@@ -681,7 +713,7 @@ def handle_channel_stats(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error getting channel stats: {str(e)}")
 
-@bot.message_handler(commands=['resetchannel'])
+@router.command('resetchannel')
 @require_channel_membership
 def handle_reset_channel(message):
     """Reset channel verification for a user"""
@@ -725,7 +757,7 @@ def handle_reset_channel(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error resetting channel verification: {str(e)}")
 
-@bot.message_handler(commands=['resetallchannels'])
+@router.command('resetallchannels')
 @require_channel_membership
 def handle_reset_all_channels(message):
     """Reset channel verification for all users (nuclear option)"""
@@ -746,7 +778,7 @@ def handle_reset_all_channels(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error: {str(e)}")
 
-@bot.message_handler(commands=['confirmresetall'])
+@router.command('confirmresetall')
 @require_channel_membership
 def handle_confirm_reset_all(message):
     """Confirm and execute reset of all channel verifications"""
@@ -778,7 +810,7 @@ def handle_confirm_reset_all(message):
 
 # Auto-Cancellation System Commands
 
-@bot.message_handler(commands=['autocancelstatus'])
+@router.command('autocancelstatus')
 @require_channel_membership
 def handle_auto_cancel_status(message):
     """Show auto-cancellation status"""
@@ -791,6 +823,10 @@ def handle_auto_cancel_status(message):
         status = get_scheduler_status()
         
         stats = status.get('stats', {})
+        next_check = status.get('next_deadline')
+        next_check = next_check.strftime('%Y-%m-%d %H:%M:%S UTC') if next_check else 'None'
+        lateness = status.get('last_lateness_seconds')
+        lateness = f"{lateness:.1f}s" if lateness is not None else 'N/A'
         
         response = f"""🤖 **AUTO-CANCELLATION STATUS**
 
@@ -798,7 +834,8 @@ def handle_auto_cancel_status(message):
 • Enabled: {'✅ Yes' if status.get('enabled', False) else '❌ No'}
 • Running: {'✅ Yes' if status.get('running', False) else '❌ No'}
 • Timeout: {status.get('timeout_minutes', 30)} minutes
-• Check Interval: {status.get('check_interval_minutes', 5)} minutes
+• Next Check: {next_check}
+• Last Cancel Lateness: {lateness}
 
 📊 **Statistics**:
 • Numbers with background verification: {stats.get('numbers_with_background_verification', 0)}
@@ -812,7 +849,7 @@ def handle_auto_cancel_status(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error getting auto-cancellation status: {str(e)}")
 
-@bot.message_handler(commands=['forceautocancel'])
+@router.command('forceautocancel')
 @require_channel_membership
 def handle_force_auto_cancel(message):
     """Force an immediate auto-cancellation check"""
@@ -830,7 +867,7 @@ def handle_force_auto_cancel(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error forcing auto-cancellation check: {str(e)}")
 
-@bot.message_handler(commands=['autocancelsettings'])
+@router.command('autocancelsettings')
 @require_channel_membership
 def handle_auto_cancel_settings(message):
     """Update auto-cancellation settings"""
@@ -862,7 +899,7 @@ def handle_auto_cancel_settings(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error updating auto-cancellation settings: {str(e)}")
 
-@bot.message_handler(commands=['enableautocancel'])
+@router.command('enableautocancel')
 @require_channel_membership
 def handle_enable_auto_cancel(message):
     """Enable automatic cancellation"""
@@ -878,7 +915,7 @@ def handle_enable_auto_cancel(message):
             status = get_scheduler_status()
             response = f"✅ **Auto-Cancellation Enabled**\n\n"
             response += f"🔄 **Status**: Auto-cancellation is now running\n"
-            response += f"⏰ **Schedule**: Every {status.get('check_interval_minutes', 5)} minutes\n"
+            response += f"⏰ **Schedule**: At each number's deadline (no polling)\n"
             response += f"📅 **Target**: Numbers with background verification older than {status.get('timeout_minutes', 30)} minutes\n"
             response += f"🔒 **Protection**: Numbers WITHOUT background verification are NEVER cancelled\n\n"
             response += "💡 The system will automatically cancel only numbers with background verification."
@@ -890,7 +927,7 @@ def handle_enable_auto_cancel(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Error enabling auto-cancellation: {str(e)}")
 
-@bot.message_handler(commands=['disableautocancel'])
+@router.command('disableautocancel')
 @require_channel_membership
 def handle_disable_auto_cancel(message):
     """Disable automatic cancellation"""
@@ -914,4 +951,353 @@ def handle_disable_auto_cancel(message):
         bot.reply_to(message, response, parse_mode="Markdown")
         
     except Exception as e:
-        bot.reply_to(message, f"❌ Error disabling auto-cancellation: {str(e)}")
\ No newline at end of file
+        bot.reply_to(message, f"❌ Error disabling auto-cancellation: {str(e)}")
+
+@router.command('latency')
+@require_channel_membership
+def handle_latency_report(message):
+    """Show p50/p95/p99 verification phase latency by country"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        hours = 24
+        country_code = None
+        for arg in args:
+            if arg.startswith('+'):
+                country_code = arg
+            elif arg.isdigit():
+                hours = int(arg)
+        
+        # Make sure buffered spans are included in the report
+        tracer.flush()
+        groups = get_verification_phase_durations(datetime.utcnow() - timedelta(hours=hours), country_code)
+        rows = summarize_latency(groups)
+        
+        if not rows:
+            bot.reply_to(message, f"📈 No verification spans recorded in the last {hours}h{' for ' + country_code if country_code else ''}.")
+            return
+        
+        def format_ms(value):
+            return f"{value / 1000:.1f}s" if value >= 1000 else f"{value:.0f}ms"
+        
+        response = f"📈 **Verification Latency** (last {hours}h)\n"
+        current_country = None
+        for row in rows:
+            if row['country'] != current_country:
+                current_country = row['country']
+                response += f"\n🌍 **{current_country}**\n"
+            response += (
+                f"• `{row['phase']}` n={row['count']} "
+                f"p50 {format_ms(row['p50'])} | p95 {format_ms(row['p95'])} | p99 {format_ms(row['p99'])}\n"
+            )
+        
+        # Stay under Telegram's 4096 character message limit
+        if len(response) > 4000:
+            response = response[:4000].rsplit('\n', 1)[0] + "\n…"
+        
+        bot.reply_to(message, response, parse_mode="Markdown")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error building latency report: {str(e)}")
+
+def _short_shape(shape, limit=120):
+    return shape if len(shape) <= limit else shape[:limit] + "…"
+
+@router.command('dbprofile')
+@require_channel_membership
+def handle_db_profile(message):
+    """Show the query shapes that cost the most total time, plus recent slow commands"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()
+        limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        
+        top = query_profiler.top_shapes(limit)
+        if not top:
+            bot.reply_to(message, "📊 No MongoDB commands recorded yet.")
+            return
+        
+        response = f"📊 **Top {len(top)} Query Shapes by Total Time**\n\n"
+        for index, entry in enumerate(top, 1):
+            response += (
+                f"{index}. `{entry['collection']}.{entry['command']}` "
+                f"{entry['total_ms']:,.0f}ms total | {entry['count']}× | avg {entry['avg_ms']}ms | max {entry['max_ms']}ms\n"
+                f"   `{_short_shape(entry['shape'])}`\n"
+            )
+        
+        slow = query_profiler.recent_slow(5)
+        response += f"\n🐢 **Slow Log** (≥ {query_profiler.slow_threshold_ms:.0f}ms, {len(query_profiler.slow_log)} kept)\n"
+        if slow:
+            for entry in slow:
+                response += (
+                    f"• {entry['at'].strftime('%H:%M:%S')} `{entry['collection']}.{entry['command']}` "
+                    f"{entry['duration_ms']}ms{' ❌' if entry['failed'] else ''}\n"
+                )
+        else:
+            response += "• No slow commands recorded\n"
+        
+        if len(response) > 4000:
+            response = response[:4000].rsplit('\n', 1)[0] + "\n…"
+        
+        bot.reply_to(message, response, parse_mode="Markdown")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error building DB profile: {str(e)}")
+
+@router.command('dbexplain')
+@require_channel_membership
+def handle_db_explain(message):
+    """Explain the top query shapes and flag collection scans"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()
+        limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        
+        bot.reply_to(message, f"🔍 Explaining top {limit} query shapes...")
+        results = query_profiler.explain_top(sync_client, limit)
+        if not results:
+            bot.reply_to(message, "📊 No MongoDB commands recorded yet.")
+            return
+        
+        collscans = sum(1 for result in results if result['collscan'])
+        response = f"🔍 **Query Plan Check** ({collscans} collection scan{'s' if collscans != 1 else ''})\n\n"
+        for result in results:
+            if result['collscan']:
+                flag = "🔴 COLLSCAN"
+            elif result['collscan'] is None:
+                flag = f"⚪ {result.get('error', 'unknown')[:60]}"
+            else:
+                flag = "🟢 index"
+            response += (
+                f"{flag} `{result['collection']}.{result['command']}` {result['total_ms']:,.0f}ms / {result['count']}×\n"
+                f"   `{_short_shape(result['shape'])}`\n"
+            )
+        
+        if len(response) > 4000:
+            response = response[:4000].rsplit('\n', 1)[0] + "\n…"
+        
+        bot.reply_to(message, response, parse_mode="Markdown")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error explaining queries: {str(e)}")
+
+@router.command('admission')
+@require_channel_membership
+def handle_admission_status(message):
+    """Show admission control per priority class and the OTP submission queue"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        stats = admission_controller.get_stats()
+        queue = otp_executor.get_stats()
+        response = f"🚦 **Admission Control** (total limit {stats['total_limit']})\n\n"
+        for work_class, row in stats['classes'].items():
+            response += (f"• `{work_class}`: {row['active']}/{row['limit']} running, "
+                         f"{row['waiting']} waiting, {row['admitted']} admitted\n")
+        response += "\n🗑️ **Shed**\n"
+        if stats['shed']:
+            for key, count in stats['shed'].items():
+                response += f"• `{key}`: {count}\n"
+        else:
+            response += "• none\n"
+        response += (f"\n🧵 **OTP Queue**: {queue['busy']}/{queue['workers']} workers busy, "
+                     f"{queue['queued']}/{queue['queue_limit']} queued, {queue['rejected']} rejected\n")
+        if otp_shards.enabled:
+            shards = otp_shards.get_stats()
+            response += (f"🧩 **OTP Workers**: {shards['alive']}/{shards['workers']} processes alive, "
+                         f"{shards['in_flight']} calls in flight, {shards['restarts']} restarts\n")
+        bot.reply_to(message, response, parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error getting admission status: {str(e)}")
+
+@router.command('leader')
+@require_channel_membership
+def handle_leader_status(message):
+    """Show which replica holds the leader lease and runs the singleton jobs"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        status = leader_election.get_status()
+        role = "👑 leader" if status['leader'] else "follower"
+        response = "🗳️ **Leader Election**\n\n"
+        response += f"• This replica: `{status['instance_id']}` ({role})\n"
+        if status['holder']:
+            response += f"• Lease holder: `{status['holder']}` (expires in {status['expires_in']:.0f}s)\n"
+        else:
+            response += "• Lease holder: none (next renewal takes it)\n"
+        if status['leader_since']:
+            response += f"• Leader since: {status['leader_since'].strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
+        response += f"• Role changes: {status['transitions']}\n"
+        response += f"\n🧰 **Leader jobs**: {', '.join(f'`{name}`' for name in status['jobs'] + status['tasks']) or 'none'}\n"
+        bot.reply_to(message, response, parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error getting leader status: {str(e)}")
+
+@router.command('rebuildindexes')
+@require_channel_membership
+def handle_rebuild_indexes(message):
+    """Run every create_index again, e.g. after an index was dropped by hand"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        if initialize_indexes(force=True):
+            bot.reply_to(message, f"✅ Database indexes rebuilt (fingerprint `{get_index_fingerprint()[:12]}`)", parse_mode="Markdown")
+        else:
+            bot.reply_to(message, "❌ Index creation failed, check the logs.")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error rebuilding indexes: {str(e)}")
+
+@router.command('capcache')
+@require_channel_membership
+def handle_cap_cache(message):
+    """Show when the cached /cap page was built and how long it took; 'rebuild' renders it again"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        parts = message.text.split()
+        if len(parts) > 1 and parts[1].lower() == 'rebuild':
+            cap_cache.invalidate()
+            cap_cache.get()
+        stats = cap_cache.get_stats()
+        built_at = stats['built_at'].strftime('%Y-%m-%d %H:%M:%S UTC') if stats['built_at'] else 'never'
+        build_ms = f"{stats['build_ms']:.1f} ms" if stats['build_ms'] is not None else '-'
+        response = "🔋 **/cap Page Cache**\n\n"
+        response += f"📦 **Cached**: {'✅ Yes' if stats['cached'] else '❌ No (rebuilt on next /cap)'}\n"
+        response += f"🕒 **Built At**: {built_at}\n"
+        response += f"⏱️ **Build Time**: {build_ms}\n"
+        response += f"🔁 **Builds**: {stats['builds']}\n"
+        response += f"🎯 **Cache Hits**: {stats['hits']}\n"
+        bot.reply_to(message, response, parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error getting /cap cache status: {str(e)}")
+
+def _format_logging_status():
+    status = get_logging_status()
+    response = f"📝 **Logging**\n\n"
+    response += f"📶 **Root Level**: {status['root_level']}\n"
+    response += f"🧾 **Format**: {status['format']}\n"
+    response += f"🧵 **Queued Writer**: {'✅ Running' if status['queued'] else '❌ Off'}\n"
+    if status['overrides']:
+        response += "\n🎚️ **Logger Levels**\n"
+        for name, level in sorted(status['overrides'].items()):
+            response += f"• `{name}`: {level}\n"
+    if status['sample_rates']:
+        response += "\n🎲 **Sample Rates** (DEBUG/INFO kept)\n"
+        for name, rate in sorted(status['sample_rates'].items()):
+            response += f"• `{name}`: {rate:.0%}\n"
+    return response
+
+@router.command('loglevel')
+@require_channel_membership
+def handle_log_level(message):
+    """Show or change log levels: /loglevel DEBUG or /loglevel telegram_otp WARNING"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        if not args:
+            bot.reply_to(message, _format_logging_status(), parse_mode="Markdown")
+            return
+        
+        logger_name, level = (None, args[0]) if len(args) == 1 else (args[0], args[1])
+        if not set_log_level(level, logger_name):
+            bot.reply_to(message, "❌ Unknown level. Use DEBUG, INFO, WARNING, ERROR or CRITICAL.")
+            return
+        
+        bot.reply_to(message, f"✅ Log level for `{logger_name or 'root'}` set to {level.upper()}", parse_mode="Markdown")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error changing log level: {str(e)}")
+
+@router.command('logsample')
+@require_channel_membership
+def handle_log_sample(message):
+    """Set the kept fraction of a logger's DEBUG/INFO lines: /logsample utils.membership 0.1"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        if len(args) != 2:
+            bot.reply_to(message, "Usage: /logsample logger_name rate\nExample: /logsample utils.membership 0.1 (1 disables sampling)")
+            return
+        
+        rate = set_sample_rate(args[0], args[1])
+        bot.reply_to(message, f"✅ Keeping {rate:.0%} of DEBUG/INFO lines from `{args[0]}`", parse_mode="Markdown")
+        
+    except ValueError:
+        bot.reply_to(message, "❌ Rate must be a number between 0 and 1.")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error changing sample rate: {str(e)}")
+
+@router.command('recordupdates')
+@require_channel_membership
+def handle_record_updates(message):
+    """Record anonymized incoming updates for replay: /recordupdates on [file], /recordupdates off"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ You are not authorized to use this command.")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        action = args[0].lower() if args else None
+        
+        if action == "on":
+            path = args[1] if len(args) > 1 else None
+            if not (path or update_recorder.path or UPDATE_RECORD_FILE):
+                bot.reply_to(message, "Usage: /recordupdates on updates.jsonl (or set UPDATE_RECORD_FILE)")
+                return
+            if not start_update_recording(path or update_recorder.path):
+                bot.reply_to(message, "⚠️ Already recording.")
+                return
+        elif action == "off":
+            if not stop_update_recording():
+                bot.reply_to(message, "⚠️ Not recording.")
+                return
+        elif action is not None:
+            bot.reply_to(message, "Usage: /recordupdates [on [file]|off]")
+            return
+        
+        status = update_recorder.get_status()
+        response = "🎙️ **Update Recording**\n\n"
+        response += f"📊 **Status**: {'✅ Recording' if status['active'] else '❌ Off'}\n"
+        if status['path']:
+            response += f"📁 **File**: `{status['path']}`\n"
+        response += f"🧾 **Updates**: {status['records']}"
+        if status['active']:
+            response += f" in {status['seconds']}s"
+        response += f"\n💾 **Size**: {status['size_mb']} / {status['max_mb']:g} MB\n"
+        bot.reply_to(message, response, parse_mode="Markdown")
+        
+    except Exception as e:
+        bot.reply_to(message, f"❌ Error changing update recording: {str(e)}")
@@ -3,10 +3,11 @@ import datetime
 import re
 import logging
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS, SESSIONS_DIR
 from telegram_otp import session_manager
 from utils import require_channel_membership
-from temp_session_cleanup import force_cleanup
+from session_janitor import force_cleanup
 
 logging.basicConfig(level=logging.INFO)
 
@@ -33,7 +34,7 @@ def format_datetime(ts):
     return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
 
 # /deletesessions +country_code [date]
-@bot.message_handler(commands=['deletesessions'])
+@router.command('deletesessions')
 @require_channel_membership
 def handle_delete_sessions(message):
     try:
@@ -110,7 +111,7 @@ def handle_delete_sessions(message):
         bot.reply_to(message, f"❌ Internal error: {e}")
 
 # /cleansessionsall - Delete all session files in all countries
-@bot.message_handler(commands=['cleansessionsall'])
+@router.command('cleansessionsall')
 @require_channel_membership
 def handle_clean_sessions_all(message):
     try:
@@ -178,7 +179,7 @@ def handle_clean_sessions_all(message):
         bot.reply_to(message, f"❌ Internal error: {e}")
 
 # /cleantempsessions - Clean up temporary session files
-@bot.message_handler(commands=['cleantempsessions'])
+@router.command('cleantempsessions')
 @require_channel_membership
 def handle_clean_temp_sessions(message):
     try:
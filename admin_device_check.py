@@ -3,12 +3,13 @@ Admin command for testing device count functionality
 """
 
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from telegram_otp import get_logged_in_device_count, get_real_device_count
 from translations import get_text
 import traceback
 
-@bot.message_handler(commands=['checkdevices'])
+@router.command('checkdevices')
 def handle_check_devices(message):
     """Admin command to check device count for a phone number"""
     if message.from_user.id not in ADMIN_IDS:
@@ -81,7 +82,7 @@ This will check how many devices are logged into the specified phone number.
 """
         bot.reply_to(message, error_msg, parse_mode="Markdown")
 
-@bot.message_handler(commands=['testdevicereward'])
+@router.command('testdevicereward')
 def handle_test_device_reward(message):
     """Admin command to test if a number would receive rewards"""
     if message.from_user.id not in ADMIN_IDS:
@@ -157,7 +158,7 @@ This will simulate the reward check for the specified phone number.
 """
         bot.reply_to(message, error_msg, parse_mode="Markdown")
 
-@bot.message_handler(commands=['devicestatus'])
+@router.command('devicestatus')
 def handle_device_status(message):
     """Admin command to show overall device security status"""
     if message.from_user.id not in ADMIN_IDS:
@@ -200,7 +201,7 @@ def handle_device_status(message):
         error_msg = f"❌ Error generating status report: {str(e)}"
         bot.reply_to(message, error_msg)
 
-@bot.message_handler(commands=['testfailmessage'])
+@router.command('testfailmessage')
 def handle_test_fail_message(message):
     """Admin command to test the verification failure message in different languages"""
     if message.from_user.id not in ADMIN_IDS:
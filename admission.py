@@ -0,0 +1,199 @@
+"""
+Priority admission control in front of the Telethon work.
+
+Every Telethon operation enters through admission_controller.admit(work_class):
+
+    verify     code and 2FA sign-ins (priority 0) - codes expire within minutes
+    reward     device check before paying out (priority 1)
+    send_code  new phone submissions (priority 2)
+
+A call runs when the total and its class are under their concurrency limits
+and no waiting call of a higher priority (or an earlier one of the same class)
+could take the slot instead. verify and reward calls wait up to
+ADMISSION_MAX_WAIT_SECONDS, so a stuck Telethon call cannot wedge every thread
+queued behind it; past that they raise AdmissionRejected ("timeout"). send_code
+calls are shed much sooner: they raise AdmissionRejected when more than
+ADMISSION_SEND_CODE_MAX_WAITING are already waiting, when no slot frees up
+within ADMISSION_SEND_CODE_WAIT_SECONDS, or when the number's country is over
+its per-minute send_code rate. The country token is only taken once the call
+has a slot, so shed calls do not use up the country's rate. The user is asked
+to send the number again later and nothing about the number has been stored yet.
+"""
+
+import time
+import itertools
+import threading
+import contextlib
+import metrics
+from config import (
+    ADMISSION_TOTAL_LIMIT, ADMISSION_VERIFY_LIMIT, ADMISSION_REWARD_LIMIT, ADMISSION_SEND_CODE_LIMIT,
+    ADMISSION_SEND_CODE_MAX_WAITING, ADMISSION_SEND_CODE_WAIT_SECONDS, ADMISSION_MAX_WAIT_SECONDS,
+    COUNTRY_SEND_CODE_PER_MINUTE, COUNTRY_SEND_CODE_LIMITS
+)
+
+PRIORITIES = {"verify": 0, "reward": 1, "send_code": 2}
+SHEDDABLE = {"send_code"}
+
+class AdmissionRejected(Exception):
+    def __init__(self, work_class, reason):
+        super().__init__(f"{work_class} rejected: {reason}")
+        self.work_class = work_class
+        self.reason = reason
+
+def parse_country_limits(value):
+    """'+1=30,+44=10' -> {'+1': 30.0, '+44': 10.0} (send_code calls per minute)"""
+    limits = {}
+    for item in (value or "").split(','):
+        if '=' not in item:
+            continue
+        code, rate = item.split('=', 1)
+        try:
+            limits[code.strip()] = float(rate)
+        except ValueError:
+            print(f"⚠️ Ignoring invalid country send_code limit: {item}")
+    return limits
+
+class CountryRateLimiter:
+    """Token bucket per country; the bucket holds one minute's worth of calls"""
+
+    def __init__(self, default_per_minute=0.0, overrides=None):
+        self.default_per_minute = default_per_minute
+        self.overrides = dict(overrides or {})
+        self.buckets = {}  # country_code -> [tokens, last_refill]
+        self.lock = threading.Lock()
+
+    def rate_for(self, country_code):
+        return self.overrides.get(country_code, self.default_per_minute)
+
+    def try_acquire(self, country_code):
+        rate = self.rate_for(country_code)
+        if not country_code or rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(country_code, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate / 60)
+            if tokens < 1:
+                self.buckets[country_code] = (tokens, now)
+                return False
+            self.buckets[country_code] = (tokens - 1, now)
+            return True
+
+class _Ticket:
+    __slots__ = ("work_class", "priority", "seq")
+
+    def __init__(self, work_class, seq):
+        self.work_class = work_class
+        self.priority = PRIORITIES[work_class]
+        self.seq = seq
+
+class AdmissionController:
+    def __init__(self, total_limit=ADMISSION_TOTAL_LIMIT, class_limits=None,
+                 send_code_max_waiting=ADMISSION_SEND_CODE_MAX_WAITING,
+                 send_code_wait_seconds=ADMISSION_SEND_CODE_WAIT_SECONDS, max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS,
+                 country_limiter=None):
+        self.total_limit = total_limit
+        self.class_limits = class_limits or {
+            "verify": ADMISSION_VERIFY_LIMIT,
+            "reward": ADMISSION_REWARD_LIMIT,
+            "send_code": ADMISSION_SEND_CODE_LIMIT
+        }
+        self.send_code_max_waiting = send_code_max_waiting
+        self.send_code_wait_seconds = send_code_wait_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.country_limiter = country_limiter or CountryRateLimiter(
+            COUNTRY_SEND_CODE_PER_MINUTE, parse_country_limits(COUNTRY_SEND_CODE_LIMITS)
+        )
+        self.condition = threading.Condition()
+        self.active = {work_class: 0 for work_class in PRIORITIES}
+        self.waiting = []  # tickets ordered by (priority, seq)
+        self.admitted = {work_class: 0 for work_class in PRIORITIES}
+        self.shed = {}  # (work_class, reason) -> count
+        self._seq = itertools.count()
+
+    def _has_slot(self, work_class):
+        return sum(self.active.values()) < self.total_limit and self.active[work_class] < self.class_limits[work_class]
+
+    def _can_run(self, ticket):
+        if not self._has_slot(ticket.work_class):
+            return False
+        for other in self.waiting:
+            if other is ticket:
+                return True
+            # Someone ahead in line could use this slot
+            if self.active[other.work_class] < self.class_limits[other.work_class]:
+                return False
+        return True
+
+    def _waiting_count(self, work_class):
+        return sum(1 for ticket in self.waiting if ticket.work_class == work_class)
+
+    def _reject(self, work_class, reason):
+        self.shed[(work_class, reason)] = self.shed.get((work_class, reason), 0) + 1
+        metrics.ADMISSION_SHED.inc(work_class=work_class, reason=reason)
+        raise AdmissionRejected(work_class, reason)
+
+    def acquire(self, work_class, country_code=None):
+        """Block until work_class may run; raises AdmissionRejected for shed or timed-out calls"""
+        started = time.perf_counter()
+        with self.condition:
+            sheddable = work_class in SHEDDABLE
+            if sheddable and self._waiting_count(work_class) >= self.send_code_max_waiting:
+                self._reject(work_class, "queue_full")
+
+            ticket = _Ticket(work_class, next(self._seq))
+            self.waiting.append(ticket)
+            self.waiting.sort(key=lambda waiting: (waiting.priority, waiting.seq))
+            deadline = started + (self.send_code_wait_seconds if sheddable else self.max_wait_seconds)
+            try:
+                while not self._can_run(ticket):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._reject(work_class, "overloaded" if sheddable else "timeout")
+                    self.condition.wait(remaining)
+                # Only a call that got a slot spends one of its country's tokens
+                if sheddable and not self.country_limiter.try_acquire(country_code):
+                    self._reject(work_class, "country_rate")
+            finally:
+                self.waiting.remove(ticket)
+                # A ticket leaving the line (admitted or not) may unblock the ones behind it
+                self.condition.notify_all()
+            self.active[work_class] += 1
+            self.admitted[work_class] += 1
+        metrics.ADMISSION_WAIT_SECONDS.observe_since(started, work_class=work_class)
+
+    def release(self, work_class):
+        with self.condition:
+            self.active[work_class] -= 1
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, work_class, country_code=None):
+        self.acquire(work_class, country_code)
+        try:
+            yield
+        finally:
+            self.release(work_class)
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "total_limit": self.total_limit,
+                "classes": {
+                    work_class: {
+                        "active": self.active[work_class],
+                        "limit": self.class_limits[work_class],
+                        "waiting": self._waiting_count(work_class),
+                        "admitted": self.admitted[work_class]
+                    }
+                    for work_class in sorted(PRIORITIES, key=PRIORITIES.get)
+                },
+                "shed": {f"{work_class}:{reason}": count for (work_class, reason), count in sorted(self.shed.items())}
+            }
+
+admission_controller = AdmissionController()
+
+metrics.ADMISSION_ACTIVE.set_function(lambda: dict(admission_controller.active))
+metrics.ADMISSION_WAITING.set_function(
+    lambda: {work_class: admission_controller._waiting_count(work_class) for work_class in PRIORITIES}
+)
@@ -12,32 +12,30 @@ Key Features:
 - Configurable timeout periods
 - Detailed logging and statistics
 - Safe cancellation with proper cleanup
+
+Scheduling:
+The scheduler no longer polls every few minutes. It asks MongoDB (one indexed
+find_one) for the oldest running background verification and sleeps until
+background_verification_started + timeout, so a number is cancelled when its
+deadline passes rather than up to a check interval later. When nothing is
+running it sleeps for a whole timeout: a claim started after that query cannot
+fall due before then, so the next query always comes in time for it. Settings
+changes, /forceautocancel and stop wake the loop at once. MongoDB errors, and a
+number still due right after a check, retry after RETRY_SECONDS.
 """
 
 import threading
-import time
-import schedule
 import logging
 from datetime import datetime, timedelta
 from db import (
     auto_cancel_background_verification_numbers,
     get_auto_cancellation_stats,
-    get_numbers_with_background_verification,
+    get_next_auto_cancel_deadline,
     get_numbers_without_background_verification
 )
 from bot_init import bot
 from config import ADMIN_IDS
 
-# Configuration
-AUTO_CANCEL_ENABLED = True
-AUTO_CANCEL_TIMEOUT_MINUTES = 30  # Cancel background verifications after 30 minutes
-CHECK_INTERVAL_MINUTES = 5  # Check every 5 minutes
-NOTIFICATION_ENABLED = True
-
-# Global scheduler control
-scheduler_thread = None
-scheduler_running = False
-
 def setup_logging():
     """Setup logging for auto-cancellation system"""
     logging.basicConfig(
@@ -48,70 +46,176 @@ def setup_logging():
 
 logger = setup_logging()
 
+class AutoCancelScheduler:
+    RETRY_SECONDS = 60  # Back-off after a failed check, or when a due number could not be cancelled
+
+    def __init__(self, timeout_minutes=30, enabled=True, notification_enabled=True):
+        self.enabled = enabled
+        self.timeout_minutes = timeout_minutes  # Cancel background verifications after this long
+        self.notification_enabled = notification_enabled
+        self.condition = threading.Condition()
+        self.next_deadline = None  # UTC time of the next check; None sleeps until woken
+        self.recheck = False       # Settings changed or a check was forced: look again now
+        self.running = False
+        self.thread = None
+        self.wakeups = 0
+        self.cancelled_total = 0
+        self.last_check = None
+        self.last_lateness_seconds = None  # How long after its deadline the last due number was cancelled
+
+    # ---- scheduling ----
+
+    def _wait_for_deadline(self):
+        """Block until the next deadline passes or someone asks for a recheck; False once stopped"""
+        with self.condition:
+            while self.running and not self.recheck:
+                if self.next_deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = (self.next_deadline - datetime.utcnow()).total_seconds()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            self.recheck = False
+            return self.running
+
+    def _plan_next_deadline(self, checked_at):
+        if not self.enabled:
+            return None
+        deadline = get_next_auto_cancel_deadline(self.timeout_minutes)
+        if deadline is None:
+            # Nothing running: anything that starts from now on is due at checked_at + timeout at the earliest
+            return checked_at + timedelta(minutes=self.timeout_minutes)
+        return deadline
+
+    def _loop(self):
+        logger.info(f"🤖 Auto-cancel scheduler started (timeout: {self.timeout_minutes}m, deadline-driven)")
+        while self._wait_for_deadline():
+            try:
+                self.wakeups += 1
+                due_at = self.next_deadline
+                checked_at = datetime.utcnow()
+                if self.enabled:
+                    cancelled = self.run_check()
+                    if cancelled and due_at is not None and due_at <= checked_at:
+                        self.last_lateness_seconds = (checked_at - due_at).total_seconds()
+                next_deadline = self._plan_next_deadline(checked_at)
+                if next_deadline is not None and next_deadline <= checked_at:
+                    # Still due right after the check: its cancel failed, don't spin on it
+                    next_deadline = datetime.utcnow() + timedelta(seconds=self.RETRY_SECONDS)
+                with self.condition:
+                    self.next_deadline = next_deadline
+            except Exception as e:
+                logger.error(f"❌ Error in scheduler loop: {e}")
+                with self.condition:
+                    self.next_deadline = datetime.utcnow() + timedelta(seconds=self.RETRY_SECONDS)  # Back off while MongoDB is down
+        logger.info("🛑 Auto-cancel scheduler stopped")
+
+    def wake(self):
+        """Re-read the next deadline now (settings changed, manual check, start)"""
+        with self.condition:
+            self.recheck = True
+            self.condition.notify()
+
+    # ---- cancellation ----
+
+    def run_check(self):
+        """
+        Cancel background verification numbers past their timeout.
+        IMPORTANT: Only cancels numbers WITH background verification.
+        Numbers WITHOUT background verification are NEVER touched.
+        """
+        self.last_check = datetime.utcnow()
+        cancelled_count = auto_cancel_background_verification_numbers(self.timeout_minutes)
+        if cancelled_count > 0:
+            self.cancelled_total += cancelled_count
+            logger.info(f"🤖 Auto-cancelled {cancelled_count} background verification numbers")
+
+            # Statistics are only gathered for the report, not on every wakeup
+            if self.notification_enabled:
+                protected_count = len(get_numbers_without_background_verification())
+                send_admin_notification(cancelled_count, get_auto_cancellation_stats(), protected_count)
+        return cancelled_count
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self.running:
+            logger.warning("⚠️ Auto-cancel scheduler is already running")
+            return False
+        with self.condition:
+            self.running = True
+            self.recheck = True  # First pass cancels anything that fell due while no scheduler ran
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="AutoCancelScheduler")
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            logger.warning("⚠️ Auto-cancel scheduler is not running")
+            return False
+        with self.condition:
+            self.running = False
+            self.next_deadline = None
+            self.condition.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        return True
+
+    def update_settings(self, enabled=None, timeout_minutes=None):
+        with self.condition:
+            if enabled is not None:
+                self.enabled = enabled
+                logger.info(f"🔧 Auto-cancel enabled: {enabled}")
+            if timeout_minutes is not None:
+                self.timeout_minutes = timeout_minutes
+                logger.info(f"🔧 Auto-cancel timeout: {timeout_minutes} minutes")
+        # Every deadline moved with the timeout
+        self.wake()
+
+    def get_status(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "timeout_minutes": self.timeout_minutes,
+            "next_deadline": self.next_deadline if self.running else None,
+            "wakeups": self.wakeups,
+            "cancelled_total": self.cancelled_total,
+            "last_check": self.last_check,
+            "last_lateness_seconds": self.last_lateness_seconds
+        }
+
+auto_cancel_scheduler = AutoCancelScheduler()
+
 def auto_cancel_job():
-    """
-    Main job that runs periodically to cancel background verification numbers.
-    IMPORTANT: Only cancels numbers WITH background verification.
-    Numbers WITHOUT background verification are NEVER touched.
-    """
+    """Run one cancellation pass now, outside the scheduler thread"""
     try:
-        if not AUTO_CANCEL_ENABLED:
-            return
-        
+        if not auto_cancel_scheduler.enabled:
+            return 0
         logger.info("🤖 Starting automatic cancellation check...")
-        
-        # Get statistics before cancellation
-        stats_before = get_auto_cancellation_stats()
-        
-        # Get numbers that will be protected (no background verification)
-        protected_numbers = get_numbers_without_background_verification()
-        protected_count = len(protected_numbers)
-        
-        # Get numbers that are eligible for cancellation (with background verification)
-        eligible_numbers = get_numbers_with_background_verification(AUTO_CANCEL_TIMEOUT_MINUTES)
-        eligible_count = len(eligible_numbers)
-        
-        logger.info(f"📊 Protected numbers (no background verification): {protected_count}")
-        logger.info(f"📊 Eligible for cancellation (background verification): {eligible_count}")
-        
-        if eligible_count == 0:
+        cancelled_count = auto_cancel_scheduler.run_check()
+        if cancelled_count == 0:
             logger.info("✅ No numbers eligible for auto-cancellation")
-            return
-        
-        # Perform automatic cancellation (only background verification numbers)
-        cancelled_count = auto_cancel_background_verification_numbers(AUTO_CANCEL_TIMEOUT_MINUTES)
-        
-        # Get statistics after cancellation
-        stats_after = get_auto_cancellation_stats()
-        
-        # Log results
-        if cancelled_count > 0:
-            logger.info(f"🤖 Auto-cancelled {cancelled_count} background verification numbers")
-            
-            # Send notification to admins if enabled
-            if NOTIFICATION_ENABLED and cancelled_count > 0:
-                send_admin_notification(cancelled_count, stats_before, stats_after, protected_count)
-        else:
-            logger.info("✅ No background verification numbers were cancelled")
-            
+        return cancelled_count
     except Exception as e:
         logger.error(f"❌ Error in auto_cancel_job: {e}")
         import traceback
         traceback.print_exc()
+        return 0
 
-def send_admin_notification(cancelled_count, stats_before, stats_after, protected_count):
+def send_admin_notification(cancelled_count, stats, protected_count):
     """Send notification to admins about auto-cancellation results"""
     try:
         message = f"""🤖 **AUTO-CANCELLATION REPORT**
 
 🛑 **Cancelled**: {cancelled_count} numbers with background verification
 ✅ **Protected**: {protected_count} numbers without background verification
-⏰ **Timeout**: {AUTO_CANCEL_TIMEOUT_MINUTES} minutes
+⏰ **Timeout**: {auto_cancel_scheduler.timeout_minutes} minutes
 
 📊 **STATISTICS:**
-• Background verification numbers: {stats_after.get('numbers_with_background_verification', 0)}
-• Protected numbers: {stats_after.get('numbers_without_background_verification', 0)}
-• Total auto-cancelled: {stats_after.get('auto_cancelled_count', 0)}
+• Background verification numbers: {stats.get('numbers_with_background_verification', 0)}
+• Protected numbers: {stats.get('numbers_without_background_verification', 0)}
+• Total auto-cancelled: {stats.get('auto_cancelled_count', 0)}
 
 🔒 **SAFETY**: Numbers without background verification are NEVER auto-cancelled."""
 
@@ -120,65 +224,22 @@ def send_admin_notification(cancelled_count, stats_before, stats_after, protecte
                 bot.send_message(admin_id, message, parse_mode="Markdown")
             except Exception as send_error:
                 logger.error(f"❌ Error sending notification to admin {admin_id}: {send_error}")
-                
+
     except Exception as e:
         logger.error(f"❌ Error in send_admin_notification: {e}")
 
 def start_auto_cancel_scheduler():
     """Start the automatic cancellation scheduler"""
-    global scheduler_thread, scheduler_running
-    
-    if scheduler_running:
-        logger.warning("⚠️ Auto-cancel scheduler is already running")
-        return False
-    
     try:
-        # Clear any existing scheduled jobs
-        schedule.clear('auto-cancel')
-        
-        # Schedule the auto-cancellation job
-        schedule.every(CHECK_INTERVAL_MINUTES).minutes.do(auto_cancel_job).tag('auto-cancel')
-        
-        def run_scheduler():
-            global scheduler_running
-            scheduler_running = True
-            logger.info(f"🤖 Auto-cancel scheduler started (check every {CHECK_INTERVAL_MINUTES}m, timeout: {AUTO_CANCEL_TIMEOUT_MINUTES}m)")
-            
-            while scheduler_running:
-                try:
-                    schedule.run_pending()
-                    time.sleep(30)  # Check every 30 seconds
-                except Exception as e:
-                    logger.error(f"❌ Error in scheduler loop: {e}")
-                    time.sleep(60)  # Wait longer on error
-            
-            logger.info("🛑 Auto-cancel scheduler stopped")
-        
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True, name="AutoCancelScheduler")
-        scheduler_thread.start()
-        
-        # Run initial check
-        threading.Thread(target=auto_cancel_job, daemon=True, name="InitialAutoCancelCheck").start()
-        
-        return True
-        
+        return auto_cancel_scheduler.start()
     except Exception as e:
         logger.error(f"❌ Error starting auto-cancel scheduler: {e}")
         return False
 
 def stop_auto_cancel_scheduler():
     """Stop the automatic cancellation scheduler"""
-    global scheduler_running
-    
-    if not scheduler_running:
-        logger.warning("⚠️ Auto-cancel scheduler is not running")
-        return False
-    
     try:
-        scheduler_running = False
-        schedule.clear('auto-cancel')
-        logger.info("🛑 Auto-cancel scheduler stopped")
-        return True
+        return auto_cancel_scheduler.stop()
     except Exception as e:
         logger.error(f"❌ Error stopping auto-cancel scheduler: {e}")
         return False
@@ -186,14 +247,9 @@ def stop_auto_cancel_scheduler():
 def get_scheduler_status():
     """Get the status of the auto-cancellation scheduler"""
     try:
-        stats = get_auto_cancellation_stats()
-        return {
-            "enabled": AUTO_CANCEL_ENABLED,
-            "running": scheduler_running,
-            "timeout_minutes": AUTO_CANCEL_TIMEOUT_MINUTES,
-            "check_interval_minutes": CHECK_INTERVAL_MINUTES,
-            "stats": stats
-        }
+        status = auto_cancel_scheduler.get_status()
+        status["stats"] = get_auto_cancellation_stats()
+        return status
     except Exception as e:
         logger.error(f"❌ Error getting scheduler status: {e}")
         return {}
@@ -203,45 +259,18 @@ def force_auto_cancel_check():
     try:
         logger.info("🔧 Force running auto-cancellation check...")
         auto_cancel_job()
+        # The numbers just cancelled may have held the next deadline
+        auto_cancel_scheduler.wake()
         return True
     except Exception as e:
         logger.error(f"❌ Error in force auto-cancel check: {e}")
         return False
 
-def update_auto_cancel_settings(enabled=None, timeout_minutes=None, check_interval_minutes=None):
+def update_auto_cancel_settings(enabled=None, timeout_minutes=None):
     """Update auto-cancellation settings"""
-    global AUTO_CANCEL_ENABLED, AUTO_CANCEL_TIMEOUT_MINUTES, CHECK_INTERVAL_MINUTES
-    
     try:
-        restart_needed = False
-        
-        if enabled is not None:
-            AUTO_CANCEL_ENABLED = enabled
-            logger.info(f"🔧 Auto-cancel enabled: {enabled}")
-        
-        if timeout_minutes is not None:
-            AUTO_CANCEL_TIMEOUT_MINUTES = timeout_minutes
-            logger.info(f"🔧 Auto-cancel timeout: {timeout_minutes} minutes")
-        
-        if check_interval_minutes is not None:
-            CHECK_INTERVAL_MINUTES = check_interval_minutes
-            restart_needed = True
-            logger.info(f"🔧 Auto-cancel check interval: {check_interval_minutes} minutes")
-        
-        if restart_needed and scheduler_running:
-            stop_auto_cancel_scheduler()
-            start_auto_cancel_scheduler()
-        
+        auto_cancel_scheduler.update_settings(enabled=enabled, timeout_minutes=timeout_minutes)
         return True
-        
     except Exception as e:
         logger.error(f"❌ Error updating auto-cancel settings: {e}")
         return False
-
-# Auto-start the scheduler when module is imported
-if __name__ != "__main__":
-    # Start scheduler automatically when imported
-    try:
-        start_auto_cancel_scheduler()
-    except Exception as e:
-        logger.error(f"❌ Error auto-starting scheduler: {e}")
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Boot-time profiling for main.py.
+
+boot_profiler.install() puts a finder at the front of sys.meta_path that times
+the execution of every module from this directory: the total includes nested
+imports, the self time excludes other bot modules but includes the third-party
+packages a module pulls in (so proxy_manager's self time is mostly Telethon).
+main() wraps its startup steps in boot_profiler.phase() and calls mark_ready()
+just before polling, which prints a report of the slowest modules and phases.
+
+Enabled with BOOT_PROFILE (default on); the finder is removed once imports finish.
+"""
+
+import os
+import sys
+import time
+import threading
+import contextlib
+import importlib.abc
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        finding = getattr(self._local, "finding", None)
+        if finding is None:
+            finding = self._local.finding = set()
+        if fullname in finding:
+            return None
+        finding.add(fullname)
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            finding.discard(fullname)
+
+        if spec is None or not spec.origin or os.path.dirname(os.path.abspath(spec.origin)) != BOT_DIR:
+            return spec
+        loader = spec.loader
+        exec_module = getattr(loader, "exec_module", None)
+        if exec_module is None:
+            return spec
+
+        profiler = self.profiler
+
+        def timed_exec_module(module):
+            profiler._enter(fullname)
+            try:
+                exec_module(module)
+            finally:
+                profiler._exit(fullname)
+
+        loader.exec_module = timed_exec_module
+        return spec
+
+class BootProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {}  # module -> (total_seconds, self_seconds)
+        self.phases = []  # (name, seconds)
+        self.imports_seconds = None
+        self.ready_seconds = None
+        self._finder = None
+        self._stack = threading.local()
+
+    def install(self):
+        """Start timing bot module imports; the boot clock starts here"""
+        if self._finder is None:
+            self.started = time.perf_counter()
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def finish_imports(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+            self.imports_seconds = time.perf_counter() - self.started
+
+    def _enter(self, name):
+        stack = getattr(self._stack, "entries", None)
+        if stack is None:
+            stack = self._stack.entries = []
+        stack.append([name, time.perf_counter(), 0.0])
+
+    def _exit(self, name):
+        stack = self._stack.entries
+        _, started, children = stack.pop()
+        total = time.perf_counter() - started
+        if stack:
+            stack[-1][2] += total
+        self.imports[name] = (total, total - children)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def mark_ready(self):
+        self.finish_imports()
+        if self.ready_seconds is None:
+            self.ready_seconds = time.perf_counter() - self.started
+        return self.ready_seconds
+
+    def report(self, top=10):
+        ready = self.ready_seconds if self.ready_seconds is not None else time.perf_counter() - self.started
+        imports = self.imports_seconds or 0.0
+        lines = [
+            f"🚀 Boot profile: ready in {ready:.2f}s "
+            f"(imports {imports:.2f}s, startup {sum(seconds for _, seconds in self.phases):.2f}s)"
+        ]
+        if self.imports:
+            lines.append(f"   {'module':<26}{'self ms':>10}{'total ms':>10}")
+            slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            for name, (total, own) in slowest:
+                lines.append(f"   {name:<26}{own * 1000:>10.1f}{total * 1000:>10.1f}")
+        for name, seconds in self.phases:
+            lines.append(f"   ⏱️ {name:<23}{seconds * 1000:>10.1f}")
+        return "\n".join(lines)
+
+    def get_status(self):
+        return {
+            "ready_seconds": round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+            "imports_seconds": round(self.imports_seconds, 3) if self.imports_seconds is not None else None
+        }
+
+boot_profiler = BootProfiler()
@@ -1,8 +1,12 @@
 import telebot
 from config import BOT_TOKEN
+from metrics import install_bot_api_metrics
 
 bot = telebot.TeleBot(BOT_TOKEN)
 
+# Record Bot API latency and 429s for /metrics
+install_bot_api_metrics()
+
 # Initialize proxy manager with bot instance for notifications
 from proxy_manager import proxy_manager
 proxy_manager.set_notification_bot(bot)
\ No newline at end of file
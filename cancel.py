@@ -1,37 +1,36 @@
 import os
-import asyncio
 import threading
-from db import get_user, update_user, unmark_number_used, delete_specific_pending_number
+from db import update_user, unmark_number_used, delete_specific_pending_number
 from utils import require_channel_membership
+from request_context import context_for
 from bot_init import bot
-from telegram_otp import session_manager
+from router import router
 from config import SESSIONS_DIR
-from translations import TRANSLATIONS
+from translations import get_text
 
-# Use the same async loop as otp.py
-def run_async(coro):
-    """Run async function in the background thread"""
+# Go through otp.py so the call reaches the OTP worker process that owns the user
+def run_session_call(user_id, method):
+    """Run a SessionManager method for the user on otp_loop or in its OTP worker"""
     try:
-        from otp import otp_loop
-        future = asyncio.run_coroutine_threadsafe(coro, otp_loop)
-        return future.result(timeout=10)
+        from otp import call_session_manager
+        return call_session_manager(user_id, method, timeout=10)
     except Exception as e:
         print(f"Error running async in cancel: {e}")
         return False
 
-@bot.message_handler(commands=['cancel'])
+@router.command('cancel')
 @require_channel_membership
 def handle_cancel(message):
     """Simple cancel function - only allows canceling pending and failed numbers"""
     try:
         user_id = message.from_user.id
-        user = get_user(user_id) or {}
+        user = context_for(message).user or {}
         lang = user.get('language', 'English')
         
         current_phone = user.get("pending_phone")
         
         if not current_phone:
-            bot.reply_to(message, TRANSLATIONS['no_pending_verification'][lang])
+            bot.reply_to(message, get_text('no_pending_verification', lang))
             return
         
         # Check if this number is in database and what status it has
@@ -49,7 +48,7 @@ def handle_cancel(message):
             # Allow cancellation only for pending and failed numbers
             if status in ["waiting", "success", "completed"]:
                 # Cannot cancel numbers that are waiting for verification or already successful
-                bot.reply_to(message, TRANSLATIONS['cannot_cancel_received'][lang], parse_mode="Markdown")
+                bot.reply_to(message, get_text('cannot_cancel_received', lang), parse_mode="Markdown")
                 print(f"🚫 Cancel blocked - Number {current_phone} has status '{status}' (cannot cancel)")
                 return
         
@@ -93,7 +92,7 @@ def perform_cancellation(user_id, phone_number, lang):
         
         # Clean up user state
         try:
-            run_async(session_manager.cleanup_session(user_id))
+            run_session_call(user_id, "cleanup_session")
             print(f"🧹 Cleaned up session for user {user_id}")
         except Exception as cleanup_error:
             print(f"⚠️ Session cleanup warning: {cleanup_error}")
@@ -110,14 +109,7 @@ def perform_cancellation(user_id, phone_number, lang):
         })
         
         # Send success message
-        success_messages = {
-            'English': f"✅ **Cancelled Successfully**\n\n📞 Number: `{phone_number}`\n🔄 Number is now available for retry",
-            'Arabic': f"✅ **تم الإلغاء بنجاح**\n\n📞 الرقم: `{phone_number}`\n🔄 الرقم متاح الآن للمحاولة مرة أخرى",
-            'Chinese': f"✅ **取消成功**\n\n📞 号码: `{phone_number}`\n🔄 号码现在可以重试"
-        }
-        
-        success_msg = success_messages.get(lang, success_messages['English'])
-        bot.send_message(user_id, success_msg, parse_mode="Markdown")
+        bot.send_message(user_id, get_text('cancel_success', lang, phone=phone_number), parse_mode="Markdown")
         
         print(f"✅ Cancellation completed successfully for user {user_id}")
         
@@ -126,12 +118,12 @@ def perform_cancellation(user_id, phone_number, lang):
         bot.send_message(user_id, "⚠️ Cancellation partially completed. Please check your status.")
 
 # Simple callback handler (keeping for compatibility)
-@bot.callback_query_handler(func=lambda call: call.data.startswith('cancel_'))
+@router.callback('cancel_')
 def handle_cancel_callback(call):
     """Handle cancel button clicks - simplified version"""
     try:
         user_id = call.from_user.id
-        user = get_user(user_id) or {}
+        user = context_for(call).user or {}
         lang = user.get('language', 'English')
         
         if call.data == "cancel_back":
@@ -1,6 +1,11 @@
-from db import get_country_capacities, get_user
+import time
+import threading
+from datetime import datetime
+from db import get_country_capacities, get_user, add_country_change_listener
+from config import CAP_CACHE_SECONDS
 from utils import require_channel_membership
 from bot_init import bot
+from router import router
 from translations import get_text
 
 # Import withdrawal state to check for active withdrawals
@@ -207,48 +212,102 @@ COUNTRY_INFO = {
 def get_country_info(code):
     return COUNTRY_INFO.get(code, {"name": code, "flag": ""})
 
-@bot.message_handler(commands=['cap'])
-@require_channel_membership
-def handle_cap(message):
-    countries = get_country_capacities()
-    
-    # Escape function for MarkdownV2
-    def escape_md_v2(text):
-        chars_to_escape = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-        for char in chars_to_escape:
-            text = text.replace(char, f'\\{char}')
-        return text
-    
+# MarkdownV2 reserved characters, escaped in one pass
+MD_V2_ESCAPES = str.maketrans({char: f'\\{char}' for char in '_*[]()~`>#+-=|{}.!'})
+
+def escape_md_v2(text):
+    return text.translate(MD_V2_ESCAPES)
+
+def render_cap_message(countries):
+    """The /cap MarkdownV2 payload for a list of country documents"""
     # Header with emoji and title in bold
     header = "🔋 *Available Countries*\n"
     header += "────────────────\n\n"
     
-    # Sort countries by country code
-    sorted_countries = sorted(countries, key=lambda x: x['country_code'])
-    
-    # Build country entries
+    # Build country entries, sorted by country code
     country_lines = []
-    for c in sorted_countries:
+    for c in sorted(countries, key=lambda x: x['country_code']):
         code = c['country_code']
-        info = get_country_info(code)
-        flag = info['flag']
+        flag = get_country_info(code)['flag']
         free_spam = c.get('free_spam', c.get('price', 0.0))
         claim_time = c.get('claim_time', 300)
         
-        # Escape special characters for MarkdownV2
-        code_escaped = escape_md_v2(code)
-        price_escaped = escape_md_v2(str(free_spam))
-        claim_time_escaped = escape_md_v2(str(claim_time))
-        
         # Each country in its own blockquote with copyable code
-        country_lines.append(f"> {flag} `{code_escaped}` \\| \\$ {price_escaped}\\$ \\| \\$ {claim_time_escaped}s")
+        country_lines.append(
+            f"> {flag} `{escape_md_v2(code)}` \\| \\$ {escape_md_v2(str(free_spam))}\\$ \\| \\$ {escape_md_v2(str(claim_time))}s"
+        )
 
     # Combine all parts - need empty line between blockquotes to keep them separate
-    full_message = (
+    return (
         header +
         "\n\n".join(country_lines) +
         "\n\n────────────────\n" +
         f"🌍 *Total Countries*: {len(countries)}\n\n"
     )
+
+class CapPageCache:
+    """
+    The rendered /cap message, rebuilt after a country write or once it is
+    CAP_CACHE_SECONDS old.
     
-    bot.send_message(message.chat.id, full_message, parse_mode="MarkdownV2")
+    db.py fires a country-change event from set_country_capacity, set_country_price,
+    set_country_claim_time and remove_country_by_code; that drops the payload and
+    the next /cap renders it again, so an unchanged country list costs at most one
+    database read per CAP_CACHE_SECONDS. The event only reaches this process, so
+    the age limit is what bounds how long other replicas serve the old list. The
+    text is not translated, so one payload serves every language.
+    """
+    
+    def __init__(self, max_age_seconds=CAP_CACHE_SECONDS):
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.payload = None
+        self.expires_at = 0.0
+        self.generation = 0
+        self.built_at = None
+        self.build_ms = None
+        self.builds = 0
+        self.hits = 0
+    
+    def invalidate(self, country_code=None):
+        with self.lock:
+            self.payload = None
+            self.generation += 1
+    
+    def get(self):
+        with self.lock:
+            if self.payload is not None and time.monotonic() < self.expires_at:
+                self.hits += 1
+                return self.payload
+            generation = self.generation
+        
+        started = time.perf_counter()
+        payload = render_cap_message(get_country_capacities())
+        build_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.builds += 1
+            self.build_ms = build_ms
+            self.built_at = datetime.utcnow()
+            # A country changed while we were rendering; serve this payload once and render again next time
+            if generation == self.generation:
+                self.payload = payload
+                self.expires_at = time.monotonic() + self.max_age_seconds
+        return payload
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                "cached": self.payload is not None and time.monotonic() < self.expires_at,
+                "built_at": self.built_at,
+                "build_ms": self.build_ms,
+                "builds": self.builds,
+                "hits": self.hits
+            }
+
+cap_cache = CapPageCache()
+add_country_change_listener(cap_cache.invalidate)
+
+@router.command('cap')
+@require_channel_membership
+def handle_cap(message):
+    bot.send_message(message.chat.id, cap_cache.get(), parse_mode="MarkdownV2")
@@ -1,9 +1,10 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import add_leader_card
 from utils import require_channel_membership
 
-@bot.message_handler(commands=['card'])
+@router.command('card')
 @require_channel_membership
 def handle_card(message):
     admin_id = message.from_user.id
@@ -1,9 +1,10 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import get_card_withdrawal_stats
 from utils import require_channel_membership
 
-@bot.message_handler(commands=['cardw'])
+@router.command('cardw')
 @require_channel_membership
 def handle_cardw(message):
     admin_id = message.from_user.id
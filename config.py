@@ -24,6 +24,61 @@ ADMIN_IDS = [int(id) for id in os.getenv('ADMIN_IDS', '1211362365').split(',')]
 SESSIONS_DIR = os.getenv('SESSIONS_DIR', "sessions")
 VERIFIED_DIR = os.getenv('SESSIONS_DIR', "verified")
 
+# Session archive exports (/get, /getall, /sendzip)
+SESSION_ARCHIVE_PART_MB = float(os.getenv('SESSION_ARCHIVE_PART_MB', 45))  # Roll over to a new zip part before this size
+SESSION_ARCHIVE_COMPRESSION = os.getenv('SESSION_ARCHIVE_COMPRESSION', 'deflated')  # 'deflated' or 'stored'
+
+# Verification tracing (/latency)
+VERIFICATION_TRACE_RETENTION_DAYS = int(os.getenv('VERIFICATION_TRACE_RETENTION_DAYS', 30))  # Spans expire after this many days
+
+# MongoDB query profiler (/dbprofile, /dbexplain)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100))  # Commands slower than this go to the slow log
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 200))  # Slow log ring buffer size
+
+# OTP code/2FA submission workers
+OTP_WORKERS = int(os.getenv('OTP_WORKERS', 16))  # Submissions handled at once (each blocks on otp_loop)
+OTP_QUEUE_LIMIT = int(os.getenv('OTP_QUEUE_LIMIT', 200))  # Submissions waiting beyond this are asked to resend
+OTP_SHARD_WORKERS = int(os.getenv('OTP_SHARD_WORKERS', 0))  # Telethon worker processes, each owning a shard of users; 0 = all on otp_loop
+
+# Admission control for Telethon work (/admission); priority: verify > reward > send_code
+ADMISSION_TOTAL_LIMIT = int(os.getenv('ADMISSION_TOTAL_LIMIT', 32))  # Telethon operations running at once
+ADMISSION_VERIFY_LIMIT = int(os.getenv('ADMISSION_VERIFY_LIMIT', 32))  # Code and 2FA sign-ins
+ADMISSION_REWARD_LIMIT = int(os.getenv('ADMISSION_REWARD_LIMIT', 12))  # Device checks before a reward
+ADMISSION_SEND_CODE_LIMIT = int(os.getenv('ADMISSION_SEND_CODE_LIMIT', 12))  # New phone submissions
+ADMISSION_SEND_CODE_MAX_WAITING = int(os.getenv('ADMISSION_SEND_CODE_MAX_WAITING', 20))  # Shed new numbers beyond this queue
+ADMISSION_SEND_CODE_WAIT_SECONDS = float(os.getenv('ADMISSION_SEND_CODE_WAIT_SECONDS', 3))  # Shed new numbers that can't start within this
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 120))  # Give up on a code, 2FA or reward call that can't start within this
+COUNTRY_SEND_CODE_PER_MINUTE = float(os.getenv('COUNTRY_SEND_CODE_PER_MINUTE', 0))  # Per-country send_code cap; 0 = unlimited
+COUNTRY_SEND_CODE_LIMITS = os.getenv('COUNTRY_SEND_CODE_LIMITS', '')  # Per-country overrides, e.g. "+1=30,+44=10"
+
+# Bulk payouts (/paycard) and the user notification outbox
+PAYOUT_BATCH_USERS = int(os.getenv('PAYOUT_BATCH_USERS', 200))  # Users paid per transaction; an interrupted payout resumes from the next batch
+NOTIFICATION_RATE_PER_SECOND = float(os.getenv('NOTIFICATION_RATE_PER_SECOND', 25))  # Outbox send rate (Telegram allows ~30 messages/s)
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))  # Give up on a notification after this many failed sends
+
+# Conversation state (withdrawal input, verification steps, claim waits) shared across processes and restarts
+STATE_CACHE_SECONDS = float(os.getenv('STATE_CACHE_SECONDS', 2))  # How long a process trusts its cached copy of a state before re-reading MongoDB
+CAP_CACHE_SECONDS = float(os.getenv('CAP_CACHE_SECONDS', 30))  # Longest another replica's country write can go unseen in /cap
+WITHDRAW_STATE_TTL_SECONDS = int(os.getenv('WITHDRAW_STATE_TTL_SECONDS', 1800))  # Forget an unfinished withdrawal prompt after this long
+
+# Leader election: singleton jobs (auto-cancel, session janitor, proxy check, claim resume) run in one replica
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', 15))  # Another replica takes over this long after the leader stops renewing
+LEADER_RENEW_SECONDS = float(os.getenv('LEADER_RENEW_SECONDS', 5))  # How often the leader renews and followers try to take the lease
+
+# Startup
+BOOT_PROFILE = os.getenv('BOOT_PROFILE', 'true').lower() == 'true'  # Time module imports and startup steps, print a report when ready
+SKIP_UNCHANGED_INDEXES = os.getenv('SKIP_UNCHANGED_INDEXES', 'true').lower() == 'true'  # Skip index creation when the stored index fingerprint matches
+
+# Logging (/loglevel, /logsample)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'utils.membership=0.05,notice.broadcast=0.05,telegram_otp.devices=0.2')  # logger=fraction of DEBUG/INFO kept
+
+# Update recording for load replay (/recordupdates, replay.py)
+UPDATE_RECORD_FILE = os.getenv('UPDATE_RECORD_FILE', '')  # Record anonymized updates here from startup; empty = off
+UPDATE_RECORD_SALT = os.getenv('UPDATE_RECORD_SALT', '')  # Keeps pseudonymous ids stable across restarts; empty = random per process
+UPDATE_RECORD_MAX_MB = float(os.getenv('UPDATE_RECORD_MAX_MB', 100))  # Stop recording at this file size
+
 # Proxy Configuration
 PROXYLIST = os.getenv('PROXYLIST', "p.webshare.io:80:ajimjcrn-rotate:bdkf0k1ybhik")  # Format: IP:Port:username:password, IP:Port:username:password
 
@@ -1,9 +1,10 @@
 from db import set_country_capacity
 from config import ADMIN_IDS
 from bot_init import bot
+from router import router
 from cap import get_country_info
 
-@bot.message_handler(commands=['cun'])
+@router.command('cun')
 def handle_cun(message):
     user_id = message.from_user.id
     if user_id not in ADMIN_IDS:
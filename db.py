@@ -1,10 +1,19 @@
-from pymongo import MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime
-from config import MONGO_URI
+from datetime import datetime, timedelta
+from config import MONGO_URI, VERIFICATION_TRACE_RETENTION_DAYS, SKIP_UNCHANGED_INDEXES, PAYOUT_BATCH_USERS
 from bson.objectid import ObjectId
+from metrics import MongoCommandMetrics
+from db_profiler import query_profiler
 import hashlib
-from typing import Optional, Dict, List, Union
+import json
+import time
+from typing import Optional, Dict, List, Tuple, Union
+
+# Command latency by collection/operation, exported on /metrics;
+# query_profiler (db_profiler.py) keeps per-shape timings and the slow log
+mongo_command_metrics = MongoCommandMetrics()
 
 # Initialize MongoDB connections with enhanced settings
 sync_client = MongoClient(
@@ -16,7 +25,8 @@ sync_client = MongoClient(
     serverSelectionTimeoutMS=30000,
     waitQueueTimeoutMS=30000,
     retryWrites=True,
-    retryReads=True
+    retryReads=True,
+    event_listeners=[mongo_command_metrics, query_profiler]
 )
 
 async_client = AsyncIOMotorClient(
@@ -26,7 +36,8 @@ async_client = AsyncIOMotorClient(
     connectTimeoutMS=30000,
     socketTimeoutMS=30000,
     serverSelectionTimeoutMS=30000,
-    waitQueueTimeoutMS=30000
+    waitQueueTimeoutMS=30000,
+    event_listeners=[mongo_command_metrics, query_profiler]
 )
 
 db = sync_client.get_database('telegram_id_sell')
@@ -50,38 +61,53 @@ async def async_get_user(user_id: int) -> Optional[Dict]:
         print(f"Async error in get_user: {str(e)}")
         return None
 
+# Callbacks fired with (user_id, fields) after update_user writes a user's fields
+_user_write_listeners = []
+
+def add_user_write_listener(callback):
+    """Register a callback to run whenever update_user sets fields on a user"""
+    if callback not in _user_write_listeners:
+        _user_write_listeners.append(callback)
+
+def _notify_user_written(user_id: int, data: Dict):
+    for callback in list(_user_write_listeners):
+        try:
+            callback(user_id, data)
+        except Exception as e:
+            print(f"Error in user write listener for {user_id}: {str(e)}")
+
+def _user_update(data: Dict) -> Dict:
+    """
+    $set the fields; $setOnInsert only applies when the upsert creates the user,
+    so new users get their defaults without a separate existence check
+    """
+    defaults = {
+        'registered_at': datetime.utcnow(),
+        'balance': 0.0,
+        'sent_accounts': 0,
+        'pending_phone': None,
+        'otp_msg_id': None
+    }
+    # Fields in both operators would conflict, the update data wins
+    for field in data.keys():
+        defaults.pop(field, None)
+    update_data = {"$set": data}
+    if defaults:
+        update_data["$setOnInsert"] = defaults
+    return update_data
+
 def update_user(user_id: int, data: Dict) -> bool:
     """
     Atomic update or create user with automatic registration timestamp
     Returns True if successful, False otherwise
     """
     try:
-        update_data = {"$set": data}
-        
-        if not db.users.find_one({"user_id": user_id}):
-            # Default values for new users, excluding fields already in the update data
-            defaults = {
-                'registered_at': datetime.utcnow(),
-                'balance': 0.0,
-                'sent_accounts': 0,
-                'pending_phone': None,
-                'otp_msg_id': None
-            }
-            
-            # Remove any fields from defaults that are already being set in the update data
-            # to prevent MongoDB conflict error
-            for field in data.keys():
-                if field in defaults:
-                    del defaults[field]
-            
-            if defaults:  # Only add $setOnInsert if there are fields to set
-                update_data["$setOnInsert"] = defaults
-        
         result = db.users.update_one(
             {"user_id": user_id},
-            update_data,
+            _user_update(data),
             upsert=True
         )
+        _notify_user_written(user_id, data)
         return result.acknowledged
     except Exception as e:
         print(f"Error in update_user: {str(e)}")
@@ -90,32 +116,12 @@ def update_user(user_id: int, data: Dict) -> bool:
 async def async_update_user(user_id: int, data: Dict) -> bool:
     """Async version of update_user"""
     try:
-        update_data = {"$set": data}
-        
-        if not await async_db.users.find_one({"user_id": user_id}):
-            # Default values for new users, excluding fields already in the update data
-            defaults = {
-                'registered_at': datetime.utcnow(),
-                'balance': 0.0,
-                'sent_accounts': 0,
-                'pending_phone': None,
-                'otp_msg_id': None
-            }
-            
-            # Remove any fields from defaults that are already being set in the update data
-            # to prevent MongoDB conflict error
-            for field in data.keys():
-                if field in defaults:
-                    del defaults[field]
-            
-            if defaults:  # Only add $setOnInsert if there are fields to set
-                update_data["$setOnInsert"] = defaults
-        
         result = await async_db.users.update_one(
             {"user_id": user_id},
-            update_data,
+            _user_update(data),
             upsert=True
         )
+        _notify_user_written(user_id, data)
         return result.acknowledged
     except Exception as e:
         print(f"Async error in update_user: {str(e)}")
@@ -159,6 +165,41 @@ def get_withdrawals(user_id: int) -> List[Dict]:
         print(f"Error in get_withdrawals: {str(e)}")
         return []
 
+def _history_page(collection, user_id: int, projection: Dict, before: Optional[Tuple] = None,
+                  after: Optional[Tuple] = None, limit: int = 10) -> Tuple[List[Dict], bool]:
+    """
+    One page of a user's history, newest first, keyed on (timestamp, _id).
+    
+    before/after are the (timestamp, _id) of the last/first row of the page on
+    screen: before pages to older rows, after to newer ones, neither gives the
+    newest page. Reads limit + 1 rows from the (user_id, timestamp, _id) index
+    to return (rows, more) where more says another page exists in that direction.
+    """
+    query = {"user_id": user_id}
+    order = -1
+    cursor = before or after
+    if cursor:
+        timestamp, row_id = cursor
+        op = "$lt" if before else "$gt"
+        query["$or"] = [{"timestamp": {op: timestamp}}, {"timestamp": timestamp, "_id": {op: row_id}}]
+        order = -1 if before else 1
+    rows = list(collection.find(query, projection).sort([("timestamp", order), ("_id", order)]).limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if order == 1:
+        rows.reverse()
+    return rows, more
+
+def get_withdrawals_page(user_id: int, before: Optional[Tuple] = None, after: Optional[Tuple] = None,
+                         limit: int = 10) -> Tuple[List[Dict], bool]:
+    """Get one page of a user's withdrawals (see _history_page) and whether another page follows"""
+    try:
+        return _history_page(db.withdrawals, user_id, {"amount": 1, "status": 1, "timestamp": 1},
+                             before, after, limit)
+    except Exception as e:
+        print(f"Error in get_withdrawals_page: {str(e)}")
+        return [], False
+
 def get_pending_withdrawal(user_id: int) -> Optional[Dict]:
     """Get user's pending withdrawal if exists"""
     try:
@@ -210,6 +251,12 @@ def reject_withdrawals_by_user(user_id: int, reason: str = "No reason provided")
                         session=session
                     )
                     
+                    # Notify through the outbox, committed together with the rejection
+                    db.notification_outbox.insert_one(
+                        new_notification(user_id, "withdrawal_rejected", {"amount": total_amount, "reason": reason}),
+                        session=session
+                    )
+                    
                     print(f"✅ Rejected {len(pending)} withdrawals for user {user_id}, deducted ${total_amount}")
                     
                 return len(pending), pending
@@ -225,6 +272,14 @@ def get_pending_withdrawals_by_card(card_name: str) -> List[Dict]:
         print(f"Error in get_pending_withdrawals_by_card: {str(e)}")
         return []
 
+def get_pending_withdrawals_count_by_card(card_name: str) -> int:
+    """Count pending withdrawals for a specific card"""
+    try:
+        return db.withdrawals.count_documents({"card_name": card_name, "status": "pending"})
+    except Exception as e:
+        print(f"Error in get_pending_withdrawals_count_by_card: {str(e)}")
+        return 0
+
 def approve_withdrawals_by_card(card_name: str) -> int:
     """Approve all pending withdrawals for a specific card"""
     try:
@@ -238,7 +293,7 @@ def approve_withdrawals_by_card(card_name: str) -> int:
         return 0
 
 def reject_withdrawals_by_card(card_name: str, reason: str = "No reason provided") -> tuple:
-    """Reject all pending withdrawals for a leader card, deduct balances, and return (count, records)"""
+    """Reject all pending withdrawals for a leader card, deduct balances, queue notifications, and return (count, records)"""
     try:
         with sync_client.start_session() as session:
             with session.start_transaction():
@@ -249,7 +304,7 @@ def reject_withdrawals_by_card(card_name: str, reason: str = "No reason provided
                 if pending:
                     # Update withdrawal status with reason
                     db.withdrawals.update_many(
-                        {"card_name": card_name, "status": "pending"},
+                        {"_id": {"$in": [w["_id"] for w in pending]}},
                         {"$set": {
                             "status": "rejected",
                             "rejection_reason": reason,
@@ -258,31 +313,142 @@ def reject_withdrawals_by_card(card_name: str, reason: str = "No reason provided
                         session=session
                     )
                     
-                    # Deduct balance from each affected user
                     user_amounts = {}
                     for withdrawal in pending:
-                        user_id = withdrawal['user_id']
-                        amount = withdrawal['amount']
-                        if user_id not in user_amounts:
-                            user_amounts[user_id] = 0
-                        user_amounts[user_id] += amount
+                        user_amounts[withdrawal['user_id']] = user_amounts.get(withdrawal['user_id'], 0) + withdrawal['amount']
                     
-                    # Apply balance deductions
-                    for user_id, total_amount in user_amounts.items():
-                        db.users.update_one(
-                            {"user_id": user_id},
-                            {"$inc": {"balance": -total_amount}},
-                            session=session
-                        )
-                        print(f"✅ Deducted ${total_amount} from user {user_id} for card {card_name}")
+                    # One round trip for all balance deductions and one for the notifications
+                    db.users.bulk_write(
+                        [UpdateOne({"user_id": user_id}, {"$inc": {"balance": -total_amount}})
+                         for user_id, total_amount in user_amounts.items()],
+                        ordered=False,
+                        session=session
+                    )
+                    db.notification_outbox.insert_many(
+                        [new_notification(user_id, "withdrawal_rejected", {"amount": total_amount, "reason": reason})
+                         for user_id, total_amount in user_amounts.items()],
+                        session=session
+                    )
                     
-                    print(f"✅ Rejected {len(pending)} withdrawals for card {card_name}")
+                    print(f"✅ Rejected {len(pending)} withdrawals for card {card_name}, deducted balances of {len(user_amounts)} users")
                     
                 return len(pending), pending
     except Exception as e:
         print(f"Error in reject_withdrawals_by_card: {str(e)}")
         return 0, []
 
+def _pay_card_batch(card_name: str, user_ids: List[int], batch_id: str, session) -> Dict:
+    """Pay one batch of users' pending card withdrawals inside the caller's transaction"""
+    now = datetime.utcnow()
+    # Pending withdrawals per user, oldest first, joined with the user's balance and language
+    pipeline = [
+        {"$match": {"card_name": card_name, "status": "pending", "user_id": {"$in": user_ids}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$user_id",
+            "withdrawals": {"$push": {"_id": "$_id", "amount": "$amount"}}
+        }},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "user_id", "as": "user"}},
+        {"$project": {
+            "withdrawals": 1,
+            "found": {"$gt": [{"$size": "$user"}, 0]},
+            "balance": {"$ifNull": [{"$arrayElemAt": ["$user.balance", 0]}, 0.0]},
+            "language": {"$ifNull": [{"$arrayElemAt": ["$user.language", 0]}, "English"]}
+        }}
+    ]
+    debits, approvals, ledger, notifications, skipped = [], [], [], [], []
+    paid_amount = 0.0
+    for row in db.withdrawals.aggregate(pipeline, session=session):
+        user_id = row["_id"]
+        remaining = row["balance"] if row["found"] else 0.0
+        user_paid = 0.0
+        for withdrawal in row["withdrawals"]:
+            amount = withdrawal["amount"]
+            if remaining < amount:
+                # Stays pending; a later /paycard pays it once the balance covers it
+                skipped.append({"user_id": user_id, "amount": amount, "balance": remaining})
+                continue
+            remaining -= amount
+            user_paid += amount
+            approvals.append(UpdateOne(
+                {"_id": withdrawal["_id"], "status": "pending"},
+                {"$set": {"status": "approved", "approved_at": now, "payout_batch": batch_id}}
+            ))
+            ledger.append({
+                "user_id": user_id,
+                "transaction_type": "leader_card_withdrawal",
+                "amount": -amount,
+                "description": f"Leader card withdrawal approved: {card_name}",
+                "phone_number": "",
+                "withdrawal_id": withdrawal["_id"],
+                "payout_batch": batch_id,
+                "timestamp": now,
+                "status": "completed"
+            })
+        if user_paid:
+            # Only debit the balance the aggregation validated against
+            debits.append(UpdateOne(
+                {"user_id": user_id, "balance": row["balance"]},
+                {"$inc": {"balance": -user_paid}}
+            ))
+            notifications.append(new_notification(
+                user_id, "leader_card_paid", {"amount": round(user_paid, 2), "card_name": card_name}, row["language"]
+            ))
+            paid_amount += user_paid
+    
+    if debits:
+        result = db.users.bulk_write(debits, ordered=False, session=session)
+        if result.modified_count != len(debits):
+            raise RuntimeError("a balance changed while the payout was being validated")
+        result = db.withdrawals.bulk_write(approvals, ordered=False, session=session)
+        if result.modified_count != len(approvals):
+            raise RuntimeError("a withdrawal was settled by another payout")
+        db.transactions.insert_many(ledger, session=session)
+        db.notification_outbox.insert_many(notifications, session=session)
+    
+    return {"paid": len(approvals), "paid_amount": paid_amount, "users": len(debits), "skipped": skipped}
+
+def pay_withdrawals_by_card(card_name: str, batch_users: int = PAYOUT_BATCH_USERS) -> Dict:
+    """
+    Pay out all pending withdrawals for a leader card.
+    
+    Users are paid in batches of batch_users, one transaction per batch: a single
+    aggregation validates the batch's withdrawals against the users' balances,
+    then debits, ledger entries, approvals and user notifications are written
+    with bulk operations. Withdrawals a balance does not cover stay pending.
+    A batch commits whole or not at all, so running the payout again after an
+    interruption pays exactly what is still pending.
+    """
+    summary = {"batch_id": str(ObjectId()), "paid": 0, "paid_amount": 0.0, "users": 0,
+               "skipped": [], "failed_batches": 0}
+    try:
+        user_ids = sorted(db.withdrawals.distinct("user_id", {"card_name": card_name, "status": "pending"}))
+    except Exception as e:
+        print(f"Error in pay_withdrawals_by_card: {str(e)}")
+        summary["failed_batches"] = 1
+        return summary
+    
+    for start in range(0, len(user_ids), batch_users):
+        batch = user_ids[start:start + batch_users]
+        try:
+            with sync_client.start_session() as session:
+                # with_transaction retries the batch on transient write conflicts
+                result = session.with_transaction(
+                    lambda s: _pay_card_batch(card_name, batch, summary["batch_id"], s)
+                )
+            summary["paid"] += result["paid"]
+            summary["paid_amount"] += result["paid_amount"]
+            summary["users"] += result["users"]
+            summary["skipped"].extend(result["skipped"])
+        except Exception as e:
+            summary["failed_batches"] += 1
+            print(f"Error in pay_withdrawals_by_card (users {start + 1}-{start + len(batch)}): {str(e)}")
+    
+    for skip in summary["skipped"]:
+        print(f"⚠️ Skipping withdrawal for user {skip['user_id']}: insufficient balance ({skip['balance']}$ < {skip['amount']}$)")
+    print(f"✅ Paid {summary['paid']} withdrawals (${summary['paid_amount']:.2f}) to {summary['users']} users for card {card_name}")
+    return summary
+
 def get_card_withdrawal_stats(card_name: str) -> Dict:
     """Get statistics for withdrawals by card"""
     try:
@@ -438,6 +604,30 @@ def update_pending_number_status(pending_id, status):
         print(f"Error in update_pending_number_status: {str(e)}")
         return False
 
+def get_pending_number_status(pending_id) -> Optional[str]:
+    """Current status of a pending number record, None if it is gone"""
+    try:
+        record = db.pending_numbers.find_one({"_id": ObjectId(pending_id)}, {"status": 1})
+        return record.get("status") if record else None
+    except Exception as e:
+        print(f"Error in get_pending_number_status: {str(e)}")
+        return None
+
+def settle_pending_number(pending_id) -> bool:
+    """Move a waiting pending number to success; False if it was cancelled or settled first"""
+    try:
+        record = db.pending_numbers.find_one_and_update(
+            {"_id": ObjectId(pending_id), "status": "waiting"},
+            {"$set": {
+                "status": "success",
+                "last_updated": datetime.utcnow()
+            }}
+        )
+        return record is not None
+    except Exception as e:
+        print(f"Error in settle_pending_number: {str(e)}")
+        return False
+
 async def async_update_pending_number_status(pending_id, status):
     """Async version of update_pending_number_status - can transition from any status"""
     try:
@@ -533,6 +723,22 @@ async def async_mark_number_used(phone_number: str, user_id: int) -> bool:
 
 # ================= COUNTRY/CAPACITY MANAGEMENT =================
 
+# Callbacks fired with the country code after a write to the countries collection
+_country_change_listeners = []
+
+def add_country_change_listener(callback):
+    """Register a callback to run whenever a country's capacity, price, claim time or existence changes"""
+    if callback not in _country_change_listeners:
+        _country_change_listeners.append(callback)
+
+def _notify_country_changed(country_code: str):
+    """Fire country-change callbacks without letting a listener break the write path"""
+    for callback in list(_country_change_listeners):
+        try:
+            callback(country_code)
+        except Exception as e:
+            print(f"Error in country change listener for {country_code}: {str(e)}")
+
 def set_country_capacity(country_code: str, capacity: int, name: Optional[str] = None, flag: Optional[str] = None) -> bool:
     """Set capacity for a country"""
     try:
@@ -545,6 +751,7 @@ def set_country_capacity(country_code: str, capacity: int, name: Optional[str] =
             {"$set": update},
             upsert=True
         )
+        _notify_country_changed(country_code)
         return result.acknowledged
     except Exception as e:
         print(f"Error in set_country_capacity: {str(e)}")
@@ -558,6 +765,7 @@ def set_country_price(country_code: str, price: float) -> bool:
             {"$set": {"price": price}},
             upsert=True
         )
+        _notify_country_changed(country_code)
         return result.acknowledged
     except Exception as e:
         print(f"Error in set_country_price: {str(e)}")
@@ -571,6 +779,7 @@ def set_country_claim_time(country_code: str, claim_time: int) -> bool:
             {"$set": {"claim_time": claim_time}},
             upsert=True
         )
+        _notify_country_changed(country_code)
         return result.acknowledged
     except Exception as e:
         print(f"Error in set_country_claim_time: {str(e)}")
@@ -604,6 +813,8 @@ def remove_country_by_code(country_code: str) -> bool:
     """Remove a country from the database"""
     try:
         result = db.countries.delete_one({"country_code": country_code})
+        if result.deleted_count:
+            _notify_country_changed(country_code)
         return result.deleted_count > 0
     except Exception as e:
         print(f"Error in remove_country_by_code: {str(e)}")
@@ -736,6 +947,16 @@ def get_user_numbers(user_id: int, limit: int = 100) -> List[Dict]:
         print(f"Error in get_user_numbers: {str(e)}")
         return []
 
+def get_user_numbers_page(user_id: int, before: Optional[Tuple] = None, after: Optional[Tuple] = None,
+                          limit: int = 10) -> Tuple[List[Dict], bool]:
+    """Get one page of the numbers a user has sold (see _history_page) and whether another page follows"""
+    try:
+        return _history_page(db.used_numbers, user_id, {"number_hash": 1, "timestamp": 1},
+                             before, after, limit)
+    except Exception as e:
+        print(f"Error in get_user_numbers_page: {str(e)}")
+        return [], False
+
 def get_pending_numbers(limit: int = 100) -> List[Dict]:
     """Get all pending numbers with basic info"""
     try:
@@ -813,48 +1034,637 @@ def get_user_transactions(user_id: int, limit: int = 50) -> List[Dict]:
         print(f"Error in get_user_transactions: {str(e)}")
         return []
 
+def get_transactions_page(user_id: int, before: Optional[Tuple] = None, after: Optional[Tuple] = None,
+                          limit: int = 10) -> Tuple[List[Dict], bool]:
+    """Get one page of a user's transaction log (see _history_page) and whether another page follows"""
+    try:
+        return _history_page(db.transactions, user_id,
+                             {"transaction_type": 1, "amount": 1, "description": 1, "timestamp": 1},
+                             before, after, limit)
+    except Exception as e:
+        print(f"Error in get_transactions_page: {str(e)}")
+        return [], False
+
+# ================== SESSION UPLOAD OUTBOX ==================
+
+def enqueue_session_upload(phone_number: str, user_id: int, country_code: str, price: float,
+                           session_path: str, ready: bool = True, wait_seconds: int = 30) -> Optional[str]:
+    """Queue a session file for upload to the session channel and return the outbox ID"""
+    try:
+        now = datetime.utcnow()
+        upload = {
+            "phone_number": phone_number,
+            "user_id": user_id,
+            "country_code": country_code,
+            "price": price,
+            "session_path": session_path,
+            "status": "pending",
+            "attempts": 0,
+            # Files that are not on disk yet become due when the session-saved event
+            # fires, or when the wait window runs out
+            "next_attempt_at": now if ready else now + timedelta(seconds=wait_seconds),
+            "created_at": now,
+            "last_updated": now
+        }
+        result = db.session_outbox.insert_one(upload)
+        return str(result.inserted_id)
+    except Exception as e:
+        print(f"Error in enqueue_session_upload: {str(e)}")
+        return None
+
+def mark_session_upload_ready(phone_number: str) -> int:
+    """Make queued uploads for a phone number due immediately (session file was saved)"""
+    try:
+        result = db.session_outbox.update_many(
+            {"phone_number": phone_number, "status": "pending", "attempts": 0},
+            {"$set": {"next_attempt_at": datetime.utcnow(), "last_updated": datetime.utcnow()}}
+        )
+        return result.modified_count
+    except Exception as e:
+        print(f"Error in mark_session_upload_ready: {str(e)}")
+        return 0
+
+def claim_session_uploads(worker_id: str, limit: int = 10) -> List[Dict]:
+    """Atomically claim up to `limit` due uploads for a worker"""
+    claimed = []
+    try:
+        for _ in range(limit):
+            now = datetime.utcnow()
+            upload = db.session_outbox.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"$set": {"status": "sending", "claimed_by": worker_id, "claimed_at": now, "last_updated": now}},
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not upload:
+                break
+            claimed.append(upload)
+    except Exception as e:
+        print(f"Error in claim_session_uploads: {str(e)}")
+    return claimed
+
+def complete_session_uploads(upload_ids: List, file_ids: Optional[Dict] = None) -> int:
+    """Mark claimed uploads as sent, optionally recording the Telegram file_id per upload"""
+    try:
+        file_ids = file_ids or {}
+        now = datetime.utcnow()
+        modified = 0
+        for upload_id in upload_ids:
+            update = {"status": "sent", "sent_at": now, "last_updated": now}
+            if upload_id in file_ids:
+                update["file_id"] = file_ids[upload_id]
+            result = db.session_outbox.update_one({"_id": upload_id}, {"$set": update})
+            modified += result.modified_count
+        return modified
+    except Exception as e:
+        print(f"Error in complete_session_uploads: {str(e)}")
+        return 0
+
+def retry_session_uploads(upload_ids: List, delay_seconds: float, error: str, max_attempts: int = 5) -> int:
+    """Return claimed uploads to the queue with a backoff delay, failing them after max_attempts"""
+    try:
+        now = datetime.utcnow()
+        db.session_outbox.update_many(
+            {"_id": {"$in": upload_ids}, "status": "sending", "attempts": {"$gte": max_attempts - 1}},
+            {"$set": {"status": "failed", "last_error": error, "last_updated": now},
+             "$inc": {"attempts": 1}}
+        )
+        result = db.session_outbox.update_many(
+            {"_id": {"$in": upload_ids}, "status": "sending"},
+            {"$set": {
+                "status": "pending",
+                "last_error": error,
+                "next_attempt_at": now + timedelta(seconds=delay_seconds),
+                "last_updated": now
+            }, "$inc": {"attempts": 1}}
+        )
+        return result.modified_count
+    except Exception as e:
+        print(f"Error in retry_session_uploads: {str(e)}")
+        return 0
+
+def fail_session_upload(upload_id, error: str) -> bool:
+    """Mark a claimed upload as permanently failed"""
+    try:
+        result = db.session_outbox.update_one(
+            {"_id": upload_id},
+            {"$set": {"status": "failed", "last_error": error, "last_updated": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error in fail_session_upload: {str(e)}")
+        return False
+
+def requeue_stale_session_uploads(older_than_seconds: int = 600) -> int:
+    """Return uploads left in 'sending' by a crashed worker to the queue"""
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+        result = db.session_outbox.update_many(
+            {"status": "sending", "claimed_at": {"$lt": cutoff}},
+            {"$set": {"status": "pending", "next_attempt_at": datetime.utcnow(), "last_updated": datetime.utcnow()}}
+        )
+        return result.modified_count
+    except Exception as e:
+        print(f"Error in requeue_stale_session_uploads: {str(e)}")
+        return 0
+
+def get_next_session_upload_time() -> Optional[datetime]:
+    """Get the earliest next_attempt_at among pending uploads"""
+    try:
+        upload = db.session_outbox.find_one(
+            {"status": "pending"},
+            {"_id": 0, "next_attempt_at": 1},
+            sort=[("next_attempt_at", 1)]
+        )
+        return upload["next_attempt_at"] if upload else None
+    except Exception as e:
+        print(f"Error in get_next_session_upload_time: {str(e)}")
+        return None
+
+def get_session_outbox_stats() -> Dict:
+    """Count outbox entries by status"""
+    try:
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        return {row["_id"]: row["count"] for row in db.session_outbox.aggregate(pipeline)}
+    except Exception as e:
+        print(f"Error in get_session_outbox_stats: {str(e)}")
+        return {}
+
+# ================== NOTIFICATION OUTBOX ==================
+
+def new_notification(user_id: int, template: str, params: Dict, language: str = "English") -> Dict:
+    """Build a notification outbox entry (rendered from NOTIFICATION_TEMPLATES when sent)"""
+    now = datetime.utcnow()
+    return {
+        "user_id": user_id,
+        "template": template,
+        "params": params,
+        "language": language,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+        "last_updated": now
+    }
+
+def enqueue_notifications(notifications: List[Dict]) -> int:
+    """Queue notifications built with new_notification and return how many were queued"""
+    try:
+        if not notifications:
+            return 0
+        result = db.notification_outbox.insert_many(notifications)
+        return len(result.inserted_ids)
+    except Exception as e:
+        print(f"Error in enqueue_notifications: {str(e)}")
+        return 0
+
+def claim_notifications(worker_id: str, limit: int = 50) -> List[Dict]:
+    """Atomically claim up to `limit` due notifications for a worker"""
+    claimed = []
+    try:
+        for _ in range(limit):
+            now = datetime.utcnow()
+            notification = db.notification_outbox.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"$set": {"status": "sending", "claimed_by": worker_id, "claimed_at": now, "last_updated": now}},
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not notification:
+                break
+            claimed.append(notification)
+    except Exception as e:
+        print(f"Error in claim_notifications: {str(e)}")
+    return claimed
+
+def complete_notification(notification_id, worker_id: str) -> bool:
+    """Mark a notification this worker still has claimed as sent"""
+    try:
+        now = datetime.utcnow()
+        result = db.notification_outbox.update_one(
+            {"_id": notification_id, "status": "sending", "claimed_by": worker_id},
+            {"$set": {"status": "sent", "sent_at": now, "last_updated": now}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error in complete_notification: {str(e)}")
+        return False
+
+def retry_notification(notification_id, worker_id: str, delay_seconds: float, error: str, max_attempts: int = 5,
+                       count_attempt: bool = True) -> bool:
+    """
+    Return a notification this worker still has claimed to the queue with a delay,
+    failing it after max_attempts. Both writes are guarded on the claim, so a row
+    that was requeued or claimed by another worker meanwhile is left alone.
+    """
+    try:
+        now = datetime.utcnow()
+        claim = {"_id": notification_id, "status": "sending", "claimed_by": worker_id}
+        notification = db.notification_outbox.find_one_and_update(
+            claim,
+            {"$inc": {"attempts": 1 if count_attempt else 0}, "$set": {"last_error": error, "last_updated": now}},
+            projection={"attempts": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not notification:
+            return False
+        if notification["attempts"] >= max_attempts:
+            update = {"status": "failed"}
+        else:
+            update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=delay_seconds)}
+        result = db.notification_outbox.update_one(claim, {"$set": update})
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error in retry_notification: {str(e)}")
+        return False
+
+def fail_notification(notification_id, worker_id: str, error: str) -> bool:
+    """Mark a notification this worker still has claimed as permanently failed"""
+    try:
+        result = db.notification_outbox.update_one(
+            {"_id": notification_id, "status": "sending", "claimed_by": worker_id},
+            {"$set": {"status": "failed", "last_error": error, "last_updated": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error in fail_notification: {str(e)}")
+        return False
+
+def requeue_stale_notifications(older_than_seconds: int = 600) -> int:
+    """Return notifications left in 'sending' by a crashed worker to the queue"""
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+        result = db.notification_outbox.update_many(
+            {"status": "sending", "claimed_at": {"$lt": cutoff}},
+            {"$set": {"status": "pending", "next_attempt_at": datetime.utcnow(), "last_updated": datetime.utcnow()}}
+        )
+        return result.modified_count
+    except Exception as e:
+        print(f"Error in requeue_stale_notifications: {str(e)}")
+        return 0
+
+def get_next_notification_time() -> Optional[datetime]:
+    """Get the earliest next_attempt_at among pending notifications"""
+    try:
+        notification = db.notification_outbox.find_one(
+            {"status": "pending"},
+            {"_id": 0, "next_attempt_at": 1},
+            sort=[("next_attempt_at", 1)]
+        )
+        return notification["next_attempt_at"] if notification else None
+    except Exception as e:
+        print(f"Error in get_next_notification_time: {str(e)}")
+        return None
+
+def get_notification_outbox_stats() -> Dict:
+    """Count notification outbox entries by status"""
+    try:
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        return {row["_id"]: row["count"] for row in db.notification_outbox.aggregate(pipeline)}
+    except Exception as e:
+        print(f"Error in get_notification_outbox_stats: {str(e)}")
+        return {}
+
+# ================= SESSION FILE_ID REGISTRY =================
+
+def get_session_file_id(content_hash: str) -> Optional[str]:
+    """Get the Telegram file_id previously returned for a session file's content hash"""
+    try:
+        entry = db.session_file_ids.find_one({"content_hash": content_hash}, {"_id": 0, "file_id": 1})
+        return entry["file_id"] if entry else None
+    except Exception as e:
+        print(f"Error in get_session_file_id: {str(e)}")
+        return None
+
+def register_session_file_id(content_hash: str, file_id: str, session_path: str, size: int) -> bool:
+    """Record the file_id for a content hash and drop entries for older contents of the same path"""
+    try:
+        db.session_file_ids.delete_many({"session_path": session_path, "content_hash": {"$ne": content_hash}})
+        result = db.session_file_ids.update_one(
+            {"content_hash": content_hash},
+            {"$set": {
+                "file_id": file_id,
+                "session_path": session_path,
+                "size": size,
+                "last_updated": datetime.utcnow()
+            }, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return result.acknowledged
+    except Exception as e:
+        print(f"Error in register_session_file_id: {str(e)}")
+        return False
+
+def invalidate_session_file_id(content_hash: Optional[str] = None, session_path: Optional[str] = None) -> int:
+    """Forget registered file_ids by content hash and/or session path"""
+    try:
+        query = {}
+        if content_hash:
+            query["content_hash"] = content_hash
+        if session_path:
+            query["session_path"] = session_path
+        if not query:
+            return 0
+        result = db.session_file_ids.delete_many(query)
+        return result.deleted_count
+    except Exception as e:
+        print(f"Error in invalidate_session_file_id: {str(e)}")
+        return 0
+
+# ================== SESSION EXPORT WATERMARKS ==================
+
+def get_export_watermark(destination: str) -> Optional[float]:
+    """Get the time the last complete export to a destination started scanning (sessions modified later are new)"""
+    try:
+        entry = db.export_watermarks.find_one({"destination": destination}, {"_id": 0, "last_mtime": 1})
+        return entry["last_mtime"] if entry else None
+    except Exception as e:
+        print(f"Error in get_export_watermark: {str(e)}")
+        return None
+
+def set_export_watermark(destination: str, last_mtime: float, file_count: int) -> bool:
+    """Advance a destination's export watermark after a successful export"""
+    try:
+        result = db.export_watermarks.update_one(
+            {"destination": destination},
+            {"$max": {"last_mtime": last_mtime},
+             "$set": {"last_export_files": file_count, "last_export_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return result.acknowledged
+    except Exception as e:
+        print(f"Error in set_export_watermark: {str(e)}")
+        return False
+
+def reset_export_watermark(destination: str) -> bool:
+    """Forget a destination's watermark so the next incremental export is a full one"""
+    try:
+        result = db.export_watermarks.delete_one({"destination": destination})
+        return result.deleted_count > 0
+    except Exception as e:
+        print(f"Error in reset_export_watermark: {str(e)}")
+        return False
+
+# ================== CONVERSATION STATE ==================
+# Unlike the helpers above these re-raise after logging: a failed read must not
+# look like "no conversation" to the caller (state_store would cache it).
+
+def _state_id(namespace: str, key) -> str:
+    return f"{namespace}:{key}"
+
+def get_conversation_state(namespace: str, key) -> Optional[Dict]:
+    """Unexpired state document for key in namespace (the TTL monitor only deletes about once a minute)"""
+    try:
+        return db.conversation_state.find_one({
+            "_id": _state_id(namespace, key),
+            "expires_at": {"$gt": datetime.utcnow()}
+        })
+    except Exception as e:
+        print(f"Error in get_conversation_state: {str(e)}")
+        raise
+
+def set_conversation_state(namespace: str, key, data: Dict, expires_at: datetime) -> bool:
+    """Replace the state stored for key in namespace"""
+    try:
+        result = db.conversation_state.replace_one(
+            {"_id": _state_id(namespace, key)},
+            {
+                "namespace": namespace,
+                "key": key,
+                "data": data,
+                "expires_at": expires_at,
+                "updated_at": datetime.utcnow()
+            },
+            upsert=True
+        )
+        return result.acknowledged
+    except Exception as e:
+        print(f"Error in set_conversation_state: {str(e)}")
+        raise
+
+def delete_conversation_state(namespace: str, key) -> bool:
+    try:
+        result = db.conversation_state.delete_one({"_id": _state_id(namespace, key)})
+        return result.deleted_count > 0
+    except Exception as e:
+        print(f"Error in delete_conversation_state: {str(e)}")
+        raise
+
+def list_conversation_states(namespace: str) -> List[Dict]:
+    """Every unexpired state document in namespace"""
+    try:
+        return list(db.conversation_state.find({
+            "namespace": namespace,
+            "expires_at": {"$gt": datetime.utcnow()}
+        }))
+    except Exception as e:
+        print(f"Error in list_conversation_states: {str(e)}")
+        raise
+
+def count_conversation_states(namespace: str) -> int:
+    try:
+        return db.conversation_state.count_documents({
+            "namespace": namespace,
+            "expires_at": {"$gt": datetime.utcnow()}
+        })
+    except Exception as e:
+        print(f"Error in count_conversation_states: {str(e)}")
+        raise
+
+# ================== LEADER LEASES ==================
+
+def acquire_lease(name: str, holder: str, lease_seconds: float) -> Optional[bool]:
+    """Take or renew the named lease for holder; False while another holder's lease is unexpired, None if MongoDB failed"""
+    try:
+        now = datetime.utcnow()
+        db.leases.update_one(
+            {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}]},
+            {"$set": {
+                "holder": holder,
+                "expires_at": now + timedelta(seconds=lease_seconds),
+                "renewed_at": now
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The filter missed an existing lease, so the upsert collided with it: someone else holds it
+        return False
+    except Exception as e:
+        print(f"Error in acquire_lease: {str(e)}")
+        return None
+
+def release_lease(name: str, holder: str) -> bool:
+    try:
+        result = db.leases.delete_one({"_id": name, "holder": holder})
+        return result.deleted_count > 0
+    except Exception as e:
+        print(f"Error in release_lease: {str(e)}")
+        return False
+
+def get_lease(name: str) -> Union[Dict, None, bool]:
+    """The named lease if it is unexpired, None if there is none, False if MongoDB failed"""
+    try:
+        return db.leases.find_one({"_id": name, "expires_at": {"$gt": datetime.utcnow()}})
+    except Exception as e:
+        print(f"Error in get_lease: {str(e)}")
+        return False
+
+# ====================== VERIFICATION TRACES ======================
+
+def ensure_verification_spans_collection(retention_days: int = 30) -> bool:
+    """Create the time-series collection holding verification phase spans (MongoDB 5.0+)"""
+    try:
+        if "verification_spans" in db.list_collection_names():
+            return True
+        db.create_collection(
+            "verification_spans",
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+            expireAfterSeconds=retention_days * 24 * 60 * 60
+        )
+        return True
+    except Exception as e:
+        print(f"Error in ensure_verification_spans_collection: {str(e)}")
+        return False
+
+def insert_verification_spans(spans: List[Dict]) -> int:
+    """Batch-insert finished spans; returns the number written"""
+    try:
+        if not spans:
+            return 0
+        result = db.verification_spans.insert_many(spans, ordered=False)
+        return len(result.inserted_ids)
+    except Exception as e:
+        print(f"Error in insert_verification_spans: {str(e)}")
+        return 0
+
+def get_verification_phase_durations(since: datetime, country_code: Optional[str] = None) -> List[Dict]:
+    """Span durations (ms) grouped by country and phase for spans started after `since`"""
+    try:
+        match = {"ts": {"$gte": since}}
+        if country_code:
+            match["meta.country"] = country_code
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"country": "$meta.country", "phase": "$meta.phase"},
+                "durations": {"$push": "$duration_ms"}
+            }},
+            {"$sort": {"_id.country": 1, "_id.phase": 1}}
+        ]
+        return [
+            {"country": group["_id"].get("country"), "phase": group["_id"].get("phase"), "durations": group["durations"]}
+            for group in db.verification_spans.aggregate(pipeline, allowDiskUse=True)
+        ]
+    except Exception as e:
+        print(f"Error in get_verification_phase_durations: {str(e)}")
+        return []
+
+# ====================== HEALTH ======================
+
+def is_database_ready() -> bool:
+    """True when the driver currently sees a readable server; never blocks on server selection"""
+    try:
+        return sync_client.topology_description.has_readable_server()
+    except Exception as e:
+        print(f"Error in is_database_ready: {str(e)}")
+        return False
+
 # ====================== INDEX MANAGEMENT ======================
 
-def initialize_indexes():
-    """Create all recommended indexes for optimal performance"""
+# (collection, keys, create_index options); changing this list changes the fingerprint
+INDEX_SPECS = [
+    # User indexes
+    ("users", "user_id", {"unique": True}),
+    ("users", "balance", {}),
+    ("users", "registered_at", {}),
+    
+    # Withdrawal indexes
+    ("withdrawals", [("user_id", 1), ("timestamp", -1), ("_id", -1)], {}),  # History pages
+    ("withdrawals", [("status", 1), ("timestamp", -1)], {}),
+    ("withdrawals", "card_name", {}),
+    ("withdrawals", "amount", {}),
+    
+    # Transaction indexes
+    ("transactions", [("user_id", 1), ("timestamp", -1), ("_id", -1)], {}),  # History pages
+    ("transactions", [("transaction_type", 1), ("timestamp", -1)], {}),
+    ("transactions", "timestamp", {}),
+    ("transactions", "phone_number", {}),
+    
+    # Pending numbers indexes
+    ("pending_numbers", "user_id", {}),
+    ("pending_numbers", "status", {}),
+    ("pending_numbers", "created_at", {}),
+    ("pending_numbers", "phone_number", {}),  # Removed unique constraint to allow retries
+    ("pending_numbers", [("has_background_verification", 1), ("status", 1), ("background_verification_started", 1)], {}),  # Auto-cancel deadlines
+    
+    # Used numbers indexes
+    ("used_numbers", "number_hash", {"unique": True}),
+    ("used_numbers", [("user_id", 1), ("timestamp", -1), ("_id", -1)], {}),  # History pages
+    ("used_numbers", "timestamp", {}),
+    
+    # Country indexes
+    ("countries", "country_code", {"unique": True}),
+    ("countries", "capacity", {}),
+    ("countries", "price", {}),
+    
+    # Card indexes
+    ("cards", "card_name", {"unique": True}),
+    
+    # Session upload outbox indexes
+    ("session_outbox", [("status", 1), ("next_attempt_at", 1)], {}),
+    ("session_outbox", "phone_number", {}),
+    
+    # Notification outbox indexes
+    ("notification_outbox", [("status", 1), ("next_attempt_at", 1)], {}),
+    
+    # Session file_id registry indexes
+    ("session_file_ids", "content_hash", {"unique": True}),
+    ("session_file_ids", "session_path", {}),
+    
+    # Export watermark indexes
+    ("export_watermarks", "destination", {"unique": True}),
+    
+    # Conversation state indexes
+    ("conversation_state", "expires_at", {"expireAfterSeconds": 0}),  # TTL
+    ("conversation_state", [("namespace", 1), ("expires_at", 1)], {}),
+    
+    # Leader lease indexes
+    ("leases", "expires_at", {"expireAfterSeconds": 0}),  # TTL
+]
+
+def get_index_fingerprint() -> str:
+    """Hash of INDEX_SPECS and the span retention, stored once the indexes exist"""
+    spec = json.dumps([INDEX_SPECS, VERIFICATION_TRACE_RETENTION_DAYS], sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+def initialize_indexes(force: bool = False) -> bool:
+    """
+    Create all recommended indexes for optimal performance. Skipped (one read
+    instead of ~30 round trips) when the fingerprint stored by the last run
+    matches, unless force is set.
+    """
     try:
-        # User indexes
-        db.users.create_index("user_id", unique=True)
-        db.users.create_index("balance")
-        db.users.create_index("registered_at")
-        
-        # Withdrawal indexes
-        db.withdrawals.create_index("user_id")
-        db.withdrawals.create_index([("status", 1), ("timestamp", -1)])
-        db.withdrawals.create_index("card_name")
-        db.withdrawals.create_index("amount")
-        
-        # Transaction indexes
-        db.transactions.create_index("user_id")
-        db.transactions.create_index([("transaction_type", 1), ("timestamp", -1)])
-        db.transactions.create_index("timestamp")
-        db.transactions.create_index("phone_number")
-        
-        # Pending numbers indexes
-        db.pending_numbers.create_index("user_id")
-        db.pending_numbers.create_index("status")
-        db.pending_numbers.create_index("created_at")
-        db.pending_numbers.create_index("phone_number")  # Removed unique constraint to allow retries
-        
-        # Used numbers indexes
-        db.used_numbers.create_index("number_hash", unique=True)
-        db.used_numbers.create_index("user_id")
-        db.used_numbers.create_index("timestamp")
+        started = time.perf_counter()
+        fingerprint = get_index_fingerprint()
+        if SKIP_UNCHANGED_INDEXES and not force:
+            stored = db.schema_meta.find_one({"_id": "indexes"})
+            if stored and stored.get("fingerprint") == fingerprint:
+                print(f"✅ Database indexes up to date ({fingerprint[:12]}), skipped creation")
+                return True
         
-        # Country indexes
-        db.countries.create_index("country_code", unique=True)
-        db.countries.create_index("capacity")
-        db.countries.create_index("price")
+        for collection, keys, options in INDEX_SPECS:
+            db[collection].create_index(keys, **options)
         
-        # Card indexes
-        db.cards.create_index("card_name", unique=True)
+        # Verification phase spans (time-series; indexed on meta by the server)
+        ensure_verification_spans_collection(VERIFICATION_TRACE_RETENTION_DAYS)
         
-        print("✅ All database indexes created successfully")
+        db.schema_meta.update_one(
+            {"_id": "indexes"},
+            {"$set": {"fingerprint": fingerprint, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        print(f"✅ All database indexes created successfully in {time.perf_counter() - started:.2f}s")
         return True
     except Exception as e:
         print(f"❌ Error creating indexes: {str(e)}")
@@ -885,7 +1695,7 @@ def mark_background_verification_start(phone_number):
         return False
 
 def get_numbers_with_background_verification(older_than_minutes=30):
-    """Get numbers that have background verification and are older than specified minutes"""
+    """Get numbers that have background verification and are older than specified minutes (raises if MongoDB fails)"""
     try:
         from datetime import timedelta
         cutoff_time = datetime.utcnow() - timedelta(minutes=older_than_minutes)
@@ -893,11 +1703,30 @@ def get_numbers_with_background_verification(older_than_minutes=30):
         return list(db.pending_numbers.find({
             "has_background_verification": True,
             "status": {"$in": ["pending", "waiting", "processing"]},
-            "created_at": {"$lt": cutoff_time}
+            "background_verification_started": {"$lte": cutoff_time}
         }))
     except Exception as e:
         print(f"Error in get_numbers_with_background_verification: {str(e)}")
-        return []
+        raise
+
+def get_next_auto_cancel_deadline(timeout_minutes=30):
+    """When the longest-running background verification times out, None if none is running (raises if MongoDB fails)"""
+    try:
+        oldest = db.pending_numbers.find_one(
+            {
+                "has_background_verification": True,
+                "status": {"$in": ["pending", "waiting", "processing"]},
+                "background_verification_started": {"$exists": True}
+            },
+            {"background_verification_started": 1},
+            sort=[("background_verification_started", 1)]
+        )
+        if not oldest:
+            return None
+        return oldest["background_verification_started"] + timedelta(minutes=timeout_minutes)
+    except Exception as e:
+        print(f"Error in get_next_auto_cancel_deadline: {str(e)}")
+        raise
 
 def get_numbers_without_background_verification():
     """Get numbers that do NOT have background verification - these should NEVER be auto-canceled"""
@@ -917,6 +1746,8 @@ def auto_cancel_background_verification_numbers(older_than_minutes=30):
     """
     Automatically cancel numbers that have background verification and are older than specified time.
     Numbers WITHOUT background verification will NEVER be canceled automatically.
+    Raises if the due numbers cannot be read, so the scheduler backs off instead of
+    taking the failure for "nothing due".
     """
     try:
         numbers_to_cancel = get_numbers_with_background_verification(older_than_minutes)
@@ -928,8 +1759,9 @@ def auto_cancel_background_verification_numbers(older_than_minutes=30):
                 user_id = number_record["user_id"]
                 
                 # Update status to auto_cancelled
+                # Skip a number that finished between the query and this update
                 result = db.pending_numbers.update_one(
-                    {"_id": number_record["_id"]},
+                    {"_id": number_record["_id"], "status": {"$in": ["pending", "waiting", "processing"]}},
                     {"$set": {
                         "status": "auto_cancelled",
                         "auto_cancelled_at": datetime.utcnow(),
@@ -956,7 +1788,7 @@ def auto_cancel_background_verification_numbers(older_than_minutes=30):
         
     except Exception as e:
         print(f"Error in auto_cancel_background_verification_numbers: {str(e)}")
-        return 0
+        raise
 
 def get_auto_cancellation_stats():
     """Get statistics about auto-cancellation system"""
@@ -0,0 +1,273 @@
+"""
+MongoDB command profiler.
+
+A pymongo CommandListener registered on both the sync client and the motor
+client (motor drives pymongo underneath, so the same listener covers it). For
+every command it records the duration against a normalized query shape - the
+filter with literal values replaced by "?" - so calls that differ only in
+their arguments aggregate together. Commands slower than SLOW_QUERY_THRESHOLD_MS
+are kept in a ring buffer. /dbprofile shows the top shapes by total time and
+/dbexplain runs queryPlanner explains on them to flag collection scans.
+
+The command kept per shape for /dbexplain has its filters and update documents
+masked: every literal becomes a constant of the same type, so the planner sees
+the same fields and operators but no phone number, user id or balance stays in
+memory.
+"""
+
+import re
+import json
+import copy
+import threading
+from collections import deque
+from datetime import datetime
+from bson import ObjectId, Regex
+from pymongo import monitoring
+from config import SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_LOG_SIZE
+
+# Handshake, auth and session commands, plus our own explains
+_IGNORED_COMMANDS = {
+    "isMaster", "ismaster", "hello", "ping", "saslStart", "saslContinue",
+    "endSessions", "buildInfo", "explain", "listCollections", "killCursors"
+}
+
+# Commands where the filter lives somewhere other than a top-level "filter"
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query"
+}
+
+# Commands explain can run against
+_EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+# Driver and transaction fields that explain rejects or that make no sense to replay
+_SAMPLE_DROP_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern"}
+
+# Fields holding user data per command; the rest (collection, sort, projection, limit, ...) is structure.
+# update and delete keep theirs in updates[].q/u and deletes[].q, aggregate in $match stages.
+_SAMPLE_MASK_FIELDS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query", "update")
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_ZERO_ID = ObjectId("0" * 24)
+
+def normalize_shape(value):
+    """Replace literal values with "?" while keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: normalize_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return "?"
+        return [normalize_shape(item) for item in value]
+    return "?"
+
+def mask_literals(value):
+    """Copy of value with every literal replaced by a constant of the same type"""
+    if isinstance(value, dict):
+        return {key: mask_literals(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return [mask_literals(value[0])]  # One element keeps $in / $all valid
+        return [mask_literals(item) for item in value]
+    if value is None or isinstance(value, bool):
+        return False if isinstance(value, bool) else None
+    if isinstance(value, int):
+        return 0
+    if isinstance(value, float):
+        return 0.0
+    if isinstance(value, datetime):
+        return _EPOCH
+    if isinstance(value, ObjectId):
+        return _ZERO_ID
+    if isinstance(value, (Regex, re.Pattern)):
+        return Regex("")
+    if isinstance(value, bytes):
+        return b""
+    return ""
+
+def sample_command(command_name, command):
+    """The command to keep for explain: driver fields dropped, user data masked"""
+    mask_fields = _SAMPLE_MASK_FIELDS.get(command_name, ())
+    sample = {}
+    for field, value in command.items():
+        if field in _SAMPLE_DROP_FIELDS or field.startswith("$"):
+            continue
+        if field in mask_fields:
+            value = mask_literals(value)
+        elif command_name in ("update", "delete") and field in ("updates", "deletes"):
+            # The shape comes from the first statement, so that is the one explained
+            value = [{key: mask_literals(item) if key in ("q", "u") else copy.deepcopy(item)
+                      for key, item in entry.items()} for entry in value[:1]]
+        elif command_name == "aggregate" and field == "pipeline":
+            value = [{"$match": mask_literals(stage["$match"])} if "$match" in stage else copy.deepcopy(stage)
+                     for stage in value]
+        else:
+            value = copy.deepcopy(value)
+        sample[field] = value
+    return sample
+
+def command_shape(command_name, command):
+    """The part of a command that identifies its query shape"""
+    if command_name in _FILTER_FIELDS:
+        shape = {"filter": normalize_shape(command.get(_FILTER_FIELDS[command_name], {}))}
+        if command.get("sort"):
+            shape["sort"] = list(command["sort"].keys()) if isinstance(command["sort"], dict) else "?"
+        return shape
+    if command_name == "aggregate":
+        return {"pipeline": normalize_shape(command.get("pipeline", []))}
+    if command_name == "update":
+        updates = command.get("updates") or [{}]
+        return {"filter": normalize_shape(updates[0].get("q", {})), "multi": bool(updates[0].get("multi"))}
+    if command_name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return {"filter": normalize_shape(deletes[0].get("q", {}))}
+    return {}
+
+def _find_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_find_collscan(item) for item in plan.values())
+    if isinstance(plan, list):
+        return any(_find_collscan(item) for item in plan)
+    return False
+
+def plan_has_collscan(explain_result):
+    """True when any winning plan in an explain result contains a COLLSCAN stage"""
+    if isinstance(explain_result, dict):
+        for key, item in explain_result.items():
+            if key == "winningPlan" and _find_collscan(item):
+                return True
+            if plan_has_collscan(item):
+                return True
+    elif isinstance(explain_result, list):
+        return any(plan_has_collscan(item) for item in explain_result)
+    return False
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, slow_threshold_ms=SLOW_QUERY_THRESHOLD_MS, slow_log_size=SLOW_QUERY_LOG_SIZE, max_shapes=1000):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.max_shapes = max_shapes
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._pending = {}  # request_id -> (key, database)
+        self._shapes = {}   # (database, collection, command, shape_json) -> stats
+        self._lock = threading.Lock()
+
+    # ---- listener ----
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        command = event.command
+        name = event.command_name
+        if name == "getMore":
+            collection = command.get("collection", "")
+            shape = {}
+        else:
+            collection = command.get(name, "")
+            shape = command_shape(name, command)
+        if not isinstance(collection, str):
+            collection = ""
+        shape_json = json.dumps(shape, default=str)
+        key = (event.database_name, collection, name, shape_json)
+
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is None and len(self._shapes) < self.max_shapes:
+                stats = self._shapes[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "failures": 0, "sample": None}
+            if stats is not None and stats["sample"] is None and name in _EXPLAINABLE:
+                stats["sample"] = sample_command(name, command)
+        self._pending[event.request_id] = key
+
+    def _finish(self, event, failed):
+        key = self._pending.pop(event.request_id, None)
+        if key is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is not None:
+                stats["count"] += 1
+                stats["total_ms"] += duration_ms
+                stats["max_ms"] = max(stats["max_ms"], duration_ms)
+                if failed:
+                    stats["failures"] += 1
+        if duration_ms >= self.slow_threshold_ms:
+            database, collection, command, shape = key
+            self.slow_log.append({
+                "at": datetime.utcnow(),
+                "collection": collection,
+                "command": command,
+                "shape": shape,
+                "duration_ms": round(duration_ms, 1),
+                "failed": failed
+            })
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+    # ---- reports ----
+
+    def top_shapes(self, limit=10):
+        """Query shapes ordered by total time spent"""
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._shapes.items() if stats["count"]]
+        items.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+        report = []
+        for (database, collection, command, shape), stats in items[:limit]:
+            report.append({
+                "database": database,
+                "collection": collection,
+                "command": command,
+                "shape": shape,
+                "count": stats["count"],
+                "total_ms": round(stats["total_ms"], 1),
+                "avg_ms": round(stats["total_ms"] / stats["count"], 2),
+                "max_ms": round(stats["max_ms"], 1),
+                "failures": stats["failures"],
+                "sample": stats["sample"]
+            })
+        return report
+
+    def recent_slow(self, limit=10):
+        return list(self.slow_log)[-limit:][::-1]
+
+    def explain_top(self, client, limit=10):
+        """
+        Run a queryPlanner explain for the top shapes' sample commands and
+        flag the ones whose winning plan scans the whole collection.
+        """
+        results = []
+        for entry in self.top_shapes(limit):
+            result = {key: entry[key] for key in ("collection", "command", "shape", "count", "total_ms")}
+            if not entry["sample"]:
+                result["collscan"] = None
+                result["error"] = "not explainable"
+                results.append(result)
+                continue
+            try:
+                explain = client[entry["database"]].command({"explain": entry["sample"], "verbosity": "queryPlanner"})
+                result["collscan"] = plan_has_collscan(explain)
+            except Exception as e:
+                result["collscan"] = None
+                result["error"] = str(e)
+            results.append(result)
+        return results
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+        self.slow_log.clear()
+
+
+# Global profiler instance, registered on both Mongo clients in db.py
+query_profiler = QueryProfiler()
@@ -1,13 +1,13 @@
 from bot_init import bot
+from router import router
 from utils import require_channel_membership
-from translations import TRANSLATIONS
+from translations import get_text
+from request_context import context_for
 
-@bot.message_handler(commands=['help'])
+@router.command('help')
 @require_channel_membership
 def handle_help(message):
-    user_id = message.from_user.id
-    from db import get_user
-    user = get_user(user_id) or {}
+    user = context_for(message).user or {}
     lang = user.get('language', 'English')
-    help_text = TRANSLATIONS['help_support'][lang]
+    help_text = get_text('help_support', lang)
     bot.reply_to(message, help_text, parse_mode="Markdown")
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""
+Reply markups built once at import and kept as serialized JSON.
+
+telebot passes a reply_markup string through to the Bot API unchanged, so
+handlers send these instead of building InlineKeyboardMarkup or
+ReplyKeyboardMarkup objects on every message. Localized keyboards hold one
+JSON string per language; keyboard_for() falls back to English.
+"""
+
+import telebot.types
+from translations import LANGUAGES, DEFAULT_LANGUAGE, get_text
+
+CHANNEL_INVITE_URL = "https://t.me/+AWczWKG8V6s3OGY1"
+
+def _per_language(build):
+    return {lang: build(lang).to_json() for lang in LANGUAGES}
+
+def keyboard_for(keyboards, lang):
+    return keyboards.get(lang, keyboards[DEFAULT_LANGUAGE])
+
+def _language_selection():
+    markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+    markup.add(*LANGUAGES)
+    return markup
+
+def _channel_join():
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(telebot.types.InlineKeyboardButton(text="Join Now", url=CHANNEL_INVITE_URL))
+    return markup
+
+def _withdraw_options():
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(telebot.types.InlineKeyboardButton("💳 Leader Card (Min: $2)", callback_data="withdraw_leader_card"))
+    markup.add(telebot.types.InlineKeyboardButton("💰 Binance Pay ID (Min: $5)", callback_data="withdraw_binance"))
+    markup.add(telebot.types.InlineKeyboardButton("❌ Cancel", callback_data="withdraw_cancel"))
+    return markup
+
+def _account(lang):
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(telebot.types.InlineKeyboardButton(text=get_text('withdraw_button', lang), callback_data='account_withdraw'))
+    return markup
+
+LANGUAGE_SELECTION = _language_selection().to_json()
+REMOVE_KEYBOARD = telebot.types.ReplyKeyboardRemove().to_json()
+CHANNEL_JOIN = _channel_join().to_json()
+WITHDRAW_OPTIONS = _withdraw_options().to_json()
+ACCOUNT = _per_language(_account)
@@ -0,0 +1,170 @@
+"""
+Lease-based leader election for the jobs that must run in one replica only.
+
+The auto-cancel scheduler, the session janitor, the proxy health check and
+the sweep of expired verification states started in every process, so two
+replicas cancelled the same numbers twice and raced on the same session
+files. Every process now tries to take or renew the "scheduler" document in
+the `leases` collection every LEADER_RENEW_SECONDS. The holder runs the
+leader jobs. When it stops renewing (crash, lost connection), the lease
+expires after LEADER_LEASE_SECONDS and the next follower to try takes it over
+and starts the jobs. A follower costs two small writes per renewal, so load
+grows with the work, not with the number of replicas.
+
+Each process also keeps an "instance:<id>" lease alive. That lets the leader
+tell a claim wait owned by a live replica from one whose process is gone
+(otp.resume_claim_waits).
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime
+from config import LEADER_LEASE_SECONDS, LEADER_RENEW_SECONDS
+from db import acquire_lease, release_lease, get_lease
+
+LEADER_LEASE = "scheduler"
+
+class LeaderElection:
+    def __init__(self, lease_name=LEADER_LEASE, lease_seconds=LEADER_LEASE_SECONDS, renew_seconds=LEADER_RENEW_SECONDS):
+        self.lease_name = lease_name
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs = []   # (name, start, stop): started on becoming leader, stopped when the lease is lost
+        self.tasks = []  # [name, func, interval_seconds, last_run]: run from the election loop while leader
+        self.leader = False
+        self.leader_since = None
+        self.lease_deadline = 0.0  # monotonic time our last successful renewal runs out
+        self.transitions = 0
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def add_leader_job(self, name, start, stop=None):
+        self.jobs.append((name, start, stop))
+
+    def add_leader_task(self, name, func, interval_seconds):
+        """Run func every interval_seconds in the leader; keep it short, it delays the next renewal"""
+        self.tasks.append([name, func, interval_seconds, 0.0])
+
+    def is_leader(self):
+        return self.leader
+
+    def is_instance_alive(self, instance_id):
+        """Whether the process that wrote instance_id is still renewing its instance lease; None if MongoDB could not tell"""
+        if instance_id == self.instance_id:
+            return True
+        lease = get_lease(f"instance:{instance_id}")
+        if lease is False:
+            return None
+        return lease is not None
+
+    # ---- election ----
+
+    def _tick(self):
+        acquire_lease(f"instance:{self.instance_id}", self.instance_id, self.lease_seconds)
+        asked_at = time.monotonic()
+        held = acquire_lease(self.lease_name, self.instance_id, self.lease_seconds)
+        if held:
+            self.lease_deadline = asked_at + self.lease_seconds
+            if not self.leader:
+                self._become_leader()
+        elif self.leader and (held is False or time.monotonic() >= self.lease_deadline):
+            # Taken by another replica, or MongoDB has been unreachable for a whole lease
+            self._step_down()
+
+        if self.leader:
+            self._run_due_tasks()
+
+    def _become_leader(self):
+        self.leader = True
+        self.leader_since = datetime.utcnow()
+        self.transitions += 1
+        print(f"👑 {self.instance_id} is now the leader; starting {len(self.jobs)} singleton jobs")
+        for name, start, _ in self.jobs:
+            try:
+                start()
+            except Exception as e:
+                print(f"❌ Error starting leader job {name}: {e}")
+        for task in self.tasks:
+            task[3] = 0.0
+
+    def _step_down(self):
+        self.leader = False
+        self.leader_since = None
+        self.transitions += 1
+        print(f"🔻 {self.instance_id} lost the leader lease; stopping singleton jobs")
+        for name, _, stop in reversed(self.jobs):
+            if stop is None:
+                continue
+            try:
+                stop()
+            except Exception as e:
+                print(f"❌ Error stopping leader job {name}: {e}")
+
+    def _run_due_tasks(self):
+        now = time.monotonic()
+        for task in self.tasks:
+            name, func, interval, last_run = task
+            if now - last_run < interval:
+                continue
+            task[3] = now
+            try:
+                func()
+            except Exception as e:
+                print(f"❌ Error in leader task {name}: {e}")
+
+    def _loop(self):
+        while self.running:
+            self.wakeup.wait(self.renew_seconds)
+            if not self.running:
+                break
+            try:
+                self._tick()
+            except Exception as e:
+                print(f"❌ Error in leader election: {e}")
+
+    # ---- lifecycle ----
+
+    def start(self):
+        """Join the election; the first round runs here so a lone replica starts its jobs at boot"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.running = True
+        self.wakeup.clear()
+        try:
+            self._tick()
+        except Exception as e:
+            print(f"❌ Error in leader election: {e}")
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="LeaderElection")
+        self.thread.start()
+        print(f"🗳️ Joined leader election as {self.instance_id} ({'leader' if self.leader else 'follower'})")
+
+    def stop(self):
+        """Leave the election and hand the lease over without waiting for it to expire (shutdown)"""
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.leader:
+            self._step_down()
+            release_lease(self.lease_name, self.instance_id)
+        release_lease(f"instance:{self.instance_id}", self.instance_id)
+
+    def get_status(self):
+        lease = get_lease(self.lease_name)
+        return {
+            "instance_id": self.instance_id,
+            "leader": self.leader,
+            "leader_since": self.leader_since,
+            "holder": lease["holder"] if lease else None,
+            "expires_in": max(0.0, (lease["expires_at"] - datetime.utcnow()).total_seconds()) if lease else None,
+            "jobs": [name for name, _, _ in self.jobs],
+            "tasks": [task[0] for task in self.tasks],
+            "transitions": self.transitions
+        }
+
+leader_election = LeaderElection()
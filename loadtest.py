@@ -0,0 +1,953 @@
+"""
+End-to-end load test for the /start, phone verification and /withdraw flows.
+
+The real handlers from start.py, otp.py and withdraw.py run in-process and are
+driven by synthetic users through a local fake Bot API: updates are served on
+getUpdates, so the bot's own polling loop and worker pool are exercised, and
+every sendMessage/editMessageText is recorded for the users to wait on.
+Telethon is replaced by FakeTelegramClient (configurable connect, send_code,
+sign_in and GetAuthorizations latencies plus error injection), MongoDB is
+mongomock (default) or a local mongod, and otp.py runs on a VirtualClock so the
+claim_time wait is compressed.
+
+For each concurrency level it reports throughput, per-stage latency
+percentiles, thread counts and memory growth per verification.
+
+Usage:
+    python loadtest.py --concurrency 1,10,50
+    python loadtest.py --concurrency 25 --two-fa-rate 0.3 --sign-in-error-rate 0.05
+    python loadtest.py --concurrency 50 --json loadtest.json --min-throughput 5 --max-p95-ms send_code=1500
+    python loadtest.py --concurrency 50 --mongo local --otp-shards 4
+
+Needs mongomock for --mongo mock (pip install mongomock). Runs offline; exits
+with status 1 when a --min-throughput, --max-p95-ms or --max-failure-rate
+threshold is missed so it can gate CI.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import tempfile
+import argparse
+import threading
+import contextlib
+import importlib
+from types import SimpleNamespace
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOADTEST_COUNTRY = "+999"
+LOADTEST_CARD = "LOADTEST-CARD"
+LOADTEST_USER_BASE = 9_100_000_000
+SESSION_FILE_BYTES = 28672  # Roughly the size of a real Telethon SQLite session
+
+STAGES = ("start", "language", "send_code", "verify_code", "verify_2fa", "claim_and_reward", "withdraw", "total")
+
+# Bot replies that end a step unsuccessfully
+FAILURE_PREFIXES = ("❌", "⚠️", "⏰")
+# The OTP queue or admission control turned the request away (translations 'verification_busy',
+# 'send_code_busy', 'country_rate_limited'); users resend after a pause
+BUSY_MARKERS = ("Please send it again", "send your number again", "Please try again in a few minutes")
+BUSY_RETRIES = 5
+
+# ==== FAKE BOT API ====
+
+class _Chat:
+    def __init__(self):
+        self.messages = []  # (perf_counter, method, message_id, text)
+        self.condition = threading.Condition()
+
+class FakeBotAPI:
+    """
+    Minimal Bot API server on 127.0.0.1. Updates pushed with push_update() are
+    returned by getUpdates; outgoing messages are stored per chat so a virtual
+    user can wait for the bot's reply.
+    """
+
+    def __init__(self, latency_ms=0.0, rate_limit_rate=0.0):
+        self.latency = latency_ms / 1000
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._updates_condition = threading.Condition()
+        self._chats = {}
+        self._lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                parsed = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if body and content_type.startswith("application/x-www-form-urlencoded"):
+                    params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+                elif body and content_type.startswith("application/json"):
+                    params.update(json.loads(body))
+                status, payload = api.handle(parsed.path.rsplit('/', 1)[-1], params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="loadtest-bot-api")
+        self.thread.start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # ---- driver side ----
+
+    def push_update(self, update):
+        with self._updates_condition:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._updates_condition.notify_all()
+
+    def chat(self, chat_id):
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat()
+            return chat
+
+    def message_count(self, chat_id):
+        return len(self.chat(chat_id).messages)
+
+    def wait_for_message(self, chat_id, after, predicate, timeout):
+        """First message to chat_id at index >= after that predicate accepts, or None"""
+        chat = self.chat(chat_id)
+        deadline = time.monotonic() + timeout
+        index = after
+        with chat.condition:
+            while True:
+                while index < len(chat.messages):
+                    entry = chat.messages[index]
+                    index += 1
+                    if predicate(entry[3]):
+                        return entry, index
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, index
+                chat.condition.wait(remaining)
+
+    # ---- API side ----
+
+    def handle(self, method, params):
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}}
+        if method == "getChatMember":
+            user_id = int(params.get("user_id", 0))
+            return 200, {"ok": True, "result": {"user": {"id": user_id, "is_bot": False, "first_name": "Load"}, "status": "member"}}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return 200, {"ok": True, "result": self._record_message(method, params)}
+        return 200, {"ok": True, "result": True}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        # Cap long polling so stop_polling() returns promptly
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self._updates_condition:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_condition.wait(remaining)
+            return self._updates[:100]
+
+    def _record_message(self, method, params):
+        chat_id = int(params.get("chat_id") or 0)
+        text = params.get("text") or params.get("caption") or ""
+        with self._lock:
+            message_id = int(params.get("message_id") or 0) or self._next_message_id
+            self._next_message_id += 1
+        chat = self.chat(chat_id)
+        with chat.condition:
+            chat.messages.append((time.perf_counter(), method, message_id, text))
+            chat.condition.notify_all()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            "from": {"id": 1, "is_bot": True, "first_name": "LoadTest"},
+            "text": text
+        }
+        if method == "sendDocument":
+            message.pop("text")
+            message["document"] = {"file_id": f"loadtest-{message_id}", "file_unique_id": f"u{message_id}"}
+        return message
+
+# ==== FAKE TELETHON ====
+
+class FakeTelethonProfile:
+    """Mean latencies (seconds) and error rates for FakeTelegramClient"""
+
+    def __init__(self, connect=0.05, send_code=0.3, sign_in=0.2, edit_2fa=0.1, get_authorizations=0.15,
+                 jitter=0.3, connect_error_rate=0.0, send_code_error_rate=0.0, sign_in_error_rate=0.0,
+                 two_fa_rate=0.0, extra_device_rate=0.0):
+        self.latencies = {
+            "connect": connect,
+            "send_code": send_code,
+            "sign_in": sign_in,
+            "edit_2fa": edit_2fa,
+            "get_authorizations": get_authorizations,
+            "disconnect": 0.0
+        }
+        self.jitter = jitter
+        self.connect_error_rate = connect_error_rate
+        self.send_code_error_rate = send_code_error_rate
+        self.sign_in_error_rate = sign_in_error_rate
+        self.two_fa_rate = two_fa_rate
+        self.extra_device_rate = extra_device_rate
+
+    def delay(self, operation):
+        mean = self.latencies.get(operation, 0.0)
+        return max(0.0, random.gauss(mean, mean * self.jitter)) if mean else 0.0
+
+    @staticmethod
+    def hit(rate):
+        return rate > 0 and random.random() < rate
+
+class FakeSession:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def save(self):
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) < SESSION_FILE_BYTES:
+            with open(self.filename, "wb") as session_file:
+                session_file.write(b"SQLite format 3\x00".ljust(SESSION_FILE_BYTES, b"\x00"))
+
+class FakeTelegramClient:
+    """
+    Drop-in for telethon's TelegramClient covering what telegram_otp uses. Like
+    telethon.sync, each call returns a coroutine inside a running event loop
+    and blocks outside one.
+    """
+
+    profile = FakeTelethonProfile()
+    calls = Counter()
+
+    def __init__(self, session, api_id=None, api_hash=None, proxy=None, timeout=10, **kwargs):
+        session = str(session)
+        self.session = FakeSession(session if session.endswith(".session") else f"{session}.session")
+        self.proxy = proxy
+        self._connected = False
+
+    def _call(self, operation, result):
+        FakeTelegramClient.calls[operation] += 1
+        delay = self.profile.delay(operation)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            time.sleep(delay)
+            return result()
+
+        async def call():
+            await asyncio.sleep(delay)
+            return result()
+        return call()
+
+    def connect(self):
+        def result():
+            if self.profile.hit(self.profile.connect_error_rate):
+                raise ConnectionError("fake connection failure")
+            self._connected = True
+            return True
+        return self._call("connect", result)
+
+    def disconnect(self):
+        def result():
+            self._connected = False
+        return self._call("disconnect", result)
+
+    def is_connected(self):
+        return self._connected
+
+    def send_code_request(self, phone):
+        from telethon.errors import FloodWaitError
+
+        def result():
+            if self.profile.hit(self.profile.send_code_error_rate):
+                raise FloodWaitError(request=None, capture=30)
+            return SimpleNamespace(phone_code_hash=uuid.uuid4().hex, type=None)
+        return self._call("send_code", result)
+
+    def sign_in(self, phone=None, code=None, password=None, phone_code_hash=None, **kwargs):
+        from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
+
+        def result():
+            if password is None:
+                if self.profile.hit(self.profile.sign_in_error_rate):
+                    raise PhoneCodeInvalidError(request=None)
+                if self.profile.hit(self.profile.two_fa_rate):
+                    raise SessionPasswordNeededError(request=None)
+            self.session.save()
+            return SimpleNamespace(id=random.randint(10**8, 10**9), phone=phone)
+        return self._call("sign_in", result)
+
+    def edit_2fa(self, current_password=None, new_password=None, **kwargs):
+        return self._call("edit_2fa", lambda: True)
+
+    def __call__(self, request):
+        if type(request).__name__ == "GetAuthorizationsRequest":
+            def result():
+                authorizations = [SimpleNamespace(current=True, hash=0, platform="Windows", device_model="LoadTest", app_name="Telegram Desktop")]
+                if self.profile.hit(self.profile.extra_device_rate):
+                    authorizations.append(SimpleNamespace(current=False, hash=1, platform="Android", device_model="Pixel", app_name="Telegram Android"))
+                return SimpleNamespace(authorizations=authorizations)
+            return self._call("get_authorizations", result)
+        return self._call(type(request).__name__, lambda: True)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
+
+def install_fake_telethon(profile):
+    """Point every telethon TelegramClient import at FakeTelegramClient"""
+    import telethon
+    import telethon.sync
+
+    FakeTelegramClient.profile = profile
+    telethon.TelegramClient = FakeTelegramClient
+    telethon.sync.TelegramClient = FakeTelegramClient
+
+def install_shard_fakes():
+    """OTP worker initializer (--otp-shards): the bot process's fake Telethon profile, from the environment"""
+    install_fake_telethon(FakeTelethonProfile(**json.loads(os.environ["LOADTEST_TELETHON_PROFILE"])))
+
+# ==== VIRTUAL CLOCK ====
+
+class VirtualClock:
+    """
+    Stand-in for the time module inside otp.py: sleep() is divided by speedup so
+    the claim_time wait passes quickly; everything else is the real module.
+    """
+
+    def __init__(self, speedup):
+        self.speedup = max(1.0, speedup)
+        self.virtual_slept = 0.0
+        self._lock = threading.Lock()
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.virtual_slept += seconds
+        time.sleep(seconds / self.speedup)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+# ==== RESOURCE SAMPLING ====
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def _bot_thread_count():
+    """Threads belonging to the bot, leaving out the harness and the fake API"""
+    return sum(
+        1 for thread in threading.enumerate()
+        if not thread.name.startswith("loadtest") and "process_request_thread" not in thread.name
+    )
+
+class ResourceSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.running = False
+        self.thread = None
+        self.threads_peak = 0
+        self.bot_threads_peak = 0
+        self.rss_peak = 0
+
+    def _loop(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        self.threads_peak = max(self.threads_peak, threading.active_count())
+        self.bot_threads_peak = max(self.bot_threads_peak, _bot_thread_count())
+        self.rss_peak = max(self.rss_peak, _rss_bytes())
+
+    def start(self):
+        self.running = True
+        self.sample()
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="loadtest-sampler")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+        self.sample()
+
+# ==== VIRTUAL USERS ====
+
+def _message_update(user_id, text):
+    message = {
+        "message_id": random.randint(1, 2**31),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"},
+        "text": text
+    }
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+def _callback_update(user_id, data, message_id):
+    return {"callback_query": {
+        "id": uuid.uuid4().hex,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "text": ""
+        }
+    }}
+
+def _is_busy(text):
+    return any(marker in text for marker in BUSY_MARKERS)
+
+def _markers(*markers):
+    """Predicate matching a bot reply that contains one of markers or starts with a failure prefix"""
+    return lambda text: any(marker in text for marker in markers) or text.startswith(FAILURE_PREFIXES)
+
+class VirtualUser:
+    def __init__(self, harness, user_id, phone_number):
+        self.harness = harness
+        self.api = harness.api
+        self.user_id = user_id
+        self.phone = phone_number
+        self.stages = {}
+        self.outcome = None
+        self.busy_retries = 0
+        self._cursor = 0
+
+    def _send(self, update):
+        self._cursor = self.api.message_count(self.user_id)
+        self.api.push_update(update)
+        return time.perf_counter()
+
+    def _think(self):
+        think = self.harness.args.think_ms / 1000
+        if think:
+            time.sleep(random.uniform(0.5, 1.5) * think)
+
+    def _step(self, stage, update, predicate, timeout=None):
+        """Send an update and wait for the matching reply; returns its text or None on timeout/failure"""
+        started = self._send(update)
+        entry, self._cursor = self.api.wait_for_message(
+            self.user_id, self._cursor, predicate, timeout or self.harness.args.step_timeout
+        )
+        if entry is None:
+            self.outcome = f"timeout:{stage}"
+            return None
+        self.stages[stage] = self.stages.get(stage, 0.0) + (entry[0] - started) * 1000
+        if entry[3].startswith(FAILURE_PREFIXES):
+            self.outcome = f"failed:{stage}"
+            return None
+        return entry
+
+    def _submit(self, stage, text, predicate):
+        """_step for a number, code or password, resending it like a user would while the bot says it is busy"""
+        for _ in range(BUSY_RETRIES):
+            entry = self._step(stage, _message_update(self.user_id, text), lambda reply: _is_busy(reply) or predicate(reply))
+            if entry is None or not _is_busy(entry[3]):
+                return entry
+            self.busy_retries += 1
+            time.sleep(random.uniform(1.0, 3.0))
+        self.outcome = f"busy:{stage}"
+        return None
+
+    def _wait_for_pending_phone(self):
+        # handle_phone_number stores pending_phone just after editing the prompt;
+        # the OTP handler ignores codes until it is there
+        deadline = time.monotonic() + self.harness.args.step_timeout
+        while time.monotonic() < deadline:
+            if (self.harness.db.get_user(self.user_id) or {}).get("pending_phone"):
+                return True
+            time.sleep(0.02)
+        return False
+
+    def run(self, barrier, start_delay=0.0):
+        try:
+            barrier.wait()
+            if start_delay:
+                time.sleep(start_delay)
+            self._run()
+        except Exception as e:
+            self.outcome = f"error:{type(e).__name__}"
+
+    def _run(self):
+        args = self.harness.args
+
+        if not self._step("start", _message_update(self.user_id, "/start"), lambda text: True):
+            return
+        if not self._step("language", _message_update(self.user_id, "English"), lambda text: True):
+            return
+
+        self._think()
+        if not self._submit("send_code", self.phone, _markers("Enter the code")):
+            return
+
+        self._think()
+        if not self._wait_for_pending_phone():
+            self.outcome = "timeout:pending_phone"
+            return
+        entry = self._submit("verify_code", "12345", _markers("Account Received", "Two-factor authentication required"))
+        if not entry:
+            return
+        if "Two-factor" in entry[3]:
+            self._think()
+            entry = self._submit("verify_2fa", "hunter2", _markers("Account Received"))
+            if not entry:
+                return
+        received_at = entry[0]
+
+        claim_timeout = args.step_timeout + args.claim_time / args.clock_speedup
+        entry, self._cursor = self.api.wait_for_message(
+            self.user_id, self._cursor, _markers("Successfully Verified", "Verification Failed"), claim_timeout
+        )
+        if entry is None:
+            self.outcome = "timeout:claim_and_reward"
+            return
+        self.stages["claim_and_reward"] = (entry[0] - received_at) * 1000
+        if "Successfully Verified" not in entry[3]:
+            self.outcome = "failed:claim_and_reward"
+            return
+
+        if args.withdraw:
+            self._think()
+            options = self._step("withdraw", _message_update(self.user_id, "/withdraw"), lambda text: True)
+            if not options:
+                return
+            if not self._step("withdraw", _callback_update(self.user_id, "withdraw_leader_card", options[2]), lambda text: True):
+                return
+            self._think()
+            if not self._step("withdraw", _message_update(self.user_id, LOADTEST_CARD), lambda text: True):
+                return
+
+        # Time spent waiting on the bot, leaving out the users' think time
+        self.stages["total"] = sum(self.stages.values())
+        self.outcome = "rewarded"
+
+# ==== HARNESS ====
+
+class LoadTestHarness:
+    # Handler modules imported after the fakes are installed; replay.py uses main's full set
+    handler_modules = ("start", "withdraw")
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.run_id = int(time.time()) % 10000
+        self.api = FakeBotAPI(args.api_latency_ms, args.api_429_rate)
+        self.clock = VirtualClock(args.clock_speedup)
+        self.bot = None
+        self.db = None
+        self.otp = None
+        self.polling_thread = None
+        self._levels_run = 0
+
+    def setup(self):
+        """Configure the environment, install the fakes and import the bot's handlers"""
+        args = self.args
+        os.environ["BOT_TOKEN"] = "123456:LOADTEST"
+        os.environ["PROXYLIST"] = ""
+        os.environ["SESSIONS_DIR"] = os.path.join(self.workdir, "sessions")
+        os.environ["MONGO_URI"] = args.mongo_uri
+        os.environ["NO_PROXY"] = "127.0.0.1,localhost"
+
+        if args.mongo == "mock":
+            try:
+                import mongomock
+            except ImportError:
+                sys.exit("❌ --mongo mock needs mongomock (pip install mongomock), or use --mongo local")
+            import pymongo
+            pymongo.MongoClient = mongomock.MongoClient
+        elif not args.allow_remote_mongo and urlparse(args.mongo_uri).hostname not in ("127.0.0.1", "localhost"):
+            sys.exit("❌ Refusing to load test a non-local MongoDB; pass --allow-remote-mongo to override")
+
+        profile = dict(
+            connect=args.connect_ms / 1000,
+            send_code=args.send_code_ms / 1000,
+            sign_in=args.sign_in_ms / 1000,
+            edit_2fa=args.edit_2fa_ms / 1000,
+            get_authorizations=args.auth_ms / 1000,
+            jitter=args.jitter,
+            connect_error_rate=args.connect_error_rate,
+            send_code_error_rate=args.send_code_error_rate,
+            sign_in_error_rate=args.sign_in_error_rate,
+            two_fa_rate=args.two_fa_rate,
+            extra_device_rate=args.extra_device_rate
+        )
+        install_fake_telethon(FakeTelethonProfile(**profile))
+        if args.otp_shards:
+            # The worker processes install the same fakes (install_shard_fakes) and need a MongoDB they share
+            if args.mongo != "local":
+                sys.exit("❌ --otp-shards needs --mongo local: worker processes share conversation state through MongoDB")
+            os.environ["LOADTEST_TELETHON_PROFILE"] = json.dumps(profile)
+
+        self.api.start()
+        from telebot import apihelper
+        apihelper.API_URL = self.api.url + "/bot{0}/{1}"
+
+        import db
+        import telegram_otp
+        import otp
+        for module in self.handler_modules:
+            importlib.import_module(module)
+        from bot_init import bot
+        from proxy_manager import proxy_manager
+
+        telegram_otp.TelegramClient = FakeTelegramClient
+        otp.time = self.clock
+        if args.otp_shards:
+            otp.otp_shards.worker_count = args.otp_shards
+            otp.otp_shards.initializer = "loadtest:install_shard_fakes"
+            otp.start_otp_workers()
+        if args.proxy_fallback:
+            async def fake_working_proxy():
+                return {"proxy_type": "socks5", "addr": "127.0.0.1", "port": 1080, "rdns": True, "username": None, "password": None}
+            proxy_manager.get_working_proxy = fake_working_proxy
+
+        self.bot, self.db, self.otp = bot, db, otp
+
+        db.set_country_capacity(LOADTEST_COUNTRY, 10**9, name="Load Test", flag="🏁")
+        db.set_country_price(LOADTEST_COUNTRY, args.price)
+        db.set_country_claim_time(LOADTEST_COUNTRY, args.claim_time)
+        db.add_leader_card(LOADTEST_CARD)
+
+        self.polling_thread = threading.Thread(
+            target=bot.infinity_polling,
+            kwargs={"timeout": 10, "long_polling_timeout": 1, "skip_pending": True},
+            daemon=True,
+            name="loadtest-polling"
+        )
+        self.polling_thread.start()
+
+    def teardown(self):
+        if self.bot:
+            self.bot.stop_polling()
+        if self.otp:
+            self.otp.otp_shards.stop()
+        if self.polling_thread:
+            self.polling_thread.join(timeout=5)
+        self.api.stop()
+        if self.db is not None and self.args.mongo == "local":
+            self.cleanup_database()
+
+    def cleanup_database(self):
+        """Remove everything the run wrote to a local mongod"""
+        database = self.db.db
+        by_user = {"user_id": {"$gte": LOADTEST_USER_BASE}}
+        for collection in ("users", "withdrawals", "pending_numbers", "used_numbers", "transactions", "session_outbox"):
+            database[collection].delete_many(by_user)
+        database.countries.delete_one({"country_code": LOADTEST_COUNTRY})
+        database.cards.delete_one({"card_name": LOADTEST_CARD})
+
+    def wait_for_background_threads(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while self.otp.background_threads and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def run_level(self, concurrency):
+        """Run `concurrency` users at once and return the level's report"""
+        level = self._levels_run
+        self._levels_run += 1
+        users = []
+        for index in range(concurrency):
+            user_id = LOADTEST_USER_BASE + self.run_id * 100_000 + level * 10_000 + index
+            phone = f"{LOADTEST_COUNTRY}{self.run_id:04d}{level:02d}{index:04d}"
+            users.append(VirtualUser(self, user_id, phone))
+
+        ramp = self.args.ramp_seconds
+        barrier = threading.Barrier(concurrency + 1)
+        threads = [
+            threading.Thread(
+                target=user.run,
+                args=(barrier, ramp * index / concurrency if ramp else 0.0),
+                daemon=True,
+                name=f"loadtest-user-{index}"
+            )
+            for index, user in enumerate(users)
+        ]
+
+        sampler = ResourceSampler()
+        calls_before = Counter(self.api.calls)
+        rss_start = _rss_bytes()
+        threads_start = _bot_thread_count()
+        sampler.start()
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        self.wait_for_background_threads()
+        sampler.stop()
+
+        return self._report(concurrency, users, wall, sampler, rss_start, threads_start, calls_before)
+
+    def _report(self, concurrency, users, wall, sampler, rss_start, threads_start, calls_before):
+        from tracing import percentile
+
+        outcomes = Counter(user.outcome or "unknown" for user in users)
+        stages = {}
+        for stage in STAGES:
+            durations = sorted(user.stages[stage] for user in users if stage in user.stages)
+            if durations:
+                stages[stage] = {
+                    "count": len(durations),
+                    "p50": round(percentile(durations, 0.50), 1),
+                    "p95": round(percentile(durations, 0.95), 1),
+                    "p99": round(percentile(durations, 0.99), 1),
+                    "max": round(durations[-1], 1)
+                }
+        rewarded = outcomes.get("rewarded", 0)
+        api_calls = Counter(self.api.calls)
+        api_calls.subtract(calls_before)
+        return {
+            "concurrency": concurrency,
+            "wall_seconds": round(wall, 3),
+            "rewarded": rewarded,
+            "failure_rate": round(1 - rewarded / concurrency, 4) if concurrency else 0.0,
+            "throughput_per_second": round(rewarded / wall, 3) if wall else 0.0,
+            "outcomes": dict(outcomes),
+            "busy_retries": sum(user.busy_retries for user in users),
+            "stages_ms": stages,
+            "threads": {
+                "bot_before": threads_start,
+                "bot_peak": sampler.bot_threads_peak,
+                "bot_after": _bot_thread_count(),
+                "process_peak": sampler.threads_peak
+            },
+            "memory": {
+                "rss_start_mb": round(rss_start / 2**20, 1),
+                "rss_peak_mb": round(sampler.rss_peak / 2**20, 1),
+                "rss_end_mb": round(_rss_bytes() / 2**20, 1),
+                "kb_per_verification": round((sampler.rss_peak - rss_start) / 1024 / concurrency, 1) if concurrency else 0.0
+            },
+            "bot_api_calls": {method: count for method, count in api_calls.items() if count},
+            "telethon_calls": dict(FakeTelegramClient.calls)
+        }
+
+# ==== REPORTING ====
+
+def format_level(report):
+    lines = [
+        f"📊 Concurrency {report['concurrency']}: {report['rewarded']}/{report['concurrency']} rewarded "
+        f"in {report['wall_seconds']:.2f}s → {report['throughput_per_second']:.2f} verifications/s",
+        f"   Outcomes: " + ", ".join(f"{outcome}={count}" for outcome, count in sorted(report['outcomes'].items()))
+        + (f" ({report['busy_retries']} resent after a busy reply)" if report["busy_retries"] else ""),
+        f"   {'stage':<18}{'count':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)"
+    ]
+    for stage, row in report["stages_ms"].items():
+        lines.append(f"   {stage:<18}{row['count']:>6}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}{row['max']:>10.1f}")
+    threads, memory = report["threads"], report["memory"]
+    lines.append(
+        f"   🧵 Bot threads {threads['bot_before']} → peak {threads['bot_peak']} → {threads['bot_after']} "
+        f"(process peak {threads['process_peak']})"
+    )
+    lines.append(
+        f"   💾 RSS {memory['rss_start_mb']} → peak {memory['rss_peak_mb']} MB "
+        f"({memory['kb_per_verification']} KB per verification)"
+    )
+    api_calls = sorted((method, count) for method, count in report["bot_api_calls"].items() if method != "getUpdates")
+    lines.append("   📡 Bot API: " + ", ".join(f"{method}={count}" for method, count in api_calls))
+    return "\n".join(lines)
+
+def parse_stage_limits(values):
+    limits = {}
+    for value in values or []:
+        stage, _, limit = value.partition('=')
+        if stage not in STAGES or not limit:
+            raise argparse.ArgumentTypeError(f"expected STAGE=MS with STAGE one of {', '.join(STAGES)}: {value}")
+        limits[stage] = float(limit)
+    return limits
+
+def check_thresholds(reports, args):
+    """Threshold violations across all levels, as readable strings"""
+    violations = []
+    p95_limits = parse_stage_limits(args.max_p95_ms)
+    for report in reports:
+        level = f"concurrency {report['concurrency']}"
+        if args.min_throughput is not None and report["throughput_per_second"] < args.min_throughput:
+            violations.append(f"{level}: throughput {report['throughput_per_second']}/s < {args.min_throughput}/s")
+        if args.max_failure_rate is not None and report["failure_rate"] > args.max_failure_rate:
+            violations.append(f"{level}: failure rate {report['failure_rate']} > {args.max_failure_rate}")
+        for stage, limit in p95_limits.items():
+            row = report["stages_ms"].get(stage)
+            if row and row["p95"] > limit:
+                violations.append(f"{level}: {stage} p95 {row['p95']}ms > {limit}ms")
+    return violations
+
+def add_backend_arguments(parser):
+    """Fake Bot API, fake Telethon, clock and MongoDB options (shared with replay.py)"""
+    bot_group = parser.add_argument_group("bot and clock")
+    bot_group.add_argument("--claim-time", type=int, default=600, help="Country claim_time in seconds")
+    bot_group.add_argument("--clock-speedup", type=float, default=600.0, help="How much faster otp.py's sleeps run")
+    bot_group.add_argument("--price", type=float, default=2.5, help="Country price (>= 2 so /withdraw passes)")
+    bot_group.add_argument("--api-latency-ms", type=float, default=0.0, help="Added latency per Bot API call")
+    bot_group.add_argument("--api-429-rate", type=float, default=0.0, help="Fraction of Bot API calls answered with 429")
+    bot_group.add_argument("--otp-shards", type=int, default=0, help="OTP worker processes (OTP_SHARD_WORKERS); needs --mongo local")
+
+    telethon_group = parser.add_argument_group("fake Telethon")
+    telethon_group.add_argument("--connect-ms", type=float, default=50.0)
+    telethon_group.add_argument("--send-code-ms", type=float, default=300.0)
+    telethon_group.add_argument("--sign-in-ms", type=float, default=200.0)
+    telethon_group.add_argument("--edit-2fa-ms", type=float, default=100.0)
+    telethon_group.add_argument("--auth-ms", type=float, default=150.0, help="GetAuthorizations latency")
+    telethon_group.add_argument("--jitter", type=float, default=0.3, help="Latency standard deviation as a fraction of the mean")
+    telethon_group.add_argument("--connect-error-rate", type=float, default=0.0, help="Connect failures on any client (OTP send falls back to the proxy path, the device check blocks the reward)")
+    telethon_group.add_argument("--send-code-error-rate", type=float, default=0.0, help="FloodWaitError on send_code")
+    telethon_group.add_argument("--sign-in-error-rate", type=float, default=0.0, help="PhoneCodeInvalidError on sign_in")
+    telethon_group.add_argument("--two-fa-rate", type=float, default=0.0, help="Accounts that ask for a 2FA password")
+    telethon_group.add_argument("--extra-device-rate", type=float, default=0.0, help="Accounts reporting a second device")
+    telethon_group.add_argument("--no-proxy-fallback", dest="proxy_fallback", action="store_false",
+                                help="Don't offer a fake proxy when the direct connection fails")
+
+    mongo_group = parser.add_argument_group("MongoDB")
+    mongo_group.add_argument("--mongo", choices=("mock", "local"), default="mock", help="mongomock or a local mongod")
+    mongo_group.add_argument("--mongo-uri", default="mongodb://127.0.0.1:27017")
+    mongo_group.add_argument("--allow-remote-mongo", action="store_true")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="End-to-end load test with a fake Bot API and fake Telethon")
+    parser.add_argument("--concurrency", default="1,10,50", help="Comma-separated concurrent user counts, one run each")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="Spread user starts over this many seconds")
+    parser.add_argument("--think-ms", type=float, default=200.0, help="Mean pause before each user reply")
+    parser.add_argument("--step-timeout", type=float, default=60.0, help="Seconds to wait for each bot reply")
+    parser.add_argument("--no-withdraw", dest="withdraw", action="store_false", help="Skip the /withdraw flow")
+
+    add_backend_arguments(parser)
+
+    output_group = parser.add_argument_group("output and thresholds")
+    output_group.add_argument("--json", help="Write the full report to this file")
+    output_group.add_argument("--bot-log", default=os.devnull, help="Where the bot's own output goes (default: discarded)")
+    output_group.add_argument("--log-level", default="WARNING")
+    output_group.add_argument("--keep-workdir", action="store_true", help="Keep the temporary sessions directory")
+    output_group.add_argument("--min-throughput", type=float, help="Fail below this many rewarded verifications/s")
+    output_group.add_argument("--max-p95-ms", action="append", metavar="STAGE=MS", help="Fail when a stage's p95 exceeds MS (repeatable)")
+    output_group.add_argument("--max-failure-rate", type=float, help="Fail when more than this fraction of users isn't rewarded")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+        parse_stage_limits(args.max_p95_ms)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        sys.exit(f"❌ {e}")
+
+    workdir = tempfile.mkdtemp(prefix="otpbot-loadtest-")
+    out = sys.stdout
+    reports = []
+    with open(args.bot_log, "a") as bot_log:
+        logging.basicConfig(level=args.log_level.upper(), stream=bot_log, force=True)
+        harness = LoadTestHarness(args, workdir)
+        try:
+            with contextlib.redirect_stdout(bot_log):
+                harness.setup()
+            for concurrency in levels:
+                print(f"🚀 Running {concurrency} concurrent verifications...", file=out, flush=True)
+                with contextlib.redirect_stdout(bot_log):
+                    report = harness.run_level(concurrency)
+                reports.append(report)
+                print(format_level(report), file=out, flush=True)
+        finally:
+            with contextlib.redirect_stdout(bot_log):
+                harness.teardown()
+            if not args.keep_workdir:
+                import shutil
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {
+        "levels": reports,
+        "settings": {key: value for key, value in vars(args).items() if key not in ("json", "bot_log")},
+        "virtual_seconds_slept": round(harness.clock.virtual_slept, 1)
+    }
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(summary, report_file, indent=2)
+        print(f"💾 Report written to {args.json}", file=out)
+
+    violations = check_thresholds(reports, args)
+    for violation in violations:
+        print(f"❌ {violation}", file=out)
+    if violations:
+        return 1
+    print("✅ Load test passed", file=out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
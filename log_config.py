@@ -0,0 +1,147 @@
+"""
+Queue-based logging pipeline.
+
+setup_logging() puts a single QueueHandler on the root logger, so threads only
+enqueue records while one QueueListener thread formats and writes them to
+stdout (JSON lines by default). Records below WARNING can be sampled per logger
+prefix (LOG_SAMPLE_RATES, e.g. "utils.membership=0.05") before they are ever
+enqueued. Levels and sample rates can be changed at runtime (/loglevel, /logsample).
+"""
+
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG/INFO records for loggers with a sample rate"""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def rate_for(self, logger_name):
+        # Longest matching prefix wins so "telegram_otp.devices" can differ from "telegram_otp"
+        best, rate = -1, 1.0
+        for prefix, prefix_rate in self.rates.items():
+            if (logger_name == prefix or logger_name.startswith(prefix + ".")) and len(prefix) > best:
+                best, rate = len(prefix), prefix_rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process queue: the message is rendered now (so later
+    mutation of args can't change it) but exc_info is kept for the formatter.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def parse_sample_rates(value):
+    rates = {}
+    for item in (value or "").split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            print(f"⚠️ Ignoring invalid log sample rate: {item}")
+    return rates
+
+sampling_filter = SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES))
+_listener = None
+
+def setup_logging(level=None, log_format=None):
+    """Install the queue handler on the root logger and start the writer thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(-1)
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(sampling_filter)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if (log_format or LOG_FORMAT).lower() == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    root = logging.getLogger()
+    # Replace any handlers a module's basicConfig() may already have added
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.getLevelName((level or LOG_LEVEL).upper()))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def set_log_level(level, logger_name=None):
+    """Change a logger's level (root when logger_name is None); returns False for unknown levels"""
+    level_value = logging.getLevelName(level.upper())
+    if not isinstance(level_value, int):
+        return False
+    logging.getLogger(logger_name).setLevel(level_value)
+    return True
+
+def set_sample_rate(logger_name, rate):
+    """Set the kept fraction of DEBUG/INFO records for a logger prefix; 1.0 removes sampling"""
+    rate = max(0.0, min(1.0, float(rate)))
+    if rate >= 1.0:
+        sampling_filter.rates.pop(logger_name, None)
+    else:
+        sampling_filter.rates[logger_name] = rate
+    return rate
+
+def get_logging_status():
+    root = logging.getLogger()
+    overrides = {
+        name: logging.getLevelName(logger.level)
+        for name, logger in logging.Logger.manager.loggerDict.items()
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET
+    }
+    return {
+        "root_level": logging.getLevelName(root.level),
+        "format": LOG_FORMAT,
+        "queued": _listener is not None,
+        "overrides": overrides,
+        "sample_rates": dict(sampling_filter.rates)
+    }
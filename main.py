@@ -1,6 +1,14 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+# Time every bot module import from here on (printed as the boot profile)
+from config import BOOT_PROFILE
+from boot_profiler import boot_profiler
+if BOOT_PROFILE:
+    boot_profiler.install()
+# Install the queued logging pipeline before any module calls logging.basicConfig()
+from log_config import setup_logging
+setup_logging()
 from bot_init import bot
 import start
 import account
@@ -28,11 +36,22 @@ import admin_sessions
 import admin_delete_sessions
 import device_sessions
 import admin_device_check
-import session_cleanup
-import temp_session_cleanup
+import session_janitor
 import auto_cancel_scheduler
+import session_sender
+import notification_outbox
 import threading
-from flask import Flask, jsonify
+import time
+import metrics
+import tracing
+import update_recorder
+from config import UPDATE_RECORD_FILE
+from db import is_database_ready
+from proxy_manager import proxy_manager
+from leader_election import leader_election
+from flask import Flask, jsonify, Response
+
+boot_profiler.finish_imports()
 
 # Create Flask app for health checks
 app = Flask(__name__)
@@ -41,6 +60,38 @@ app = Flask(__name__)
 def home():
     return jsonify({"message": "Telegram Bot is running", "status": "active"})
 
+STARTED_AT = time.time()
+
+@app.route('/health')
+def health():
+    """Liveness: the process is serving and the OTP event loop is running"""
+    alive = otp.otp_loop.is_running()
+    body = {
+        "status": "ok" if alive else "down",
+        "uptime_seconds": int(time.time() - STARTED_AT),
+        "boot_seconds": boot_profiler.get_status()["ready_seconds"]
+    }
+    return jsonify(body), 200 if alive else 503
+
+@app.route('/ready')
+def ready():
+    """Readiness: MongoDB is reachable and the background workers are up"""
+    checks = {
+        "mongo": is_database_ready(),
+        "otp_loop": otp.otp_loop.is_running(),
+        # Only the leader runs the janitor
+        "session_janitor": not leader_election.is_leader() or bool(session_janitor.session_janitor.thread and session_janitor.session_janitor.thread.is_alive()),
+        "session_outbox": any(worker.is_alive() for worker in session_sender.session_outbox.workers),
+        "notification_outbox": bool(notification_outbox.notification_outbox.worker and notification_outbox.notification_outbox.worker.is_alive())
+    }
+    is_ready = all(checks.values())
+    return jsonify({"status": "ready" if is_ready else "not_ready", "checks": checks,
+                    "leader": leader_election.is_leader()}), 200 if is_ready else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
 def run_flask():
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
@@ -49,26 +100,63 @@ def main():
     print("Bot is running...")
     
     # Start Flask server in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    with boot_profiler.phase("flask"):
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+    
+    # Start the OTP event loop and periodic cleanup (deferred from import)
+    with boot_profiler.phase("otp_workers"):
+        otp.start_otp_workers()
     
-    # Start the temporary session cleanup scheduler (always enabled)
-    temp_session_cleanup.start_cleanup_scheduler()
+    # Start the session upload outbox workers (also drains uploads queued before a restart)
+    with boot_profiler.phase("session_outbox"):
+        session_sender.start_session_outbox()
+    
+    # Start the user notification sender (payout and rejection messages, resumes after a restart)
+    with boot_profiler.phase("notification_outbox"):
+        notification_outbox.start_notification_outbox()
+    
+    # Start the verification trace flusher (spans for /latency)
+    with boot_profiler.phase("tracing"):
+        tracing.start_tracing()
+    
+    # Record anonymized incoming updates for replay.py (also toggled with /recordupdates)
+    with boot_profiler.phase("update_recorder"):
+        update_recorder.install_update_recorder()
+        if UPDATE_RECORD_FILE:
+            update_recorder.start_update_recording()
     
     # Session cleanup is disabled by default - admin must enable it
     print("🧹 Session cleanup is DISABLED by default - use /enablecleanup to turn it on")
     
-    # Start automatic cancellation scheduler
-    print("🤖 Starting automatic cancellation scheduler...")
+    # Jobs that must run in one replica only go to the holder of the leader lease
+    # (a lone replica takes it at once; followers take over when the leader stops renewing)
+    leader_election.add_leader_job("session_janitor", session_janitor.start_janitor, session_janitor.stop_janitor)
+    leader_election.add_leader_job("auto_cancel_scheduler", auto_cancel_scheduler.start_auto_cancel_scheduler,
+                                   auto_cancel_scheduler.stop_auto_cancel_scheduler)
+    leader_election.add_leader_job("proxy_health_check", proxy_manager.start_initial_health_check)
+    # Claim waits interrupted by a restart, or owned by a replica that is gone
+    leader_election.add_leader_task("claim_resume", otp.resume_claim_waits, 30)
     print("🔒 PROTECTION: Numbers without background verification will NEVER be auto-cancelled")
     
+    boot_profiler.mark_ready()
+    if BOOT_PROFILE:
+        print(boot_profiler.report())
+    
+    # Joined once the bot is up, so the proxy health check still runs after boot
+    leader_election.start()
+    
     try:
         bot.infinity_polling()
     except Exception as e:
         print(f"Bot crashed: {str(e)}")
-        # Stop session cleanup on shutdown if running
-        session_cleanup.stop_session_cleanup()
-        temp_session_cleanup.stop_cleanup_scheduler()
+        # Stop the leader jobs (session cleanup, auto-cancel) and hand the lease over
+        leader_election.stop()
+        session_sender.stop_session_outbox()
+        notification_outbox.stop_notification_outbox()
+        otp.otp_shards.stop()
+        tracing.stop_tracing()
+        update_recorder.stop_update_recording()
         # Add any cleanup or restart logic here
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+"""
+In-process metrics exposed in Prometheus text format on the Flask app's /metrics.
+
+Counters and histograms are updated from the OTP pipeline, a pymongo command
+listener and a Bot API request hook. Gauges are read through callbacks
+registered by the module that owns the state, so scraping never has to import
+otp or telegram_otp. No client library is required.
+"""
+
+import time
+import threading
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def observe_since(self, started, **labels):
+        """Observe the time elapsed since a time.perf_counter() reading"""
+        self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(float(bound))))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+class Gauge:
+    """
+    Gauge read from a callback at scrape time. The callback returns a number,
+    or a dict of label value tuples (or single values) to numbers.
+    """
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._callback = None
+
+    def set_function(self, callback):
+        self._callback = callback
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if self._callback is None:
+            return lines
+        try:
+            value = self._callback()
+        except Exception as e:
+            print(f"❌ Error collecting gauge {self.name}: {e}")
+            return lines
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(item)}")
+        else:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+# ==== OTP PIPELINE ====
+
+OTP_STAGE_SECONDS = Histogram(
+    "otp_stage_seconds",
+    "Duration of OTP pipeline stages (send_code, verify_code, verify_2fa, reward_settlement)",
+    ("stage", "outcome")
+)
+OTP_USER_STATES = Gauge("otp_user_states", "Verification states held by SessionManager")
+OTP_BACKGROUND_THREADS = Gauge("otp_background_threads", "Background reward threads being tracked")
+OTP_CLAIMS_WAITING = Gauge("otp_claims_waiting", "Verified numbers waiting for their claim window to elapse")
+OTP_QUEUE_DEPTH = Gauge("otp_queue_depth", "Code and 2FA submissions waiting for an OTP worker")
+OTP_WORKERS_BUSY = Gauge("otp_workers_busy", "OTP workers currently handling a submission")
+OTP_QUEUE_WAIT_SECONDS = Histogram("otp_queue_wait_seconds", "Time a code or 2FA submission waited for an OTP worker", ("kind",))
+OTP_SHARD_IN_FLIGHT = Gauge("otp_shard_in_flight", "Telethon calls waiting on each OTP worker process", ("shard",))
+OTP_SHARD_RESTARTS = Counter("otp_shard_restarts_total", "OTP worker processes started again after exiting", ("shard",))
+ADMISSION_ACTIVE = Gauge("admission_active", "Telethon operations running, by priority class", ("work_class",))
+ADMISSION_WAITING = Gauge("admission_waiting", "Telethon operations waiting for admission, by priority class", ("work_class",))
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time a Telethon operation waited for admission", ("work_class",))
+ADMISSION_SHED = Counter("admission_shed_total", "Telethon operations turned away by admission control", ("work_class", "reason"))
+OTP_QUEUE_REJECTED = Counter("otp_queue_rejected_total", "Code and 2FA submissions turned away because the OTP queue was full", ("kind",))
+NOTIFICATIONS_SENT = Counter("notifications_sent_total", "User notifications handled by the notification outbox", ("template", "result"))
+
+_claims_waiting = 0
+_claims_lock = threading.Lock()
+
+def claim_wait_started():
+    global _claims_waiting
+    with _claims_lock:
+        _claims_waiting += 1
+
+def claim_wait_finished():
+    global _claims_waiting
+    with _claims_lock:
+        _claims_waiting = max(0, _claims_waiting - 1)
+
+OTP_CLAIMS_WAITING.set_function(lambda: _claims_waiting)
+
+# ==== MONGODB ====
+
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_seconds",
+    "MongoDB command latency by collection and command",
+    ("collection", "command")
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total",
+    "MongoDB commands that failed, by collection and command",
+    ("collection", "command")
+)
+
+# Commands that carry no collection name and would only add noise
+_IGNORED_MONGO_COMMANDS = {"isMaster", "ismaster", "hello", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener recording command latency; pass it in event_listeners"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if event.command_name in _IGNORED_MONGO_COMMANDS:
+            return
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection", "")
+        else:
+            collection = command.get(event.command_name, "")
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, None)
+        if collection is None:
+            return
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, None)
+        if collection is None:
+            return
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        MONGO_COMMAND_FAILURES.inc(collection=collection, command=event.command_name)
+
+# ==== BOT API ====
+
+BOT_API_SECONDS = Histogram("bot_api_seconds", "Telegram Bot API call latency by method", ("method",))
+BOT_API_RATE_LIMITED = Counter("bot_api_rate_limited_total", "Bot API calls answered with 429", ("method",))
+BOT_API_ERRORS = Counter("bot_api_errors_total", "Bot API calls that failed, by method and HTTP status", ("method", "status"))
+
+def install_bot_api_metrics():
+    """Time every Bot API request through telebot's CUSTOM_REQUEST_SENDER hook"""
+    from telebot import apihelper
+
+    if getattr(apihelper.CUSTOM_REQUEST_SENDER, "_records_metrics", False):
+        return
+
+    downstream = apihelper.CUSTOM_REQUEST_SENDER
+
+    def timed_request(method, url, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            if downstream:
+                response = downstream(method, url, **kwargs)
+            else:
+                response = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception:
+            BOT_API_SECONDS.observe_since(started, method=api_method)
+            BOT_API_ERRORS.inc(method=api_method, status="network")
+            raise
+        BOT_API_SECONDS.observe_since(started, method=api_method)
+        if response.status_code == 429:
+            BOT_API_RATE_LIMITED.inc(method=api_method)
+        elif response.status_code >= 400:
+            BOT_API_ERRORS.inc(method=api_method, status=response.status_code)
+        return response
+
+    timed_request._records_metrics = True
+    apihelper.CUSTOM_REQUEST_SENDER = timed_request
+
+# ==== PROXIES ====
+
+PROXY_SCORE = Gauge("proxy_score", "Proxy success ratio from health checks (1.0 = always healthy)", ("proxy",))
+PROXY_RESPONSE_SECONDS = Gauge("proxy_response_seconds", "Last proxy health-check response time", ("proxy",))
+PROXY_FAILED = Gauge("proxy_failed", "1 when the proxy is currently marked failed", ("proxy",))
+
+# ==== EXPOSITION ====
+
+REGISTRY = [
+    OTP_STAGE_SECONDS, OTP_USER_STATES, OTP_BACKGROUND_THREADS, OTP_CLAIMS_WAITING,
+    OTP_QUEUE_DEPTH, OTP_WORKERS_BUSY, OTP_QUEUE_WAIT_SECONDS, OTP_QUEUE_REJECTED,
+    OTP_SHARD_IN_FLIGHT, OTP_SHARD_RESTARTS,
+    ADMISSION_ACTIVE, ADMISSION_WAITING, ADMISSION_WAIT_SECONDS, ADMISSION_SHED,
+    NOTIFICATIONS_SENT,
+    MONGO_COMMAND_SECONDS, MONGO_COMMAND_FAILURES,
+    BOT_API_SECONDS, BOT_API_RATE_LIMITED, BOT_API_ERRORS,
+    PROXY_SCORE, PROXY_RESPONSE_SECONDS, PROXY_FAILED
+]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,480 @@
+"""
+Microbenchmarks for the pure functions that run on every update or reward.
+
+Each benchmark times one hot function with timeit, with its database lookups
+replaced by in-memory tables so only CPU time is measured:
+
+- otp.PHONE_REGEX matching (the handle_phone_number predicate)
+- otp.get_country_code prefix resolution
+- translations.get_text formatting from the compiled catalog
+- keyboards.keyboard_for, the prebuilt per-language reply markups
+- cap.handle_cap, served from the cached /cap page
+- cap.render_cap_message, the rebuild after a country changes
+- SessionManager._get_session_path
+- the require_channel_membership wrapper around a no-op handler
+- router.resolve_message for a command, a language button, a phone number and stray text
+
+Those timings replace get_user() with a free lambda, so they show what the
+per-update context costs but not the MongoDB reads it saves. The suite also
+counts get_user() calls per update: a few everyday updates go through telebot's
+own dispatch to the real handlers, with the Bot API faked and mongomock behind
+them. A count above the baseline's fails like a timing regression.
+
+Results are compared with microbench_baseline.json. Every benchmark is timed
+next to a fixed calibration loop over several rounds and stored as the median
+ratio between the two, so a baseline recorded on one machine still applies on
+a faster or slower (or busier) one.
+
+Usage:
+    python microbench.py                 # compare with the stored baseline
+    python microbench.py --save          # record a new baseline
+    python microbench.py --filter country --tolerance 0.2
+
+Needs mongomock (pip install mongomock) because importing db.py creates its
+indexes. Exits with status 1 when a benchmark is slower than its baseline by
+more than --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import importlib
+import platform
+import statistics
+import tempfile
+import contextlib
+from types import SimpleNamespace
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json")
+
+SAMPLE_PHONES = [
+    "+12025550143", "+447911123456", "+919876543210", "+8613800138000", "+5511987654321",
+    "+2348031234567", "+639171234567", "+966501234567", "+380501234567", "+9779841234567"
+]
+SAMPLE_TEXTS = SAMPLE_PHONES + ["12345", "/start", "English", "hello there", "+12 34", "LEADER-CARD-01"]
+
+BENCH_USER_ID = 1000
+
+# name -> message text or ("callback", data), sent by a registered, channel-verified user
+QUERY_COUNT_UPDATES = {
+    "start": "/start",
+    "language_button": "English",
+    "cap": "/cap",
+    "account": "/account",
+    "withdraw": "/withdraw",
+    "account_withdraw_button": ("callback", "account_withdraw")
+}
+
+def _bootstrap(workdir):
+    """Point the bot's modules at mongomock and a scratch sessions directory, then import them"""
+    os.environ["BOT_TOKEN"] = "123456:MICROBENCH"
+    os.environ["PROXYLIST"] = ""
+    os.environ["SESSIONS_DIR"] = os.path.join(workdir, "sessions")
+    os.environ["MONGO_URI"] = "mongodb://127.0.0.1:27017"
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("❌ microbench.py needs mongomock (pip install mongomock)")
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import db
+        import otp
+        import cap
+        import utils
+        import request_context
+        import translations
+        import keyboards
+        import telegram_otp
+        import router
+        import bot_init
+        for handler_module in ("start", "account", "withdraw"):
+            importlib.import_module(handler_module)  # Registers the routes resolved and dispatched below
+    return SimpleNamespace(db=db, otp=otp, cap=cap, utils=utils, request_context=request_context,
+                           translations=translations, keyboards=keyboards, telegram_otp=telegram_otp,
+                           router=router, bot=bot_init.bot)
+
+def _country_table(modules):
+    """country_code -> country document, built from cap.COUNTRY_INFO"""
+    table = {}
+    for code in modules.cap.COUNTRY_INFO:
+        if code[1:].isdigit():
+            table[code] = {"country_code": code, "price": 0.75, "claim_time": 600, "capacity": 100}
+    return table
+
+def _message(user_id=1000, text="/cap"):
+    return SimpleNamespace(
+        text=text,
+        chat=SimpleNamespace(id=user_id),
+        from_user=SimpleNamespace(id=user_id, first_name="Bench", username="bench")
+    )
+
+# ==== BENCHMARKS ====
+# Each returns (callable, operations per call)
+
+def bench_calibration(modules):
+    def run():
+        total = 0
+        for i in range(200):
+            total += len(str(i))
+        return total
+    return run, 1
+
+def bench_phone_regex(modules):
+    pattern = modules.otp.PHONE_REGEX
+
+    def run():
+        for text in SAMPLE_TEXTS:
+            text and pattern.match(text.strip())
+    return run, len(SAMPLE_TEXTS)
+
+def bench_get_country_code(modules):
+    table = _country_table(modules)
+    modules.otp.get_country_by_code = table.get
+
+    def run():
+        for phone in SAMPLE_PHONES:
+            modules.otp.get_country_code(phone)
+    return run, len(SAMPLE_PHONES)
+
+def bench_get_text(modules):
+    get_text = modules.translations.get_text
+    calls = [
+        ("account_received", "English", {"phone": "+12025550143", "price": 0.75, "claim_time": 600}),
+        ("account_received", "Arabic", {"phone": "+966501234567", "price": 1.5, "claim_time": 300}),
+        ("verification_success", "Chinese", {"phone_number": "+8613800138000", "reward": 0.5}),
+        ("withdrawal_options", "English", {"balance": 12.5}),
+        ("language_selection", "English", {}),
+        ("welcome_message", "Arabic", {})
+    ]
+
+    def run():
+        for key, lang, kwargs in calls:
+            get_text(key, lang, **kwargs)
+    return run, len(calls)
+
+def bench_keyboard_lookup(modules):
+    keyboards = modules.keyboards
+    langs = ["English", "Arabic", "Chinese", "French"]
+
+    def run():
+        for lang in langs:
+            keyboards.keyboard_for(keyboards.ACCOUNT, lang)
+    return run, len(langs)
+
+def bench_handle_cap(modules):
+    countries = list(_country_table(modules).values())
+    modules.cap.get_country_capacities = lambda: countries
+    modules.cap.cap_cache.invalidate()
+    modules.cap.bot = SimpleNamespace(send_message=lambda *args, **kwargs: None)
+    modules.request_context.get_user = lambda user_id: {"user_id": user_id, "channel_verified": True}
+    message = _message()
+
+    def run():
+        # Every update arrives as a new message, without a loaded context
+        message.__dict__.pop("_request_context", None)
+        modules.cap.handle_cap(message)
+    return run, 1
+
+def bench_render_cap(modules):
+    countries = list(_country_table(modules).values())
+
+    def run():
+        modules.cap.render_cap_message(countries)
+    return run, 1
+
+def bench_get_session_path(modules):
+    table = _country_table(modules)
+    modules.db.get_country_by_code = table.get
+    manager = modules.telegram_otp.SessionManager()
+
+    def run():
+        for phone in SAMPLE_PHONES:
+            manager._get_session_path(phone)
+    return run, len(SAMPLE_PHONES)
+
+def bench_membership_wrapper(modules):
+    modules.request_context.get_user = lambda user_id: {"user_id": user_id, "channel_verified": True}
+    handler = modules.utils.require_channel_membership(lambda message: None)
+    message = _message(text="+12025550143")
+
+    def run():
+        message.__dict__.pop("_request_context", None)
+        handler(message)
+    return run, 1
+
+def bench_route_message(modules):
+    modules.request_context.get_user = lambda user_id: {"user_id": user_id, "channel_verified": True}
+    messages = [_message(text=text) for text in ("/start", "English", "+12025550143", "hello")]
+    resolve = modules.router.router.resolve_message
+
+    def run():
+        for message in messages:
+            message.__dict__.pop("_request_context", None)
+            resolve(message)
+    return run, len(messages)
+
+BENCHMARKS = {
+    "calibration": bench_calibration,
+    "phone_regex": bench_phone_regex,
+    "get_country_code": bench_get_country_code,
+    "get_text": bench_get_text,
+    "keyboard_lookup": bench_keyboard_lookup,
+    "handle_cap": bench_handle_cap,
+    "render_cap": bench_render_cap,
+    "get_session_path": bench_get_session_path,
+    "membership_wrapper": bench_membership_wrapper,
+    "route_message": bench_route_message
+}
+
+# ==== QUERY COUNTS ====
+
+def _fake_bot_api(token, method_name, method='get', params=None, files=None):
+    """Answer every Bot API call with an object that parses as a Message, a User or a ChatMember"""
+    user = {"id": BENCH_USER_ID, "is_bot": False, "first_name": "Bench", "username": "bench"}
+    return dict(user, message_id=1, date=0, chat={"id": BENCH_USER_ID, "type": "private"},
+                user=user, status="member")
+
+def _update(update_id, content):
+    from telebot import types
+    user = {"id": BENCH_USER_ID, "is_bot": False, "first_name": "Bench", "username": "bench"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": BENCH_USER_ID, "type": "private"},
+               "from": user}
+    if isinstance(content, tuple):
+        _, data = content
+        return types.Update.de_json({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "microbench", "data": data, "message": message
+        }})
+    message["text"] = content
+    if content.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(content)}]
+    return types.Update.de_json({"update_id": update_id, "message": message})
+
+def count_get_user_calls(modules):
+    """get_user() calls made while each QUERY_COUNT_UPDATES update is dispatched"""
+    from telebot import apihelper
+    real_get_user = modules.db.get_user
+    calls = []
+
+    def counting_get_user(user_id):
+        calls.append(user_id)
+        return real_get_user(user_id)
+
+    # Every module holds its own `from db import get_user` reference
+    patched = [module for module in list(sys.modules.values())
+               if getattr(module, "__dict__", {}).get("get_user") is real_get_user]
+    real_make_request = apihelper._make_request
+    threaded = modules.bot.threaded
+    for module in patched:
+        module.get_user = counting_get_user
+    apihelper._make_request = _fake_bot_api
+    modules.bot.threaded = False  # Run handlers in this thread so their calls are counted
+    try:
+        modules.db.db.users.insert_one({
+            "user_id": BENCH_USER_ID, "name": "Bench", "username": "bench", "language": "English",
+            "balance": 12.5, "sent_accounts": 3, "channel_verified": True, "pending_phone": None
+        })
+        counts = {}
+        for update_id, (name, content) in enumerate(QUERY_COUNT_UPDATES.items(), start=1):
+            del calls[:]
+            modules.bot.process_new_updates([_update(update_id, content)])
+            counts[name] = len(calls)
+        return counts
+    finally:
+        for module in patched:
+            module.get_user = real_get_user
+        apihelper._make_request = real_make_request
+        modules.bot.threaded = threaded
+        modules.db.db.users.delete_one({"user_id": BENCH_USER_ID})
+
+def compare_counts(counts, baseline):
+    """Rows of (name, calls, baseline_calls, status); any increase is a regression"""
+    stored = (baseline or {}).get("get_user_calls", {})
+    rows = []
+    for name, calls in counts.items():
+        expected = stored.get(name)
+        if expected is None:
+            status = "new"
+        elif calls > expected:
+            status = "regressed"
+        elif calls < expected:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, calls, expected, status))
+    return rows
+
+def format_count_rows(rows):
+    icons = {"ok": "✅", "improved": "🚀", "regressed": "❌", "new": "🆕"}
+    lines = ["🔎 get_user() calls per update", f"   {'update':<26}{'calls':>8}{'baseline':>10}"]
+    for name, calls, expected, status in rows:
+        expected_text = str(expected) if expected is not None else "-"
+        lines.append(f"{icons[status]} {name:<26}{calls:>8}{expected_text:>10}")
+    return "\n".join(lines)
+
+# ==== RUNNER ====
+
+class Measurement:
+    def __init__(self, func, ops_per_call, target_time=0.02):
+        self.timer = timeit.Timer(func, timer=time.perf_counter)
+        self.ops_per_call = ops_per_call
+        # Calls per timing so that one timing takes about target_time
+        number, elapsed = self.timer.autorange()
+        self.number = max(1, int(number * target_time / max(elapsed, 1e-9)))
+
+    def best_ns(self, repeat=3):
+        """Best-of-`repeat` nanoseconds per operation"""
+        return min(self.timer.repeat(repeat=repeat, number=self.number)) / self.number / self.ops_per_call * 1e9
+
+def run_benchmarks(modules, names, rounds):
+    """
+    Median ns/op and median ratio to the calibration loop per benchmark. The
+    calibration is re-timed right before each benchmark in every round so
+    CPU contention affects both sides of the ratio alike.
+    """
+    calibration = Measurement(*bench_calibration(modules))
+    measurements = {name: Measurement(*BENCHMARKS[name](modules)) for name in names if name != "calibration"}
+    samples = {name: [] for name in measurements}
+    calibration_samples = []
+    for _ in range(rounds):
+        for name, measurement in measurements.items():
+            calibration_ns = calibration.best_ns()
+            calibration_samples.append(calibration_ns)
+            samples[name].append((measurement.best_ns(), calibration_ns))
+
+    results = {"calibration": {"ns_per_op": statistics.median(calibration_samples), "relative": 1.0}}
+    for name, pairs in samples.items():
+        results[name] = {
+            "ns_per_op": statistics.median(ns for ns, _ in pairs),
+            "relative": statistics.median(ns / calibration_ns for ns, calibration_ns in pairs)
+        }
+    return results
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(path, results, counts):
+    baseline = {
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ns": round(results["calibration"]["ns_per_op"], 2),
+        "benchmarks": {
+            name: {"ns_per_op": round(result["ns_per_op"], 2), "relative": round(result["relative"], 6)}
+            for name, result in results.items() if name != "calibration"
+        },
+        "get_user_calls": counts
+    }
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+    return baseline
+
+def compare(results, baseline, tolerance):
+    """
+    Rows of (name, ns, expected_ns, change, status). The change compares
+    calibration ratios; expected_ns is the baseline ratio at this run's speed.
+    """
+    calibration = results["calibration"]["ns_per_op"]
+    rows = []
+    for name, result in results.items():
+        if name == "calibration":
+            continue
+        ns = result["ns_per_op"]
+        entry = (baseline or {}).get("benchmarks", {}).get(name)
+        if not entry:
+            rows.append((name, ns, None, None, "new"))
+            continue
+        expected = entry["relative"] * calibration
+        change = result["relative"] / entry["relative"] - 1
+        if change > tolerance:
+            status = "regressed"
+        elif change < -tolerance:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, ns, expected, change, status))
+    return rows
+
+def format_rows(rows, calibration):
+    icons = {"ok": "✅", "improved": "🚀", "regressed": "❌", "new": "🆕"}
+    lines = [
+        f"⏱️ Calibration loop: {calibration:.0f} ns",
+        f"   {'benchmark':<22}{'ns/op':>12}{'baseline':>12}{'change':>10}"
+    ]
+    for name, ns, expected, change, status in rows:
+        expected_text = f"{expected:.1f}" if expected is not None else "-"
+        change_text = f"{change * 100:+.1f}%" if change is not None else "-"
+        lines.append(f"{icons[status]} {name:<22}{ns:>12.1f}{expected_text:>12}{change_text:>10}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for per-update hot functions")
+    parser.add_argument("--save", action="store_true", help="Record the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file")
+    # Shared CI runners swing by ~30% between runs; the regressions worth catching here are multiples
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown before failing (0.5 = 50%%)")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7, help="Timing rounds per benchmark (the median is kept)")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    names = ["calibration"] + [name for name in BENCHMARKS if name != "calibration" and args.filter in name]
+    with tempfile.TemporaryDirectory(prefix="otpbot-microbench-") as workdir:
+        modules = _bootstrap(workdir)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # Counted first: the timing benchmarks swap module attributes for in-memory stand-ins
+            counts = count_get_user_calls(modules)
+            results = run_benchmarks(modules, names, args.rounds)
+
+    if args.save:
+        if args.filter:
+            sys.exit("❌ --save records every benchmark; drop --filter")
+        save_baseline(args.baseline, results, counts)
+        print(format_rows(compare(results, None, args.tolerance), results["calibration"]["ns_per_op"]))
+        print(format_count_rows(compare_counts(counts, None)))
+        print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"⚠️ No baseline at {args.baseline}; run with --save to record one")
+    elif baseline.get("python") != platform.python_version():
+        print(f"⚠️ Baseline was recorded on Python {baseline.get('python')}, running {platform.python_version()}")
+
+    rows = compare(results, baseline, args.tolerance)
+    count_rows = compare_counts(counts, baseline)
+    print(format_rows(rows, results["calibration"]["ns_per_op"]))
+    print(format_count_rows(count_rows))
+
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump({
+                "calibration_ns": results["calibration"]["ns_per_op"],
+                "benchmarks": {name: {"ns_per_op": ns, "baseline_ns": expected, "change": change, "status": status}
+                               for name, ns, expected, change, status in rows},
+                "get_user_calls": {name: {"calls": calls, "baseline_calls": expected, "status": status}
+                                   for name, calls, expected, status in count_rows}
+            }, report_file, indent=2)
+
+    regressed = [row[0] for row in rows if row[4] == "regressed"]
+    more_reads = [row[0] for row in count_rows if row[3] == "regressed"]
+    if regressed:
+        print(f"❌ Slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+    if more_reads:
+        print(f"❌ More get_user() calls than baseline: {', '.join(more_reads)}")
+    if regressed or more_reads:
+        return 1
+    print("✅ No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
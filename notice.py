@@ -1,4 +1,5 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import get_user
 from utils import require_channel_membership
@@ -10,11 +11,13 @@ import logging
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# One line per recipient; DEBUG and sampled via LOG_SAMPLE_RATES
+broadcast_logger = logging.getLogger("notice.broadcast")
 
 client = MongoClient(MONGO_URI)
 db = client['telegram_id_sell']  # Fixed database name to match db.py
 
-@bot.message_handler(commands=['notice'])
+@router.command('notice')
 @require_channel_membership
 def handle_notice(message):
     # Check if user is admin
@@ -49,7 +52,7 @@ def handle_notice(message):
             try:
                 bot.send_message(user['user_id'], broadcast_message)
                 successful_sends += 1
-                logger.info(f"Successfully sent to user {user['user_id']}")
+                broadcast_logger.debug("Successfully sent to user %s", user['user_id'])
             except Exception as e:
                 failed_sends += 1
                 error_type = type(e).__name__
@@ -67,7 +70,7 @@ def handle_notice(message):
                 else:
                     error_details.append(f"User {user['user_id']}: {error_type} - {error_msg}")
                 
-                logger.warning(f"Failed to send to user {user['user_id']}: {error_type} - {error_msg}")
+                logger.warning("Failed to send to user %s: %s - %s", user['user_id'], error_type, error_msg)
             
             # Update status every 10 users (more frequent updates)
             if i % 10 == 0 or i == total_users:
@@ -115,7 +118,7 @@ def handle_notice(message):
         logger.error(f"Error during broadcast: {str(e)}")
         bot.reply_to(message, f"❌ Error during broadcast: {str(e)}")
 
-@bot.message_handler(commands=['cleanusers'])
+@router.command('cleanusers')
 @require_channel_membership
 def handle_clean_users(message):
     """Identify and optionally remove users who have blocked the bot"""
@@ -214,7 +217,7 @@ def handle_clean_users(message):
         logger.error(f"Error in clean_users: {str(e)}")
         bot.reply_to(message, f"❌ Error checking users: {str(e)}")
 
-@bot.message_handler(commands=['removeblocked'])
+@router.command('removeblocked')
 @require_channel_membership
 def handle_remove_blocked(message):
     """Remove users who have blocked the bot from the database"""
@@ -0,0 +1,208 @@
+"""
+Outbound queue for user notifications.
+
+Payouts and rejections write their notifications to the `notification_outbox`
+collection in the same transaction as the balance changes, so a user is told
+exactly when their money moved and nothing is lost if the bot restarts halfway
+through a card with hundreds of withdrawals. Entries store a template name and
+its parameters; a worker renders them in the user's language and sends them
+at NOTIFICATION_RATE_PER_SECOND, honouring Telegram's retry_after on 429s.
+Users who blocked the bot are marked failed instead of retried. Entries left in
+'sending' by a worker that died (here or on another replica) are requeued once
+their claim is older than any batch takes to send.
+"""
+
+import time
+import uuid
+import threading
+import telebot
+import metrics
+from datetime import datetime
+from bot_init import bot
+from config import NOTIFICATION_RATE_PER_SECOND, NOTIFICATION_MAX_ATTEMPTS
+from db import (
+    enqueue_notifications, claim_notifications, complete_notification, retry_notification,
+    fail_notification, requeue_stale_notifications, get_next_notification_time,
+    get_notification_outbox_stats
+)
+
+# template -> (parse_mode, {language: text}); texts are str.format()ed with the entry's params
+NOTIFICATION_TEMPLATES = {
+    "leader_card_paid": (None, {
+        'English': "✅ Your withdrawal of {amount}$ with leader card '{card_name}' has been approved and completed. Thank you!",
+        'Arabic': "✅ تم الموافقة على سحبك بمبلغ {amount}$ باستخدام بطاقة القائد '{card_name}' وتمت العملية بنجاح. شكرًا لك!",
+        'Chinese': "✅ 您使用领队卡 '{card_name}' 的 {amount}$ 提现已批准并完成。谢谢！"
+    }),
+    "withdrawal_rejected": ("Markdown", {
+        'English': (
+            "❌ *Withdrawal Rejected* ❌\n\n"
+            "💰 **Amount**: ${amount}\n"
+            "📋 **Reason**: {reason}\n"
+            "📉 **Balance deducted**: ${amount}\n\n"
+            "💬 Contact support if you have questions about this rejection.\n"
+            "🔄 You can make a new withdrawal request if eligible."
+        )
+    })
+}
+
+# Bot API errors that will not go away on retry (blocked, deactivated, chat not found)
+PERMANENT_ERROR_CODES = {400, 403}
+
+def render_notification(notification):
+    """(text, parse_mode) for an outbox entry"""
+    parse_mode, texts = NOTIFICATION_TEMPLATES[notification["template"]]
+    text = texts.get(notification.get("language"), texts['English'])
+    return text.format(**notification.get("params", {})), parse_mode
+
+class NotificationOutbox:
+    CLAIM_SIZE = 50
+
+    def __init__(self, rate_per_second=NOTIFICATION_RATE_PER_SECOND, max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+                 base_backoff_seconds=5, max_backoff_seconds=600):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_idle_seconds = 60  # Re-check the queue at least this often
+        self.stale_claim_seconds = 600  # Longer than a claimed batch takes to send; older claims belong to a dead worker
+        self.stale_check_seconds = 60
+        self.last_stale_check = None
+        self.worker = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending_signal = False
+        self.next_send_at = 0.0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the sender (safe to call more than once)"""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+
+        self.worker = threading.Thread(target=self._worker_loop, daemon=True, name="NotificationSender")
+        self.worker.start()
+        print(f"📨 Notification outbox started ({1 / self.interval if self.interval else 'unlimited'} msg/s)")
+
+    def stop(self):
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify_all()
+        if self.worker:
+            self.worker.join(timeout=5)
+            self.worker = None
+
+    def notify(self):
+        """Wake the sender because new notifications were committed"""
+        with self.wakeup:
+            self.pending_signal = True
+            self.wakeup.notify_all()
+
+    def enqueue(self, notifications):
+        """Queue notifications outside a transaction and wake the sender"""
+        queued = enqueue_notifications(notifications)
+        if queued:
+            self.notify()
+        return queued
+
+    def _requeue_stale_claims(self):
+        """Return notifications claimed by a worker that died mid-batch to the queue, at most once per stale_check_seconds"""
+        now = time.monotonic()
+        if self.last_stale_check is not None and now - self.last_stale_check < self.stale_check_seconds:
+            return
+        self.last_stale_check = now
+        requeued = requeue_stale_notifications(self.stale_claim_seconds)
+        if requeued:
+            print(f"🔄 Requeued {requeued} interrupted notifications")
+
+    def _wait_for_work(self):
+        timeout = self.max_idle_seconds
+        next_due = get_next_notification_time()
+        if next_due:
+            timeout = min(timeout, max(0.0, (next_due - datetime.utcnow()).total_seconds()))
+
+        with self.wakeup:
+            if not self.pending_signal and self.running and timeout > 0:
+                self.wakeup.wait(timeout)
+            self.pending_signal = False
+
+    def _pace(self):
+        """Sleep until the next send slot"""
+        delay = self.next_send_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_send_at = max(self.next_send_at, time.monotonic()) + self.interval
+
+    def _worker_loop(self):
+        worker_id = f"NotificationSender-{uuid.uuid4().hex[:8]}"
+        while self.running:
+            try:
+                self._requeue_stale_claims()
+                batch = claim_notifications(worker_id, self.CLAIM_SIZE)
+                if not batch:
+                    self._wait_for_work()
+                    continue
+                for notification in batch:
+                    self._pace()
+                    self._send(notification)
+            except Exception as e:
+                print(f"❌ Error in notification worker {worker_id}: {e}")
+                time.sleep(self.base_backoff_seconds)
+
+    def _send(self, notification):
+        template = notification.get("template", "unknown")
+        try:
+            text, parse_mode = render_notification(notification)
+        except Exception as e:
+            fail_notification(notification["_id"], notification["claimed_by"], f"Could not render: {e}")
+            self.failed += 1
+            metrics.NOTIFICATIONS_SENT.inc(template=template, result="failed")
+            return
+
+        try:
+            bot.send_message(notification["user_id"], text, parse_mode=parse_mode)
+            complete_notification(notification["_id"], notification["claimed_by"])
+            self.sent += 1
+            metrics.NOTIFICATIONS_SENT.inc(template=template, result="sent")
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after') or self.base_backoff_seconds
+                # Hold every send, not just this one, until Telegram lets us back in
+                self.next_send_at = time.monotonic() + retry_after
+                retry_notification(notification["_id"], notification["claimed_by"], retry_after, str(e), self.max_attempts, count_attempt=False)
+                metrics.NOTIFICATIONS_SENT.inc(template=template, result="rate_limited")
+            elif e.error_code in PERMANENT_ERROR_CODES:
+                fail_notification(notification["_id"], notification["claimed_by"], str(e))
+                self.failed += 1
+                metrics.NOTIFICATIONS_SENT.inc(template=template, result="failed")
+            else:
+                self._retry(notification, e)
+        except Exception as e:
+            self._retry(notification, e)
+
+    def _retry(self, notification, error):
+        attempts = notification.get("attempts", 0)
+        delay = min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** attempts))
+        retry_notification(notification["_id"], notification["claimed_by"], delay, str(error), self.max_attempts)
+        metrics.NOTIFICATIONS_SENT.inc(template=notification.get("template", "unknown"), result="retried")
+        print(f"⚠️ Notification to {notification['user_id']} failed, retrying in {delay}s: {error}")
+
+    def get_stats(self):
+        return {
+            "running": self.running,
+            "sent": self.sent,
+            "failed": self.failed,
+            "queue": get_notification_outbox_stats()
+        }
+
+notification_outbox = NotificationOutbox()
+
+def start_notification_outbox():
+    """Start the notification sender (drains anything queued before a restart)"""
+    notification_outbox.start()
+
+def stop_notification_outbox():
+    notification_outbox.stop()
@@ -1,8 +1,9 @@
 from db import remove_country_by_code
 from config import ADMIN_IDS
 from bot_init import bot
+from router import router
 
-@bot.message_handler(commands=['numberd'])
+@router.command('numberd')
 def handle_numberd(message):
     user_id = message.from_user.id
     if user_id not in ADMIN_IDS:
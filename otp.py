@@ -31,27 +31,40 @@ import asyncio
 import threading
 import time
 import os
+from types import SimpleNamespace
 from db import (
-    get_user, update_user, get_country_by_code,
+    update_user, get_country_by_code,
     add_pending_number, update_pending_number_status,
     check_number_used, mark_number_used, unmark_number_used,
     update_user_balance, add_transaction_log,
     mark_background_verification_start, auto_cancel_background_verification_numbers,
-    get_auto_cancellation_stats
+    get_auto_cancellation_stats, get_pending_number_status, settle_pending_number
 )
 from bot_init import bot
+from router import router
 from utils import require_channel_membership
+from request_context import context_for, get_context_user, get_user_language
 from telegram_otp import session_manager, get_logged_in_device_count
 from config import SESSIONS_DIR
-from translations import get_text, TRANSLATIONS
+from translations import get_text
 from session_sender import send_session_delayed
+import metrics
+from tracing import tracer
+from otp_executor import otp_executor
+from otp_shards import otp_shards
+from admission import admission_controller, AdmissionRejected
+from state_store import StateMap
+from leader_election import leader_election
 
 PHONE_REGEX = re.compile(r'^\+\d{1,4}\d{6,14}$')
+CANCEL_WORDS = {'/cancel', 'cancel', 'إلغاء', '取消'}
 otp_loop = asyncio.new_event_loop()
 
 # Background thread tracking and cancellation
 background_threads = {}  # user_id -> {"thread": thread_obj, "cancel_event": event, "phone": phone_number}
 thread_lock = threading.Lock()
+# What each claim wait needs to run again after a restart (the threads themselves stay local)
+claim_states = StateMap("claims", 24 * 3600)
 
 # Constants for overflow prevention
 MAX_BACKGROUND_THREADS = 100  # Maximum number of concurrent background threads
@@ -90,9 +103,32 @@ def check_thread_limit():
             return len(background_threads) < MAX_BACKGROUND_THREADS
     return True
 
-def run_async(coro):
+metrics.OTP_BACKGROUND_THREADS.set_function(lambda: len(background_threads))
+metrics.OTP_USER_STATES.set_function(lambda: len(session_manager.user_states))
+
+def run_async(coro, timeout=None):
+    start_otp_workers()
     future = asyncio.run_coroutine_threadsafe(coro, otp_loop)
-    return future.result()
+    return future.result(timeout)
+
+def call_session_manager(user_id, method, *args, timeout=None):
+    """
+    Run a SessionManager method for user_id where the user's live client is:
+    in the OTP worker process owning the user, or on otp_loop here.
+    """
+    if otp_shards.enabled:
+        start_otp_workers()
+        return otp_shards.call(user_id, method, user_id, *args, timeout=timeout)
+    result = getattr(session_manager, method)(user_id, *args)
+    if asyncio.iscoroutine(result):
+        return run_async(result, timeout)
+    return result
+
+def count_logged_in_devices(user_id, phone_number):
+    """get_logged_in_device_count, run in the user's OTP worker process when sharded"""
+    if otp_shards.enabled:
+        return otp_shards.call(user_id, "get_logged_in_device_count", phone_number)
+    return get_logged_in_device_count(phone_number)
 
 def start_otp_loop():
     asyncio.set_event_loop(otp_loop)
@@ -115,16 +151,43 @@ def cancel_background_verification(user_id):
 
 def cleanup_background_thread(user_id):
     """Clean up background thread tracking for a user"""
+    phone_number = None
     with thread_lock:
         if user_id in background_threads:
             thread_info = background_threads.pop(user_id)
             phone_number = thread_info.get("phone")
             print(f"🗑️ Cleaned up background thread tracking for {phone_number} (User: {user_id})")
-            return phone_number
-    return None
+    # After the in-process entry is gone: a MongoDB failure here must not leak it
+    try:
+        del claim_states[user_id]
+    except Exception as e:
+        print(f"❌ Failed to delete claim state for user {user_id}: {e}")
+    return phone_number
 
-otp_thread = threading.Thread(target=start_otp_loop, daemon=True)
-otp_thread.start()
+def resume_claim_waits():
+    """Take over claim waits whose process is gone, e.g. after a restart (leader task, see main())"""
+    resumed = 0
+    for user_id, claim in claim_states.items():
+        with thread_lock:
+            if user_id in background_threads:
+                continue
+        # Only take over once the owner's lease is confirmed gone; unknown counts as alive
+        if leader_election.is_instance_alive(claim.get("owner")) is not False:
+            continue
+        status = get_pending_number_status(claim["pending_id"])
+        if status is None:
+            continue  # Unreadable (or gone): try again next round, the claim's TTL ends it either way
+        # Cancelled, auto-cancelled or settled while nobody was waiting on it
+        if status != "waiting":
+            del claim_states[user_id]
+            continue
+        claim["owner"] = leader_election.instance_id
+        claim_states[user_id] = claim
+        start_claim_wait(user_id, claim)
+        resumed += 1
+    if resumed:
+        print(f"♻️ Resumed {resumed} claim waits whose process had stopped")
+    return resumed
 
 # Periodic cleanup thread to prevent memory overflow
 def periodic_cleanup():
@@ -138,13 +201,14 @@ def periodic_cleanup():
             if cleaned_threads > 0:
                 print(f"🧹 Periodic cleanup: removed {cleaned_threads} old background threads")
             
-            # Cleanup old user states in session manager
-            try:
-                cleaned_states = session_manager.cleanup_old_user_states()
-                if cleaned_states > 0:
-                    print(f"🧹 Periodic cleanup: removed {cleaned_states} old user states")
-            except Exception as e:
-                print(f"❌ Error during user state cleanup: {e}")
+            # Cleanup old user states in session manager (shared by every replica, so only the leader does it)
+            if leader_election.is_leader():
+                try:
+                    cleaned_states = session_manager.cleanup_old_user_states()
+                    if cleaned_states > 0:
+                        print(f"🧹 Periodic cleanup: removed {cleaned_states} old user states")
+                except Exception as e:
+                    print(f"❌ Error during user state cleanup: {e}")
             
             # Report current usage
             with thread_lock:
@@ -157,9 +221,26 @@ def periodic_cleanup():
         except Exception as e:
             print(f"❌ Error in periodic cleanup: {e}")
 
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
-print("🧹 Started periodic cleanup thread for overflow prevention")
+otp_thread = None
+cleanup_thread = None
+workers_lock = threading.Lock()
+
+def start_otp_workers():
+    """Start the OTP event loop and periodic cleanup threads (main() at boot, otherwise on first use)"""
+    global otp_thread, cleanup_thread
+    if otp_thread is not None:
+        return
+    with workers_lock:
+        if otp_thread is not None:
+            return
+        cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
+        cleanup_thread.start()
+        print("🧹 Started periodic cleanup thread for overflow prevention")
+        thread = threading.Thread(target=start_otp_loop, daemon=True)
+        thread.start()
+        otp_thread = thread
+        otp_executor.start()
+        otp_shards.start()
 
 def get_country_code(phone_number):
     for code_length in [4, 3, 2, 1]:
@@ -168,14 +249,9 @@ def get_country_code(phone_number):
             return code
     return None
 
-def get_user_language(user_id):
-    user = get_user(user_id)
-    if user and user.get('language'):
-        return user['language']
-    return 'English'
-
-@bot.message_handler(func=lambda m: m.text and PHONE_REGEX.match(m.text.strip()))
+@router.pattern(PHONE_REGEX)
 @require_channel_membership
+@tracer.phase("handle_phone_number")
 def handle_phone_number(message):
     try:
         user_id = message.from_user.id
@@ -186,52 +262,61 @@ def handle_phone_number(message):
         if cancelled:
             print(f"🛑 Cancelled previous verification for {old_phone} to start new one for {phone_number}")
 
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         # Show progress message immediately as reply to user's number
-        progress_msgs = {
-            'English': '⏳ Processing your number, please wait...!',
-            'Arabic': '⏳ جارٍ معالجة رقمك، يرجى الانتظار...!',
-            'Chinese': '⏳ 正在处理您的号码，请稍候...!'
-        }
-        progress_msg = bot.reply_to(message, progress_msgs.get(lang, progress_msgs['English']))
+        progress_msg = bot.reply_to(message, get_text('processing_number', lang))
 
         # Bot checks: Valid format, country code exists, capacity, not already used
         if check_number_used(phone_number):
-            bot.reply_to(message, TRANSLATIONS['number_used'][lang])
+            tracer.current_span()["outcome"] = "number_used"
+            bot.reply_to(message, get_text('number_used', lang))
             return
 
         country_code = get_country_code(phone_number)
         if not country_code:
-            bot.reply_to(message, TRANSLATIONS['invalid_country_code'][lang])
+            tracer.current_span()["outcome"] = "invalid_country_code"
+            bot.reply_to(message, get_text('invalid_country_code', lang))
             return
 
         country = get_country_by_code(country_code)
         if not country:
-            bot.reply_to(message, TRANSLATIONS['country_not_supported'][lang])
+            tracer.current_span()["outcome"] = "country_not_supported"
+            bot.reply_to(message, get_text('country_not_supported', lang))
             return
 
         if country.get("capacity", 0) <= 0:
-            bot.reply_to(message, TRANSLATIONS['no_capacity'][lang])
+            tracer.current_span()["outcome"] = "no_capacity"
+            bot.reply_to(message, get_text('no_capacity', lang))
             return
 
+        tracer.begin(user_id, phone_number, country_code)
+
         # Send OTP via Telethon - Fixed version
         try:
             print(f"🚀 Starting OTP verification for {phone_number}")
-            status, result = run_async(session_manager.start_verification(user_id, phone_number))
+            with tracer.span("start_verification", user_id) as span:
+                started = time.perf_counter()
+                try:
+                    with admission_controller.admit("send_code", country_code):
+                        status, result = call_session_manager(user_id, "start_verification", phone_number)
+                except AdmissionRejected as rejected:
+                    # Shed before anything about the number was stored; the user can simply resend it
+                    status, result = f"shed_{rejected.reason}", rejected.reason
+                metrics.OTP_STAGE_SECONDS.observe_since(started, stage="send_code", outcome=status)
+                span["outcome"] = status
+                span["path"] = session_manager.user_states.get(user_id, {}).get("connection_path")
+            tracer.annotate(user_id, path=span["path"])
+            tracer.current_span()["outcome"] = status
             
             if status == "code_sent":
                 # Edit the progress message with OTP prompt including the phone number
-                otp_prompt_msgs = {
-                    'English': f"🔢Enter the code sent to {phone_number}\n\n/cancel",
-                                         'Arabic': f"🔢أدخل الرمز المرسل إلى {phone_number}\n\n/cancel",
-                                         'Chinese': f"🔢输入发送到 {phone_number} 的验证码\n\n/cancel"
-                }
+                otp_prompt = get_text('otp_prompt', lang, phone=phone_number)
                 
                 try:
                     # Edit the progress message (which is already a reply) with OTP prompt
                     bot.edit_message_text(
-                        otp_prompt_msgs.get(lang, otp_prompt_msgs['English']),
+                        otp_prompt,
                         user_id,
                         progress_msg.message_id,
                         parse_mode="Markdown"
@@ -246,7 +331,7 @@ def handle_phone_number(message):
                     # Fallback: send new reply message if edit fails
                     reply = bot.reply_to(
                         message,
-                        otp_prompt_msgs.get(lang, otp_prompt_msgs['English']),
+                        otp_prompt,
                         parse_mode="Markdown"
                     )
                     update_user(user_id, {
@@ -254,6 +339,12 @@ def handle_phone_number(message):
                         "otp_msg_id": reply.message_id,
                         "country_code": country_code
                     })
+            elif status.startswith("shed_"):
+                busy_key = 'country_rate_limited' if result == "country_rate" else 'send_code_busy'
+                try:
+                    bot.edit_message_text(get_text(busy_key, lang), user_id, progress_msg.message_id)
+                except Exception:
+                    bot.reply_to(message, get_text(busy_key, lang))
             else:
                 # Edit progress message with error
                 error_msg = f"❌ Error: {result}"
@@ -285,7 +376,7 @@ def handle_otp_reply_disabled(message):
     try:
         user_id = message.from_user.id
         otp_code = message.text.strip()
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         
         # Check if user wants to cancel
@@ -296,22 +387,24 @@ def handle_otp_reply_disabled(message):
             return
         
         if not user.get("pending_phone"):
-            bot.reply_to(message, TRANSLATIONS['no_active_verification'][lang])
+            bot.reply_to(message, get_text('no_active_verification', lang))
             return
 
-        # 🚀 SPEED OPTIMIZATION: Show immediate waiting message
-        waiting_messages = {
-            'English': "⏳ Verifying OTP code...\n\nPlease wait a moment while we process your verification.",
-            'Arabic': "⏳ جارٍ التحقق من رمز OTP...\n\nيرجى الانتظار لحظة بينما نقوم بمعالجة التحقق الخاص بك.",
-            'Chinese': "⏳ 正在验证OTP验证码...\n\n请稍等，我们正在处理您的验证。"
-        }
+        if not otp_executor.has_capacity():
+            bot.reply_to(message, get_text('verification_busy', lang))
+            return
         
-        waiting_msg = bot.reply_to(message, waiting_messages.get(lang, waiting_messages['English']))
+        waiting_msg = bot.reply_to(message, get_text('verifying_code', lang))
 
         # Bot verifies the OTP in the background
         def verify_otp_async():
             try:
-                status, result = run_async(session_manager.verify_code(user_id, otp_code))
+                with tracer.span("verify_code", user_id) as span:
+                    started = time.perf_counter()
+                    with admission_controller.admit("verify"):
+                        status, result = call_session_manager(user_id, "verify_code", otp_code)
+                    metrics.OTP_STAGE_SECONDS.observe_since(started, stage="verify_code", outcome=status)
+                    span["outcome"] = status
                 
                 # Delete the waiting message
                 try:
@@ -329,42 +422,25 @@ def handle_otp_reply_disabled(message):
                         
                 elif status == "need_password":
                     # 2FA required - update state but keep the session data
-                    if user_id in session_manager.user_states:
-                        session_manager.user_states[user_id]['state'] = 'awaiting_password'
-                    else:
-                        # This shouldn't happen, but create a basic state as fallback
-                        session_manager.user_states[user_id] = {'state': 'awaiting_password'}
+                    session_manager.mark_awaiting_password(user_id)
                     
-                    password_messages = {
-                        'English': "🔐 Two-factor authentication required.\n\nPlease enter your 2FA password:",
-                        'Arabic': "🔐 مطلوب التحقق بخطوتين.\n\nيرجى إدخال كلمة مرور 2FA الخاصة بك:",
-                        'Chinese': "🔐 需要双重验证。\n\n请输入您的2FA密码："
-                    }
-                    bot.send_message(user_id, password_messages.get(lang, password_messages['English']))
+                    bot.send_message(user_id, get_text('password_required', lang))
                 elif status == "code_invalid":
-                    invalid_messages = {
-                        'English': "❌ Invalid OTP code. Please check and try again.\n\nType /cancel to abort.",
-                        'Arabic': "❌ رمز OTP غير صحيح. يرجى التحقق والمحاولة مرة أخرى.\n\nاكتب /cancel للإلغاء.",
-                        'Chinese': "❌ OTP验证码无效。请检查后重试。\n\n输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, invalid_messages.get(lang, invalid_messages['English']))
+                    bot.send_message(user_id, get_text('code_invalid', lang))
                     
                 elif status == "code_expired":
-                    expired_messages = {
-                        'English': "⏰ OTP code has expired. Please request a new code.\n\nType /cancel to abort.",
-                        'Arabic': "⏰ انتهت صلاحية رمز OTP. يرجى طلب رمز جديد.\n\nاكتب /cancel للإلغاء.",
-                        'Chinese': "⏰ OTP验证码已过期。请申请新的验证码。\n\n输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, expired_messages.get(lang, expired_messages['English']))
+                    bot.send_message(user_id, get_text('code_expired', lang))
                     
                 else:
                     print(f"❌ Unexpected verification status: {status} for user {user_id}")
-                    error_messages = {
-                        'English': f"❌ Verification failed: {result}\n\nPlease try again or type /cancel to abort.",
-                        'Arabic': f"❌ فشل التحقق: {result}\n\nيرجى المحاولة مرة أخرى أو اكتب /cancel للإلغاء.",
-                        'Chinese': f"❌ 验证失败: {result}\n\n请重试或输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, error_messages.get(lang, error_messages['English']))
+                    bot.send_message(user_id, get_text('code_verification_failed', lang, reason=result))
+            except AdmissionRejected:
+                # No slot within ADMISSION_MAX_WAIT_SECONDS; the code was not used, so it can be sent again
+                try:
+                    bot.delete_message(user_id, waiting_msg.message_id)
+                except:
+                    pass
+                bot.reply_to(message, get_text('verification_busy', lang))
             except Exception as e:
                 try:
                     bot.delete_message(user_id, waiting_msg.message_id)
@@ -372,28 +448,26 @@ def handle_otp_reply_disabled(message):
                     pass
                 bot.reply_to(message, f"⚠️ Error: {str(e)}")
         
-        # Run verification in background thread for faster response
-        thread = threading.Thread(target=verify_otp_async, daemon=True)
-        thread.start()
+        # Verify on a bounded OTP worker; the queue can fill up between the check above and here
+        if not otp_executor.submit("verify_code", verify_otp_async):
+            try:
+                bot.delete_message(user_id, waiting_msg.message_id)
+            except:
+                pass
+            bot.reply_to(message, get_text('verification_busy', lang))
         
     except Exception as e:
         bot.reply_to(message, f"⚠️ Error: {str(e)}")
 
-# Handle OTP codes sent as regular messages (improved to handle all OTP scenarios)
-@bot.message_handler(func=lambda m: (
-    m.text and 
-    m.text.strip().isdigit() and  # Only digits
-    len(m.text.strip()) >= 4 and len(m.text.strip()) <= 8 and  # Reasonable OTP length
-    (get_user(m.from_user.id) or {}).get("pending_phone") and  # User has pending verification
-    session_manager.user_states.get(m.from_user.id, {}).get('state') != 'awaiting_password'  # Not waiting for 2FA password
-))
+# Handle OTP codes sent as regular messages (routed from handle_pending_verification_text)
 @require_channel_membership
+@tracer.phase("handle_otp_direct")
 def handle_otp_direct(message):
     """Handle OTP codes sent directly without replying to the prompt"""
     try:
         user_id = message.from_user.id
         otp_code = message.text.strip()
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         
         # Check if user wants to cancel
@@ -404,22 +478,24 @@ def handle_otp_direct(message):
             return
         
         if not user.get("pending_phone"):
-            bot.reply_to(message, TRANSLATIONS['no_active_verification'][lang])
+            bot.reply_to(message, get_text('no_active_verification', lang))
             return
 
-        # 🚀 SPEED OPTIMIZATION: Show immediate waiting message
-        waiting_messages = {
-            'English': "⏳ Verifying OTP code...\n\nPlease wait a moment while we process your verification.",
-            'Arabic': "⏳ جارٍ التحقق من رمز OTP...\n\nيرجى الانتظار لحظة بينما نقوم بمعالجة التحقق الخاص بك.",
-            'Chinese': "⏳ 正在验证OTP验证码...\n\n请稍等，我们正在处理您的验证。"
-        }
+        if not otp_executor.has_capacity():
+            bot.reply_to(message, get_text('verification_busy', lang))
+            return
         
-        waiting_msg = bot.reply_to(message, waiting_messages.get(lang, waiting_messages['English']))
+        waiting_msg = bot.reply_to(message, get_text('verifying_code', lang))
 
         # Bot verifies the OTP in the background
         def verify_otp_async():
             try:
-                status, result = run_async(session_manager.verify_code(user_id, otp_code))
+                with tracer.span("verify_code", user_id) as span:
+                    started = time.perf_counter()
+                    with admission_controller.admit("verify"):
+                        status, result = call_session_manager(user_id, "verify_code", otp_code)
+                    metrics.OTP_STAGE_SECONDS.observe_since(started, stage="verify_code", outcome=status)
+                    span["outcome"] = status
                 
                 # Delete the waiting message
                 try:
@@ -437,44 +513,27 @@ def handle_otp_direct(message):
                     
                 elif status == "need_password":
                     # 2FA required - update state but keep the session data
-                    if user_id in session_manager.user_states:
-                        session_manager.user_states[user_id]['state'] = 'awaiting_password'
-                    else:
-                        # This shouldn't happen, but create a basic state as fallback
-                        session_manager.user_states[user_id] = {'state': 'awaiting_password'}
+                    session_manager.mark_awaiting_password(user_id)
                     
-                    password_messages = {
-                        'English': "🔐 Two-factor authentication required.\n\nPlease enter your 2FA password:",
-                        'Arabic': "🔐 مطلوب التحقق بخطوتين.\n\nيرجى إدخال كلمة مرور 2FA الخاصة بك:",
-                        'Chinese': "🔐 需要双重验证。\n\n请输入您的2FA密码："
-                    }
-                    bot.send_message(user_id, password_messages.get(lang, password_messages['English']))
+                    bot.send_message(user_id, get_text('password_required', lang))
                     
                 elif status == "code_invalid":
-                    invalid_messages = {
-                        'English': "❌ Invalid OTP code. Please check and try again.\n\nType /cancel to abort.",
-                        'Arabic': "❌ رمز OTP غير صحيح. يرجى التحقق والمحاولة مرة أخرى.\n\nاكتب /cancel للإلغاء.",
-                        'Chinese': "❌ OTP验证码无效。请检查后重试。\n\n输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, invalid_messages.get(lang, invalid_messages['English']))
+                    bot.send_message(user_id, get_text('code_invalid', lang))
                     
                 elif status == "code_expired":
-                    expired_messages = {
-                        'English': "⏰ OTP code has expired. Please request a new code.\n\nType /cancel to abort.",
-                        'Arabic': "⏰ انتهت صلاحية رمز OTP. يرجى طلب رمز جديد.\n\nاكتب /cancel للإلغاء.",
-                        'Chinese': "⏰ OTP验证码已过期。请申请新的验证码。\n\n输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, expired_messages.get(lang, expired_messages['English']))
+                    bot.send_message(user_id, get_text('code_expired', lang))
                     
                 else:
                     print(f"❌ Unexpected verification status: {status} for user {user_id}")
-                    error_messages = {
-                        'English': f"❌ Verification failed: {result}\n\nPlease try again or type /cancel to abort.",
-                        'Arabic': f"❌ فشل التحقق: {result}\n\nيرجى المحاولة مرة أخرى أو اكتب /cancel للإلغاء.",
-                        'Chinese': f"❌ 验证失败: {result}\n\n请重试或输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, error_messages.get(lang, error_messages['English']))
+                    bot.send_message(user_id, get_text('code_verification_failed', lang, reason=result))
                     
+            except AdmissionRejected:
+                # No slot within ADMISSION_MAX_WAIT_SECONDS; the code was not used, so it can be sent again
+                try:
+                    bot.delete_message(user_id, waiting_msg.message_id)
+                except:
+                    pass
+                bot.reply_to(message, get_text('verification_busy', lang))
             except Exception as e:
                 try:
                     bot.delete_message(user_id, waiting_msg.message_id)
@@ -482,18 +541,18 @@ def handle_otp_direct(message):
                     pass
                 bot.reply_to(message, f"⚠️ Error: {str(e)}")
         
-        # Run verification in background thread for faster response
-        thread = threading.Thread(target=verify_otp_async, daemon=True)
-        thread.start()
+        # Verify on a bounded OTP worker; the queue can fill up between the check above and here
+        if not otp_executor.submit("verify_code", verify_otp_async):
+            try:
+                bot.delete_message(user_id, waiting_msg.message_id)
+            except:
+                pass
+            bot.reply_to(message, get_text('verification_busy', lang))
         
     except Exception as e:
         bot.reply_to(message, f"⚠️ Error: {str(e)}")
 
 # Enhanced cancel handler that works during any verification phase
-@bot.message_handler(func=lambda m: (
-    m.text and m.text.strip().lower() in ['/cancel', 'cancel', 'إلغاء', '取消'] and
-    (get_user(m.from_user.id) or {}).get("pending_phone")
-))
 @require_channel_membership
 def handle_cancel_during_verification(message):
     """Handle cancel command during any phase of verification with proper status checking"""
@@ -504,10 +563,8 @@ def handle_cancel_during_verification(message):
         print(f"Error in cancel during verification: {e}")
         bot.reply_to(message, "⚠️ Error processing cancel request. Please try again.")
 
-@bot.message_handler(func=lambda m: (
-    m.text and  # Has text content
+@router.state("awaiting_password", lambda m: (
     session_manager.user_states.get(m.from_user.id, {}).get('state') == 'awaiting_password' and  # Waiting for 2FA password
-    not m.text.strip().startswith('/') and  # Not a command
     len(m.text.strip()) > 0  # Not empty
 ))
 @require_channel_membership
@@ -523,17 +580,14 @@ def handle_2fa_password(message):
             handle_cancel(message)
             return
         
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         
-        # 🚀 SPEED OPTIMIZATION: Show immediate waiting message for 2FA
-        waiting_2fa_messages = {
-            'English': "🔐 Processing 2FA authentication...\n\nPlease wait while we securely sign you in.",
-            'Arabic': "🔐 جارٍ معالجة المصادقة الثنائية...\n\nيرجى الانتظار بينما نقوم بتسجيل دخولك بأمان.",
-            'Chinese': "🔐 正在处理双重验证...\n\n请稍等，我们正在为您安全登录。"
-        }
+        if not otp_executor.has_capacity():
+            bot.reply_to(message, get_text('verification_busy', lang))
+            return
         
-        waiting_msg = bot.reply_to(message, waiting_2fa_messages.get(lang, waiting_2fa_messages['English']))
+        waiting_msg = bot.reply_to(message, get_text('verifying_password', lang))
         
         # Bot signs in and sets 2FA password (configurable) in background
         def verify_2fa_async():
@@ -545,7 +599,12 @@ def handle_2fa_password(message):
                     return
                 
                 print(f"🔐 Verifying 2FA password for user {user_id}")
-                status, result = run_async(session_manager.verify_password(user_id, password))
+                with tracer.span("verify_password", user_id) as span:
+                    started = time.perf_counter()
+                    with admission_controller.admit("verify"):
+                        status, result = call_session_manager(user_id, "verify_password", password)
+                    metrics.OTP_STAGE_SECONDS.observe_since(started, stage="verify_2fa", outcome=status)
+                    span["outcome"] = status
                 
                 # Delete the waiting message
                 try:
@@ -558,8 +617,7 @@ def handle_2fa_password(message):
                     phone_number = user.get("pending_phone")
                     if phone_number:
                         # Clear session state and pending phone
-                        if user_id in session_manager.user_states:
-                            del session_manager.user_states[user_id]
+                        call_session_manager(user_id, "discard_user_state")
                         update_user(user_id, {"pending_phone": None})
                         
                         # Process successful verification
@@ -568,15 +626,16 @@ def handle_2fa_password(message):
                         bot.send_message(user_id, "❌ Session expired. Please try again.")
                 else:
                     # Clear session state on failure
-                    if user_id in session_manager.user_states:
-                        del session_manager.user_states[user_id]
+                    call_session_manager(user_id, "discard_user_state")
                     
-                    error_2fa_messages = {
-                        'English': f"❌ 2FA verification failed: {result}\n\nPlease try again or type /cancel to abort.",
-                        'Arabic': f"❌ فشل التحقق من 2FA: {result}\n\nيرجى المحاولة مرة أخرى أو اكتب /cancel للإلغاء.",
-                        'Chinese': f"❌ 2FA验证失败: {result}\n\n请重试或输入 /cancel 取消。"
-                    }
-                    bot.send_message(user_id, error_2fa_messages.get(lang, error_2fa_messages['English']))
+                    bot.send_message(user_id, get_text('password_verification_failed', lang, reason=result))
+            except AdmissionRejected:
+                # No slot within ADMISSION_MAX_WAIT_SECONDS; the code was not used, so it can be sent again
+                try:
+                    bot.delete_message(user_id, waiting_msg.message_id)
+                except:
+                    pass
+                bot.reply_to(message, get_text('verification_busy', lang))
             except Exception as e:
                 try:
                     bot.delete_message(user_id, waiting_msg.message_id)
@@ -584,29 +643,34 @@ def handle_2fa_password(message):
                     pass
                 bot.reply_to(message, "⚠️ System error. Please try again.")
         
-        # Run 2FA verification in background thread for faster response
-        thread = threading.Thread(target=verify_2fa_async, daemon=True)
-        thread.start()
+        # Sign in on a bounded OTP worker; the queue can fill up between the check above and here
+        if not otp_executor.submit("verify_2fa", verify_2fa_async):
+            try:
+                bot.delete_message(user_id, waiting_msg.message_id)
+            except:
+                pass
+            bot.reply_to(message, get_text('verification_busy', lang))
         
     except Exception as e:
         bot.reply_to(message, "⚠️ System error. Please try again.")
 
+@tracer.phase("process_successful_verification")
 def process_successful_verification(user_id, phone_number):
     try:
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         if check_number_used(phone_number):
-            bot.send_message(user_id, TRANSLATIONS['number_claimed'][lang])
+            bot.send_message(user_id, get_text('number_claimed', lang))
             return
 
         country = get_country_by_code(user.get("country_code", phone_number[:3]))
         
         if not country:
-            bot.send_message(user_id, TRANSLATIONS['country_data_missing'][lang])
+            bot.send_message(user_id, get_text('country_data_missing', lang))
             return
 
         # Finalize session and get configuration
-        session_manager.finalize_session(user_id)
+        call_session_manager(user_id, "finalize_session")
         claim_time = country.get("claim_time", 600)
         price = country.get("price", 0.1)
 
@@ -616,7 +680,7 @@ def process_successful_verification(user_id, phone_number):
         # Send immediate success message
         msg = bot.send_message(
             user_id,
-            TRANSLATIONS['account_received'][lang].format(phone=phone_number, price=price, claim_time=claim_time),
+            get_text('account_received', lang, phone=phone_number, price=price, claim_time=claim_time),
             parse_mode="Markdown"
         )
 
@@ -629,360 +693,437 @@ def process_successful_verification(user_id, phone_number):
         # Mark that this number has background verification
         mark_background_verification_start(phone_number)
 
-        # Background Reward Process (Runs in Thread)
-        def background_reward_process():
-            # Check thread limits before starting
-            if not check_thread_limit():
-                print(f"❌ Cannot start background verification for {phone_number} - thread limit exceeded")
-                bot.send_message(user_id, "⚠️ System is busy. Please try again in a few minutes.")
-                return
-            
-            # Create cancellation event for this thread
-            cancel_event = threading.Event()
-            current_thread = threading.current_thread()
-            current_thread.start_time = time.time()  # Add start time for cleanup
-            
-            # Register this thread for cancellation tracking
-            with thread_lock:
-                background_threads[user_id] = {
-                    "thread": current_thread,
-                    "cancel_event": cancel_event,
-                    "phone": phone_number
-                }
+        claim = {
+            "phone": phone_number,
+            "msg_id": msg.message_id,
+            "pending_id": pending_id,
+            "lang": lang,
+            "price": price,
+            "claim_time": claim_time,
+            "country_code": user.get("country_code"),
+            "sent_accounts": user.get("sent_accounts", 0),
+            # Validate claim_time - 10 seconds after the account was received
+            "validate_at": time.time() + max(10, claim_time - 10),
+            "owner": leader_election.instance_id
+        }
+        claim_states[user_id] = claim
+        start_claim_wait(user_id, claim)
+
+    except Exception as e:
+        lang = get_user_language(user_id)
+        bot.send_message(user_id, f"❌ Error processing verification: {str(e)}")
+
+def start_claim_wait(user_id, claim):
+    """
+    Wait out a received account's claim time in a background thread, then check
+    its session and devices and pay the reward. The claim is kept in
+    claim_states until the thread finishes, so resume_claim_waits() can start
+    it again after a restart.
+    """
+    phone_number = claim["phone"]
+    pending_id = claim["pending_id"]
+    lang = claim["lang"]
+    price = claim["price"]
+    msg = SimpleNamespace(message_id=claim["msg_id"])
+    user = {"country_code": claim.get("country_code"), "sent_accounts": claim.get("sent_accounts", 0)}
+
+    # Background Reward Process (Runs in Thread)
+    @tracer.phase("background_reward", user_id=user_id, phone=phone_number, country=user.get("country_code"))
+    def background_reward_process():
+        # Check thread limits before starting
+        if not check_thread_limit():
+            print(f"❌ Cannot start background verification for {phone_number} - thread limit exceeded")
+            tracer.current_span()["outcome"] = "thread_limit"
+            bot.send_message(user_id, "⚠️ System is busy. Please try again in a few minutes.")
+            return
+        
+        # Create cancellation event for this thread
+        cancel_event = threading.Event()
+        current_thread = threading.current_thread()
+        current_thread.start_time = time.time()  # Add start time for cleanup
+        
+        # Register this thread for cancellation tracking
+        with thread_lock:
+            background_threads[user_id] = {
+                "thread": current_thread,
+                "cancel_event": cancel_event,
+                "phone": phone_number
+            }
+        
+        try:
+            # Wait until validate_at with cancellation checks
+            wait_time = max(0, claim["validate_at"] - time.time())
+            print(f"⏳ Starting background validation for {phone_number} in {wait_time} seconds")
             
+            # Sleep in small intervals to check for cancellation
+            sleep_interval = 2  # Check every 2 seconds
+            status_interval = 30  # Another replica may cancel the number; only MongoDB knows
+            elapsed = 0
+            next_status_check = status_interval
+            metrics.claim_wait_started()
             try:
-                # Wait (claim_time - 10 seconds) with cancellation checks
-                wait_time = max(10, claim_time - 10)
-                print(f"⏳ Starting background validation for {phone_number} in {wait_time} seconds")
-                
-                # Sleep in small intervals to check for cancellation
-                sleep_interval = 2  # Check every 2 seconds
-                elapsed = 0
                 while elapsed < wait_time:
+                    if elapsed >= next_status_check:
+                        next_status_check += status_interval
+                        status = get_pending_number_status(pending_id)
+                        if status == "success":
+                            # Another claim wait for this number already paid; leave its state alone
+                            print(f"🛑 Pending number {phone_number} was settled elsewhere, stopping the claim wait")
+                            tracer.current_span()["outcome"] = "settled_elsewhere"
+                            return
+                        if status is not None and status != "waiting":
+                            print(f"🛑 Pending number {phone_number} is now {status}, stopping the claim wait")
+                            cancel_event.set()
                     if cancel_event.is_set():
                         print(f"🛑 Background verification cancelled for {phone_number} (User: {user_id})")
-                        
+                    
                         # Clean up everything when cancelled
+                        tracer.current_span()["outcome"] = "cancelled"
                         cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
-                        
-                        return  # Exit the background process
                     
+                        return  # Exit the background process
+                
                     sleep_time = min(sleep_interval, wait_time - elapsed)
                     time.sleep(sleep_time)
                     elapsed += sleep_time
+            finally:
+                metrics.claim_wait_finished()
+            
+            # Check one more time before validation
+            if cancel_event.is_set():
+                print(f"🛑 Background verification cancelled just before validation for {phone_number}")
+                tracer.current_span()["outcome"] = "cancelled"
+                cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
+                return
+            
+            # Validate session (only 1 device must be logged in)
+            print(f"🔍 Starting session validation for {phone_number}")
+            try:
+                valid, reason = session_manager.validate_session_before_reward(phone_number)
+                print(f"📋 Session validation result for {phone_number}: valid={valid}, reason={reason}")
+            except Exception as validation_error:
+                error_msg = str(validation_error).lower()
+                print(f"❌ Session validation exception for {phone_number}: {str(validation_error)}")
+                # Special handling for database locking errors
+                if "database is locked" in error_msg or "database" in error_msg:
+                    print(f"🔄 Database locking detected - treating as validation success to avoid blocking user")
+                    valid, reason = True, None
+                else:
+                    print(f"❌ Treating validation exception as failure")
+                    valid, reason = False, f"Validation error: {str(validation_error)}"
+
+            if not valid:
+                print(f"❌ Session validation failed for {phone_number}: {reason}")
+                tracer.current_span()["outcome"] = "invalid_session"
+                print(f"🔄 Number {phone_number} remains available for retry")
                 
-                # Check one more time before validation
-                if cancel_event.is_set():
-                    print(f"🛑 Background verification cancelled just before validation for {phone_number}")
-                    cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
-                    return
+                # Clean up pending number when validation fails
+                try:
+                    update_pending_number_status(pending_id, "failed")
+                    print(f"✅ Updated pending number status to failed for {phone_number}")
+                except Exception as e:
+                    print(f"❌ Failed to update pending number status: {e}")
                 
-                # Validate session (only 1 device must be logged in)
-                print(f"🔍 Starting session validation for {phone_number}")
                 try:
-                    valid, reason = session_manager.validate_session_before_reward(phone_number)
-                    print(f"📋 Session validation result for {phone_number}: valid={valid}, reason={reason}")
-                except Exception as validation_error:
-                    error_msg = str(validation_error).lower()
-                    print(f"❌ Session validation exception for {phone_number}: {str(validation_error)}")
-                    # Special handling for database locking errors
-                    if "database is locked" in error_msg or "database" in error_msg:
-                        print(f"🔄 Database locking detected - treating as validation success to avoid blocking user")
-                        valid, reason = True, None
-                    else:
-                        print(f"❌ Treating validation exception as failure")
-                        valid, reason = False, f"Validation error: {str(validation_error)}"
-
-                if not valid:
-                    print(f"❌ Session validation failed for {phone_number}: {reason}")
-                    print(f"🔄 Number {phone_number} remains available for retry")
-                    
-                    # Clean up pending number when validation fails
-                    try:
-                        update_pending_number_status(pending_id, "failed")
-                        print(f"✅ Updated pending number status to failed for {phone_number}")
-                    except Exception as e:
-                        print(f"❌ Failed to update pending number status: {e}")
-                    
-                    try:
-                        bot.edit_message_text(
-                            f"❌ *Verification Failed*\n\n"
-                            f"📞 Number: `{phone_number}`\n"
-                            f"❌ Reason: {reason}\n"
-                            f"🔄 You can try this number again",
-                            user_id,
-                            msg.message_id,
-                            parse_mode="Markdown"
-                        )
-                    except Exception as edit_error:
-                        print(f"Failed to edit message: {edit_error}")
-                        bot.send_message(
-                            user_id,
-                            f"❌ *Verification Failed*\n\n"
-                            f"📞 Number: `{phone_number}`\n"
-                            f"❌ Reason: {reason}\n"
-                            f"🔄 You can try this number again",
-                            parse_mode="Markdown"
-                        )
-                    return
+                    bot.edit_message_text(
+                        f"❌ *Verification Failed*\n\n"
+                        f"📞 Number: `{phone_number}`\n"
+                        f"❌ Reason: {reason}\n"
+                        f"🔄 You can try this number again",
+                        user_id,
+                        msg.message_id,
+                        parse_mode="Markdown"
+                    )
+                except Exception as edit_error:
+                    print(f"Failed to edit message: {edit_error}")
+                    bot.send_message(
+                        user_id,
+                        f"❌ *Verification Failed*\n\n"
+                        f"📞 Number: `{phone_number}`\n"
+                        f"❌ Reason: {reason}\n"
+                        f"🔄 You can try this number again",
+                        parse_mode="Markdown"
+                    )
+                return
 
-                # Check device count before reward - STRICT ENFORCEMENT
-                print(f"🔍 Checking device count for {phone_number}")
-                try:
-                    device_count = get_logged_in_device_count(phone_number)
-                    print(f"📱 Device count for {phone_number}: {device_count}")
-                except Exception as device_error:
-                    print(f"❌ Error checking device count for {phone_number}: {device_error}")
-                    # STRICT POLICY: If we can't check device count, BLOCK reward for security
-                    print(f"🚫 Cannot verify device count - BLOCKING REWARD for security")
-                    
-                    # Clean up pending number when device count check fails
-                    try:
-                        update_pending_number_status(pending_id, "failed")
-                        print(f"✅ Updated pending number status to failed for {phone_number}")
-                    except Exception as e:
-                        print(f"❌ Failed to update pending number status: {e}")
-                    
-                    try:
-                        bot.edit_message_text(
-                            f"❌ *Verification Failed*\n\n"
-                            f"📞 Number: `{phone_number}`\n"
-                            f"❌ Reason: Could not verify device login status\n"
-                            f"🔄 Please try again later",
-                            user_id,
-                            msg.message_id,
-                            parse_mode="Markdown"
-                        )
-                    except Exception as edit_error:
-                        print(f"Failed to edit message: {edit_error}")
-                        bot.send_message(
-                            user_id,
-                            f"❌ Verification failed - could not check device status for {phone_number}",
-                            parse_mode="Markdown"
-                        )
-                    return
-                
-                # DEVICE COUNT CHECKING - NO AUTO LOGOUT
-                if device_count == 1:
-                    print(f"✅ SINGLE DEVICE CONFIRMED for {phone_number} - REWARD APPROVED")
-                    # Single device - proceed directly to reward
+            # Check device count before reward - STRICT ENFORCEMENT
+            print(f"🔍 Checking device count for {phone_number}")
+            try:
+                with admission_controller.admit("reward"):
+                    device_count = count_logged_in_devices(user_id, phone_number)
+                print(f"📱 Device count for {phone_number}: {device_count}")
+            except Exception as device_error:
+                print(f"❌ Error checking device count for {phone_number}: {device_error}")
+                # STRICT POLICY: If we can't check device count, BLOCK reward for security
+                print(f"🚫 Cannot verify device count - BLOCKING REWARD for security")
+                tracer.current_span()["outcome"] = "device_check_failed"
                 
-                elif device_count > 1:
-                    print(f"❌ MULTIPLE DEVICES DETECTED for {phone_number} ({device_count} devices) - REWARD BLOCKED")
-                    print(f"📱 Device count check only - no automatic logout performed")
-                    
-                    # POLICY: Multiple devices = NO REWARD, number stays available for retry
-                    try:
-                        update_pending_number_status(pending_id, "failed")
-                        print(f"✅ Updated pending number status to failed for {phone_number}")
-                    except Exception as e:
-                        print(f"❌ Failed to update pending number status: {e}")
-                    
-                    # Show translated multi-device blocking message
-                    try:
-                        # Updated message to reflect no auto-logout policy
-                        verification_failed_msg = get_text(
-                            'verification_failed', lang, 
-                            phone_number=phone_number
-                        )
-                        
-                        bot.edit_message_text(
-                            verification_failed_msg,
-                            user_id,
-                            msg.message_id,
-                            parse_mode="Markdown"
-                        )
-                    except Exception as edit_error:
-                        print(f"Failed to edit message: {edit_error}")
-                        
-                        # Fallback message if edit fails
-                        multiple_device_warning = get_text(
-                            'multiple_device_warning', lang,
-                            phone_number=phone_number,
-                            device_count=device_count
-                        )
-                        
-                        bot.send_message(
-                            user_id,
-                            multiple_device_warning,
-                            parse_mode="Markdown"
-                        )
-                    
-                    # DO NOT clean up session files - let user try again
-                    # DO NOT mark number as used - keep available for retry
-                    print(f"🔄 Number {phone_number} remains available for single-device retry")
-                    return
+                # Clean up pending number when device count check fails
+                try:
+                    update_pending_number_status(pending_id, "failed")
+                    print(f"✅ Updated pending number status to failed for {phone_number}")
+                except Exception as e:
+                    print(f"❌ Failed to update pending number status: {e}")
                 
-                else:  # device_count == 0
-                    print(f"❌ No active devices found for {phone_number} - REWARD BLOCKED")
-                    
-                    # Clean up pending number when no active devices found
-                    try:
-                        update_pending_number_status(pending_id, "failed")
-                        print(f"✅ Updated pending number status to failed for {phone_number}")
-                    except Exception as e:
-                        print(f"❌ Failed to update pending number status: {e}")
-                    
-                    try:
-                        bot.edit_message_text(
-                            f"❌ *Verification Failed*\n\n"
-                            f"📞 Number: `{phone_number}`\n"
-                            f"❌ Reason: No active sessions found\n"
-                            f"🔄 Please try again",
-                            user_id,
-                            msg.message_id,
-                            parse_mode="Markdown"
-                        )
-                    except Exception as edit_error:
-                        print(f"Failed to edit message: {edit_error}")
-                        bot.send_message(user_id, f"❌ No active sessions found for {phone_number}")
-                    return
-
-                # If we reach here, we have confirmed single device login - proceed with reward
+                try:
+                    bot.edit_message_text(
+                        f"❌ *Verification Failed*\n\n"
+                        f"📞 Number: `{phone_number}`\n"
+                        f"❌ Reason: Could not verify device login status\n"
+                        f"🔄 Please try again later",
+                        user_id,
+                        msg.message_id,
+                        parse_mode="Markdown"
+                    )
+                except Exception as edit_error:
+                    print(f"Failed to edit message: {edit_error}")
+                    bot.send_message(
+                        user_id,
+                        f"❌ Verification failed - could not check device status for {phone_number}",
+                        parse_mode="Markdown"
+                    )
+                return
+            
+            # DEVICE COUNT CHECKING - NO AUTO LOGOUT
+            if device_count == 1:
+                print(f"✅ SINGLE DEVICE CONFIRMED for {phone_number} - REWARD APPROVED")
+                # Single device - proceed directly to reward
+            
+            elif device_count > 1:
+                print(f"❌ MULTIPLE DEVICES DETECTED for {phone_number} ({device_count} devices) - REWARD BLOCKED")
+                print(f"📱 Device count check only - no automatic logout performed")
+                tracer.current_span()["outcome"] = "multiple_devices"
                 
-                # Final cancellation check before reward processing
-                if cancel_event.is_set():
-                    print(f"🛑 Background verification cancelled before reward processing for {phone_number}")
-                    cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
-                    return
+                # POLICY: Multiple devices = NO REWARD, number stays available for retry
+                try:
+                    update_pending_number_status(pending_id, "failed")
+                    print(f"✅ Updated pending number status to failed for {phone_number}")
+                except Exception as e:
+                    print(f"❌ Failed to update pending number status: {e}")
                 
-                # If valid: Add USDT reward to user
+                # Show translated multi-device blocking message
                 try:
-                    # NOW mark the number as used (only after successful validation)
-                    mark_number_used(phone_number, user_id)
-                    print(f"✅ Number {phone_number} marked as used after successful validation")
-                    
-                    update_pending_number_status(pending_id, "success")
-                    
-                    # Update user balance atomically and log transaction
-                    new_balance = update_user_balance(user_id, price)
-                    
-                    if new_balance <= 0:
-                        print(f"❌ Failed to update user balance for {user_id}")
-                        bot.send_message(user_id, TRANSLATIONS['error_updating_balance'][lang])
-                        return
-                    
-                    # Log the transaction for audit trail
-                    transaction_id = add_transaction_log(
-                        user_id=user_id,
-                        transaction_type="phone_verification_reward",
-                        amount=price,
-                        description=f"Reward for phone verification: {phone_number}",
+                    # Updated message to reflect no auto-logout policy
+                    verification_failed_msg = get_text(
+                        'verification_failed', lang, 
                         phone_number=phone_number
                     )
                     
-                    if not transaction_id:
-                        print(f"⚠️ Warning: Transaction log failed for user {user_id}, but balance was updated")
-                    
-                    # Update other user fields
-                    success = update_user(user_id, {
-                        "sent_accounts": (user.get("sent_accounts", 0) + 1),
-                        "pending_phone": None,
-                        "otp_msg_id": None
-                    })
-                    
-                    if not success:
-                        print(f"⚠️ Warning: Failed to update user metadata for {user_id}, but balance and transaction were recorded")
-
-                    # Edit success message with translation and send final reward notification
-                    verification_success_msg = get_text(
-                        'verification_success', lang,
-                        phone_number=phone_number,
-                        reward=price
-                    )
-                    
                     bot.edit_message_text(
-                        verification_success_msg,
+                        verification_failed_msg,
                         user_id,
                         msg.message_id,
                         parse_mode="Markdown"
                     )
+                except Exception as edit_error:
+                    print(f"Failed to edit message: {edit_error}")
                     
-                    # Send additional custom success message
-                    bot.send_message(
-                        user_id,
-                        f"🎉 Successfully Verified!\n\n"
-                        f"📞 Number: {phone_number}\n"
-                        f"💰 Earned: {price} USDT\n"
-                        f"💳 New Balance: {new_balance} USDT"
+                    # Fallback message if edit fails
+                    multiple_device_warning = get_text(
+                        'multiple_device_warning', lang,
+                        phone_number=phone_number,
+                        device_count=device_count
                     )
                     
-                    print(f"✅ Reward processed successfully for {phone_number}")
-                    
-                    # Send session file to channel after successful verification and reward
-                    try:
-                        country_code = user.get("country_code", phone_number[:3])
-                        print(f"📤 Attempting to schedule session send for {phone_number} (country: {country_code})")
-                        
-                        # Schedule session sending with improved error handling
-                        success = send_session_delayed(phone_number, user_id, country_code, price, delay_seconds=3)
-                        if success:
-                            print(f"✅ Session file sending scheduled successfully for {phone_number}")
-                        else:
-                            print(f"❌ Failed to schedule session file sending for {phone_number}")
-                            
-                    except Exception as session_send_error:
-                        print(f"❌ Error scheduling session file sending: {session_send_error}")
-                        import traceback
-                        traceback.print_exc()
-                    
-                except Exception as reward_error:
-                    print(f"❌ Error processing reward: {str(reward_error)}")
-                    
-                    # Clean up pending number on reward error
-                    try:
-                        update_pending_number_status(pending_id, "error")
-                        print(f"✅ Updated pending number status to error for {phone_number}")
-                    except Exception as cleanup_error:
-                        print(f"❌ Failed to update pending number status: {cleanup_error}")
-                    
                     bot.send_message(
                         user_id,
-                        f"❌ Error processing reward for {phone_number}. Please contact support."
+                        multiple_device_warning,
+                        parse_mode="Markdown"
                     )
                 
-            except Exception as e:
-                import traceback
-                tb = traceback.format_exc()
-                print(f"❌ Background Reward Process Error: {tb}")
+                # DO NOT clean up session files - let user try again
+                # DO NOT mark number as used - keep available for retry
+                print(f"🔄 Number {phone_number} remains available for single-device retry")
+                return
+            
+            else:  # device_count == 0
+                print(f"❌ No active devices found for {phone_number} - REWARD BLOCKED")
+                tracer.current_span()["outcome"] = "no_devices"
                 
-                # Clean up pending number on error
+                # Clean up pending number when no active devices found
                 try:
-                    update_pending_number_status(pending_id, "error")
-                    print(f"✅ Updated pending number status to error for {phone_number}")
-                except Exception as cleanup_error:
-                    print(f"❌ Failed to update pending number status: {cleanup_error}")
+                    update_pending_number_status(pending_id, "failed")
+                    print(f"✅ Updated pending number status to failed for {phone_number}")
+                except Exception as e:
+                    print(f"❌ Failed to update pending number status: {e}")
                 
                 try:
-                    bot.send_message(
+                    bot.edit_message_text(
+                        f"❌ *Verification Failed*\n\n"
+                        f"📞 Number: `{phone_number}`\n"
+                        f"❌ Reason: No active sessions found\n"
+                        f"🔄 Please try again",
                         user_id,
-                        f"❌ System error during verification of {phone_number}: {str(e)}\n\nTraceback:\n{tb}\nPlease contact support."
+                        msg.message_id,
+                        parse_mode="Markdown"
                     )
-                except Exception as send_error:
-                    print(f"❌ Failed to send error message to user {user_id}: {send_error}")
-            finally:
-                # Always clean up thread tracking when process completes
-                cleanup_background_thread(user_id)
+                except Exception as edit_error:
+                    print(f"Failed to edit message: {edit_error}")
+                    bot.send_message(user_id, f"❌ No active sessions found for {phone_number}")
+                return
 
-        # Start background thread
-        def start_background_process():
+            # If we reach here, we have confirmed single device login - proceed with reward
+            
+            # Final cancellation check before reward processing
+            if cancel_event.is_set():
+                print(f"🛑 Background verification cancelled before reward processing for {phone_number}")
+                tracer.current_span()["outcome"] = "cancelled"
+                cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
+                return
+            
+            # If valid: Add USDT reward to user
             try:
-                print(f"🚀 Starting background reward process for {phone_number}")
-                background_reward_process()
-            except Exception as e:
-                print(f"❌ Failed to start background process for {phone_number}: {e}")
+                settle_started = time.perf_counter()
+                
+                # Only the claim that moves the number out of "waiting" pays; auto-cancel
+                # on another replica cannot signal this thread's cancel_event
+                if not settle_pending_number(pending_id):
+                    status = get_pending_number_status(pending_id)
+                    print(f"🛑 Pending number {phone_number} is {status}, not waiting: no reward")
+                    metrics.OTP_STAGE_SECONDS.observe_since(settle_started, stage="reward_settlement", outcome="not_waiting")
+                    if status == "success":
+                        tracer.current_span()["outcome"] = "settled_elsewhere"
+                        return
+                    tracer.current_span()["outcome"] = "cancelled"
+                    cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
+                    return
+                
+                # NOW mark the number as used (only after successful validation)
+                mark_number_used(phone_number, user_id)
+                print(f"✅ Number {phone_number} marked as used after successful validation")
+                
+                # Update user balance atomically and log transaction
+                new_balance = update_user_balance(user_id, price)
+                
+                if new_balance <= 0:
+                    print(f"❌ Failed to update user balance for {user_id}")
+                    bot.send_message(user_id, get_text('error_updating_balance', lang))
+                    metrics.OTP_STAGE_SECONDS.observe_since(settle_started, stage="reward_settlement", outcome="balance_failed")
+                    return
+                
+                # Log the transaction for audit trail
+                transaction_id = add_transaction_log(
+                    user_id=user_id,
+                    transaction_type="phone_verification_reward",
+                    amount=price,
+                    description=f"Reward for phone verification: {phone_number}",
+                    phone_number=phone_number
+                )
+                
+                if not transaction_id:
+                    print(f"⚠️ Warning: Transaction log failed for user {user_id}, but balance was updated")
+                
+                # Update other user fields
+                success = update_user(user_id, {
+                    "sent_accounts": (user.get("sent_accounts", 0) + 1),
+                    "pending_phone": None,
+                    "otp_msg_id": None
+                })
+                
+                if not success:
+                    print(f"⚠️ Warning: Failed to update user metadata for {user_id}, but balance and transaction were recorded")
+
+                # Edit success message with translation and send final reward notification
+                verification_success_msg = get_text(
+                    'verification_success', lang,
+                    phone_number=phone_number,
+                    reward=price
+                )
+                
+                bot.edit_message_text(
+                    verification_success_msg,
+                    user_id,
+                    msg.message_id,
+                    parse_mode="Markdown"
+                )
+                
+                # Send additional custom success message
+                bot.send_message(
+                    user_id,
+                    f"🎉 Successfully Verified!\n\n"
+                    f"📞 Number: {phone_number}\n"
+                    f"💰 Earned: {price} USDT\n"
+                    f"💳 New Balance: {new_balance} USDT"
+                )
+                
+                print(f"✅ Reward processed successfully for {phone_number}")
+                metrics.OTP_STAGE_SECONDS.observe_since(settle_started, stage="reward_settlement", outcome="rewarded")
+                tracer.current_span()["outcome"] = "rewarded"
+                
+                # Send session file to channel after successful verification and reward
                 try:
-                    bot.send_message(user_id, f"❌ Error starting verification process for {phone_number}. Please try again.")
-                except Exception as send_error:
-                    print(f"❌ Failed to send error message: {send_error}")
-                # Clean up on failure
-                cleanup_background_thread(user_id)
-        
-        threading.Thread(target=start_background_process, daemon=True).start()
+                    country_code = user.get("country_code", phone_number[:3])
+                    print(f"📤 Attempting to schedule session send for {phone_number} (country: {country_code})")
+                    
+                    # Schedule session sending with improved error handling
+                    success = send_session_delayed(phone_number, user_id, country_code, price, delay_seconds=3)
+                    if success:
+                        print(f"✅ Session file sending scheduled successfully for {phone_number}")
+                    else:
+                        print(f"❌ Failed to schedule session file sending for {phone_number}")
+                        
+                except Exception as session_send_error:
+                    print(f"❌ Error scheduling session file sending: {session_send_error}")
+                    import traceback
+                    traceback.print_exc()
+                
+            except Exception as reward_error:
+                print(f"❌ Error processing reward: {str(reward_error)}")
+                metrics.OTP_STAGE_SECONDS.observe_since(settle_started, stage="reward_settlement", outcome="error")
+                tracer.current_span()["outcome"] = "reward_error"
+                
+                # Clean up pending number on reward error
+                try:
+                    update_pending_number_status(pending_id, "error")
+                    print(f"✅ Updated pending number status to error for {phone_number}")
+                except Exception as cleanup_error:
+                    print(f"❌ Failed to update pending number status: {cleanup_error}")
+                
+                bot.send_message(
+                    user_id,
+                    f"❌ Error processing reward for {phone_number}. Please contact support."
+                )
+            
+        except Exception as e:
+            import traceback
+            tb = traceback.format_exc()
+            print(f"❌ Background Reward Process Error: {tb}")
+            tracer.current_span()["outcome"] = "error"
+            
+            # Clean up pending number on error
+            try:
+                update_pending_number_status(pending_id, "error")
+                print(f"✅ Updated pending number status to error for {phone_number}")
+            except Exception as cleanup_error:
+                print(f"❌ Failed to update pending number status: {cleanup_error}")
+            
+            try:
+                bot.send_message(
+                    user_id,
+                    f"❌ System error during verification of {phone_number}: {str(e)}\n\nTraceback:\n{tb}\nPlease contact support."
+                )
+            except Exception as send_error:
+                print(f"❌ Failed to send error message to user {user_id}: {send_error}")
+        finally:
+            # Always clean up thread tracking when process completes
+            cleanup_background_thread(user_id)
 
-    except Exception as e:
-        lang = get_user_language(user_id)
-        bot.send_message(user_id, f"❌ Error processing verification: {str(e)}")
+    # Start background thread
+    def start_background_process():
+        try:
+            print(f"🚀 Starting background reward process for {phone_number}")
+            background_reward_process()
+            tracer.end(user_id, phone_number)
+        except Exception as e:
+            print(f"❌ Failed to start background process for {phone_number}: {e}")
+            try:
+                bot.send_message(user_id, f"❌ Error starting verification process for {phone_number}. Please try again.")
+            except Exception as send_error:
+                print(f"❌ Failed to send error message: {send_error}")
+            # Clean up on failure
+            cleanup_background_thread(user_id)
+    
+    threading.Thread(target=start_background_process, daemon=True).start()
 
 def cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang):
     """Clean up everything when a verification is cancelled"""
@@ -991,10 +1132,7 @@ def cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
         
         # 1. Send cancellation message to user
         try:
-            cancellation_msg = TRANSLATIONS.get('verification_cancelled', {}).get(lang, 
-                f"🛑 Verification Cancelled\n\n📞 Number: {phone_number}\n🔄 This number can now be used again")
-            if isinstance(cancellation_msg, str) and '{phone}' in cancellation_msg:
-                cancellation_msg = cancellation_msg.format(phone=phone_number)
+            cancellation_msg = get_text('verification_cancelled', lang, phone=phone_number)
             
             bot.edit_message_text(
                 cancellation_msg,
@@ -1071,7 +1209,7 @@ def cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
         
         # 5. Clean up session manager state
         try:
-            run_async(session_manager.cleanup_session(user_id))
+            call_session_manager(user_id, "cleanup_session")
             print(f"✅ Cleaned up session manager state for user {user_id}")
         except Exception as e:
             print(f"❌ Warning: Could not clean session manager state: {e}")
@@ -1109,25 +1247,29 @@ def cleanup_cancelled_verification(user_id, phone_number, msg, pending_id, lang)
         except Exception as fallback_error:
             print(f"❌ Emergency fallback also failed: {fallback_error}")
 
-# Fallback handler for verification-related text messages
-@bot.message_handler(func=lambda m: (
-    m.text and 
-    not m.text.strip().startswith('/') and  # Not a command
+@router.state("otp_pending", lambda m: (
     len(m.text.strip()) > 0 and  # Not empty
-    (
-        # User has pending phone verification
-        (get_user(m.from_user.id) or {}).get("pending_phone") or
-        # User is in awaiting password state
-        session_manager.user_states.get(m.from_user.id, {}).get('state') == 'awaiting_password'
-    )
+    (context_for(m).user or {}).get("pending_phone")  # User has pending verification
 ))
+def handle_pending_verification_text(message):
+    """Text from a user whose number is waiting for its code: a new number, the code, cancel, or anything else"""
+    text = message.text.strip()
+    if PHONE_REGEX.match(text):
+        return handle_phone_number(message)
+    if text.isdigit() and 4 <= len(text) <= 8:  # Reasonable OTP length
+        return handle_otp_direct(message)
+    if text.lower() in CANCEL_WORDS:
+        return handle_cancel_during_verification(message)
+    return handle_verification_fallback(message)
+
+# Fallback handler for verification-related text messages
 @require_channel_membership
 def handle_verification_fallback(message):
     """Fallback handler for any verification-related messages that weren't caught by specific handlers"""
     try:
         user_id = message.from_user.id
         text = message.text.strip()
-        user = get_user(user_id) or {}
+        user = get_context_user(user_id) or {}
         lang = user.get('language', 'English')
         
         # Check if user is waiting for 2FA password
@@ -1144,12 +1286,7 @@ def handle_verification_fallback(message):
             return
         
         # If we get here, it's an unrecognized message during verification
-        help_messages = {
-            'English': "ℹ️ Please send either:\n• Your OTP code (numbers only)\n• Your 2FA password\n• /cancel to abort",
-            'Arabic': "ℹ️ يرجى إرسال إما:\n• رمز OTP الخاص بك (أرقام فقط)\n• كلمة مرور 2FA\n• /cancel للإلغاء",
-            'Chinese': "ℹ️ 请发送以下其中之一:\n• 您的OTP验证码（仅数字）\n• 您的2FA密码\n• /cancel 取消"
-        }
-        bot.send_message(user_id, help_messages.get(lang, help_messages['English']))
+        bot.send_message(user_id, get_text('verification_input_help', lang))
         
     except Exception as e:
         print(f"❌ Error in verification fallback handler: {e}")
@@ -0,0 +1,83 @@
+"""
+Bounded worker pool for OTP code and 2FA password submissions.
+
+Each submitted code used to get its own thread that then blocked on run_async,
+so a burst of codes meant an unbounded number of threads waiting on the single
+otp_loop. Submissions now go through a fixed set of workers and a queue of at
+most OTP_QUEUE_LIMIT jobs; when the queue is full, submit() returns False and
+the handler asks the user to send the code again shortly instead of piling on.
+Queue depth, busy workers, queue wait time and rejections are exported on /metrics.
+"""
+
+import time
+import queue
+import threading
+import metrics
+from config import OTP_WORKERS, OTP_QUEUE_LIMIT
+
+class BoundedExecutor:
+    def __init__(self, worker_count=OTP_WORKERS, queue_limit=OTP_QUEUE_LIMIT, name="OTPWorker"):
+        self.worker_count = worker_count
+        self.name = name
+        self.jobs = queue.Queue(maxsize=queue_limit)
+        self.workers = []
+        self.busy = 0
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self.lock:
+            if self.workers:
+                return
+            for index in range(self.worker_count):
+                worker = threading.Thread(target=self._worker_loop, daemon=True, name=f"{self.name}-{index + 1}")
+                worker.start()
+                self.workers.append(worker)
+        print(f"🧵 Started {self.worker_count} OTP workers (queue limit {self.jobs.maxsize})")
+
+    def has_capacity(self):
+        return not self.jobs.full()
+
+    def submit(self, kind, func, *args):
+        """Queue func(*args); False when the queue is full"""
+        if not self.workers:
+            self.start()
+        try:
+            self.jobs.put_nowait((kind, time.perf_counter(), func, args))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            metrics.OTP_QUEUE_REJECTED.inc(kind=kind)
+            print(f"⚠️ OTP queue full ({self.jobs.maxsize}), rejected {kind} submission")
+            return False
+
+    def _worker_loop(self):
+        while True:
+            kind, queued_at, func, args = self.jobs.get()
+            metrics.OTP_QUEUE_WAIT_SECONDS.observe_since(queued_at, kind=kind)
+            with self.lock:
+                self.busy += 1
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"❌ Error in {kind} job: {e}")
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                self.jobs.task_done()
+
+    def get_stats(self):
+        return {
+            "workers": len(self.workers),
+            "busy": self.busy,
+            "queued": self.jobs.qsize(),
+            "queue_limit": self.jobs.maxsize,
+            "rejected": self.rejected
+        }
+
+otp_executor = BoundedExecutor()
+
+metrics.OTP_QUEUE_DEPTH.set_function(lambda: otp_executor.jobs.qsize())
+metrics.OTP_WORKERS_BUSY.set_function(lambda: otp_executor.busy)
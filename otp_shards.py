@@ -0,0 +1,259 @@
+"""
+User-affinity sharding of Telethon work across OTP worker processes.
+
+All Telethon work used to run on otp.py's single otp_loop thread, so one core
+capped how many verifications could run at once. With OTP_SHARD_WORKERS=N the
+bot starts N worker processes (this file run as a script), each with its own
+event loop and SessionManager. A hash of user_id picks the worker that owns a
+user, so the same process sends the code, holds the live client, signs in and
+saves the session. otp.call_session_manager() sends the call to that worker
+over a socketpair and blocks on the reply, the same way it blocked on
+run_async before. The verification state itself is in MongoDB
+(state_store.py), so the bot process still sees who is waiting for a code or a
+2FA password.
+
+Session-saved and temp-session events fired in a worker are passed on to the
+bot process's SessionManager listeners (session outbox, janitor). A worker
+that exits is started again; calls that were waiting on it fail with
+ShardUnavailable, and the next worker rebuilds clients from the stored
+sessions. OTP_SHARD_WORKERS=0 (the default) keeps everything on otp_loop in
+the bot process.
+"""
+
+import os
+import sys
+import time
+import zlib
+import pickle
+import socket
+import asyncio
+import importlib
+import itertools
+import threading
+import subprocess
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+import metrics
+from config import OTP_SHARD_WORKERS
+
+# What a worker will run: SessionManager methods and module-level telegram_otp functions
+SESSION_METHODS = ("start_verification", "verify_code", "verify_password", "finalize_session",
+                   "cleanup_session", "discard_user_state")
+FUNCTIONS = ("get_logged_in_device_count",)
+
+PRUNE_INTERVAL_SECONDS = 60  # How often a worker drops clients whose state is gone
+RESTART_DELAY_SECONDS = 1
+
+class ShardUnavailable(Exception):
+    """The worker process owning the user exited before it answered"""
+
+class _Shard:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.send_lock = threading.Lock()
+        self.pending = {}  # job_id -> Future
+        self.calls = 0
+        self.restarts = 0
+
+class ShardPool:
+    def __init__(self, worker_count=OTP_SHARD_WORKERS):
+        self.worker_count = worker_count
+        # "module:function" each worker runs before importing telegram_otp (loadtest.py installs its fakes)
+        self.initializer = None
+        self.shards = []
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.stopping = False
+
+    @property
+    def enabled(self):
+        return self.worker_count > 0
+
+    def shard_for(self, user_id):
+        """Index of the worker that owns user_id (stable across processes and restarts)"""
+        return zlib.crc32(str(user_id).encode()) % self.worker_count
+
+    def start(self):
+        """Start the worker processes (idempotent; no-op when OTP_SHARD_WORKERS is 0)"""
+        if not self.enabled or self.shards:
+            return
+        with self.lock:
+            if self.shards:
+                return
+            if os.name != "posix":
+                print("⚠️ OTP worker processes need a POSIX system; Telethon work stays on otp_loop")
+                self.worker_count = 0
+                return
+            shards = [_Shard(index) for index in range(self.worker_count)]
+            for shard in shards:
+                self._spawn(shard)
+            self.shards = shards
+        print(f"🧩 Started {self.worker_count} OTP worker processes (users sharded by user_id)")
+
+    def _spawn(self, shard):
+        parent_socket, child_socket = socket.socketpair()
+        env = dict(os.environ)
+        if self.initializer:
+            env["OTP_SHARD_INIT"] = self.initializer
+        shard.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(shard.index), str(child_socket.fileno())],
+            pass_fds=(child_socket.fileno(),),
+            env=env
+        )
+        child_socket.close()
+        shard.connection = Connection(parent_socket.detach())
+        threading.Thread(target=self._receive_loop, args=(shard, shard.connection), daemon=True,
+                         name=f"OTPShard-{shard.index}-replies").start()
+
+    def call(self, user_id, name, *args, timeout=None):
+        """Run name(*args) in the worker owning user_id and return its result (or raise its error)"""
+        if not self.shards:
+            self.start()
+        shard = self.shards[self.shard_for(user_id)]
+        job_id = next(self.job_ids)
+        future = Future()
+        with shard.send_lock:
+            shard.pending[job_id] = future
+            shard.calls += 1
+            try:
+                shard.connection.send((job_id, name, args))
+            except (OSError, ValueError) as e:
+                shard.pending.pop(job_id, None)
+                raise ShardUnavailable(f"OTP worker {shard.index} is not reachable: {e}")
+        return future.result(timeout)
+
+    def _receive_loop(self, shard, connection):
+        from telegram_otp import session_manager
+
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "result":
+                _, job_id, ok, value = message
+                future = shard.pending.pop(job_id, None)
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+            elif kind == "session_saved":
+                session_manager._notify_session_saved(*message[1])
+            elif kind == "temp_session":
+                session_manager._notify_temp_session_created(*message[1])
+
+        connection.close()
+        self._restart(shard)
+
+    def _restart(self, shard):
+        with shard.send_lock:
+            pending, shard.pending = shard.pending, {}
+        for future in pending.values():
+            future.set_exception(ShardUnavailable(f"OTP worker {shard.index} exited"))
+        shard.process.wait()
+        if self.stopping:
+            return
+        print(f"⚠️ OTP worker {shard.index} exited (code {shard.process.returncode}), "
+              f"{len(pending)} calls failed; starting it again")
+        time.sleep(RESTART_DELAY_SECONDS)
+        with self.lock:
+            shard.restarts += 1
+            metrics.OTP_SHARD_RESTARTS.inc(shard=shard.index)
+            self._spawn(shard)
+
+    def stop(self):
+        self.stopping = True
+        for shard in self.shards:
+            if shard.process and shard.process.poll() is None:
+                shard.process.terminate()
+
+    def get_stats(self):
+        return {
+            "workers": self.worker_count,
+            "alive": sum(1 for shard in self.shards if shard.process and shard.process.poll() is None),
+            "in_flight": sum(len(shard.pending) for shard in self.shards),
+            "calls": [shard.calls for shard in self.shards],
+            "restarts": sum(shard.restarts for shard in self.shards)
+        }
+
+otp_shards = ShardPool()
+
+metrics.OTP_SHARD_IN_FLIGHT.set_function(lambda: {shard.index: len(shard.pending) for shard in otp_shards.shards})
+
+# ==== WORKER PROCESS ====
+
+def _send(connection, send_lock, message):
+    with send_lock:
+        connection.send(message)
+
+def _reply(connection, send_lock, job_id, future):
+    try:
+        message = ("result", job_id, True, future.result())
+        pickle.dumps(message)
+    except Exception as e:
+        message = ("result", job_id, False, f"{type(e).__name__}: {e}")
+    try:
+        _send(connection, send_lock, message)
+    except (OSError, ValueError):
+        pass  # The bot process is gone; the receive loop stops the worker
+
+async def _run(target, args):
+    if asyncio.iscoroutinefunction(target):
+        return await target(*args)
+    # Blocking calls (session file moves, the device count check) go to the default thread pool
+    return await asyncio.get_running_loop().run_in_executor(None, target, *args)
+
+async def _prune_clients(session_manager):
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+        try:
+            pruned = await session_manager.prune_clients()
+            if pruned:
+                print(f"🧹 Disconnected {pruned} clients without a verification state")
+        except Exception as e:
+            print(f"❌ Error pruning clients: {e}")
+
+def _receive_jobs(connection, send_lock, loop, targets):
+    while True:
+        try:
+            job_id, name, args = connection.recv()
+        except (EOFError, OSError):
+            break
+        future = asyncio.run_coroutine_threadsafe(_run(targets[name], args), loop)
+        future.add_done_callback(lambda done, job_id=job_id: _reply(connection, send_lock, job_id, done))
+    loop.call_soon_threadsafe(loop.stop)
+
+def run_worker(index, fd):
+    initializer = os.getenv("OTP_SHARD_INIT")
+    if initializer:
+        module, _, function = initializer.partition(":")
+        getattr(importlib.import_module(module), function)()
+
+    import telegram_otp
+    from telegram_otp import session_manager
+
+    connection = Connection(fd)
+    send_lock = threading.Lock()
+    session_manager.add_session_saved_listener(
+        lambda phone_number, session_path: _send(connection, send_lock, ("session_saved", (phone_number, session_path))))
+    session_manager.add_temp_session_listener(
+        lambda session_path: _send(connection, send_lock, ("temp_session", (session_path,))))
+
+    targets = {name: getattr(session_manager, name) for name in SESSION_METHODS}
+    targets.update({name: getattr(telegram_otp, name) for name in FUNCTIONS})
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.create_task(_prune_clients(session_manager))
+    threading.Thread(target=_receive_jobs, args=(connection, send_lock, loop, targets), daemon=True,
+                     name=f"OTPShard-{index}-jobs").start()
+    print(f"🧩 OTP worker {index} ready (pid {os.getpid()})")
+    loop.run_forever()
+
+if __name__ == "__main__":
+    run_worker(int(sys.argv[1]), int(sys.argv[2]))
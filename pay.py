@@ -1,9 +1,11 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import approve_withdrawal, get_user, update_user, get_pending_withdrawal, update_user_balance, add_transaction_log
 from utils import require_channel_membership
+from translations import get_text
 
-@bot.message_handler(commands=['pay'])
+@router.command('pay')
 @require_channel_membership
 def handle_pay(message):
     admin_id = message.from_user.id
@@ -48,17 +50,7 @@ def handle_pay(message):
     modified = approve_withdrawal(user_id)
     lang = user.get('language', 'English')
     if modified:
-        texts = {
-            'English': "✅ Your withdrawal has been approved and completed. Thank you!",
-            'Arabic': "✅ تم الموافقة على سحبك وتمت العملية بنجاح. شكرًا لك!",
-            'Chinese': "✅ 您的提现已批准并完成。谢谢！"
-        }
-        bot.send_message(user_id, texts.get(lang, texts['English']))
-        admin_texts = {
-            'English': f"✅ Withdrawal for user {user_id} marked as complete and balance updated.",
-            'Arabic': f"✅ تم تحديث رصيد المستخدم {user_id} وتأكيد السحب.",
-            'Chinese': f"✅ 用户 {user_id} 的提现已完成并更新余额。"
-        }
-        bot.reply_to(message, admin_texts.get(lang, admin_texts['English']))
+        bot.send_message(user_id, get_text('withdrawal_approved', lang))
+        bot.reply_to(message, get_text('withdrawal_approved_admin', lang, user_id=user_id))
     else:
         bot.reply_to(message, "❌ No pending withdrawal found for that user.")
@@ -1,16 +1,14 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import (
-    get_pending_withdrawals_by_card,
-    approve_withdrawals_by_card,
-    get_user,
-    update_user,
-    update_user_balance,
-    add_transaction_log
+    get_pending_withdrawals_count_by_card,
+    pay_withdrawals_by_card
 )
+from notification_outbox import notification_outbox
 from utils import require_channel_membership
 
-@bot.message_handler(commands=['paycard'])
+@router.command('paycard')
 @require_channel_membership
 def handle_paycard(message):
     admin_id = message.from_user.id
@@ -24,50 +22,22 @@ def handle_paycard(message):
         return
 
     card_name = parts[1].strip()
-    pending_withdrawals = get_pending_withdrawals_by_card(card_name)
-    if not pending_withdrawals:
+    if not get_pending_withdrawals_count_by_card(card_name):
         bot.reply_to(message, f"❌ No pending withdrawals found for card '{card_name}'.")
         return
 
-    # Process each withdrawal
-    for w in pending_withdrawals:
-        user_id = w["user_id"]
-        amount = w["amount"]
-        user = get_user(user_id) or {}
-        current_balance = user.get("balance", 0.0)
-        
-        # Deduct the amount and log transaction
-        if current_balance >= amount:
-            new_balance = update_user_balance(user_id, -amount)  # Negative amount for withdrawal
-            # Log the withdrawal transaction
-            add_transaction_log(
-                user_id=user_id,
-                transaction_type="leader_card_withdrawal",
-                amount=-amount,  # Negative for withdrawal
-                description=f"Leader card withdrawal approved: {card_name}",
-                phone_number=""
-            )
-        else:
-            # Skip this withdrawal if insufficient balance
-            print(f"⚠️ Skipping withdrawal for user {user_id}: insufficient balance ({current_balance}$ < {amount}$)")
-            continue
-        # Notify the user
-        lang = user.get('language', 'English')
-        try:
-            texts = {
-                'English': f"✅ Your withdrawal of {amount}$ with leader card '{card_name}' has been approved and completed. Thank you!",
-                'Arabic': f"✅ تم الموافقة على سحبك بمبلغ {amount}$ باستخدام بطاقة القائد '{card_name}' وتمت العملية بنجاح. شكرًا لك!",
-                'Chinese': f"✅ 您使用领队卡 '{card_name}' 的 {amount}$ 提现已批准并完成。谢谢！"
-            }
-            bot.send_message(user_id, texts.get(lang, texts['English']))
-        except Exception:
-            pass  # User may have blocked the bot, ignore errors
+    # Debits, ledger entries, approvals and user notifications are written in
+    # batched transactions; rerunning /paycard resumes an interrupted payout
+    summary = pay_withdrawals_by_card(card_name)
+    notification_outbox.notify()
 
-    # Approve all in the database
-    approve_withdrawals_by_card(card_name)
-    admin_texts = {
-        'English': f"✅ All pending withdrawals for card '{card_name}' have been approved and users notified.",
-        'Arabic': f"✅ تم الموافقة على جميع طلبات السحب المعلقة لبطاقة '{card_name}' وتم إخطار المستخدمين.",
-        'Chinese': f"✅ 领队卡 '{card_name}' 的所有待处理提现已批准并通知用户。"
-    }
-    bot.reply_to(message, admin_texts.get('English', admin_texts['English']))
+    lines = [
+        f"✅ Paid {summary['paid']} pending withdrawals for card '{card_name}' "
+        f"(${summary['paid_amount']:.2f} to {summary['users']} users). Users are being notified."
+    ]
+    if summary["skipped"]:
+        skipped_users = len({skip["user_id"] for skip in summary["skipped"]})
+        lines.append(f"⚠️ {len(summary['skipped'])} withdrawals from {skipped_users} users were left pending: insufficient balance.")
+    if summary["failed_batches"]:
+        lines.append(f"❌ {summary['failed_batches']} batches failed and were rolled back. Run /paycard {card_name} again to retry them.")
+    bot.reply_to(message, "\n".join(lines))
@@ -8,6 +8,7 @@ from telethon import TelegramClient
 import socks
 import aiohttp
 import socket
+import metrics
 
 class ProxyManager:
     def __init__(self):
@@ -22,7 +23,9 @@ class ProxyManager:
     def set_notification_bot(self, bot):
         """Set the bot instance for sending notifications"""
         self.notification_bot = bot
-        # Perform initial health check when bot is set
+    
+    def start_initial_health_check(self):
+        """Check every proxy once in a background thread (main() runs this after the bot is ready)"""
         if self.proxies:
             import asyncio
             import threading
@@ -328,6 +331,14 @@ class ProxyManager:
         
         print("🔄 Reset all failed proxies")
     
+    def get_proxy_scores(self) -> Dict[str, float]:
+        """Success ratio per proxy from health checks; unchecked proxies score 1.0"""
+        scores = {}
+        for proxy_key, status in list(self.proxy_health_status.items()):
+            checks = status['success_count'] + status['failure_count']
+            scores[proxy_key] = status['success_count'] / checks if checks else 1.0
+        return scores
+    
     def get_proxy_stats(self) -> str:
         """Get detailed proxy statistics"""
         if not self.proxies:
@@ -362,4 +373,12 @@ class ProxyManager:
         return stats
 
 # Global proxy manager instance
-proxy_manager = ProxyManager()
\ No newline at end of file
+proxy_manager = ProxyManager()
+
+metrics.PROXY_SCORE.set_function(proxy_manager.get_proxy_scores)
+metrics.PROXY_RESPONSE_SECONDS.set_function(
+    lambda: {key: status['response_time'] for key, status in list(proxy_manager.proxy_health_status.items())}
+)
+metrics.PROXY_FAILED.set_function(
+    lambda: {key: int(status['status'] == 'failed') for key, status in list(proxy_manager.proxy_health_status.items())}
+)
@@ -1,32 +1,16 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import (
     reject_withdrawals_by_user,
     reject_withdrawals_by_card,
     get_user
 )
+from notification_outbox import notification_outbox
 from utils import require_channel_membership
 import re
 
-def notify_user_rejection(user_id, withdrawals, reason="No reason provided"):
-    """Send rejection notification to user with custom reason"""
-    total_amount = sum(w['amount'] for w in withdrawals)
-    try:
-        bot.send_message(
-            user_id,
-            f"❌ *Withdrawal Rejected* ❌\n\n"
-            f"💰 **Amount**: ${total_amount}\n"
-            f"📋 **Reason**: {reason}\n"
-            f"📉 **Balance deducted**: ${total_amount}\n\n"
-            f"💬 Contact support if you have questions about this rejection.\n"
-            f"🔄 You can make a new withdrawal request if eligible.",
-            parse_mode="Markdown"
-        )
-        print(f"✅ Notified user {user_id} about rejection (${total_amount}) - Reason: {reason}")
-    except Exception as e:
-        print(f"Could not notify user {user_id}: {str(e)}")
-
-@bot.message_handler(commands=['rejectpayment'])
+@router.command('rejectpayment')
 @require_channel_membership
 def handle_reject_payment(message):
     admin_id = message.from_user.id
@@ -50,19 +34,11 @@ def handle_reject_payment(message):
     # Check if rejecting by card
     if target.startswith("card:"):
         card_name = target[5:]  # Remove 'card:' prefix
+        # The rejection queues one notification per user in the same transaction
         count, withdrawals = reject_withdrawals_by_card(card_name, reason)
         if count > 0:
-            # Notify each affected user with reason
-            user_withdrawals = {}
-            for w in withdrawals:
-                user_id = w['user_id']
-                if user_id not in user_withdrawals:
-                    user_withdrawals[user_id] = []
-                user_withdrawals[user_id].append(w)
-            
-            # Send notifications with custom reason
-            for user_id, user_w_list in user_withdrawals.items():
-                notify_user_rejection(user_id, user_w_list, reason)
+            notification_outbox.notify()
+            user_withdrawals = {w['user_id'] for w in withdrawals}
             
             total_amount = sum(w['amount'] for w in withdrawals)
             bot.reply_to(message, 
@@ -88,7 +64,7 @@ def handle_reject_payment(message):
 
         count, withdrawals = reject_withdrawals_by_user(user_id, reason)
         if count > 0:
-            notify_user_rejection(user_id, withdrawals, reason)
+            notification_outbox.notify()
             total_amount = sum(w['amount'] for w in withdrawals)
             bot.reply_to(message, 
                 f"✅ *Payment Rejection Completed*\n\n"
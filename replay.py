@@ -0,0 +1,345 @@
+"""
+Replay recorded Telegram updates against stand-in backends.
+
+Takes a JSONL file written by update_recorder.py (UPDATE_RECORD_FILE or
+/recordupdates) and feeds the updates back through the bot's full handler chain
+(every module main.py imports) on the fake Bot API, fake Telethon and mongomock
+from loadtest.py. Inter-arrival gaps are preserved and divided by --speed, so
+--speed 10 replays an hour of production traffic in six minutes with the same
+bursts.
+
+For every update it measures the time until the bot's first message to that
+chat, grouped by kind (command, phone, code, text, callback), and reports how
+far the replayer itself fell behind its schedule.
+
+Usage:
+    python replay.py updates.jsonl
+    python replay.py updates.jsonl --speed 20 --max-gap-seconds 30
+    python replay.py updates.jsonl --speed 5 --send-code-ms 800 --json replay.json --max-reply-p95-ms 2000
+
+Countries for the recorded phone prefixes are created in the stand-in database
+so phone numbers route like they did in production. Exits with status 1 when
+--max-reply-p95-ms or --max-unanswered-rate is exceeded.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import contextlib
+from collections import Counter
+
+from loadtest import (
+    FakeTelegramClient, LoadTestHarness, ResourceSampler, add_backend_arguments,
+    _bot_thread_count, _rss_bytes
+)
+
+REPLY_KINDS = ("command", "phone", "code", "text", "callback", "other")
+
+def load_recording(path, limit=None, max_gap=None):
+    """
+    (offset, update) pairs from a recording, starting at offset 0. Offsets keep
+    increasing across the recordings appended to one file; idle gaps longer
+    than max_gap seconds are shortened to max_gap.
+    """
+    entries = []
+    session_base = 0.0
+    last_offset = 0.0
+    with open(path, encoding="utf-8") as recording:
+        for line in recording:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "recording_started" in entry:
+                # A later recording continues right where the previous one stopped
+                session_base = last_offset
+                continue
+            last_offset = session_base + entry["t"]
+            entries.append((last_offset, entry["update"]))
+            if limit and len(entries) >= limit:
+                break
+
+    replay = []
+    previous = None
+    offset = 0.0
+    for recorded_offset, update in entries:
+        if previous is not None:
+            gap = max(0.0, recorded_offset - previous)
+            offset += min(gap, max_gap) if max_gap is not None else gap
+        previous = recorded_offset
+        replay.append((offset, update))
+    return replay
+
+def _update_message(update):
+    return update.get("message") or update.get("edited_message")
+
+def update_chat_id(update):
+    message = _update_message(update)
+    if message:
+        return message["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    return None
+
+def update_kind(update, phone_regex):
+    if "callback_query" in update:
+        return "callback"
+    message = _update_message(update)
+    if not message:
+        return "other"
+    text = (message.get("text") or "").strip()
+    if text.startswith('/'):
+        return "command"
+    if phone_regex.match(text) or "contact" in message:
+        return "phone"
+    if text.isdigit():
+        return "code"
+    return "text"
+
+def recorded_country_prefixes(replay, phone_regex):
+    """Country prefixes (as otp.get_country_code reads them) of every recorded phone number"""
+    from update_recorder import PHONE_PREFIX_LENGTH
+
+    prefixes = set()
+    for _, update in replay:
+        message = _update_message(update) or {}
+        text = (message.get("text") or "").strip()
+        if phone_regex.match(text):
+            prefixes.add(text[:PHONE_PREFIX_LENGTH])
+        contact = message.get("contact") or {}
+        if contact.get("phone_number"):
+            prefixes.add(contact["phone_number"][:PHONE_PREFIX_LENGTH])
+    return prefixes
+
+class ReplayHarness(LoadTestHarness):
+    handler_modules = ("main",)
+
+    def __init__(self, args, workdir):
+        super().__init__(args, workdir)
+        self.countries = set()
+
+    def setup(self):
+        # main.py installs the queued logging pipeline at import; keep it at the requested level
+        os.environ["LOG_LEVEL"] = self.args.log_level
+        os.environ["LOG_FORMAT"] = "text"
+        super().setup()
+
+    def seed_countries(self, prefixes):
+        for prefix in prefixes:
+            if self.db.get_country_by_code(prefix):
+                continue
+            self.db.set_country_capacity(prefix, 10**9, name=f"Replay {prefix}", flag="🏁")
+            self.db.set_country_price(prefix, self.args.price)
+            self.db.set_country_claim_time(prefix, self.args.claim_time)
+            self.countries.add(prefix)
+
+    def cleanup_database(self):
+        super().cleanup_database()
+        for prefix in self.countries:
+            self.db.db.countries.delete_one({"country_code": prefix})
+
+    def wait_for_quiet(self, idle_seconds, timeout):
+        """Wait until the bot has sent nothing for idle_seconds (or timeout passes)"""
+        deadline = time.monotonic() + timeout
+        self.wait_for_background_threads(timeout)
+        last_count, last_change = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            count = sum(self.api.calls[method] for method in ("sendMessage", "editMessageText", "sendDocument"))
+            if count != last_count:
+                last_count, last_change = count, time.monotonic()
+            elif time.monotonic() - last_change >= idle_seconds:
+                return
+            time.sleep(0.05)
+
+    def replay(self, entries, speed):
+        """Push every update at its scheduled time and return the replay report"""
+        phone_regex = self.otp.PHONE_REGEX
+        pushed = []
+        lags = []
+
+        sampler = ResourceSampler()
+        calls_before = Counter(self.api.calls)
+        rss_start = _rss_bytes()
+        threads_start = _bot_thread_count()
+        sampler.start()
+        started = time.perf_counter()
+        for offset, update in entries:
+            due = started + offset / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            chat_id = update_chat_id(update)
+            pushed_at = time.perf_counter()
+            index = self.api.message_count(chat_id) if chat_id is not None else 0
+            self.api.push_update(dict(update))
+            lags.append((pushed_at - due) * 1000)
+            pushed.append((chat_id, update_kind(update, phone_regex), pushed_at, index))
+        pushing_done = time.perf_counter()
+        self.wait_for_quiet(self.args.drain_seconds, self.args.drain_timeout)
+        wall = time.perf_counter() - started
+        sampler.stop()
+
+        latencies = {kind: [] for kind in REPLY_KINDS}
+        unanswered = Counter()
+        for chat_id, kind, pushed_at, index in pushed:
+            reply = None
+            if chat_id is not None:
+                messages = self.api.chat(chat_id).messages
+                reply = next((entry for entry in messages[index:] if entry[0] >= pushed_at), None)
+            if reply is None:
+                unanswered[kind] += 1
+            else:
+                latencies[kind].append((reply[0] - pushed_at) * 1000)
+
+        api_calls = Counter(self.api.calls)
+        api_calls.subtract(calls_before)
+        recorded_seconds = entries[-1][0] if entries else 0.0
+        return {
+            "updates": len(entries),
+            "recorded_seconds": round(recorded_seconds, 1),
+            "speed": speed,
+            "push_seconds": round(pushing_done - started, 3),
+            "wall_seconds": round(wall, 3),
+            "updates_per_second": round(len(entries) / (pushing_done - started), 2) if pushing_done > started else 0.0,
+            "schedule_lag_ms": _summary(sorted(lags)),
+            "replied": sum(len(values) for values in latencies.values()),
+            "unanswered": dict(unanswered),
+            "unanswered_rate": round(sum(unanswered.values()) / len(entries), 4) if entries else 0.0,
+            "reply_ms": {
+                kind: _summary(sorted(values))
+                for kind, values in list(latencies.items()) + [("all", [v for values in latencies.values() for v in values])]
+                if values
+            },
+            "threads": {
+                "bot_before": threads_start,
+                "bot_peak": sampler.bot_threads_peak,
+                "bot_after": _bot_thread_count(),
+                "process_peak": sampler.threads_peak
+            },
+            "memory": {
+                "rss_start_mb": round(rss_start / 2**20, 1),
+                "rss_peak_mb": round(sampler.rss_peak / 2**20, 1),
+                "rss_end_mb": round(_rss_bytes() / 2**20, 1)
+            },
+            "bot_api_calls": {method: count for method, count in api_calls.items() if count},
+            "telethon_calls": dict(FakeTelegramClient.calls)
+        }
+
+def _summary(values):
+    from tracing import percentile
+
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50), 1),
+        "p95": round(percentile(values, 0.95), 1),
+        "p99": round(percentile(values, 0.99), 1),
+        "max": round(values[-1], 1)
+    }
+
+def format_report(report):
+    lag = report["schedule_lag_ms"]
+    lines = [
+        f"📊 Replayed {report['updates']} updates ({report['recorded_seconds']:.0f}s recorded) at {report['speed']:g}× "
+        f"in {report['push_seconds']:.1f}s → {report['updates_per_second']:.2f} updates/s",
+        f"   ⏱️ Schedule lag p95 {lag.get('p95', 0):.1f} ms, max {lag.get('max', 0):.1f} ms",
+        f"   💬 Replied to {report['replied']}/{report['updates']} "
+        f"(unanswered: {', '.join(f'{kind}={count}' for kind, count in sorted(report['unanswered'].items())) or 'none'})",
+        f"   {'first reply':<18}{'count':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)"
+    ]
+    for kind, row in report["reply_ms"].items():
+        lines.append(f"   {kind:<18}{row['count']:>6}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}{row['max']:>10.1f}")
+    threads, memory = report["threads"], report["memory"]
+    lines.append(f"   🧵 Bot threads {threads['bot_before']} → peak {threads['bot_peak']} → {threads['bot_after']}")
+    lines.append(f"   💾 RSS {memory['rss_start_mb']} → peak {memory['rss_peak_mb']} MB")
+    api_calls = sorted((method, count) for method, count in report["bot_api_calls"].items() if method != "getUpdates")
+    lines.append("   📡 Bot API: " + ", ".join(f"{method}={count}" for method, count in api_calls))
+    return "\n".join(lines)
+
+def check_thresholds(report, args):
+    violations = []
+    p95 = report["reply_ms"].get("all", {}).get("p95")
+    if args.max_reply_p95_ms is not None and p95 is not None and p95 > args.max_reply_p95_ms:
+        violations.append(f"first reply p95 {p95}ms > {args.max_reply_p95_ms}ms")
+    if args.max_unanswered_rate is not None and report["unanswered_rate"] > args.max_unanswered_rate:
+        violations.append(f"unanswered rate {report['unanswered_rate']} > {args.max_unanswered_rate}")
+    return violations
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against a fake Bot API and fake Telethon")
+    parser.add_argument("recording", help="JSONL file written by update_recorder.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay this many times faster than recorded")
+    parser.add_argument("--limit", type=int, help="Only replay the first N updates")
+    parser.add_argument("--max-gap-seconds", type=float, help="Shorten recorded idle gaps to at most this (before --speed)")
+    parser.add_argument("--drain-seconds", type=float, default=3.0, help="Stop once the bot has been quiet this long after the last update")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="Longest wait for replies after the last update")
+
+    add_backend_arguments(parser)
+    # By default otp.py's claim waits are compressed by the same factor as the traffic
+    parser.set_defaults(clock_speedup=None)
+
+    output_group = parser.add_argument_group("output and thresholds")
+    output_group.add_argument("--json", help="Write the report to this file")
+    output_group.add_argument("--bot-log", default=os.devnull, help="Where the bot's own output goes (default: discarded)")
+    output_group.add_argument("--log-level", default="WARNING")
+    output_group.add_argument("--keep-workdir", action="store_true", help="Keep the temporary sessions directory")
+    output_group.add_argument("--max-reply-p95-ms", type=float, help="Fail when the first-reply p95 exceeds this")
+    output_group.add_argument("--max-unanswered-rate", type=float, help="Fail when more than this fraction of updates gets no reply")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.speed <= 0:
+        sys.exit("❌ --speed must be positive")
+    if args.clock_speedup is None:
+        args.clock_speedup = args.speed
+
+    try:
+        entries = load_recording(args.recording, args.limit, args.max_gap_seconds)
+    except (OSError, ValueError, KeyError) as e:
+        sys.exit(f"❌ Can't read recording {args.recording}: {e}")
+    if not entries:
+        sys.exit(f"❌ No updates in {args.recording}")
+
+    workdir = tempfile.mkdtemp(prefix="otpbot-replay-")
+    out = sys.stdout
+    with open(args.bot_log, "a") as bot_log:
+        harness = ReplayHarness(args, workdir)
+        try:
+            with contextlib.redirect_stdout(bot_log):
+                harness.setup()
+                harness.seed_countries(recorded_country_prefixes(entries, harness.otp.PHONE_REGEX))
+            print(f"🚀 Replaying {len(entries)} updates at {args.speed:g}×...", file=out, flush=True)
+            with contextlib.redirect_stdout(bot_log):
+                report = harness.replay(entries, args.speed)
+        finally:
+            with contextlib.redirect_stdout(bot_log):
+                harness.teardown()
+            if not args.keep_workdir:
+                import shutil
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    print(format_report(report), file=out, flush=True)
+    if args.json:
+        report["settings"] = {key: value for key, value in vars(args).items() if key not in ("json", "bot_log")}
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"💾 Report written to {args.json}", file=out)
+
+    violations = check_thresholds(report, args)
+    for violation in violations:
+        print(f"❌ {violation}", file=out)
+    if violations:
+        return 1
+    print("✅ Replay finished", file=out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Per-update context carrying the user document through a handler.
+
+The membership check, the message filters, the handler and helpers such as
+get_user_language() each used to call get_user() for the same update. The
+first of them now loads the document into a RequestContext attached to the
+message (or callback query), and the rest read it from there.
+require_channel_membership activates the context for the handler's thread, so
+helpers that only see a user_id find it through current_context().
+
+Fields that nothing else needs to see straight away (channel_verified,
+language_selecting, ...) are staged on the context and written by a single
+update_user when the handler returns. Immediate update_user calls made while a
+context is active are applied to the cached document, so later reads in the
+same update see them without going back to MongoDB.
+"""
+
+import threading
+from datetime import datetime
+from db import get_user, update_user, add_user_write_listener
+
+DEFAULT_LANGUAGE = 'English'
+
+_local = threading.local()
+
+class RequestContext:
+    __slots__ = ("user_id", "_user", "loaded", "staged")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._user = None
+        self.loaded = False
+        self.staged = {}
+
+    @property
+    def user(self):
+        """The user's document, read from MongoDB at most once per update"""
+        if not self.loaded:
+            self._user = get_user(self.user_id)
+            self.loaded = True
+        return self._user
+
+    @property
+    def language(self):
+        user = self.user
+        if user and user.get('language'):
+            return user['language']
+        return DEFAULT_LANGUAGE
+
+    def create_user(self, data):
+        """Stage a new user's fields and cache the document the upsert will create, instead of reading it back"""
+        document = {
+            'user_id': self.user_id,
+            'registered_at': datetime.utcnow(),
+            'balance': 0.0,
+            'sent_accounts': 0,
+            'pending_phone': None,
+            'otp_msg_id': None
+        }
+        # Fields update_user already sets on insert are left to $setOnInsert, so the
+        # deferred write can never reset a balance credited earlier in the update
+        self.staged.update({field: value for field, value in data.items() if field not in document})
+        document.update(data)
+        self._user = document
+        self.loaded = True
+        return document
+
+    def apply(self, data):
+        """Bring the cached document in line with fields written elsewhere"""
+        if self.loaded and self._user is not None:
+            self._user.update(data)
+
+    def stage(self, data):
+        """Set fields on the cached document now and write them when the update is done"""
+        self.staged.update(data)
+        if self.loaded and self._user is not None:
+            self._user.update(data)
+
+    def flush(self):
+        """Write staged fields in one update_user call"""
+        if not self.staged:
+            return True
+        staged, self.staged = self.staged, {}
+        return update_user(self.user_id, staged)
+
+def context_for(update):
+    """The context of a message or callback query, created on first use"""
+    context = update.__dict__.get('_request_context')
+    if context is None:
+        context = RequestContext(update.from_user.id)
+        update._request_context = context
+    return context
+
+def current_context(user_id=None):
+    """The context active in this thread, if any (and if it is for user_id when given)"""
+    context = getattr(_local, 'context', None)
+    if context is not None and user_id is not None and context.user_id != user_id:
+        return None
+    return context
+
+def activate(context):
+    """Make context current for this thread; returns the context to restore in deactivate()"""
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    return previous
+
+def deactivate(context, previous):
+    """Restore the previous context and write what the handler staged"""
+    _local.context = previous
+    context.flush()
+
+def get_context_user(user_id):
+    """get_user() that reuses the active context's document"""
+    context = current_context(user_id)
+    if context is not None:
+        return context.user
+    return get_user(user_id)
+
+def get_user_language(user_id):
+    context = current_context(user_id)
+    if context is not None:
+        return context.language
+    user = get_user(user_id)
+    if user and user.get('language'):
+        return user['language']
+    return DEFAULT_LANGUAGE
+
+def _apply_user_write(user_id, data):
+    context = current_context(user_id)
+    if context is not None:
+        context.apply(data)
+
+add_user_write_listener(_apply_user_write)
@@ -0,0 +1,157 @@
+"""
+Table-driven dispatch for incoming messages and callback queries.
+
+telebot tests every registered handler's filter in registration order, so each
+message used to run through ~60 predicates (phone regex, language list,
+withdrawal state, pending phone lookups) and the first match won. The router
+registers a single message handler and a single callback handler with telebot
+and picks the target with table lookups instead:
+
+    /command        commands[name]
+    exact text      texts[text]                    (language buttons)
+    conversation    the user's state, checked in STATE_PRIORITY order
+    free text       patterns, tried last           (phone numbers)
+
+    callback data   exact_callbacks[data], then callbacks[prefix]
+                    where prefix is the data up to and including its first '_'
+
+Routing a second handler to the same command, text, state or callback raises
+ValueError at import, so the order modules are imported in no longer decides
+which handler runs. The route is resolved in the polling thread like telebot's
+filters were; the handler itself still runs on telebot's worker threads.
+"""
+
+from telebot import util
+from bot_init import bot
+
+# Which conversation wins when a user is in several at once
+STATE_PRIORITY = ("withdraw_input", "awaiting_password", "otp_pending")
+
+class UpdateRouter:
+    def __init__(self):
+        self.commands = {}
+        self.texts = {}
+        self.states = {}  # state -> (active(message), handler)
+        self.patterns = []  # (compiled regex, handler), matched against the stripped text
+        self.exact_callbacks = {}
+        self.callbacks = {}
+
+    def _add(self, table, key, handler, label):
+        existing = table.get(key)
+        if existing is not None and existing is not handler:
+            raise ValueError(f"{label} is already routed to {existing.__name__}")
+        table[key] = handler
+
+    # ==== REGISTRATION ====
+    def command(self, *names):
+        def register(handler):
+            for name in names:
+                self._add(self.commands, name, handler, f"/{name}")
+            return handler
+        return register
+
+    def text(self, *values):
+        def register(handler):
+            for value in values:
+                self._add(self.texts, value, handler, f"Text {value!r}")
+            return handler
+        return register
+
+    def state(self, name, active):
+        """Route text from users for whom active(message) is true; name must be in STATE_PRIORITY"""
+        if name not in STATE_PRIORITY:
+            raise ValueError(f"Unknown conversation state {name!r} (add it to STATE_PRIORITY)")
+
+        def register(handler):
+            if name in self.states:
+                raise ValueError(f"State {name} is already routed to {self.states[name][1].__name__}")
+            self.states[name] = (active, handler)
+            return handler
+        return register
+
+    def pattern(self, regex):
+        def register(handler):
+            for existing, routed in self.patterns:
+                if existing.pattern == regex.pattern:
+                    raise ValueError(f"Pattern {regex.pattern!r} is already routed to {routed.__name__}")
+            self.patterns.append((regex, handler))
+            return handler
+        return register
+
+    def callback(self, data):
+        """Route callback queries whose data is exactly data, or starts with it when it ends in '_'"""
+        def register(handler):
+            if data.endswith('_'):
+                self._add(self.callbacks, data, handler, f"Callback prefix {data!r}")
+            else:
+                self._add(self.exact_callbacks, data, handler, f"Callback {data!r}")
+            return handler
+        return register
+
+    # ==== DISPATCH ====
+    def resolve_message(self, message):
+        text = message.text
+        if not text:
+            return None
+        if text[0] == '/':
+            # Commands never fall through to the text routes
+            return self.commands.get(util.extract_command(text))
+
+        handler = self.texts.get(text)
+        if handler is not None:
+            return handler
+
+        for name in STATE_PRIORITY:
+            route = self.states.get(name)
+            if route is None:
+                continue
+            try:
+                active = route[0](message)
+            except Exception as e:
+                # Conversation state unreadable (MongoDB down): drop the message rather than
+                # let a password or withdrawal amount fall through to the free-text routes
+                print(f"Error resolving {name} state: {str(e)}")
+                return None
+            if active:
+                return route[1]
+
+        stripped = text.strip()
+        for regex, handler in self.patterns:
+            if regex.match(stripped):
+                return handler
+        return None
+
+    def resolve_callback(self, call):
+        data = call.data or ''
+        handler = self.exact_callbacks.get(data)
+        if handler is not None:
+            return handler
+        separator = data.find('_')
+        if separator < 0:
+            return None
+        return self.callbacks.get(data[:separator + 1])
+
+    def _match_message(self, message):
+        message._route = self.resolve_message(message)
+        return message._route is not None
+
+    def _match_callback(self, call):
+        call._route = self.resolve_callback(call)
+        return call._route is not None
+
+    def _dispatch(self, update):
+        return update._route(update)
+
+    def get_stats(self):
+        return {
+            "commands": len(self.commands),
+            "texts": len(self.texts),
+            "states": [name for name in STATE_PRIORITY if name in self.states],
+            "patterns": len(self.patterns),
+            "callbacks": len(self.exact_callbacks) + len(self.callbacks)
+        }
+
+router = UpdateRouter()
+
+bot.register_message_handler(router._dispatch, func=router._match_message)
+bot.register_callback_query_handler(router._dispatch, func=router._match_callback)
@@ -0,0 +1,216 @@
+"""
+Streaming, size-split session archive exporter.
+
+Used by /get, /getall and /sendzip. Session files are written into zip parts that
+roll over before they reach SESSION_ARCHIVE_PART_MB, so every part fits under
+Telegram's document limit. Each finished part is handed to an uploader thread
+while the next part is being built, and is deleted as soon as it has been sent.
+A part is only handed over once the previous one is gone, so at most two parts
+are on disk (one uploading, one being built) however many sessions exist.
+
+Incremental exports pass `modified_after` (a destination's watermark) to
+iter_session_files and, once every part has been sent, advance the watermark to
+the time the scan started. Not to the newest exported mtime: os.scandir is not
+in mtime order, so a session saved mid-scan into a directory already read can be
+older than a file picked up later, and would fall below that watermark for good.
+"""
+
+import os
+import json
+import queue
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+from config import SESSIONS_DIR, SESSION_ARCHIVE_PART_MB, SESSION_ARCHIVE_COMPRESSION
+
+COMPRESSION_MODES = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED
+}
+
+# Per-entry bytes added by the local header, central directory record and data descriptor
+ZIP_ENTRY_OVERHEAD = 128
+
+def iter_session_files(country_code=None, modified_after=None):
+    """
+    Yield (country, phone_number, session_path, stat) for saved session files
+    without building the whole listing in memory. Temporary tmp_* sessions are skipped,
+    as are files not modified after `modified_after` (an mtime) when it is given.
+    """
+    if not os.path.exists(SESSIONS_DIR):
+        return
+
+    with os.scandir(SESSIONS_DIR) as countries:
+        for country_entry in countries:
+            if not country_entry.is_dir():
+                continue
+            if country_code and country_entry.name != country_code:
+                continue
+
+            with os.scandir(country_entry.path) as files:
+                for file_entry in files:
+                    name = file_entry.name
+                    if not name.endswith('.session') or name.startswith('tmp_'):
+                        continue
+                    try:
+                        stat = file_entry.stat()
+                    except OSError:
+                        continue
+                    if modified_after is not None and stat.st_mtime <= modified_after:
+                        continue
+                    yield country_entry.name, name[:-len('.session')], file_entry.path, stat
+
+class SessionArchiveExporter:
+    """
+    Build zip parts from an iterable of session entries and upload each part
+    through `send_part(part_path, part_name, part_number, file_count)` as soon
+    as it is finished.
+    """
+
+    def __init__(self, send_part, name_prefix="sessions", part_size_mb=None, compression=None, manifest=False):
+        self.send_part = send_part
+        self.name_prefix = name_prefix
+        self.part_size_bytes = int((part_size_mb or SESSION_ARCHIVE_PART_MB) * 1024 * 1024)
+        mode = (compression or SESSION_ARCHIVE_COMPRESSION).lower()
+        self.compression = COMPRESSION_MODES.get(mode, zipfile.ZIP_DEFLATED)
+        self.timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.manifest = manifest
+        self.manifest_entries = []
+
+        self.part_number = 0
+        self.file_count = 0
+        self.total_bytes = 0
+        self.parts_sent = 0
+        self.parts_failed = 0
+
+        # _finish_part waits on join() for the previous part, so the queue never holds a second one
+        self._upload_queue = queue.Queue()
+        self._uploader = None
+
+    def _part_name(self, part_number):
+        return f"{self.name_prefix}_{self.timestamp}_part{part_number:03d}.zip"
+
+    def _upload_loop(self):
+        while True:
+            item = self._upload_queue.get()
+            if item is None:
+                break
+            part_path, part_name, part_number, file_count = item
+            try:
+                self.send_part(part_path, part_name, part_number, file_count)
+                self.parts_sent += 1
+                print(f"✅ Uploaded archive part {part_name} ({file_count} sessions)")
+            except Exception as e:
+                self.parts_failed += 1
+                print(f"❌ Error uploading archive part {part_name}: {e}")
+            finally:
+                try:
+                    os.unlink(part_path)
+                except OSError:
+                    pass
+                self._upload_queue.task_done()
+
+    def _open_part(self):
+        self.part_number += 1
+        part_file = tempfile.NamedTemporaryFile(prefix='session_archive_', suffix='.zip', delete=False)
+        return part_file, zipfile.ZipFile(part_file, 'w', self.compression)
+
+    def _finish_part(self, part_file, zip_file, file_count):
+        zip_file.close()
+        part_file.close()
+        if not zip_file.filelist:
+            os.unlink(part_file.name)
+            self.part_number -= 1
+            return
+        # Hand over only once the previous part has been uploaded and deleted
+        self._upload_queue.join()
+        self._upload_queue.put((part_file.name, self._part_name(self.part_number), self.part_number, file_count))
+
+    def _manifest_json(self, parts):
+        return json.dumps({
+            "exported_at": datetime.now().isoformat(),
+            "files": self.file_count,
+            "bytes": self.total_bytes,
+            "parts": parts,
+            "entries": self.manifest_entries
+        }, indent=2).encode()
+
+    def export(self, entries):
+        """
+        Archive `entries`, an iterable of (arcname, session_path) pairs, and upload the parts.
+        Returns a summary dict with file, byte and part counts.
+        """
+        self._uploader = threading.Thread(target=self._upload_loop, daemon=True, name="SessionArchiveUploader")
+        self._uploader.start()
+
+        part_file, zip_file = self._open_part()
+        part_files = 0
+        try:
+            for arcname, session_path in entries:
+                try:
+                    stat = os.stat(session_path)
+                except OSError:
+                    continue
+                size = stat.st_size
+
+                projected = part_file.tell() + size + len(arcname) + ZIP_ENTRY_OVERHEAD
+                if part_files and projected > self.part_size_bytes:
+                    self._finish_part(part_file, zip_file, part_files)
+                    part_file, zip_file = self._open_part()
+                    part_files = 0
+
+                try:
+                    zip_file.write(session_path, arcname)
+                except OSError as e:
+                    print(f"⚠️ Skipping {session_path}: {e}")
+                    continue
+                part_files += 1
+                self.file_count += 1
+                self.total_bytes += size
+                if self.manifest:
+                    self.manifest_entries.append({
+                        "file": arcname,
+                        "size": size,
+                        "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                        "part": self.part_number
+                    })
+
+            if self.manifest and self.manifest_entries:
+                # The manifest goes into the last part so it lists every part's contents
+                manifest = self._manifest_json(self.part_number)
+                projected = part_file.tell() + len(manifest) + len("manifest.json") + ZIP_ENTRY_OVERHEAD
+                if part_files and projected > self.part_size_bytes:
+                    # No room left under the size limit: the manifest gets a part of its own
+                    self._finish_part(part_file, zip_file, part_files)
+                    part_file, zip_file = self._open_part()
+                    part_files = 0
+                    manifest = self._manifest_json(self.part_number)
+                zip_file.writestr("manifest.json", manifest)
+
+            self._finish_part(part_file, zip_file, part_files)
+        except Exception:
+            zip_file.close()
+            part_file.close()
+            if os.path.exists(part_file.name):
+                os.unlink(part_file.name)
+            raise
+        finally:
+            self._upload_queue.put(None)
+            self._uploader.join()
+
+        return {
+            "files": self.file_count,
+            "bytes": self.total_bytes,
+            "parts": self.part_number,
+            "parts_sent": self.parts_sent,
+            "parts_failed": self.parts_failed
+        }
+
+def document_part_sender(bot, chat_id, caption_prefix=""):
+    """Return a send_part callback that uploads each part as a document to chat_id"""
+    def send_part(part_path, part_name, part_number, file_count):
+        caption = f"{caption_prefix}{part_name}\n📦 Part {part_number} • 📱 {file_count} sessions"
+        with open(part_path, 'rb') as part:
+            bot.send_document(chat_id, part, caption=caption, visible_file_name=part_name)
+    return send_part
@@ -0,0 +1,423 @@
+"""
+Event-driven session file janitor.
+
+Replaces the periodic tree scans of the old temp_session_cleanup and
+session_cleanup schedulers. The sessions tree is indexed once when the janitor
+starts (and when long-term cleanup is enabled or run manually); after that files
+only enter the index through SessionManager events - a temporary session being
+created or a final session being saved. Every indexed file sits in a heap keyed
+by the time its age rule becomes due, so each pass touches only the files that
+are due. In-use paths are read from the user states once per pass as a set,
+making a pass O(due files + active states) instead of O(stored files x states).
+
+Rules carried over unchanged:
+- tmp_*.session files older than 2 minutes are removed unless a user state
+  younger than 2 minutes still holds them.
+- When long-term cleanup is enabled (off by default), sessions and journals
+  older than 24 hours are removed if they are not in use and are either
+  corrupted or have not been accessed for 24 hours. Journals are kept while
+  their main session exists.
+"""
+
+import os
+import heapq
+import threading
+import time
+from datetime import datetime
+from config import SESSIONS_DIR
+from telegram_otp import session_manager
+
+TEMP_PREFIX = 'tmp_'
+
+class SessionJanitor:
+    def __init__(self, temp_max_age_minutes=2, session_max_age_hours=24, recheck_interval_hours=4, state_sweep_seconds=60):
+        """
+        Args:
+            temp_max_age_minutes: Max age for temp sessions before cleanup
+            session_max_age_hours: Max age for sessions when long-term cleanup is enabled
+            recheck_interval_hours: Delay before re-checking a session that was kept because it was in use
+            state_sweep_seconds: How often expired user states are dropped
+        """
+        self.temp_max_age = temp_max_age_minutes * 60
+        self.session_max_age = session_max_age_hours * 60 * 60
+        self.recheck_interval = recheck_interval_hours * 60 * 60
+        self.state_sweep_seconds = state_sweep_seconds
+        self.session_cleanup_enabled = False  # Default: OFF - admin must enable
+
+        self._due = []       # heap of (due_at, session_path)
+        self._indexed = {}   # session_path -> due_at of its live heap entry
+        self._condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        self.stats = {
+            'temp_removed': 0,
+            'sessions_removed': 0,
+            'bytes_freed': 0,
+            'last_pass_checked': 0,
+            'last_scan_files': 0
+        }
+
+    # ---- index ----
+
+    @staticmethod
+    def _is_temp(session_path):
+        return os.path.basename(session_path).startswith(TEMP_PREFIX)
+
+    def _schedule(self, session_path, due_at):
+        """Add or move a file in the due heap; caller holds the condition"""
+        self._indexed[session_path] = due_at
+        heapq.heappush(self._due, (due_at, session_path))
+
+    def track(self, session_path, due_at=None):
+        """Index a session file; it is checked once its age rule becomes due"""
+        if due_at is None:
+            max_age = self.temp_max_age if self._is_temp(session_path) else self.session_max_age
+            due_at = time.time() + max_age
+        with self._condition:
+            self._schedule(session_path, due_at)
+            self._condition.notify()
+
+    # Only a running janitor (the leader's) indexes new files; start() re-seeds from disk anyway
+    def on_temp_session_created(self, session_path):
+        if self.running:
+            self.track(session_path)
+
+    def on_session_saved(self, phone_number, session_path):
+        if self.running and self.session_cleanup_enabled:
+            self.track(session_path)
+
+    def seed_index(self, include_sessions=None):
+        """
+        One pass over the sessions tree to index files that existed before this process
+        started. Temp files are always indexed; sessions and journals only when long-term
+        cleanup is enabled (or include_sessions is True).
+        """
+        if include_sessions is None:
+            include_sessions = self.session_cleanup_enabled
+
+        if not os.path.exists(SESSIONS_DIR):
+            print(f"📁 Sessions directory {SESSIONS_DIR} doesn't exist, creating it")
+            os.makedirs(SESSIONS_DIR, exist_ok=True)
+            return 0
+
+        found = []
+        directories = [SESSIONS_DIR]
+        with os.scandir(SESSIONS_DIR) as entries:
+            directories.extend(entry.path for entry in entries if entry.is_dir())
+
+        for directory in directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        name = entry.name
+                        if not (name.endswith('.session') or name.endswith('.session-journal')):
+                            continue
+                        if not name.startswith(TEMP_PREFIX) and not include_sessions:
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        max_age = self.temp_max_age if name.startswith(TEMP_PREFIX) else self.session_max_age
+                        found.append((stat.st_mtime + max_age, entry.path))
+            except OSError as e:
+                print(f"⚠️ Error scanning {directory}: {e}")
+
+        with self._condition:
+            for due_at, session_path in found:
+                self._schedule(session_path, due_at)
+            self._condition.notify()
+
+        self.stats['last_scan_files'] = len(found)
+        print(f"📊 Session janitor indexed {len(found)} session files")
+        return len(found)
+
+    # ---- rules ----
+
+    def _remove(self, session_path, size):
+        os.remove(session_path)
+        self.stats['bytes_freed'] += size
+
+    def _check_temp(self, session_path, stat, now, active_paths):
+        """Returns (next_due_at or None, removed_bytes)"""
+        due_at = stat.st_mtime + self.temp_max_age
+        if due_at > now:
+            return due_at, 0
+        if session_path in active_paths:
+            return now + self.temp_max_age, 0
+
+        self._remove(session_path, stat.st_size)
+        self.stats['temp_removed'] += 1
+        print(f"🗑️ Cleaned up temporary session: {os.path.basename(session_path)} (age: {(now - stat.st_mtime)//60:.1f}m, size: {stat.st_size} bytes)")
+        return None, stat.st_size
+
+    def _check_session(self, session_path, stat, now, active_paths):
+        """Returns (next_due_at or None, removed_bytes)"""
+        if stat.st_mtime + self.session_max_age > now:
+            return stat.st_mtime + self.session_max_age, 0
+
+        # Skip journal files while the main session exists
+        if session_path.endswith('.session-journal'):
+            if os.path.exists(session_path[:-len('-journal')]):
+                return now + self.recheck_interval, 0
+
+        if session_path in active_paths or self._is_locked(session_path):
+            print(f"⏭️ Keeping active session: {os.path.basename(session_path)}")
+            return now + self.recheck_interval, 0
+
+        if self._is_corrupted_session(session_path, stat):
+            print(f"🔧 Found corrupted session: {os.path.basename(session_path)}")
+        else:
+            last_access_time = max(stat.st_mtime, stat.st_atime)
+            if (now - last_access_time) <= self.session_max_age:
+                return last_access_time + self.session_max_age, 0
+
+        self._remove(session_path, stat.st_size)
+        self.stats['sessions_removed'] += 1
+        print(f"🗑️ Removed temporary session: {session_path}")
+
+        # An orphaned journal now falls under the rules on its own
+        journal_path = session_path + '-journal'
+        if os.path.exists(journal_path):
+            self.track(journal_path, now)
+        self._remove_empty_directory(os.path.dirname(session_path))
+        return None, stat.st_size
+
+    def _is_locked(self, session_path):
+        """Check if session is locked by another process"""
+        try:
+            with open(session_path, 'r+b'):
+                pass
+            return False
+        except (IOError, OSError):
+            return True
+
+    def _is_corrupted_session(self, session_path, stat):
+        """Very basic corruption check - file size and SQLite header"""
+        try:
+            # SQLite sessions are usually larger than 100 bytes
+            if stat.st_size < 100:
+                return True
+            with open(session_path, 'rb') as f:
+                return not f.read(16).startswith(b'SQLite format 3')
+        except Exception:
+            # If we can't read the file, consider it corrupted
+            return True
+
+    def _remove_empty_directory(self, directory):
+        if os.path.abspath(directory) == os.path.abspath(SESSIONS_DIR):
+            return
+        try:
+            if not os.listdir(directory):
+                os.rmdir(directory)
+                print(f"🗑️ Removed empty directory: {directory}")
+        except OSError:
+            pass  # Directory not empty or other issue
+
+    # ---- passes ----
+
+    def run_due(self, temp_only=False, force_sessions=False):
+        """
+        Check every indexed file whose rule is due.
+        Returns (removed_count, removed_bytes).
+        """
+        now = time.time()
+        due = []
+        skipped = []
+        with self._condition:
+            while self._due and self._due[0][0] <= now:
+                due_at, session_path = heapq.heappop(self._due)
+                if self._indexed.get(session_path) != due_at:
+                    continue  # superseded by a later track()
+                if temp_only and not self._is_temp(session_path):
+                    skipped.append((due_at, session_path))
+                    continue
+                del self._indexed[session_path]
+                due.append((due_at, session_path))
+            for entry in skipped:
+                heapq.heappush(self._due, entry)
+
+        if not due:
+            return 0, 0
+
+        # One set per pass instead of scanning every user state for every file
+        active_temp = session_manager.get_active_session_paths(self.temp_max_age)
+        active_all = session_manager.get_active_session_paths()
+        check_sessions = self.session_cleanup_enabled or force_sessions
+
+        removed_count = 0
+        removed_bytes = 0
+        reschedule = []
+        for _, session_path in due:
+            try:
+                stat = os.stat(session_path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"⚠️ Error processing session file {session_path}: {e}")
+                continue
+
+            try:
+                if self._is_temp(session_path):
+                    next_due, freed = self._check_temp(session_path, stat, now, active_temp)
+                elif check_sessions:
+                    next_due, freed = self._check_session(session_path, stat, now, active_all)
+                else:
+                    continue  # long-term cleanup disabled; re-indexed when it is enabled
+            except Exception as e:
+                print(f"❌ Error cleaning session {session_path}: {e}")
+                continue
+
+            if next_due is None:
+                removed_count += 1
+                removed_bytes += freed
+            else:
+                reschedule.append((next_due, session_path))
+
+        with self._condition:
+            for next_due, session_path in reschedule:
+                if session_path not in self._indexed:
+                    self._schedule(session_path, next_due)
+
+        self.stats['last_pass_checked'] = len(due)
+        return removed_count, removed_bytes
+
+    def _janitor_loop(self):
+        try:
+            self.seed_index()
+        except Exception as e:
+            print(f"❌ Error indexing sessions: {e}")
+
+        last_state_sweep = 0
+        while self.running:
+            try:
+                if time.time() - last_state_sweep >= self.state_sweep_seconds:
+                    expired_states = session_manager.cleanup_expired_user_states()
+                    last_state_sweep = time.time()
+                    if expired_states:
+                        print(f"🧹 Removed {expired_states} expired user states")
+
+                removed_count, removed_bytes = self.run_due()
+                if removed_count:
+                    print(f"✅ Session janitor removed {removed_count} files, freed {removed_bytes:,} bytes")
+
+                with self._condition:
+                    if not self.running:
+                        break
+                    wait = self.state_sweep_seconds - (time.time() - last_state_sweep)
+                    if self._due:
+                        wait = min(wait, self._due[0][0] - time.time())
+                    if wait > 0:
+                        self._condition.wait(wait)
+            except Exception as e:
+                print(f"❌ Error in session janitor loop: {e}")
+                time.sleep(5)
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            print("🧹 Session janitor already running")
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._janitor_loop, daemon=True, name="SessionJanitor")
+        self.thread.start()
+        print(f"🧹 Started session janitor (temp max_age: {self.temp_max_age//60}m, long-term cleanup: {'on' if self.session_cleanup_enabled else 'off'})")
+
+    def stop(self):
+        if not self.running:
+            return
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+        print("🛑 Stopped session janitor")
+
+    def enable_session_cleanup(self):
+        """Enable long-term cleanup and index the sessions that existed before"""
+        if not self.session_cleanup_enabled:
+            self.session_cleanup_enabled = True
+            self.seed_index(include_sessions=True)
+        print("✅ Session cleanup enabled")
+        return True
+
+    def disable_session_cleanup(self):
+        """Disable long-term cleanup; indexed sessions are dropped as they come due"""
+        self.session_cleanup_enabled = False
+        print("❌ Session cleanup disabled")
+        return True
+
+    def force_temp_cleanup(self):
+        """Drop expired user states and remove due temp sessions now"""
+        print("🧹 Force cleanup triggered...")
+        expired_states = session_manager.cleanup_expired_user_states()
+        cleanup_count, cleanup_size = self.run_due(temp_only=True)
+        print(f"✅ Force cleanup completed: {expired_states} expired states, {cleanup_count} temp files ({cleanup_size:,} bytes)")
+        return expired_states, cleanup_count, cleanup_size
+
+    def manual_cleanup(self):
+        """Full pass requested by an admin: re-index the tree and apply every rule now"""
+        print(f"🧹 Starting manual session cleanup at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        self.seed_index(include_sessions=True)
+        cleaned_count, _ = self.run_due(force_sessions=True)
+        print(f"✅ Manual cleanup completed - removed {cleaned_count} session files")
+        return cleaned_count
+
+    def get_status(self):
+        with self._condition:
+            indexed = len(self._indexed)
+            next_due = self._due[0][0] if self._due else None
+        return {
+            'enabled': self.session_cleanup_enabled,
+            'running': self.running,
+            'thread_alive': bool(self.thread and self.thread.is_alive()),
+            'cleanup_interval_hours': self.recheck_interval / 3600,
+            'max_session_age_hours': self.session_max_age / 3600,
+            'indexed_files': indexed,
+            'next_due_in_seconds': max(0, int(next_due - time.time())) if next_due else None,
+            **self.stats
+        }
+
+
+# Global janitor instance
+session_janitor = SessionJanitor()
+session_manager.add_temp_session_listener(session_janitor.on_temp_session_created)
+session_manager.add_session_saved_listener(session_janitor.on_session_saved)
+
+def start_janitor():
+    """Start the session janitor (temp cleanup is always on)"""
+    session_janitor.start()
+
+def stop_janitor():
+    """Stop the session janitor"""
+    session_janitor.stop()
+
+def force_cleanup():
+    """Force immediate temp session cleanup"""
+    return session_janitor.force_temp_cleanup()
+
+def manual_session_cleanup():
+    """Perform manual session cleanup"""
+    return session_janitor.manual_cleanup()
+
+def enable_session_cleanup():
+    """Enable automatic long-term session cleanup"""
+    return session_janitor.enable_session_cleanup()
+
+def disable_session_cleanup():
+    """Disable automatic long-term session cleanup"""
+    return session_janitor.disable_session_cleanup()
+
+def start_session_cleanup():
+    """Long-term cleanup runs inside the janitor; ensures it is running once enabled"""
+    if not session_janitor.session_cleanup_enabled:
+        print("🧹 Session cleanup is disabled - admin must enable it first")
+        return False
+    session_janitor.start()
+    return True
+
+def get_cleanup_status():
+    """Get status of the session janitor"""
+    return session_janitor.get_status()
@@ -1,11 +1,91 @@
 import os
-import zipfile
 from datetime import datetime
+import threading
+import time
+import uuid
+import hashlib
+import telebot
 from bot_init import bot
 from config import SEND_SESSION_CHANNEL_ID, SESSIONS_DIR
 from telegram_otp import session_manager
-import threading
-import time
+from session_archive import SessionArchiveExporter, iter_session_files
+from db import (
+    enqueue_session_upload, mark_session_upload_ready, claim_session_uploads,
+    complete_session_uploads, retry_session_uploads, fail_session_upload,
+    requeue_stale_session_uploads, get_next_session_upload_time, get_session_outbox_stats,
+    get_session_file_id, register_session_file_id, invalidate_session_file_id,
+    get_export_watermark, set_export_watermark
+)
+
+# session_path -> (mtime_ns, size, sha256) so unchanged files are not re-hashed on every send
+_content_hash_cache = {}
+_content_hash_lock = threading.Lock()
+
+def get_session_content_hash(session_path):
+    """SHA-256 of a session file, cached until the file's mtime or size changes"""
+    stat = os.stat(session_path)
+    with _content_hash_lock:
+        cached = _content_hash_cache.get(session_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+    
+    digest = hashlib.sha256()
+    with open(session_path, 'rb') as session_file:
+        for chunk in iter(lambda: session_file.read(65536), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    
+    with _content_hash_lock:
+        _content_hash_cache[session_path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+    return content_hash
+
+def send_session_document(chat_id, session_path, caption=None, parse_mode="Markdown", visible_file_name=None):
+    """
+    Send a session file, reusing the Telegram file_id from an earlier upload of the
+    same contents when there is one. Falls back to uploading the bytes if Telegram
+    rejects the cached file_id, and registers the file_id returned by new uploads.
+    """
+    content_hash = get_session_content_hash(session_path)
+    file_id = get_session_file_id(content_hash)
+    
+    if file_id:
+        try:
+            return bot.send_document(chat_id, file_id, caption=caption, parse_mode=parse_mode)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            print(f"⚠️ Cached file_id rejected for {os.path.basename(session_path)}, re-uploading: {e}")
+            invalidate_session_file_id(content_hash=content_hash)
+    
+    with open(session_path, 'rb') as session_file:
+        result = bot.send_document(
+            chat_id,
+            session_file,
+            caption=caption,
+            parse_mode=parse_mode,
+            visible_file_name=visible_file_name or os.path.basename(session_path)
+        )
+    
+    document = getattr(result, 'document', None)
+    if document:
+        register_session_file_id(content_hash, document.file_id, session_path, os.path.getsize(session_path))
+    return result
+
+def build_session_caption(phone_number, user_id, country_code, price, file_size):
+    """Build the channel caption for a newly created session file"""
+    file_size_mb = file_size / (1024 * 1024)
+    created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
+    
+    return f"""🎉 **NEW SESSION CREATED** 🎉
+
+📱 **Phone**: `{phone_number}`
+👤 **User ID**: `{user_id}`
+🌍 **Country**: `{country_code}`
+💰 **Price**: `${price}`
+📅 **Created**: `{created_at}`
+📊 **File Size**: `{file_size_mb:.2f} MB`
+
+✅ **Session file ready for use!**"""
 
 def send_session_to_channel(phone_number, user_id, country_code, price):
     """
@@ -55,30 +135,8 @@ def send_session_to_channel(phone_number, user_id, country_code, price):
             print(f"❌ Error checking file size for {phone_number}: {size_error}")
             return False
         
-        # Calculate file size
-        file_size_mb = file_size / (1024 * 1024)
-        
-        # Create session info
-        session_info = {
-            'phone': phone_number,
-            'user_id': user_id,
-            'country': country_code,
-            'price': price,
-            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC'),
-            'file_size': f"{file_size_mb:.2f} MB"
-        }
-        
         # Prepare caption
-        caption = f"""🎉 **NEW SESSION CREATED** 🎉
-
-📱 **Phone**: `{phone_number}`
-👤 **User ID**: `{user_id}`
-🌍 **Country**: `{country_code}`
-💰 **Price**: `${price}`
-📅 **Created**: `{session_info['created_at']}`
-📊 **File Size**: `{session_info['file_size']}`
-
-✅ **Session file ready for use!**"""
+        caption = build_session_caption(phone_number, user_id, country_code, price, file_size)
 
         # Validate channel ID
         if not SEND_SESSION_CHANNEL_ID:
@@ -87,16 +145,14 @@ def send_session_to_channel(phone_number, user_id, country_code, price):
 
         # Send the session file with improved error handling
         try:
-            with open(session_path, 'rb') as session_file:
-                result = bot.send_document(
-                    SEND_SESSION_CHANNEL_ID,
-                    session_file,
-                    caption=caption,
-                    parse_mode="Markdown",
-                    visible_file_name=f"{phone_number}.session"
-                )
-                print(f"✅ Session file sent to channel for {phone_number} (Message ID: {result.message_id})")
-                return True
+            result = send_session_document(
+                SEND_SESSION_CHANNEL_ID,
+                session_path,
+                caption=caption,
+                visible_file_name=f"{phone_number}.session"
+            )
+            print(f"✅ Session file sent to channel for {phone_number} (Message ID: {result.message_id})")
+            return True
         except Exception as send_error:
             print(f"❌ Error sending session file to channel for {phone_number}: {send_error}")
             print(f"   Channel ID: {SEND_SESSION_CHANNEL_ID}")
@@ -109,46 +165,235 @@ def send_session_to_channel(phone_number, user_id, country_code, price):
         traceback.print_exc()
         return False
 
-def send_session_delayed(phone_number, user_id, country_code, price, delay_seconds=5):
+class SessionUploadOutbox:
     """
-    Send session file to channel after a delay to ensure file is ready
+    Persistent upload queue for settled session files.
+    
+    Entries live in the `session_outbox` collection so a restart does not lose them.
+    A small pool of worker threads drains due entries in sendMediaGroup batches of up
+    to 10 documents, retrying failed batches with exponential backoff. Workers sleep
+    until the next entry is due and are woken when an entry is queued or a session
+    file is saved, so no thread polls the filesystem. Entries left in 'sending' by a
+    worker that died (here or on another replica) are requeued by whichever worker
+    next finds them claimed for longer than any upload takes.
     """
-    def delayed_send():
+    
+    MAX_BATCH_SIZE = 10  # Telegram's sendMediaGroup limit
+    
+    def __init__(self, worker_count=2, max_attempts=5, base_backoff_seconds=5, max_backoff_seconds=600):
+        self.worker_count = worker_count
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_idle_seconds = 60  # Re-check the queue at least this often
+        self.stale_claim_seconds = 600  # Longer than any batch upload takes; older claims belong to a dead worker
+        self.stale_check_seconds = 60
+        self.last_stale_check = None
+        self.workers = []
+        self.running = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending_signal = False
+    
+    def start(self):
+        """Start the worker pool (safe to call more than once)"""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        
+        for index in range(self.worker_count):
+            worker = threading.Thread(target=self._worker_loop, daemon=True, name=f"SessionUploader-{index + 1}")
+            worker.start()
+            self.workers.append(worker)
+        print(f"📤 Session upload outbox started with {self.worker_count} workers")
+    
+    def stop(self):
+        """Stop the worker pool"""
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify_all()
+        for worker in self.workers:
+            worker.join(timeout=5)
+        self.workers = []
+    
+    def notify(self):
+        """Wake the workers because new work may be due"""
+        with self.wakeup:
+            self.pending_signal = True
+            self.wakeup.notify_all()
+    
+    def enqueue(self, phone_number, user_id, country_code, price, wait_seconds=30):
+        """Queue a session upload and return the outbox ID"""
+        session_path = session_manager._get_session_path(phone_number)
+        ready = os.path.exists(session_path)
+        upload_id = enqueue_session_upload(
+            phone_number, user_id, country_code, price, session_path,
+            ready=ready, wait_seconds=wait_seconds
+        )
+        if upload_id:
+            self.start()
+            if ready:
+                self.notify()
+        return upload_id
+    
+    def on_session_saved(self, phone_number, session_path):
+        """Session-saved event: make any queued upload for this number due now"""
+        if mark_session_upload_ready(phone_number):
+            self.notify()
+    
+    def _requeue_stale_claims(self):
+        """Return entries claimed by a worker that died mid-upload to the queue, at most once per stale_check_seconds"""
+        now = time.monotonic()
+        with self.lock:
+            if self.last_stale_check is not None and now - self.last_stale_check < self.stale_check_seconds:
+                return
+            self.last_stale_check = now
+        requeued = requeue_stale_session_uploads(self.stale_claim_seconds)
+        if requeued:
+            print(f"🔄 Requeued {requeued} interrupted session uploads")
+    
+    def _wait_for_work(self):
+        """Sleep until the next entry is due, a notify() arrives, or the idle timeout"""
+        timeout = self.max_idle_seconds
+        next_due = get_next_session_upload_time()
+        if next_due:
+            timeout = min(timeout, max(0.0, (next_due - datetime.utcnow()).total_seconds()))
+        
+        with self.wakeup:
+            if not self.pending_signal and self.running and timeout > 0:
+                self.wakeup.wait(timeout)
+            self.pending_signal = False
+    
+    def _worker_loop(self):
+        worker_id = f"{threading.current_thread().name}-{uuid.uuid4().hex[:8]}"
+        while self.running:
+            try:
+                self._requeue_stale_claims()
+                batch = claim_session_uploads(worker_id, self.MAX_BATCH_SIZE)
+                if not batch:
+                    self._wait_for_work()
+                    continue
+                self._send_batch(batch)
+            except Exception as e:
+                print(f"❌ Error in session upload worker {worker_id}: {e}")
+                time.sleep(self.base_backoff_seconds)
+    
+    def _backoff_delay(self, attempts, retry_after=None):
+        if retry_after:
+            return retry_after
+        return min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** attempts))
+    
+    def _send_batch(self, batch):
+        """Upload one claimed batch as a media group (or a single document)"""
+        if not SEND_SESSION_CHANNEL_ID:
+            retry_session_uploads([u["_id"] for u in batch], self.max_backoff_seconds,
+                                  "SEND_SESSION_CHANNEL_ID is not configured", self.max_attempts)
+            return
+        
+        sendable = []
+        for upload in batch:
+            session_path = upload.get("session_path")
+            if not session_path or not os.path.exists(session_path) or os.path.getsize(session_path) == 0:
+                print(f"❌ Session file not available for {upload['phone_number']}: {session_path}")
+                fail_session_upload(upload["_id"], "Session file not found")
+                continue
+            sendable.append(upload)
+        
+        if not sendable:
+            return
+        
+        files = []
         try:
-            print(f"🕐 Starting delayed session send for {phone_number} after {delay_seconds}s delay")
-            time.sleep(delay_seconds)
-            
-            # Verify session file exists before attempting to send
-            session_path = session_manager._get_session_path(phone_number)
-            max_wait_time = 30  # Wait up to 30 seconds for file to appear
-            wait_count = 0
-            
-            while not os.path.exists(session_path) and wait_count < max_wait_time:
-                print(f"⏳ Waiting for session file to be created: {session_path} (wait {wait_count + 1}s)")
-                time.sleep(1)
-                wait_count += 1
+            media = []
+            for upload in sendable:
+                session_file = open(upload["session_path"], 'rb')
+                files.append(session_file)
+                caption = build_session_caption(
+                    upload["phone_number"], upload["user_id"], upload["country_code"],
+                    upload["price"], os.path.getsize(upload["session_path"])
+                )
+                media.append((upload, session_file, caption))
             
-            if os.path.exists(session_path):
-                success = send_session_to_channel(phone_number, user_id, country_code, price)
-                if success:
-                    print(f"✅ Delayed session send completed for {phone_number}")
-                else:
-                    print(f"❌ Delayed session send failed for {phone_number}")
+            if len(media) == 1:
+                upload, session_file, caption = media[0]
+                messages = [bot.send_document(
+                    SEND_SESSION_CHANNEL_ID,
+                    session_file,
+                    caption=caption,
+                    parse_mode="Markdown",
+                    visible_file_name=f"{upload['phone_number']}.session"
+                )]
             else:
-                print(f"❌ Session file still not found after {max_wait_time}s wait: {session_path}")
-        except Exception as e:
-            print(f"❌ Error in delayed session send for {phone_number}: {e}")
-            import traceback
-            traceback.print_exc()
+                messages = bot.send_media_group(
+                    SEND_SESSION_CHANNEL_ID,
+                    [telebot.types.InputMediaDocument(session_file, caption=caption, parse_mode="Markdown")
+                     for _, session_file, caption in media]
+                )
+            
+            file_ids = {}
+            for (upload, _, _), sent in zip(media, messages):
+                document = getattr(sent, 'document', None)
+                if document:
+                    file_ids[upload["_id"]] = document.file_id
+                    try:
+                        register_session_file_id(
+                            get_session_content_hash(upload["session_path"]), document.file_id,
+                            upload["session_path"], os.path.getsize(upload["session_path"])
+                        )
+                    except Exception as registry_error:
+                        print(f"⚠️ Could not register file_id for {upload['phone_number']}: {registry_error}")
+            complete_session_uploads([u["_id"] for u in sendable], file_ids)
+            print(f"✅ Uploaded {len(sendable)} session files to channel in one request")
+        except Exception as send_error:
+            retry_after = None
+            if isinstance(send_error, telebot.apihelper.ApiTelegramException) and send_error.error_code == 429:
+                retry_after = (send_error.result_json or {}).get('parameters', {}).get('retry_after')
+            attempts = max(u.get("attempts", 0) for u in sendable)
+            delay = self._backoff_delay(attempts, retry_after)
+            retry_session_uploads([u["_id"] for u in sendable], delay, str(send_error), self.max_attempts)
+            print(f"❌ Session upload batch of {len(sendable)} failed, retrying in {delay}s: {send_error}")
+        finally:
+            for session_file in files:
+                session_file.close()
+    
+    def get_stats(self):
+        """Outbox counts by status plus worker state"""
+        return {
+            "running": self.running,
+            "workers": sum(1 for worker in self.workers if worker.is_alive()),
+            "queue": get_session_outbox_stats()
+        }
+
+# Global outbox instance, woken by the session manager whenever a session is saved
+session_outbox = SessionUploadOutbox()
+session_manager.add_session_saved_listener(session_outbox.on_session_saved)
+
+def start_session_outbox():
+    """Start the session upload workers (drains anything queued before a restart)"""
+    session_outbox.start()
+
+def stop_session_outbox():
+    """Stop the session upload workers"""
+    session_outbox.stop()
+
+def send_session_delayed(phone_number, user_id, country_code, price, delay_seconds=5):
+    """
+    Queue a session file for upload to the channel.
     
-    # Run in background thread with better error handling
+    If the file is not on disk yet the upload becomes due when the session manager
+    reports it saved, or after delay_seconds + 30s at the latest.
+    """
     try:
-        thread = threading.Thread(target=delayed_send, daemon=True, name=f"SessionSender-{phone_number}")
-        thread.start()
-        print(f"🕐 Scheduled session file sending for {phone_number} in {delay_seconds} seconds")
-        return True
+        upload_id = session_outbox.enqueue(phone_number, user_id, country_code, price,
+                                           wait_seconds=delay_seconds + 30)
+        if upload_id:
+            print(f"📤 Queued session file upload for {phone_number} (outbox ID: {upload_id})")
+            return True
+        print(f"❌ Could not queue session upload for {phone_number}")
+        return False
     except Exception as e:
-        print(f"❌ Error starting session send thread for {phone_number}: {e}")
+        print(f"❌ Error queueing session upload for {phone_number}: {e}")
         return False
 
 def send_bulk_sessions_to_channel(country_code=None, max_files=50):
@@ -175,15 +420,13 @@ def send_bulk_sessions_to_channel(country_code=None, max_files=50):
                     phone_number = session_file.replace('.session', '')
                     
                     try:
-                        with open(session_path, 'rb') as file:
-                            caption = f"📱 **{phone_number}** (Country: {country_code})\n📅 Bulk export"
-                            bot.send_document(
-                                SEND_SESSION_CHANNEL_ID,
-                                file,
-                                caption=caption,
-                                parse_mode="Markdown",
-                                visible_file_name=session_file
-                            )
+                        caption = f"📱 **{phone_number}** (Country: {country_code})\n📅 Bulk export"
+                        send_session_document(
+                            SEND_SESSION_CHANNEL_ID,
+                            session_path,
+                            caption=caption,
+                            visible_file_name=session_file
+                        )
                         sent_count += 1
                         time.sleep(1)  # Avoid rate limits
                         print(f"✅ Sent {session_file} ({sent_count}/{min(len(session_files), max_files)})")
@@ -209,15 +452,13 @@ def send_bulk_sessions_to_channel(country_code=None, max_files=50):
                         phone_number = session_file.replace('.session', '')
                         
                         try:
-                            with open(session_path, 'rb') as file:
-                                caption = f"📱 **{phone_number}** (Country: {country})\n📅 Bulk export"
-                                bot.send_document(
-                                    SEND_SESSION_CHANNEL_ID,
-                                    file,
-                                    caption=caption,
-                                    parse_mode="Markdown",
-                                    visible_file_name=session_file
-                                )
+                            caption = f"📱 **{phone_number}** (Country: {country})\n📅 Bulk export"
+                            send_session_document(
+                                SEND_SESSION_CHANNEL_ID,
+                                session_path,
+                                caption=caption,
+                                visible_file_name=session_file
+                            )
                             sent_count += 1
                             time.sleep(1)  # Avoid rate limits
                             print(f"✅ Sent {session_file} from {country} ({sent_count}/{max_files})")
@@ -233,83 +474,68 @@ def send_bulk_sessions_to_channel(country_code=None, max_files=50):
         traceback.print_exc()
         return 0
 
-def create_session_zip_and_send(country_code=None, date_filter=None):
+def create_session_zip_and_send(country_code=None, date_filter=None, incremental=False, manifest=False):
     """
-    Create a ZIP file of session files and send to channel
+    Archive session files into size-limited ZIP parts and send them to channel.
+    With incremental=True only sessions modified since the channel's last complete
+    export are archived, and the watermark is advanced once every part is sent.
     """
     try:
         # Ensure sessions directory exists
         if not os.path.exists(SESSIONS_DIR):
             print(f"❌ Sessions directory does not exist: {SESSIONS_DIR}")
             return False
-            
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        if country_code:
-            zip_filename = f"sessions_{country_code}_{timestamp}.zip"
-        else:
-            zip_filename = f"sessions_all_{timestamp}.zip"
         
-        zip_path = os.path.join(SESSIONS_DIR, zip_filename)
+        if country_code and not os.path.exists(os.path.join(SESSIONS_DIR, country_code)):
+            print(f"❌ Country directory not found: {os.path.join(SESSIONS_DIR, country_code)}")
+            return False
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            session_count = 0
-            
-            if country_code:
-                country_dir = os.path.join(SESSIONS_DIR, country_code)
-                if os.path.exists(country_dir):
-                    for session_file in os.listdir(country_dir):
-                        if session_file.endswith('.session'):
-                            session_path = os.path.join(country_dir, session_file)
-                            zipf.write(session_path, f"{country_code}/{session_file}")
-                            session_count += 1
-                else:
-                    print(f"❌ Country directory not found: {country_dir}")
-                    return False
-            else:
-                for country in os.listdir(SESSIONS_DIR):
-                    country_path = os.path.join(SESSIONS_DIR, country)
-                    if os.path.isdir(country_path):
-                        for session_file in os.listdir(country_path):
-                            if session_file.endswith('.session'):
-                                session_path = os.path.join(country_path, session_file)
-                                zipf.write(session_path, f"{country}/{session_file}")
-                                session_count += 1
+        watermark_key = f"channel:{SEND_SESSION_CHANNEL_ID}:{country_code or 'all'}"
+        modified_after = get_export_watermark(watermark_key) if incremental else None
         
-        if session_count == 0:
-            print(f"❌ No session files found to zip")
-            os.remove(zip_path)
-            return False
+        caption = f"📦 **SESSION ARCHIVE**\n\n"
+        if country_code:
+            caption += f"🌍 **Country**: {country_code}\n"
+        else:
+            caption += f"🌍 **Country**: All Countries\n"
+        if incremental:
+            caption += f"🆕 **Mode**: New since last export\n"
+        caption += f"📅 **Created**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
         
-        # Send ZIP file to channel
-        try:
-            with open(zip_path, 'rb') as zip_file:
-                caption = f"📦 **SESSION ARCHIVE**\n\n"
-                if country_code:
-                    caption += f"🌍 **Country**: {country_code}\n"
-                else:
-                    caption += f"🌍 **Country**: All Countries\n"
-                caption += f"📱 **Sessions**: {session_count}\n"
-                caption += f"📅 **Created**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                
+        def send_part(part_path, part_name, part_number, file_count):
+            with open(part_path, 'rb') as zip_file:
                 bot.send_document(
                     SEND_SESSION_CHANNEL_ID,
                     zip_file,
-                    caption=caption,
+                    caption=caption + f"🧩 **Part**: {part_number}\n📱 **Sessions**: {file_count}",
                     parse_mode="Markdown",
-                    visible_file_name=zip_filename
+                    visible_file_name=part_name
                 )
-            
-            print(f"✅ Session ZIP sent to channel: {zip_filename} ({session_count} sessions)")
-        except Exception as send_error:
-            print(f"❌ Error sending ZIP file: {send_error}")
+        
+        entries = (
+            (f"{country}/{phone_number}.session", session_path)
+            for country, phone_number, session_path, _ in iter_session_files(country_code, modified_after)
+        )
+        
+        # The generator scans lazily inside export(), so this is taken before the walk starts
+        scan_started = time.time()
+        exporter = SessionArchiveExporter(
+            send_part,
+            name_prefix=f"sessions_{country_code}" if country_code else "sessions_all",
+            manifest=manifest
+        )
+        result = exporter.export(entries)
+        
+        if result['files'] == 0:
+            print(f"❌ No {'new ' if incremental else ''}session files found to zip")
             return False
-        finally:
-            # Clean up ZIP file
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
         
-        return True
+        if incremental and result['parts_failed'] == 0:
+            set_export_watermark(watermark_key, scan_started, result['files'])
+        
+        print(f"✅ Session archive sent to channel: {result['files']} sessions in {result['parts']} parts "
+              f"({result['parts_failed']} failed)")
+        return result['parts_failed'] == 0
         
     except Exception as e:
         print(f"❌ Error creating and sending session ZIP: {e}")
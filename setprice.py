@@ -1,8 +1,9 @@
 from db import set_country_price
 from config import ADMIN_IDS
 from bot_init import bot
+from router import router
 
-@bot.message_handler(commands=['setprice'])
+@router.command('setprice')
 def handle_setprice(message):
     user_id = message.from_user.id
     if user_id not in ADMIN_IDS:
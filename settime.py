@@ -2,10 +2,11 @@ import re
 from db import set_country_claim_time
 from config import ADMIN_IDS
 from bot_init import bot
+from router import router
 
 SETTIME_REGEX = re.compile(r'^/settime\s+(\+\d{1,5})\s+(\d+)s$', re.IGNORECASE)
 
-@bot.message_handler(commands=['settime'])
+@router.command('settime')
 def handle_settime(message):
     user_id = message.from_user.id
     if user_id not in ADMIN_IDS:
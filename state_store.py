@@ -0,0 +1,152 @@
+"""
+Conversation state shared by every bot process and kept across restarts.
+
+Withdrawal prompts, verification steps and claim waits used to live in
+module-level dicts, so a restart forgot every conversation in flight and a
+second process could not see the first one's. StateMap keeps the same dict
+interface over the `conversation_state` collection: one document per
+(namespace, key) with an `expires_at` TTL, so abandoned conversations clean
+themselves up.
+
+Reads go through a small in-process cache (STATE_CACHE_SECONDS, misses
+included) because the router looks up the withdrawal and 2FA states on every
+text message. Writes go to MongoDB and refresh the cache. MongoDB errors
+propagate to the caller and nothing is cached for them, so an outage is never
+remembered as "no conversation" or as a write that did not happen. Values must be
+BSON-serializable; get() returns a copy, so changing a value means assigning it
+back. Live Telethon clients stay in process memory (SessionManager.clients)
+and are rebuilt from the stored session when a state is picked up elsewhere.
+"""
+
+import copy
+import time
+import threading
+from datetime import datetime, timedelta
+from config import STATE_CACHE_SECONDS
+from db import (
+    get_conversation_state, set_conversation_state, delete_conversation_state,
+    list_conversation_states, count_conversation_states
+)
+
+class StateStore:
+    MAX_CACHE_ENTRIES = 10000  # Sweep expired cache entries beyond this many
+
+    def __init__(self, cache_seconds=STATE_CACHE_SECONDS):
+        self.cache_seconds = cache_seconds
+        self.cache = {}  # (namespace, key) -> (value or None, cached_until)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache(self, namespace, key, value, ttl_seconds=None):
+        now = time.monotonic()
+        lifetime = self.cache_seconds if ttl_seconds is None else min(self.cache_seconds, ttl_seconds)
+        with self.lock:
+            self.cache[(namespace, key)] = (value, now + lifetime)
+            if len(self.cache) > self.MAX_CACHE_ENTRIES:
+                for cache_key in [k for k, (_, until) in self.cache.items() if until <= now]:
+                    del self.cache[cache_key]
+
+    def _forget(self, namespace, key):
+        with self.lock:
+            self.cache.pop((namespace, key), None)
+
+    def get(self, namespace, key):
+        """The stored value (a copy) or None"""
+        # A single dict read needs no lock; the router comes through here for every text message
+        cached = self.cache.get((namespace, key))
+        if cached is not None and cached[1] > time.monotonic():
+            self.hits += 1
+            value = cached[0]
+            return None if value is None else copy.deepcopy(value)
+
+        self.misses += 1
+        document = get_conversation_state(namespace, key)
+        value = document["data"] if document else None
+        ttl_seconds = None
+        if document:
+            ttl_seconds = max(0.0, (document["expires_at"] - datetime.utcnow()).total_seconds())
+        self._cache(namespace, key, value, ttl_seconds)
+        return copy.deepcopy(value)
+
+    def set(self, namespace, key, value, ttl_seconds):
+        try:
+            stored = set_conversation_state(namespace, key, value, datetime.utcnow() + timedelta(seconds=ttl_seconds))
+        except Exception:
+            # The old value may or may not still be stored; read it again next time
+            self._forget(namespace, key)
+            raise
+        self._cache(namespace, key, copy.deepcopy(value), ttl_seconds)
+        return stored
+
+    def delete(self, namespace, key):
+        try:
+            deleted = delete_conversation_state(namespace, key)
+        except Exception:
+            self._forget(namespace, key)
+            raise
+        self._cache(namespace, key, None)
+        return deleted
+
+    def items(self, namespace):
+        """(key, value) for every unexpired state in namespace, read from MongoDB"""
+        return [(document["key"], document["data"]) for document in list_conversation_states(namespace)]
+
+    def count(self, namespace):
+        return count_conversation_states(namespace)
+
+    def get_stats(self):
+        return {
+            "cache_entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+state_store = StateStore()
+
+class StateMap:
+    """dict-like view of one namespace; every assignment resets the entry's TTL"""
+
+    def __init__(self, namespace, ttl_seconds, store=None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.store = store or state_store
+
+    def get(self, key, default=None):
+        value = self.store.get(self.namespace, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key) is not None
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value, self.ttl_seconds)
+
+    def __delitem__(self, key):
+        """Deleting a key that is already gone is a no-op (another process may have finished it)"""
+        self.store.delete(self.namespace, key)
+
+    def pop(self, key, default=None):
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            return default
+        self.store.delete(self.namespace, key)
+        return value
+
+    def items(self):
+        return self.store.items(self.namespace)
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __len__(self):
+        return self.store.count(self.namespace)
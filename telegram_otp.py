@@ -6,7 +6,14 @@ from config import API_ID, API_HASH, SESSIONS_DIR, DEFAULT_2FA_PASSWORD
 from telethon.errors import SessionPasswordNeededError, PhoneCodeExpiredError, PhoneCodeInvalidError, FloodWaitError
 from telethon.tl.functions.account import GetAuthorizationsRequest, ResetAuthorizationRequest
 import random
+import logging
 from proxy_manager import proxy_manager
+from state_store import StateMap
+from translations import get_text
+
+logger = logging.getLogger("telegram_otp")
+# Per-authorization device listings are high volume; sampled via LOG_SAMPLE_RATES
+device_logger = logging.getLogger("telegram_otp.devices")
 
 # Configuration for handling persistent database issues
 VALIDATION_BYPASS_MODE = True  # Set to True to be more lenient with validation errors
@@ -15,10 +22,18 @@ DATABASE_ERROR_COUNT = 0  # Track consecutive database errors
 
 class SessionManager:
     def __init__(self):
-        self.user_states = {}
         # Constants for overflow prevention
         self.MAX_USER_STATES = 500  # Maximum number of concurrent user states
         self.MAX_STATE_AGE_SECONDS = 3600  # Maximum state age before cleanup (1 hour)
+        # Verification steps per user (phone, session, phone_code_hash, ...), shared across processes
+        self.user_states = StateMap("verification", self.MAX_STATE_AGE_SECONDS)
+        # Live Telethon clients for those states; rebuilt by _get_client when missing here
+        self.clients = {}
+        
+        # Callbacks fired with (phone_number, session_path) once a final session file is on disk
+        self.session_saved_listeners = []
+        # Callbacks fired with (session_path) when a temporary tmp_*.session file is created
+        self.temp_session_listeners = []
         
         # NOTE: Automatic device logout is DISABLED
         # The system only checks device count but does NOT automatically log out other devices
@@ -41,7 +56,7 @@ class SessionManager:
         
         country_dir = os.path.join(SESSIONS_DIR, country_code)
         os.makedirs(country_dir, exist_ok=True)
-        print(f"📁 Created/ensured session directory for country: {country_code}")
+        logger.debug("📁 Created/ensured session directory for country: %s", country_code)
         return country_dir
 
     def _get_session_path(self, phone_number):
@@ -50,6 +65,49 @@ class SessionManager:
         country_dir = self._ensure_country_session_dir(country_code)
         return os.path.join(country_dir, f"{phone_number}.session")
     
+    def add_session_saved_listener(self, callback):
+        """Register a callback to run whenever a final session file has been saved"""
+        if callback not in self.session_saved_listeners:
+            self.session_saved_listeners.append(callback)
+
+    def add_temp_session_listener(self, callback):
+        """Register a callback to run whenever a temporary session file is created"""
+        if callback not in self.temp_session_listeners:
+            self.temp_session_listeners.append(callback)
+    
+    def _notify_temp_session_created(self, session_path):
+        """Fire temp-session callbacks without letting a listener break verification"""
+        for callback in list(self.temp_session_listeners):
+            try:
+                callback(session_path)
+            except Exception as e:
+                print(f"❌ Temp session listener error for {os.path.basename(session_path)}: {e}")
+    
+    def get_active_session_paths(self, max_age_seconds=None):
+        """
+        Session paths held by current user states, as a set for O(1) membership checks.
+        With max_age_seconds only states started within that window are counted.
+        """
+        import time
+        current_time = time.time()
+        active_paths = set()
+        for state in list(self.user_states.values()):
+            session_path = state.get('session_path')
+            if not session_path:
+                continue
+            if max_age_seconds is not None and current_time - state.get('start_time', current_time) > max_age_seconds:
+                continue
+            active_paths.add(session_path)
+        return active_paths
+    
+    def _notify_session_saved(self, phone_number, session_path):
+        """Fire session-saved callbacks without letting a listener break the save path"""
+        for callback in list(self.session_saved_listeners):
+            try:
+                callback(phone_number, session_path)
+            except Exception as e:
+                print(f"❌ Session saved listener error for {phone_number}: {e}")
+    
     def cleanup_old_user_states(self):
         """Clean up old user states to prevent memory overflow"""
         import time
@@ -81,65 +139,6 @@ class SessionManager:
             return len(self.user_states) < self.MAX_USER_STATES
         return True
 
-    def cleanup_temporary_sessions(self, max_age_minutes=2):
-        """Clean up temporary session files older than specified minutes"""
-        import time
-        import glob
-        
-        current_time = time.time()
-        max_age_seconds = max_age_minutes * 60
-        cleanup_count = 0
-        cleanup_size = 0
-        
-        print(f"🧹 Starting cleanup of temporary sessions older than {max_age_minutes} minutes...")
-        
-        if not os.path.exists(SESSIONS_DIR):
-            return cleanup_count, cleanup_size
-        
-        # Check all country directories
-        for item in os.listdir(SESSIONS_DIR):
-            item_path = os.path.join(SESSIONS_DIR, item)
-            
-            if os.path.isdir(item_path):
-                # Look for temporary session files in country directories
-                temp_pattern = os.path.join(item_path, "tmp_*.session")
-                temp_files = glob.glob(temp_pattern)
-                
-                for temp_file in temp_files:
-                    try:
-                        # Check file age
-                        file_stat = os.stat(temp_file)
-                        file_age = current_time - file_stat.st_mtime
-                        
-                        if file_age > max_age_seconds:
-                            file_size = file_stat.st_size
-                            
-                            # Check if this temp session is still active in user_states
-                            is_active = False
-                            for user_id, state in self.user_states.items():
-                                if state.get('session_path') == temp_file:
-                                    # Check if the state itself is too old
-                                    state_age = current_time - state.get('start_time', current_time)
-                                    if state_age <= max_age_seconds:
-                                        is_active = True
-                                        break
-                            
-                            if not is_active:
-                                os.remove(temp_file)
-                                cleanup_count += 1
-                                cleanup_size += file_size
-                                print(f"🗑️ Cleaned up temporary session: {os.path.basename(temp_file)} (age: {file_age//60:.1f}m, size: {file_size} bytes)")
-                            
-                    except Exception as e:
-                        print(f"❌ Error cleaning temp session {temp_file}: {e}")
-        
-        if cleanup_count > 0:
-            print(f"✅ Cleaned up {cleanup_count} temporary sessions, freed {cleanup_size:,} bytes")
-        else:
-            print(f"✅ No temporary sessions to clean up")
-            
-        return cleanup_count, cleanup_size
-    
     def cleanup_expired_user_states(self):
         """Clean up user states for expired temporary sessions and remove their temp files"""
         import time
@@ -167,19 +166,74 @@ class SessionManager:
         # Remove expired user states
         for user_id in states_to_remove:
             try:
-                del self.user_states[user_id]
+                self.discard_user_state(user_id)
                 print(f"🧹 Removed expired user state for user {user_id}")
             except Exception as e:
                 print(f"❌ Error removing user state {user_id}: {e}")
         
         return len(states_to_remove)
 
+    def mark_awaiting_password(self, user_id):
+        """Record that the user's next message is their 2FA password"""
+        state = self.user_states.get(user_id) or {}
+        state["state"] = "awaiting_password"
+        self.user_states[user_id] = state
+
+    def discard_user_state(self, user_id):
+        """Forget a verification step and this process's client for it (without disconnecting)"""
+        del self.user_states[user_id]
+        self.clients.pop(user_id, None)
+
+    async def prune_clients(self):
+        """Disconnect clients whose verification state is gone (expired, or discarded by another process)"""
+        pruned = 0
+        for user_id in list(self.clients):
+            if user_id in self.user_states:
+                continue
+            client = self.clients.pop(user_id, None)
+            try:
+                if client is not None and client.is_connected():
+                    await client.disconnect()
+            except Exception as e:
+                print(f"Error disconnecting client for user {user_id}: {e}")
+            pruned += 1
+        return pruned
+
+    async def _get_client(self, user_id, state):
+        """This process's client for the state, rebuilt from the stored session if it started elsewhere"""
+        client = self.clients.get(user_id)
+        if client is not None:
+            return client
+
+        session = state["session_path"]
+        if not os.path.exists(session) and state.get("session_string"):
+            # Another machine started this verification: seed a session file from the stored auth key
+            from telethon.sessions import SQLiteSession, StringSession
+            stored = StringSession(state["session_string"])
+            session = SQLiteSession(state["session_path"])
+            session.set_dc(stored.dc_id, stored.server_address, stored.port)
+            session.auth_key = stored.auth_key
+            session.save()
+
+        device = state.get("device") or get_random_device()
+        client = TelegramClient(
+            session, API_ID, API_HASH,
+            device_model=device["device_model"],
+            system_version=device["system_version"],
+            app_version=device["app_version"],
+            timeout=10
+        )
+        await asyncio.wait_for(client.connect(), timeout=10)
+        self.clients[user_id] = client
+        logger.info("♻️ Rebuilt Telegram client for %s from stored verification state", state['phone'])
+        return client
+
     async def start_verification(self, user_id, phone_number):
         try:
             # 🚀 SPEED OPTIMIZATION: Streamlined verification process
             # Check user state limits before starting
             if not self.check_user_state_limit():
-                print(f"❌ Cannot start verification for {phone_number} - user state limit exceeded")
+                logger.warning("❌ Cannot start verification for %s - user state limit exceeded", phone_number)
                 return "error", "System is busy. Please try again in a few minutes."
             
             # Create country-specific directory
@@ -189,6 +243,7 @@ class SessionManager:
             # Create temporary session in the country directory
             with NamedTemporaryFile(prefix='tmp_', suffix='.session', dir=country_dir, delete=False) as tmp:
                 temp_path = tmp.name
+            self._notify_temp_session_created(temp_path)
             
             # Pick a random device (faster device selection)
             device = get_random_device()
@@ -200,7 +255,8 @@ class SessionManager:
             sent = None
             
             # First try direct connection (usually faster)
-            print(f"📡 Trying direct connection for {phone_number}")
+            connection_path = "direct"
+            logger.debug("📡 Trying direct connection for %s", phone_number)
             try:
                 client = TelegramClient(
                     temp_path, API_ID, API_HASH,
@@ -212,10 +268,10 @@ class SessionManager:
                 
                 await asyncio.wait_for(client.connect(), timeout=10)
                 sent = await asyncio.wait_for(client.send_code_request(phone_number), timeout=10)
-                print(f"✅ Direct connection successful for {phone_number}")
+                logger.debug("✅ Direct connection successful for %s", phone_number)
                 
             except Exception as direct_error:
-                print(f"❌ Direct connection failed: {direct_error}")
+                logger.warning("❌ Direct connection failed for %s: %s", phone_number, direct_error)
                 # Close failed direct client
                 try:
                     if client:
@@ -228,7 +284,7 @@ class SessionManager:
                 working_proxy = await proxy_manager.get_working_proxy()
                 if working_proxy:
                     try:
-                        print(f"🌐 Trying proxy {working_proxy['addr']}:{working_proxy['port']} for {phone_number}")
+                        logger.info("🌐 Trying proxy %s:%s for %s", working_proxy['addr'], working_proxy['port'], phone_number)
                         
                         proxy_config = (
                             working_proxy['proxy_type'],
@@ -250,10 +306,11 @@ class SessionManager:
                         
                         await asyncio.wait_for(client.connect(), timeout=10)
                         sent = await asyncio.wait_for(client.send_code_request(phone_number), timeout=10)
-                        print(f"✅ Proxy connection successful for {phone_number}")
+                        connection_path = "proxy"
+                        logger.info("✅ Proxy connection successful for %s", phone_number)
                         
                     except Exception as proxy_error:
-                        print(f"❌ Proxy failed: {proxy_error}")
+                        logger.warning("❌ Proxy failed for %s: %s", phone_number, proxy_error)
                         proxy_manager.mark_proxy_failed(working_proxy)
                         try:
                             if client:
@@ -268,22 +325,23 @@ class SessionManager:
                 return "error", "Could not establish connection to send OTP"
 
             import time
+            self.clients[user_id] = client
             self.user_states[user_id] = {
                 "phone": phone_number,
                 "session_path": temp_path,
-                "client": client,
+                "session_string": _session_string(client),
+                "device": device,
                 "phone_code_hash": sent.phone_code_hash,
                 "state": "awaiting_code",
                 "country_code": country_code,
+                "connection_path": connection_path,
                 "start_time": time.time()  # Add timestamp for cleanup
             }
             
-            print(TRANSLATIONS['session_started'][get_user_language(user_id)].format(phone=phone_number, country=country_code))
+            logger.info("📲 Verification started for %s (country: %s, via %s)", phone_number, country_code, connection_path)
             return "code_sent", "Verification code sent"
         except Exception as e:
-            print(f"❌ OTP sending failed: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ OTP sending failed for {phone_number}: {e}")
             return "error", str(e)
 
     async def verify_code(self, user_id, code):
@@ -291,15 +349,15 @@ class SessionManager:
         if not state:
             return "error", "Session expired"
 
-        client = state["client"]
         try:
+            client = await self._get_client(user_id, state)
             # 🚀 SPEED OPTIMIZATION: Faster code verification with timeout
             await asyncio.wait_for(
                 client.sign_in(phone=state["phone"], code=code, phone_code_hash=state["phone_code_hash"]),
                 timeout=10
             )
         except SessionPasswordNeededError:
-            state["state"] = "awaiting_password"
+            self.mark_awaiting_password(user_id)
             return "need_password", None
         except PhoneCodeExpiredError:
             print(f"❌ OTP code expired for user {user_id}")
@@ -307,8 +365,7 @@ class SessionManager:
             if os.path.exists(state["session_path"]):
                 os.unlink(state["session_path"])
             # Remove user state to allow fresh start
-            if user_id in self.user_states:
-                del self.user_states[user_id]
+            self.discard_user_state(user_id)
             return "code_expired", "OTP code has expired. Please request a new code."
         except PhoneCodeInvalidError:
             print(f"❌ Invalid OTP code for user {user_id}")
@@ -345,9 +402,9 @@ class SessionManager:
         state = self.user_states.get(user_id)
         if not state:
             return "error", "Session expired"
-        client = state["client"]
 
         try:
+            client = await self._get_client(user_id, state)
             # 🚀 SPEED OPTIMIZATION: Faster 2FA verification with timeout
             await asyncio.wait_for(client.sign_in(password=password), timeout=10)
         except asyncio.TimeoutError:
@@ -371,11 +428,11 @@ class SessionManager:
         state = self.user_states.get(user_id)
         if not state:
             return False
-        client = state["client"]
+        client = self.clients.get(user_id)
         try:
             self._save_session(state, client)
             # Clean up user state after successful finalization
-            self.user_states.pop(user_id, None)
+            self.discard_user_state(user_id)
             return True
         except Exception as e:
             print(f"❌ Failed to save session: {str(e)}")
@@ -388,7 +445,7 @@ class SessionManager:
             return
         
         try:
-            client = state.get("client")
+            client = self.clients.get(user_id)
             if client and client.is_connected():
                 await client.disconnect()
                 print(f"✅ Disconnected client for user {user_id}")
@@ -396,7 +453,7 @@ class SessionManager:
             print(f"Error disconnecting client for user {user_id}: {e}")
         finally:
             # Remove user state regardless
-            self.user_states.pop(user_id, None)
+            self.discard_user_state(user_id)
             print(f"✅ Cleaned up session state for user {user_id}")
 
     async def logout_other_devices(self, client):
@@ -420,7 +477,7 @@ class SessionManager:
             print("❌ Still multiple sessions after logout.")
             return False
         except Exception as e:
-            print(TRANSLATIONS['error_during_logout'][get_user_language(0)].format(error=str(e)))
+            logger.warning(get_text('error_during_logout', error=str(e)))
             return False
 
     def logout_all_devices(self, phone_number):
@@ -505,8 +562,9 @@ class SessionManager:
         final_path = self._get_session_path(phone_number)
         
         try:
-            # Ensure the session is properly saved
-            client.session.save()
+            # Ensure the session is properly saved (a rebuilt client may live in another process)
+            if client is not None:
+                client.session.save()
             
             # Ensure destination directory exists
             os.makedirs(os.path.dirname(final_path), exist_ok=True)
@@ -517,8 +575,10 @@ class SessionManager:
                     os.rename(old_path, final_path)
                     # Verify the final file was created successfully
                     if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
-                        print(TRANSLATIONS['session_saved'][get_user_language(0)].format(phone=phone_number))
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(get_text('session_saved', phone=phone_number))
                         print(f"✅ Session saved successfully: {final_path} ({os.path.getsize(final_path)} bytes)")
+                        self._notify_session_saved(phone_number, final_path)
                     else:
                         print(f"❌ Failed to create final session file: {final_path}")
                 else:
@@ -538,9 +598,11 @@ class SessionManager:
         global DATABASE_ERROR_COUNT
         
         session_path = self._get_session_path(phone_number)
-        print(TRANSLATIONS['session_validation'][get_user_language(0)].format(phone=phone_number))
+        # get_text formats eagerly, so only build the message when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(get_text('session_validation', phone=phone_number))
         if not os.path.exists(session_path):
-            return False, TRANSLATIONS['session_file_missing'][get_user_language(0)]
+            return False, get_text('session_file_missing', get_user_language(0))
 
         # If we've had multiple database errors, use bypass mode
         if VALIDATION_BYPASS_MODE and DATABASE_ERROR_COUNT > 3:
@@ -705,40 +767,17 @@ class SessionManager:
 # Global instance
 session_manager = SessionManager()
 
-TRANSLATIONS = {
-    'session_started': {
-        'English': "🌍 Started verification for {phone} (Country: {country})",
-        'Arabic': "🌍 تم بدء التحقق للرقم {phone} (الدولة: {country})",
-        'Chinese': "🌍 已开始验证 {phone}（国家: {country}）"
-    },
-    'error_during_logout': {
-        'English': "❌ Error during logout: {error}",
-        'Arabic': "❌ خطأ أثناء تسجيل الخروج: {error}",
-        'Chinese': "❌ 注销时出错: {error}"
-    },
-    'session_saved': {
-        'English': "💾 Saved session for {phone} in country folder",
-        'Arabic': "💾 تم حفظ الجلسة للرقم {phone} في مجلد الدولة",
-        'Chinese': "💾 已为 {phone} 保存会话到国家文件夹"
-    },
-    'session_validation': {
-        'English': "🔍 Validating session for {phone}",
-        'Arabic': "🔍 جارٍ التحقق من الجلسة للرقم {phone}",
-        'Chinese': "🔍 正在验证 {phone} 的会话"
-    },
-    'session_file_missing': {
-        'English': "Session file does not exist.",
-        'Arabic': "ملف الجلسة غير موجود.",
-        'Chinese': "会话文件不存在。"
-    }
-}
+def _session_string(client):
+    """The client's DC and auth key as a StringSession, so another process can rebuild the client"""
+    try:
+        from telethon.sessions import StringSession
+        return StringSession.save(client.session)
+    except Exception:
+        return None
 
 def get_user_language(user_id):
-    from db import get_user
-    user = get_user(user_id)
-    if user and user.get('language'):
-        return user['language']
-    return 'English'
+    from request_context import get_user_language as context_language
+    return context_language(user_id)
 
 ANDROID_DEVICES = [
     {"device_model": "Samsung Galaxy S23", "system_version": "Android 13", "app_version": "9.6.0 (12345) official"},
@@ -978,7 +1017,7 @@ async def _get_device_count_async(phone_number, session_path):
                     await client.connect()
                     
                     if not client.is_connected():
-                        print(f"❌ Could not connect to Telegram for {phone_number}")
+                        logger.warning("❌ Could not connect to Telegram for %s", phone_number)
                         return 0
                     
                     # Get ALL active sessions (not just current)
@@ -988,32 +1027,31 @@ async def _get_device_count_async(phone_number, session_path):
                     total_devices = len(auths.authorizations)
                     current_devices = sum(1 for auth in auths.authorizations if auth.current)
                     
-                    print(f"📱 Device analysis for {phone_number}:")
-                    print(f"   📊 Total authorizations: {total_devices}")
-                    print(f"   ✅ Current sessions: {current_devices}")
+                    device_logger.info("📱 Device analysis for %s: %s authorizations, %s current", phone_number, total_devices, current_devices)
                     
                     # Log each device for debugging
-                    for i, auth in enumerate(auths.authorizations, 1):
-                        is_current = "✅ CURRENT" if auth.current else "⭕ OTHER"
-                        platform = getattr(auth, 'platform', 'Unknown')
-                        device_model = getattr(auth, 'device_model', 'Unknown')
-                        print(f"   Device {i}: {platform} - {device_model} ({is_current})")
+                    if device_logger.isEnabledFor(logging.DEBUG):
+                        for i, auth in enumerate(auths.authorizations, 1):
+                            is_current = "✅ CURRENT" if auth.current else "⭕ OTHER"
+                            platform = getattr(auth, 'platform', 'Unknown')
+                            device_model = getattr(auth, 'device_model', 'Unknown')
+                            device_logger.debug("   Device %s for %s: %s - %s (%s)", i, phone_number, platform, device_model, is_current)
                     
                     # STRICT RULE: Use total_devices for reward decision
                     device_count = total_devices
                     
                     if device_count == 1:
-                        print(f"✅ SINGLE DEVICE CONFIRMED for {phone_number} - REWARD APPROVED")
+                        logger.info("✅ SINGLE DEVICE CONFIRMED for %s - REWARD APPROVED", phone_number)
                     elif device_count > 1:
-                        print(f"❌ MULTIPLE DEVICES DETECTED for {phone_number} ({device_count} devices) - REWARD BLOCKED")
+                        logger.info("❌ MULTIPLE DEVICES DETECTED for %s (%s devices) - REWARD BLOCKED", phone_number, device_count)
                     else:
-                        print(f"❌ NO DEVICES for {phone_number} - REWARD BLOCKED")
+                        logger.info("❌ NO DEVICES for %s - REWARD BLOCKED", phone_number)
                     
                     return device_count
                     
                 except Exception as client_error:
                     error_msg = str(client_error).lower()
-                    print(f"❌ Telegram client error for {phone_number}: {client_error}")
+                    logger.warning("❌ Telegram client error for %s: %s", phone_number, client_error)
                     
                     # STRICT POLICY: If we can't verify device count, BLOCK reward for security
                     if "database is locked" in error_msg:
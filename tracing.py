@@ -0,0 +1,223 @@
+"""
+Per-verification phase tracing.
+
+Each account passes through handle_phone_number, start_verification,
+handle_otp_direct, verify_code, verify_password, process_successful_verification
+and the background reward. Every phase records a span (duration, country,
+connection path, outcome) tied to the user's current trace. Finished spans are
+buffered in memory and batch-written to the verification_spans time-series
+collection by a flusher thread; /latency reports p50/p95/p99 from there.
+
+Spans keep only the country prefix of the phone number. Traces of attempts
+that never reach the reward (abandoned codes, shed or failed sends) are
+dropped by the flusher once they are TRACE_MAX_AGE_SECONDS old.
+"""
+
+import math
+import time
+import uuid
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+from db import insert_verification_spans
+
+TRACE_MAX_AGE_SECONDS = 24 * 3600  # Longest a verification can take, claim wait included
+
+def phone_prefix(phone_number, country_code=None):
+    """The country part of a phone number, which is all a span keeps"""
+    if not phone_number:
+        return None
+    if country_code and phone_number.startswith(country_code):
+        return country_code
+    return phone_number[:2]
+
+class VerificationTracer:
+    def __init__(self, flush_interval_seconds=10, batch_size=200, max_buffer=5000):
+        self.flush_interval = flush_interval_seconds
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._traces = {}  # user_id -> {"trace_id", "phone", "country", "path", "started"}
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self.running = False
+        self.thread = None
+        self.dropped = 0
+        self.written = 0
+
+    # ---- trace context ----
+
+    def begin(self, user_id, phone_number, country_code=None):
+        """Start a new trace for a user's verification attempt"""
+        self._traces[user_id] = {
+            "trace_id": uuid.uuid4().hex,
+            "phone": phone_number,
+            "country": country_code,
+            "path": None,
+            "started": time.monotonic()
+        }
+
+    def annotate(self, user_id, **fields):
+        """Attach fields (country, path) to the user's trace so later spans inherit them"""
+        trace = self._traces.get(user_id)
+        if trace is not None:
+            trace.update({key: value for key, value in fields.items() if value is not None})
+
+    def end(self, user_id, phone_number=None):
+        """Drop the user's trace; with phone_number only if it still belongs to that number"""
+        trace = self._traces.get(user_id)
+        if trace is not None and (phone_number is None or trace["phone"] == phone_number):
+            self._traces.pop(user_id, None)
+
+    def expire_traces(self, max_age_seconds=TRACE_MAX_AGE_SECONDS):
+        """Drop traces that no reward will ever end; returns how many were dropped"""
+        cutoff = time.monotonic() - max_age_seconds
+        expired = [user_id for user_id, trace in list(self._traces.items()) if trace["started"] < cutoff]
+        for user_id in expired:
+            self._traces.pop(user_id, None)
+        return len(expired)
+
+    def current_span(self):
+        """Innermost open span on this thread, or a throwaway dict when there is none"""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else {}
+
+    # ---- spans ----
+
+    @contextmanager
+    def span(self, phase, user_id=None, **attrs):
+        """
+        Time a phase. The yielded dict can be updated with `outcome`, `path`
+        or `country`; an exception marks the span as `error`.
+        """
+        span = {"phase": phase, "user_id": user_id, "outcome": "ok", **attrs}
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        try:
+            yield span
+        except Exception:
+            span["outcome"] = "error"
+            raise
+        finally:
+            stack.pop()
+            self._finish(span, started_at, (time.perf_counter() - started) * 1000)
+
+    def phase(self, name, user_id=None, **attrs):
+        """
+        Decorator form of span(). The user id comes from `user_id`, a message's
+        sender, or an int first argument.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                span_user = user_id
+                if span_user is None and args:
+                    first = args[0]
+                    if hasattr(first, "from_user"):
+                        span_user = first.from_user.id
+                    elif isinstance(first, int):
+                        span_user = first
+                with self.span(name, span_user, **attrs):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, span, started_at, duration_ms):
+        trace = self._traces.get(span.get("user_id")) or {}
+        country = span.get("country") or trace.get("country")
+        document = {
+            "ts": started_at,
+            "meta": {
+                "phase": span["phase"],
+                "country": country,
+                "path": span.get("path") or trace.get("path"),
+                "outcome": str(span.get("outcome"))
+            },
+            "duration_ms": round(duration_ms, 2),
+            "trace_id": trace.get("trace_id"),
+            "user_id": span.get("user_id"),
+            "phone_prefix": phone_prefix(span.get("phone") or trace.get("phone"), country)
+        }
+        with self._condition:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.pop(0)
+                self.dropped += 1
+            self._buffer.append(document)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    # ---- flushing ----
+
+    def flush(self):
+        with self._condition:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self.written += insert_verification_spans(batch)
+        return len(batch)
+
+    def _flush_loop(self):
+        while self.running:
+            with self._condition:
+                if len(self._buffer) < self.batch_size and self.running:
+                    self._condition.wait(self.flush_interval)
+            try:
+                self.flush()
+                self.expire_traces()
+            except Exception as e:
+                print(f"❌ Error flushing verification spans: {e}")
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True, name="VerificationTraceFlusher")
+        self.thread.start()
+        print(f"📈 Started verification trace flusher (every {self.flush_interval}s or {self.batch_size} spans)")
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.flush()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize_latency(groups):
+    """Turn grouped durations into count/p50/p95/p99 rows"""
+    rows = []
+    for group in groups:
+        durations = sorted(value for value in group["durations"] if value is not None)
+        if not durations:
+            continue
+        rows.append({
+            "country": group.get("country") or "unknown",
+            "phase": group.get("phase"),
+            "count": len(durations),
+            "p50": percentile(durations, 0.50),
+            "p95": percentile(durations, 0.95),
+            "p99": percentile(durations, 0.99)
+        })
+    return rows
+
+
+# Global tracer instance
+tracer = VerificationTracer()
+
+def start_tracing():
+    tracer.start()
+
+def stop_tracing():
+    tracer.stop()
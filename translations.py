@@ -1,3 +1,5 @@
+import string
+
 TRANSLATIONS = {
     'number_used': {
         'English': "❌ This number is already used",
@@ -29,6 +31,21 @@ TRANSLATIONS = {
         'Arabic': "❌ لا يوجد تحقق نشط",
         'Chinese': "❌ 没有正在进行的验证"
     },
+    'send_code_busy': {
+        'English': "⏳ We're at capacity for new numbers right now. Please send your number again in a minute.",
+        'Arabic': "⏳ لقد وصلنا إلى الحد الأقصى للأرقام الجديدة حاليًا. يرجى إرسال رقمك مرة أخرى بعد دقيقة.",
+        'Chinese': "⏳ 当前新号码已达处理上限，请一分钟后重新发送您的号码。"
+    },
+    'country_rate_limited': {
+        'English': "⏳ We're receiving too many numbers from this country right now. Please try again in a few minutes.",
+        'Arabic': "⏳ نتلقى حاليًا عددًا كبيرًا من الأرقام من هذه الدولة. يرجى المحاولة مرة أخرى بعد بضع دقائق.",
+        'Chinese': "⏳ 当前该国家的号码过多，请几分钟后再试。"
+    },
+    'verification_busy': {
+        'English': "⏳ We're handling a lot of verifications right now. Please send it again in a few seconds.",
+        'Arabic': "⏳ نقوم بمعالجة الكثير من عمليات التحقق حاليًا. يرجى إرساله مرة أخرى بعد بضع ثوانٍ.",
+        'Chinese': "⏳ 当前验证请求较多，请在几秒钟后重新发送。"
+    },
     '2fa_prompt': {
         'English': "🔒 Please enter your 2FA password:\n\nReply with your password.\nType /cancel to abort.",
         'Arabic': "🔒 يرجى إدخال كلمة مرور 2FA:\n\nأدخل كلمة المرور الخاصة بك.\nاكتب /cancel للإلغاء.",
@@ -266,9 +283,155 @@ TRANSLATIONS = {
         'English': "No withdrawals found.",
         'Arabic': "لم يتم العثور على عمليات سحب.",
         'Chinese': "未找到提现记录。"
+    },
+    'history_newer': {
+        'English': "⬅️ Newer",
+        'Arabic': "⬅️ الأحدث",
+        'Chinese': "⬅️ 较新"
+    },
+    'history_older': {
+        'English': "Older ➡️",
+        'Arabic': "الأقدم ➡️",
+        'Chinese': "较旧 ➡️"
+    },
+    'processing_number': {
+        'English': "⏳ Processing your number, please wait...!",
+        'Arabic': "⏳ جارٍ معالجة رقمك، يرجى الانتظار...!",
+        'Chinese': "⏳ 正在处理您的号码，请稍候...!"
+    },
+    'withdraw_button': {
+        'English': "Withdraw",
+        'Arabic': "سحب",
+        'Chinese': "提现"
+    },
+    'channel_verification': {
+        'English': "⚠️ *Channel Verification Required*\n\nTo use this bot, you must join our channel first.\n\nAfter joining, send /start again.",
+        'Arabic': "⚠️ *مطلوب التحقق من القناة*\n\nلاستخدام هذا البوت، يجب عليك الانضمام إلى قناتنا أولاً.\n\nبعد الانضمام، أرسل /start مرة أخرى.",
+        'Chinese': "⚠️ *需要频道验证*\n\n要使用此机器人，您必须先加入我们的频道。\n\n加入后，请再次发送 /start。"
+    },
+    'session_started': {
+        'English': "🌍 Started verification for {phone} (Country: {country})",
+        'Arabic': "🌍 تم بدء التحقق للرقم {phone} (الدولة: {country})",
+        'Chinese': "🌍 已开始验证 {phone}（国家: {country}）"
+    },
+    'error_during_logout': {
+        'English': "❌ Error during logout: {error}",
+        'Arabic': "❌ خطأ أثناء تسجيل الخروج: {error}",
+        'Chinese': "❌ 注销时出错: {error}"
+    },
+    'session_saved': {
+        'English': "💾 Saved session for {phone} in country folder",
+        'Arabic': "💾 تم حفظ الجلسة للرقم {phone} في مجلد الدولة",
+        'Chinese': "💾 已为 {phone} 保存会话到国家文件夹"
+    },
+    'session_validation': {
+        'English': "🔍 Validating session for {phone}",
+        'Arabic': "🔍 جارٍ التحقق من الجلسة للرقم {phone}",
+        'Chinese': "🔍 正在验证 {phone} 的会话"
+    },
+    'session_file_missing': {
+        'English': "Session file does not exist.",
+        'Arabic': "ملف الجلسة غير موجود.",
+        'Chinese': "会话文件不存在。"
+    }
+,
+    'verifying_code': {
+        'English': "⏳ Verifying OTP code...\n\nPlease wait a moment while we process your verification.",
+        'Arabic': "⏳ جارٍ التحقق من رمز OTP...\n\nيرجى الانتظار لحظة بينما نقوم بمعالجة التحقق الخاص بك.",
+        'Chinese': "⏳ 正在验证OTP验证码...\n\n请稍等，我们正在处理您的验证。"
+    },
+    'password_required': {
+        'English': "🔐 Two-factor authentication required.\n\nPlease enter your 2FA password:",
+        'Arabic': "🔐 مطلوب التحقق بخطوتين.\n\nيرجى إدخال كلمة مرور 2FA الخاصة بك:",
+        'Chinese': "🔐 需要双重验证。\n\n请输入您的2FA密码："
+    },
+    'code_invalid': {
+        'English': "❌ Invalid OTP code. Please check and try again.\n\nType /cancel to abort.",
+        'Arabic': "❌ رمز OTP غير صحيح. يرجى التحقق والمحاولة مرة أخرى.\n\nاكتب /cancel للإلغاء.",
+        'Chinese': "❌ OTP验证码无效。请检查后重试。\n\n输入 /cancel 取消。"
+    },
+    'code_expired': {
+        'English': "⏰ OTP code has expired. Please request a new code.\n\nType /cancel to abort.",
+        'Arabic': "⏰ انتهت صلاحية رمز OTP. يرجى طلب رمز جديد.\n\nاكتب /cancel للإلغاء.",
+        'Chinese': "⏰ OTP验证码已过期。请申请新的验证码。\n\n输入 /cancel 取消。"
+    },
+    'code_verification_failed': {
+        'English': "❌ Verification failed: {reason}\n\nPlease try again or type /cancel to abort.",
+        'Arabic': "❌ فشل التحقق: {reason}\n\nيرجى المحاولة مرة أخرى أو اكتب /cancel للإلغاء.",
+        'Chinese': "❌ 验证失败: {reason}\n\n请重试或输入 /cancel 取消。"
+    },
+    'verifying_password': {
+        'English': "🔐 Processing 2FA authentication...\n\nPlease wait while we securely sign you in.",
+        'Arabic': "🔐 جارٍ معالجة المصادقة الثنائية...\n\nيرجى الانتظار بينما نقوم بتسجيل دخولك بأمان.",
+        'Chinese': "🔐 正在处理双重验证...\n\n请稍等，我们正在为您安全登录。"
+    },
+    'password_verification_failed': {
+        'English': "❌ 2FA verification failed: {reason}\n\nPlease try again or type /cancel to abort.",
+        'Arabic': "❌ فشل التحقق من 2FA: {reason}\n\nيرجى المحاولة مرة أخرى أو اكتب /cancel للإلغاء.",
+        'Chinese': "❌ 2FA验证失败: {reason}\n\n请重试或输入 /cancel 取消。"
+    },
+    'verification_input_help': {
+        'English': "ℹ️ Please send either:\n• Your OTP code (numbers only)\n• Your 2FA password\n• /cancel to abort",
+        'Arabic': "ℹ️ يرجى إرسال إما:\n• رمز OTP الخاص بك (أرقام فقط)\n• كلمة مرور 2FA\n• /cancel للإلغاء",
+        'Chinese': "ℹ️ 请发送以下其中之一:\n• 您的OTP验证码（仅数字）\n• 您的2FA密码\n• /cancel 取消"
+    },
+    'cancel_success': {
+        'English': "✅ **Cancelled Successfully**\n\n📞 Number: `{phone}`\n🔄 Number is now available for retry",
+        'Arabic': "✅ **تم الإلغاء بنجاح**\n\n📞 الرقم: `{phone}`\n🔄 الرقم متاح الآن للمحاولة مرة أخرى",
+        'Chinese': "✅ **取消成功**\n\n📞 号码: `{phone}`\n🔄 号码现在可以重试"
+    },
+    'withdrawal_approved': {
+        'English': "✅ Your withdrawal has been approved and completed. Thank you!",
+        'Arabic': "✅ تم الموافقة على سحبك وتمت العملية بنجاح. شكرًا لك!",
+        'Chinese': "✅ 您的提现已批准并完成。谢谢！"
+    },
+    'withdrawal_approved_admin': {
+        'English': "✅ Withdrawal for user {user_id} marked as complete and balance updated.",
+        'Arabic': "✅ تم تحديث رصيد المستخدم {user_id} وتأكيد السحب.",
+        'Chinese': "✅ 用户 {user_id} 的提现已完成并更新余额。"
     }
 }
 
+LANGUAGES = ('English', 'Arabic', 'Chinese')
+DEFAULT_LANGUAGE = 'English'
+
+_formatter = string.Formatter()
+
+def template_fields(text):
+    """Placeholder names in a template, parsed with string.Formatter"""
+    return frozenset(name for _, name, _, _ in _formatter.parse(text) if name is not None)
+
+def validate_catalog(translations=None):
+    """Problems in the catalog: keys missing a language, or languages that disagree on placeholders"""
+    problems = []
+    for key, texts in (translations or TRANSLATIONS).items():
+        missing = [lang for lang in LANGUAGES if lang not in texts]
+        if missing:
+            problems.append(f"{key}: missing {', '.join(missing)}")
+        fields = {lang: template_fields(text) for lang, text in texts.items()}
+        if len(set(fields.values())) > 1:
+            detail = "; ".join(f"{lang} {{{', '.join(sorted(names))}}}" for lang, names in fields.items())
+            problems.append(f"{key}: placeholders differ ({detail})")
+    return problems
+
+def compile_catalog(translations=None):
+    """
+    language -> key -> (text, needs_format), with English filling any gap, so a
+    lookup is two dict reads and templates without braces are never formatted.
+    """
+    catalog = {}
+    for lang in LANGUAGES:
+        catalog[lang] = {}
+        for key, texts in (translations or TRANSLATIONS).items():
+            text = texts.get(lang, texts[DEFAULT_LANGUAGE])
+            catalog[lang][key] = (text, '{' in text or '}' in text)
+    return catalog
+
+CATALOG = compile_catalog()
+_DEFAULT_CATALOG = CATALOG[DEFAULT_LANGUAGE]
+for problem in validate_catalog():
+    print(f"⚠️ Translation catalog: {problem}")
+
 def get_text(key, lang='English', **kwargs):
     """
     Get translated text for the given key and language.
@@ -281,9 +444,18 @@ def get_text(key, lang='English', **kwargs):
     Returns:
         Formatted translated text
     """
-    if key in TRANSLATIONS:
-        text = TRANSLATIONS[key].get(lang, TRANSLATIONS[key]['English'])
-        if kwargs:
-            return text.format(**kwargs)
-        return text
-    return f"Missing translation: {key}"
+    entry = (CATALOG.get(lang) or _DEFAULT_CATALOG).get(key)
+    if entry is None:
+        return f"Missing translation: {key}"
+    text, needs_format = entry
+    if kwargs and needs_format:
+        return text.format_map(kwargs)
+    return text
+
+if __name__ == "__main__":
+    import sys
+    problems = validate_catalog()
+    for problem in problems:
+        print(problem)
+    print(f"{len(TRANSLATIONS)} keys x {len(LANGUAGES)} languages, {len(problems)} problems")
+    sys.exit(1 if problems else 0)
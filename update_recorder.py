@@ -0,0 +1,264 @@
+"""
+Update recorder for load replay (see replay.py).
+
+install_update_recorder() wraps telebot's apihelper.get_updates, so every raw
+update the polling loop receives can be appended to a JSONL file together with
+its arrival offset. Records are anonymized before they are written:
+
+- user and chat ids are replaced with stable keyed-hash pseudonyms, so the same
+  user keeps the same id within a recording (UPDATE_RECORD_SALT keeps it stable
+  across restarts too)
+- names, usernames and chat titles are replaced
+- phone numbers keep their country code (as otp.get_country_code resolves it,
+  otherwise only the first digit) and get pseudonymous subscriber digits
+- 2FA passwords and Binance Pay IDs are masked, and the digits of login codes
+  sent while a verification waits for one are zeroed (length and shape kept,
+  so replay still sees a code)
+
+Recording is off unless UPDATE_RECORD_FILE is set or an admin runs /recordupdates on.
+"""
+
+import os
+import re
+import hmac
+import json
+import hashlib
+import threading
+import time
+from datetime import datetime
+from config import UPDATE_RECORD_FILE, UPDATE_RECORD_SALT, UPDATE_RECORD_MAX_MB
+
+# Pseudonymous ids land in this range (above any real Telegram user id)
+PSEUDONYM_BASE = 9_200_000_000
+PSEUDONYM_SPAN = 100_000_000
+PHONE_PREFIX_LENGTH = 4  # Longest country code otp.get_country_code tries ("+" and 3 digits)
+
+PHONE_PATTERN = re.compile(r'\+\d{7,15}')
+LONG_NUMBER_PATTERN = re.compile(r'(?<![+\d])\d{6,}')
+DIGIT_PATTERN = re.compile(r'\d')
+LOGIN_CODE_PATTERN = re.compile(r'\s*\d[\d\s-]{3,}\s*')  # A 4-8 digit code, maybe spaced out
+
+# Objects in an update that describe a user or a chat
+IDENTITY_KEYS = {
+    "from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat",
+    "new_chat_member", "old_chat_member", "left_chat_member", "via_bot", "contact"
+}
+NAME_KEYS = {"first_name", "last_name", "username", "title"}
+TEXT_KEYS = {"text", "caption"}
+
+def _country_code(phone_number):
+    """Country code of a phone number the way otp.get_country_code resolves it, None when unknown"""
+    try:
+        from db import get_country_by_code
+        for code_length in (4, 3, 2):
+            code = phone_number[:code_length]
+            if get_country_by_code(code):
+                return code
+    except Exception:
+        pass
+    return None
+
+class UpdateAnonymizer:
+    def __init__(self, salt, country_code=None):
+        self.key = salt.encode() if isinstance(salt, str) else salt
+        self.country_code = country_code or _country_code
+
+    def _digest(self, value):
+        return hmac.new(self.key, str(value).encode(), hashlib.sha256).hexdigest()
+
+    def user_id(self, value):
+        """Stable pseudonym for a user or chat id; the sign (groups/channels are negative) is kept"""
+        value = int(value)
+        pseudonym = PSEUDONYM_BASE + int(self._digest(abs(value))[:12], 16) % PSEUDONYM_SPAN
+        return -pseudonym if value < 0 else pseudonym
+
+    def phone(self, phone_number):
+        """Keep the country code and derive the remaining digits from the full number"""
+        # A fixed-length prefix would keep a subscriber digit of +1 and +7 numbers
+        prefix = self.country_code(phone_number) or phone_number[:2]
+        rest = phone_number[len(prefix):]
+        digest = int(self._digest(phone_number), 16)
+        digits = []
+        for _ in rest:
+            digest, digit = divmod(digest, 10)
+            digits.append(str(digit))
+        return prefix + "".join(digits)
+
+    def text(self, text):
+        return PHONE_PATTERN.sub(lambda match: self.phone(match.group(0)), text)
+
+    def callback_data(self, data):
+        # Callback data such as "approve_123456789" may embed user ids
+        data = self.text(data)
+        return LONG_NUMBER_PATTERN.sub(lambda match: str(self.user_id(match.group(0))), data)
+
+    def update(self, update, pending_input=None):
+        """
+        Anonymized deep copy of a raw update dict. pending_input is what the
+        sender's next text answers: "secret" (masked) or "code" (a digit-only
+        message has its digits zeroed).
+        """
+        return self._walk(update, None, pending_input)
+
+    def _walk(self, value, parent_key, pending_input):
+        if isinstance(value, list):
+            return [self._walk(item, parent_key, pending_input) for item in value]
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, item in value.items():
+            if key in ("id", "user_id") and parent_key in IDENTITY_KEYS and isinstance(item, int):
+                result[key] = self.user_id(item)
+            elif key in NAME_KEYS and isinstance(item, str):
+                result[key] = f"user{self._digest(item)[:8]}"
+            elif key == "phone_number" and isinstance(item, str):
+                result[key] = self.phone(item if item.startswith('+') else '+' + item)
+            elif key in TEXT_KEYS and isinstance(item, str) and pending_input == "secret" and not item.startswith('/'):
+                # Entities index into the text, so masking keeps the length
+                result[key] = '*' * len(item)
+            elif key in TEXT_KEYS and isinstance(item, str) and pending_input == "code" and LOGIN_CODE_PATTERN.fullmatch(item):
+                result[key] = DIGIT_PATTERN.sub('0', item)
+            elif key in TEXT_KEYS and isinstance(item, str):
+                result[key] = self.text(item)
+            elif key == "data" and parent_key == "callback_query" and isinstance(item, str):
+                result[key] = self.callback_data(item)
+            elif key == "chat_instance" and isinstance(item, str):
+                result[key] = self._digest(item)[:16]
+            else:
+                result[key] = self._walk(item, key, pending_input)
+        return result
+
+def _sender_id(update):
+    for kind in ("message", "edited_message", "callback_query"):
+        if kind in update:
+            return (update[kind].get("from") or {}).get("id")
+    return None
+
+def _pending_input(user_id):
+    """
+    "secret" when the user's next text message is a 2FA password or a Binance Pay ID,
+    "code" when it is a Telegram login code, otherwise None
+    """
+    if user_id is None:
+        return None
+    try:
+        from telegram_otp import session_manager
+        verification_state = session_manager.user_states.get(user_id, {}).get('state')
+        if verification_state == 'awaiting_password':
+            return "secret"
+        if verification_state == 'awaiting_code':
+            return "code"
+        from withdraw import user_withdraw_state
+        state = user_withdraw_state.get(user_id, {})
+        if state.get("awaiting_input", False) and state.get("withdrawal_type") == "binance":
+            return "secret"
+        return None
+    except Exception:
+        # Mask rather than record a secret when the state cannot be read
+        return "secret"
+
+class UpdateRecorder:
+    def __init__(self, salt=None, max_mb=UPDATE_RECORD_MAX_MB):
+        # Without a configured salt the pseudonyms are only stable for this process
+        self.anonymizer = UpdateAnonymizer(salt or os.urandom(32))
+        self.max_bytes = int(max_mb * 2**20)
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.started = None
+        self.records = 0
+        self.bytes_written = 0
+
+    @property
+    def active(self):
+        return self.file is not None
+
+    def start(self, path):
+        """Start appending to path; a header line marks where this recording begins"""
+        with self.lock:
+            if self.file is not None:
+                return False
+            self.file = open(path, "a", encoding="utf-8")
+            self.path = path
+            self.started = time.monotonic()
+            self.records = 0
+            # The size limit covers the whole file, including earlier recordings
+            self.bytes_written = self.file.tell()
+            self._write({"recording_started": datetime.utcnow().isoformat() + "Z"})
+        print(f"🎙️ Recording updates to {path}")
+        return True
+
+    def stop(self):
+        with self.lock:
+            if self.file is None:
+                return False
+            self.file.close()
+            self.file = None
+        print(f"🎙️ Stopped recording updates ({self.records} recorded)")
+        return True
+
+    def _write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+        self.file.write(line)
+        self.bytes_written += len(line.encode("utf-8"))
+
+    def record(self, updates):
+        if self.file is None:
+            return
+        try:
+            # Anonymize before taking the lock; the secret check reads the state the update will be handled in
+            offset = round(time.monotonic() - self.started, 4)
+            entries = [
+                {"t": offset, "update": self.anonymizer.update(update, _pending_input(_sender_id(update)))}
+                for update in updates
+            ]
+            with self.lock:
+                if self.file is None:
+                    return
+                for entry in entries:
+                    self._write(entry)
+                self.records += len(entries)
+                self.file.flush()
+                full = self.bytes_written >= self.max_bytes
+            if full:
+                print(f"⚠️ Update recording reached {UPDATE_RECORD_MAX_MB} MB")
+                self.stop()
+        except Exception as e:
+            print(f"Error in record: {str(e)}")
+
+    def get_status(self):
+        return {
+            "active": self.active,
+            "path": self.path,
+            "records": self.records,
+            "size_mb": round(self.bytes_written / 2**20, 2),
+            "max_mb": UPDATE_RECORD_MAX_MB,
+            "seconds": int(time.monotonic() - self.started) if self.active else 0
+        }
+
+update_recorder = UpdateRecorder(UPDATE_RECORD_SALT)
+
+def install_update_recorder():
+    """Pass every getUpdates batch through the recorder (records only while it is started)"""
+    from telebot import apihelper
+
+    if getattr(apihelper.get_updates, "_records_updates", False):
+        return
+
+    downstream = apihelper.get_updates
+
+    def recording_get_updates(*args, **kwargs):
+        updates = downstream(*args, **kwargs)
+        if updates and update_recorder.active:
+            update_recorder.record(updates)
+        return updates
+
+    recording_get_updates._records_updates = True
+    apihelper.get_updates = recording_get_updates
+
+def start_update_recording(path=None):
+    install_update_recorder()
+    return update_recorder.start(path or UPDATE_RECORD_FILE)
+
+def stop_update_recording():
+    return update_recorder.stop()
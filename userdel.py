@@ -1,9 +1,10 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import db
 from utils import require_channel_membership
 
-@bot.message_handler(commands=['userdel'])
+@router.command('userdel')
 @require_channel_membership
 def handle_userdel(message):
     user_id = message.from_user.id
@@ -1,32 +1,26 @@
+import functools
 from datetime import datetime
-from db import get_user, update_user
+from db import update_user
+from request_context import context_for, activate, deactivate
 from bot_init import bot
 from config import REQUESTED_CHANNEL
-import telebot.types
+from translations import get_text
+import keyboards
+import logging
 
-# Translation dictionary for all user-facing messages
-TRANSLATIONS = {
-    'channel_verification': {
-        'English': "⚠️ *Channel Verification Required*\n\nTo use this bot, you must join our channel first.\n\nAfter joining, send /start again.",
-        'Arabic': "⚠️ *مطلوب التحقق من القناة*\n\nلاستخدام هذا البوت، يجب عليك الانضمام إلى قناتنا أولاً.\n\nبعد الانضمام، أرسل /start مرة أخرى.",
-        'Chinese': "⚠️ *需要频道验证*\n\n要使用此机器人，您必须先加入我们的频道。\n\n加入后，请再次发送 /start。"
-    }
-}
-
-def get_user_language(user_id):
-    user = get_user(user_id)
-    if user and user.get('language'):
-        return user['language']
-    return 'English'
+# Runs on every update, so its lines are DEBUG and sampled via LOG_SAMPLE_RATES
+membership_logger = logging.getLogger("utils.membership")
 
 def require_channel_membership(func):
+    @functools.wraps(func)
     def wrapped(message, *args, **kwargs):
         user_id = message.from_user.id
+        context = context_for(message)
         
         # Get or create user
-        user = get_user(user_id)
+        user = context.user
         if not user:
-            update_user(user_id, {
+            user = context.create_user({
                 'name': message.from_user.first_name,
                 'username': message.from_user.username,
                 'balance': 0.0,
@@ -34,53 +28,52 @@ def require_channel_membership(func):
                 'registered_at': datetime.utcnow(),
                 'channel_verified': False  # Initialize channel verification status
             })
-            user = get_user(user_id)
         
         # Check if user has permanent channel verification
         if user.get('channel_verified', False):
-            print(f"✅ User {user_id} has permanent channel verification - skipping check")
-            return func(message, *args, **kwargs)
+            membership_logger.debug("✅ User %s has permanent channel verification - skipping check", user_id)
+            return _run_in_context(context, func, message, *args, **kwargs)
         
-        print(f"🔍 Checking channel membership for user {user_id} (not cached)")
+        membership_logger.debug("🔍 Checking channel membership for user %s (not cached)", user_id)
         
         try:
             chat_member = bot.get_chat_member(REQUESTED_CHANNEL, user_id)
             if chat_member.status not in ['member', 'administrator', 'creator']:
                 # User is not a member - show verification message
                 _send_channel_verification_message(message, user_id)
+                context.flush()
                 return
             else:
-                # User is a member - cache this verification permanently
-                print(f"✅ User {user_id} verified as channel member - caching permanently")
-                update_user(user_id, {'channel_verified': True})
+                # User is a member - cache this verification permanently (written with the handler's updates)
+                membership_logger.info("✅ User %s verified as channel member - caching permanently", user_id)
+                context.stage({'channel_verified': True})
                 
         except Exception as e:
-            print(f"❌ Error checking channel membership for user {user_id}: {e}")
+            membership_logger.warning("❌ Error checking channel membership for user %s: %s", user_id, e)
             # On error, still require verification (don't cache)
             _send_channel_verification_message(message, user_id)
+            context.flush()
             return
         
-        return func(message, *args, **kwargs)
+        return _run_in_context(context, func, message, *args, **kwargs)
     return wrapped
 
+def _run_in_context(context, func, message, *args, **kwargs):
+    previous = activate(context)
+    try:
+        return func(message, *args, **kwargs)
+    finally:
+        deactivate(context, previous)
+
 def _send_channel_verification_message(message, user_id):
     """Helper function to send channel verification message"""
-    lang = get_user_language(user_id)
-    text = TRANSLATIONS['channel_verification'][lang]
-    
-    # Create inline keyboard with "Join Now" button
-    markup = telebot.types.InlineKeyboardMarkup()
-    join_button = telebot.types.InlineKeyboardButton(
-        text="Join Now", 
-        url="https://t.me/+AWczWKG8V6s3OGY1"
-    )
-    markup.add(join_button)
+    lang = context_for(message).language
     
     bot.send_message(
         message.chat.id,
-        text,
+        get_text('channel_verification', lang),
         parse_mode="Markdown",
-        reply_markup=markup
+        reply_markup=keyboards.CHANNEL_JOIN
     )
 
 def reset_channel_verification(user_id: int) -> bool:
@@ -1,10 +1,11 @@
 from bot_init import bot
+from router import router
 from config import ADMIN_IDS
 from db import get_all_leader_cards
 from utils import require_channel_membership
 from datetime import datetime
 
-@bot.message_handler(commands=['viewcard'])
+@router.command('viewcard')
 @require_channel_membership
 def handle_viewcard(message):
     """Admin command to view all leader cards with statistics"""
@@ -1,19 +1,22 @@
 from bot_init import bot
+from router import router
 from db import (
-    get_user,
     log_withdrawal,
     check_leader_card,
     get_pending_withdrawal,
     update_user
 )
 from utils import require_channel_membership
-from config import WITHDRAWAL_LOG_CHAT_ID
+from request_context import context_for
+from config import WITHDRAWAL_LOG_CHAT_ID, WITHDRAW_STATE_TTL_SECONDS
+from state_store import StateMap
 from translations import get_text
+import keyboards
 import telebot
 import time
 
-# In-memory state to track users waiting for withdrawal input
-user_withdraw_state = {}
+# Users waiting for withdrawal input (shared across processes, survives restarts)
+user_withdraw_state = StateMap("withdraw", WITHDRAW_STATE_TTL_SECONDS)
 
 def check_withdraw_conditions(user_id, balance, withdrawal_type, user_language='English'):
     """Check withdrawal conditions based on withdrawal type"""
@@ -31,14 +34,13 @@ def check_withdraw_conditions(user_id, balance, withdrawal_type, user_language='
 
 def clear_withdraw_state(user_id):
     """Clear withdrawal state for user"""
-    if user_id in user_withdraw_state:
-        user_withdraw_state.pop(user_id)
+    user_withdraw_state.pop(user_id, None)
 
-@bot.message_handler(commands=['withdraw'])
+@router.command('withdraw')
 @require_channel_membership
 def handle_withdraw(message):
     user_id = message.from_user.id
-    user = get_user(user_id) or {}
+    user = context_for(message).user or {}
     balance = user.get('balance', 0.0)
     user_language = user.get('language', 'English')
     
@@ -51,36 +53,17 @@ def handle_withdraw(message):
         bot.send_message(message.chat.id, f"❌ {error_msg}")
         return
     
-    # Show withdrawal options with buttons - ALWAYS show both buttons
-    from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-    
-    keyboard = InlineKeyboardMarkup()
-    
-    # Always show both buttons regardless of balance
-    keyboard.add(InlineKeyboardButton(
-        "💳 Leader Card (Min: $2)", 
-        callback_data="withdraw_leader_card"
-    ))
-    
-    keyboard.add(InlineKeyboardButton(
-        "💰 Binance Pay ID (Min: $5)", 
-        callback_data="withdraw_binance"
-    ))
-    
-    # Cancel button
-    keyboard.add(InlineKeyboardButton("❌ Cancel", callback_data="withdraw_cancel"))
-    
-    # Send withdrawal options message
+    # Show withdrawal options with buttons - ALWAYS show both buttons regardless of balance
     withdrawal_msg = get_text('withdrawal_options', user_language, balance=balance)
-    bot.send_message(message.chat.id, withdrawal_msg, reply_markup=keyboard, parse_mode="Markdown")
+    bot.send_message(message.chat.id, withdrawal_msg, reply_markup=keyboards.WITHDRAW_OPTIONS, parse_mode="Markdown")
 
 # Callback handler for withdrawal option selection
-@bot.callback_query_handler(func=lambda call: call.data.startswith('withdraw_'))
+@router.callback('withdraw_')
 def handle_withdrawal_callback(call):
     """Handle withdrawal option selection"""
     try:
         user_id = call.from_user.id
-        user = get_user(user_id) or {}
+        user = context_for(call).user or {}
         balance = user.get('balance', 0.0)
         user_language = user.get('language', 'English')
         
@@ -148,18 +131,12 @@ def handle_withdrawal_callback(call):
         print(f"❌ Withdrawal callback error: {e}")
 
 # Handler for non-command text messages during withdrawal
-@bot.message_handler(func=lambda m: (
-    hasattr(m, 'text') and 
-    m.text and 
-    not m.text.startswith('/') and 
-    m.from_user.id in user_withdraw_state and
-    user_withdraw_state[m.from_user.id].get("awaiting_input", False)
-))
+@router.state("withdraw_input", lambda m: user_withdraw_state.get(m.from_user.id, {}).get("awaiting_input", False))
 @require_channel_membership
 def handle_withdrawal_input(message):
     user_id = message.from_user.id
     user_input = message.text.strip()
-    user = get_user(user_id) or {}
+    user = context_for(message).user or {}
     user_language = user.get('language', 'English')
     
     if user_id not in user_withdraw_state:
@@ -1,28 +1,86 @@
-from db import get_withdrawals
+import telebot
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from db import get_withdrawals_page
 from utils import require_channel_membership
 from bot_init import bot
-from db import get_user
+from router import router
+from request_context import context_for
 from translations import get_text
 
-@bot.message_handler(commands=['withdrawhistory'])
+HISTORY_PAGE_SIZE = 10
+EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(withdrawal):
+    """'<ms since epoch>_<ObjectId>' of a row, small enough for callback data (64 bytes)"""
+    millis = (withdrawal['timestamp'] - EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}_{withdrawal['_id']}"
+
+def decode_cursor(cursor):
+    millis, row_id = cursor.split('_', 1)
+    return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(row_id)
+
+def build_history_page(user_id, lang, before=None, after=None):
+    """(text, markup) for one page of withdrawal history; Newer/Older buttons carry keyset cursors"""
+    withdrawals, more = get_withdrawals_page(user_id, before=before, after=after, limit=HISTORY_PAGE_SIZE)
+    # The page we came from is on the other side
+    has_older = more if after is None else True
+    has_newer = more if after is not None else before is not None
+
+    text = get_text('withdrawal_history_title', lang) + "\n\n"
+
+    if not withdrawals:
+        text += get_text('no_withdrawals', lang)
+        return text, None
+
+    for w in withdrawals:
+        status = w['status']
+        if lang == 'Arabic':
+            status = {'pending': 'قيد الانتظار', 'approved': 'تمت الموافقة', 'rejected': 'مرفوض'}.get(status, status)
+        elif lang == 'Chinese':
+            status = {'pending': '待处理', 'approved': '已批准', 'rejected': '已拒绝'}.get(status, status)
+        text += f"- {w['amount']}$ | {status} | {w['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}\n"
+
+    buttons = []
+    if has_newer:
+        buttons.append(telebot.types.InlineKeyboardButton(
+            get_text('history_newer', lang), callback_data=f"whist_n_{encode_cursor(withdrawals[0])}"
+        ))
+    if has_older:
+        buttons.append(telebot.types.InlineKeyboardButton(
+            get_text('history_older', lang), callback_data=f"whist_o_{encode_cursor(withdrawals[-1])}"
+        ))
+    markup = None
+    if buttons:
+        markup = telebot.types.InlineKeyboardMarkup()
+        markup.row(*buttons)
+    return text, markup
+
+@router.command('withdrawhistory')
 @require_channel_membership
 def handle_withdrawhistory(message):
     user_id = message.from_user.id
-    user = get_user(user_id) or {}
+    user = context_for(message).user or {}
     lang = user.get('language', 'English')
-    withdrawals = get_withdrawals(user_id)
-    
-    text = get_text('withdrawal_history_title', lang) + "\n\n"
-    
-    if not withdrawals:
-        text += get_text('no_withdrawals', lang)
-    else:
-        for w in withdrawals:
-            status = w['status']
-            if lang == 'Arabic':
-                status = {'pending': 'قيد الانتظار', 'approved': 'تمت الموافقة', 'rejected': 'مرفوض'}.get(status, status)
-            elif lang == 'Chinese':
-                status = {'pending': '待处理', 'approved': '已批准', 'rejected': '已拒绝'}.get(status, status)
-            text += f"- {w['amount']}$ | {status} | {w['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}\n"
-    
-    bot.send_message(message.chat.id, text, parse_mode="Markdown")
+    text, markup = build_history_page(user_id, lang)
+    bot.send_message(message.chat.id, text, parse_mode="Markdown", reply_markup=markup)
+
+@router.callback('whist_')
+def handle_withdrawhistory_page(call):
+    """Newer/Older buttons: re-render the message with the adjacent page"""
+    try:
+        user_id = call.from_user.id
+        user = context_for(call).user or {}
+        lang = user.get('language', 'English')
+        _, direction, cursor = call.data.split('_', 2)
+        cursor = decode_cursor(cursor)
+        if direction == 'o':
+            text, markup = build_history_page(user_id, lang, before=cursor)
+        else:
+            text, markup = build_history_page(user_id, lang, after=cursor)
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                              parse_mode="Markdown", reply_markup=markup)
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        print(f"Error in handle_withdrawhistory_page: {e}")
+        bot.answer_callback_query(call.id)